@@ -46,6 +46,8 @@ from pexpect import *
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from pathlib import Path
 
+from pycheribuild.boot_cheribsd.ssh_session import SSHSession
+
 ##########################
 # Command line arguments #
 ##########################
@@ -489,22 +491,6 @@ def boot_bsd(bitfile, kernel_img, args):
     console.expect_exact('#')
     return console
 
-def do_scp (src, dst, *, port:int, key,timeout=600):
-    cmd = ['scp']
-    if port != 22:
-        cmd += ['-P', str(port)]
-    # For some reason jenkins no longer likes the de4 bluehive host keys so to work around this we
-    # completely disable host key checking by setting the known hosts file to /dev/null
-    # See https://dustymabe.com/2012/01/09/hi-planet---ssh-disable-checking-host-key-against-known_hosts-file./
-    cmd += ['-o','StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null', '-o', 'BatchMode=yes']
-    cmd += ['-i',key]
-    cmd += ['-r']
-    cmd += [src, dst]
-    hostcmdprint(" ".join(cmd))
-    boot = MySpawn(" ".join(cmd), encoding="utf-8", logfile=logf, echo=False)
-    boot.checked_expect("transfering files - scp",EOF,timeout)
-    boot.wait()
-    boot.close()
 
 def get_network_iface(args):
     result = args.network_interface
@@ -759,12 +745,18 @@ def main():
         tgtdir = op.join(tgtfs,op.basename(args.benchdir))
         print("Will copy", args.benchdir, "to", tgtfs)
         tgtout = op.join(tgtdir,args.out_path)
+        # All transfers share one SSH master connection (host key checking is disabled since jenkins no longer
+        # likes the de4 bluehive host keys)
+        ssh_session = SSHSession(args.target, ssh_port, Path(args.ssh_key), user=args.user)
         phaseprint("transfer benchmark")
         if not args.skip_copy:
-            do_scp(src=args.benchdir, dst="{}@{}:{}".format(args.user,args.target,tgtfs), port=ssh_port, key=args.ssh_key, timeout=2400)
+            # Stream the whole directory as a tar pipe instead of one scp per file
+            ssh_session.copy_directory_to_guest(Path(args.benchdir), tgtdir, timeout=2400)
             # Allow copying additional files to the fpga
             for extra_file in args.extra_input_files:
-                do_scp(src=extra_file, dst="{}@{}:{}".format(args.user, args.target, tgtfs), port=ssh_port, key=args.ssh_key)
+                ssh_session.copy_to_guest(Path(extra_file), tgtfs, timeout=600)
+        # The connection will not survive turning off the network
+        ssh_session.stop()
         phaseprint("turn network off")
         do_network_off(console, args)
         phaseprint("running benchmark")
@@ -772,11 +764,13 @@ def main():
         phaseprint("turn network on")
         do_network_on(console, args)
         phaseprint("transfer benchmark result")
-        do_scp("{}@{}:{}".format(args.user,args.target,tgtout),os.getcwd(),port=ssh_port,key=args.ssh_key)
+        ssh_session.copy_from_guest(tgtout, Path(os.getcwd()), timeout=600)
         # Allow copying more than one file from the FPGA:
         if args.extra_output_files:
             for extra_file in args.extra_output_files:
-                do_scp("{}@{}:{}".format(args.user,args.target,extra_file),os.getcwd(),port=ssh_port,key=args.ssh_key)
+                ssh_session.copy_from_guest(extra_file, Path(os.getcwd()), timeout=600)
+        infoprint(ssh_session.statistics())
+        ssh_session.close()
         if args.interact:
             console.interact()
         console.close()
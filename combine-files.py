@@ -111,8 +111,18 @@ def checkAllFilesUsed(directory: Path):
 
 # append all the individual files in the right order
 addFilteredFile(scriptDir / "colour.py")
+addFilteredFile(scriptDir / "tracing.py")
 addFilteredFile(scriptDir / "utils.py")
 addFilteredFile(scriptDir / "mtree.py")
+addFilteredFile(scriptDir / "fingerprints.py")
+addFilteredFile(scriptDir / "sysroot_clone.py")
+addFilteredFile(scriptDir / "system_deps.py")
+addFilteredFile(scriptDir / "compiler_cache.py")
+addFilteredFile(scriptDir / "deletion_queue.py")
+addFilteredFile(scriptDir / "elfstrip.py")
+addFilteredFile(scriptDir / "gitfetch.py")
+addFilteredFile(scriptDir / "outputpipeline.py")
+addFilteredFile(scriptDir / "benchmark_report.py")
 addFilteredFile(scriptDir / "config/loader.py")
 addFilteredFile(scriptDir / "config/chericonfig.py")
 addFilteredFile(scriptDir / "config/defaultconfig.py")
@@ -167,6 +177,9 @@ addFilteredFile(scriptDir / "projects/run_qemu.py")
 # this one should not be needed
 addFilteredFile(scriptDir / "projects/samba.py")
 
+# needed by __main__.py
+addFilteredFile(scriptDir / "target_index.py")
+
 
 # now make sure that all the projects were handled
 checkAllFilesUsed(scriptDir)
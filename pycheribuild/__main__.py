@@ -28,11 +28,13 @@
 # SUCH DAMAGE.
 #
 import fcntl
+import importlib
 import os
 import shlex
 import shutil
 import subprocess
 import sys
+import time
 from pathlib import Path
 
 # First thing we need to do is set up the config loader (before importing anything else!)
@@ -40,14 +42,14 @@ from pathlib import Path
 # https://stackoverflow.com/questions/3536620/how-to-change-a-module-variable-from-another-module
 from .config.loader import JsonAndCommandLineConfigLoader, JsonAndCommandLineConfigOption
 from .config.defaultconfig import DefaultCheriConfig, CheribuildAction
+from .deletion_queue import deletion_queue
 from .utils import *
 from .utils import have_working_internet_connection
 from .targets import targetManager
 from .projects.project import SimpleProject
-# noinspection PyUnresolvedReferences
-from .projects import *  # make sure all projects are loaded so that targetManager gets populated
-# noinspection PyUnresolvedReferences
-from .projects.cross import *  # make sure all projects are loaded so that targetManager gets populated
+from .target_index import TargetIndex, StartupTimer, default_index_path, lazy_loading_enabled, load_all_projects
+from .target_index import source_stamp
+from .tracing import start_tracing, stop_tracing
 
 
 def updateCheck():
@@ -86,22 +88,79 @@ def ensure_fd_is_blocking(fd):
         fatalError("fd", fd, "is set to nonblocking and could not unset flag")
 
 
+def load_projects() -> "typing.Tuple[typing.Optional[TargetIndex], typing.Optional[str]]":
+    """
+    Import the project modules. If the target index is up-to-date only the modules that are needed for the targets
+    and options on the command line are imported (the others are loaded on demand by targetManager).
+    :return: the index if lazy loading is used and the source stamp if the index needs to be regenerated
+    """
+    if not __package__:
+        return None, None  # combined single-file cheribuild.py -> all projects are already defined
+    if not lazy_loading_enabled() or "_ARGCOMPLETE" in os.environ:
+        load_all_projects()
+        return None, None
+    stamp = source_stamp()
+    index = TargetIndex.load(default_index_path(), stamp)
+    modules = index.modules_for_arguments(sys.argv[1:]) if index is not None else None
+    if modules is None:
+        load_all_projects()
+        return None, (stamp if index is None else None)
+    for module in modules:
+        importlib.import_module(module)
+    return index, None
+
+
+def update_target_index(configLoader: JsonAndCommandLineConfigLoader, stamp: str):
+    try:
+        TargetIndex.generate(targetManager, configLoader, stamp).save(default_index_path())
+    except Exception as e:
+        warningMessage("Could not update the target index", default_index_path(), "->", e)
+
+
 def real_main():
     # avoid weird errors with macos terminal:
     ensure_fd_is_blocking(sys.stdin.fileno())
     ensure_fd_is_blocking(sys.stdout.fileno())
     ensure_fd_is_blocking(sys.stderr.fileno())
 
-    allTargetNames = list(sorted(targetManager.targetNames))
+    timer = StartupTimer()
+    index, new_index_stamp = load_projects()
+    timer.phase_done("import")
+    allTargetNames = index.target_names if index is not None else list(sorted(targetManager.targetNames))
     runEverythingTarget = "__run_everything__"
     configLoader = JsonAndCommandLineConfigLoader()
+    if index is not None:
+        configLoader.lazy_option_names = set(index.options.keys())
+        targetManager.lazy_loader = index.import_module_for_target
     # Register all command line options
     cheriConfig = DefaultCheriConfig(configLoader, allTargetNames + [runEverythingTarget])
     SimpleProject._configLoader = configLoader
     targetManager.registerCommandLineOptions()
+    timer.phase_done("register-options")
+    if new_index_stamp:
+        update_target_index(configLoader, new_index_stamp)
+        timer.phase_done("update-index")
     # load them from JSON/cmd line
     cheriConfig.load()
     setCheriConfig(cheriConfig)
+    timer.phase_done("parse-arguments")
+    timer.report()
+    if cheriConfig.reap_deletion_queue:
+        deletion_queue().reap(jobs=max(1, min(8, cheriConfig.makeJobs)))
+        sys.exit()
+    if cheriConfig.trace_file:
+        recorder = start_tracing(cheriConfig.trace_file.absolute())
+        # Include the time spent loading the projects and parsing the command line arguments
+        now = time.time()
+        startup_args = {name + "_ms": round(value * 1000, 3) for name, value in timer.phases.items()}
+        startup_args["argv"] = sys.argv
+        recorder.add_complete_event("startup", "phase", (now - (time.perf_counter() - timer.start)) * 1000000,
+                                    now * 1000000, args=startup_args)
+    if cheriConfig.clear_tool_probe_cache:
+        statusUpdate("Clearing cached compiler and tool version checks in", tool_probe_cache().path)
+        tool_probe_cache().clear()
+        if not cheriConfig.targets:
+            sys.exit()
 
     if cheriConfig.docker or JsonAndCommandLineConfigLoader.get_config_prefix() == "docker-":
         # check that the docker build won't override native binaries
@@ -123,6 +182,10 @@ def real_main():
     elif CheribuildAction.DUMP_CONFIGURATION in cheriConfig.action:
         print(cheriConfig.getOptionsJSON())
         sys.exit()
+    elif CheribuildAction.BENCHMARK_REPORT in cheriConfig.action:
+        from .benchmark_report import run_benchmark_report
+        run_benchmark_report(cheriConfig)
+        sys.exit()
     elif cheriConfig.getConfigOption:
         if cheriConfig.getConfigOption not in configLoader.options:
             fatalError("Unknown config key", cheriConfig.getConfigOption)
@@ -130,6 +193,9 @@ def real_main():
         # noinspection PyProtectedMember
         print(option.__get__(cheriConfig, option._owningClass if option._owningClass else cheriConfig))
         sys.exit()
+    elif cheriConfig.explain_deps:
+        targetManager.explain_dependencies(cheriConfig, cheriConfig.explain_deps)
+        sys.exit()
 
     assert any(x in cheriConfig.action for x in (CheribuildAction.TEST, CheribuildAction.PRINT_CHOSEN_TARGETS,
                                                  CheribuildAction.BUILD, CheribuildAction.BENCHMARK))
@@ -208,7 +274,9 @@ def real_main():
         print("Sources will be stored in", cheriConfig.sourceRoot)
         print("Build artifacts will be stored in", cheriConfig.outputRoot)
     # Don't do the update check when tab-completing (otherwise it freezes)
-    if "_ARGCOMPLETE" not in os.environ and not cheriConfig.skipUpdate:  # no-combine
+    # Also skip it for the worker processes started by --parallel-targets (the parent has already checked)
+    if ("_ARGCOMPLETE" not in os.environ and "_CHERIBUILD_PARALLEL_WORKER" not in os.environ and  # no-combine
+            not cheriConfig.skipUpdate):  # no-combine
         try:                                          # no-combine
             updateCheck()                             # no-combine
         except Exception as e:                        # no-combine
@@ -224,6 +292,8 @@ def real_main():
     if CheribuildAction.BENCHMARK in cheriConfig.action:
         for target in targetManager.get_all_chosen_targets(cheriConfig):
             target.run_benchmarks(cheriConfig)
+    if cheriConfig.verbose:
+        statusUpdate(tool_probe_cache().statistics())
 
 def main():
     try:
@@ -234,6 +304,10 @@ def main():
         cwd = (". Working directory was ", err.cwd) if hasattr(err, "cwd") else ()
         fatalError("Command ", "`" + commandline_to_str(err.cmd) + "` failed with non-zero exit code ",
                    err.returncode, *cwd, fatalWhenPretending=True, sep="")
+    finally:
+        recorder = stop_tracing()
+        if recorder is not None:
+            statusUpdate("Wrote trace with", len(recorder.events), "events to", recorder.path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,413 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import csv
+import html
+import io
+import math
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+from .utils import *
+
+# All statcounters values are costs (cycles, instructions, cache misses, ...) so a larger value is a regression
+DEFAULT_REPORT_METRICS = ("cycles", "instructions")
+_STATCOUNTERS_NAME_COLUMNS = ("progname", "archname")
+# <target>-statcounters<suffix>-<date>.csv as written by CrossCompileMixin.default_statcounters_csv_name
+_STATCOUNTERS_CSV_NAME_RE = re.compile(r"^(?P<target>.+)-statcounters(?P<suffix>.*?)(-\d{8}-\d{6})?$")
+
+
+def median(values: "typing.Sequence[float]") -> float:
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def geometric_mean(values: "typing.Sequence[float]") -> "typing.Optional[float]":
+    if not values or any(v <= 0 for v in values):
+        return None
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+
+def _binomial_cdf_half(k: int, n: int) -> float:
+    # P(X <= k) for X ~ Binomial(n, 0.5)
+    term = 1.0
+    total = 0.0
+    for i in range(k + 1):
+        total += term
+        term = term * (n - i) / (i + 1)
+    return total / 2.0 ** n
+
+
+def median_confidence_interval(values: "typing.Sequence[float]",
+                               confidence: float = 0.95) -> "typing.Tuple[float, float]":
+    """
+    Distribution-free confidence interval for the median based on order statistics. For very small samples the
+    interval is the full range of values (and the actual confidence is lower than requested).
+    """
+    values = sorted(values)
+    n = len(values)
+    alpha = 1.0 - confidence
+    # Find the largest k such that [x_(k), x_(n-k+1)] still covers the median with the requested confidence
+    k = 0
+    while k + 1 <= n // 2 and 2 * _binomial_cdf_half(k, n) <= alpha:
+        k += 1
+    k = max(k, 1)
+    return values[k - 1], values[n - k]
+
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # Continued fraction for the incomplete beta function (modified Lentz's method)
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)), -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + aa / c
+            c = c if abs(c) > tiny else tiny
+            delta = d * c
+            h *= delta
+        if abs(delta - 1.0) < 3e-14:
+            break
+    return h
+
+
+def _regularized_incomplete_beta(a: float, b: float, x: float) -> float:
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_t_test(a: "typing.Sequence[float]", b: "typing.Sequence[float]") -> "typing.Optional[float]":
+    """
+    :return: the two-sided p-value of Welch's t-test for the means of a and b being different or None if there are
+    not enough samples
+    """
+    if len(a) < 2 or len(b) < 2:
+        return None
+    mean_a = sum(a) / len(a)
+    mean_b = sum(b) / len(b)
+    var_a = sum((x - mean_a) ** 2 for x in a) / (len(a) - 1) / len(a)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (len(b) - 1) / len(b)
+    if var_a + var_b == 0:
+        # Deterministic counters (e.g. instructions on QEMU): any difference is significant
+        return 1.0 if mean_a == mean_b else 0.0
+    t = (mean_a - mean_b) / math.sqrt(var_a + var_b)
+    df = (var_a + var_b) ** 2 / (var_a ** 2 / (len(a) - 1) + var_b ** 2 / (len(b) - 1))
+    return _regularized_incomplete_beta(df / 2.0, 0.5, df / (df + t * t))
+
+
+def statcounters_configuration_name(csv_file: Path) -> str:
+    match = _STATCOUNTERS_CSV_NAME_RE.match(csv_file.stem)
+    if match:
+        return match.group("target") + match.group("suffix")
+    return csv_file.stem
+
+
+class StatcountersSamples(object):
+    """All samples of one configuration: benchmark -> metric -> values"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.files = []  # type: typing.List[Path]
+        self.samples = OrderedDict()  # type: typing.Dict[str, typing.Dict[str, typing.List[float]]]
+
+    def load_csv(self, csv_file: Path):
+        self.files.append(csv_file)
+        with csv_file.open("r", newline="") as f:
+            for row in csv.DictReader(f):
+                benchmark = row.get("progname")
+                # libstatcounters writes a new header line for every run appending to an existing file
+                if not benchmark or benchmark == "progname":
+                    continue
+                metrics = self.samples.setdefault(benchmark, dict())
+                for metric, value in row.items():
+                    if metric is None or metric in _STATCOUNTERS_NAME_COLUMNS or value is None:
+                        continue
+                    try:
+                        metrics.setdefault(metric.strip(), []).append(float(value))
+                    except ValueError:
+                        continue
+
+    def values(self, benchmark: str, metric: str) -> "typing.List[float]":
+        return self.samples.get(benchmark, dict()).get(metric, [])
+
+
+class BenchmarkComparison(object):
+    def __init__(self, benchmark: str, metric: str, baseline: "typing.List[float]", other: "typing.List[float]",
+                 alpha: float, threshold: float):
+        self.benchmark = benchmark
+        self.metric = metric
+        self.baseline_median = median(baseline)
+        self.median = median(other)
+        self.confidence_interval = median_confidence_interval(other)
+        self.p_value = welch_t_test(baseline, other)
+        self.significant = self.p_value is not None and self.p_value < alpha
+        if self.baseline_median:
+            self.overhead = self.median / self.baseline_median - 1.0
+        else:
+            self.overhead = None
+        self.regression = self.significant and self.overhead is not None and self.overhead * 100 > threshold
+
+
+class BenchmarkReport(object):
+    """
+    Compares the statcounters samples of multiple configurations (e.g. mips vs. purecap) against a baseline
+    configuration. Overheads are computed from the per-benchmark medians and summarised using the geometric mean.
+    """
+
+    def __init__(self, configurations: "typing.List[StatcountersSamples]", baseline: str = None,
+                 metrics: "typing.Sequence[str]" = DEFAULT_REPORT_METRICS, alpha: float = 0.05, threshold: float = 0.0):
+        assert configurations, "Need at least one configuration"
+        self.configurations = OrderedDict((c.name, c) for c in configurations)
+        if baseline and baseline not in self.configurations:
+            raise ValueError("Unknown baseline configuration " + baseline + ", available configurations are " +
+                             ", ".join(self.configurations))
+        self.baseline = self.configurations[baseline] if baseline else configurations[0]
+        self.metrics = list(metrics)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.benchmarks = []  # type: typing.List[str]
+        for config in configurations:
+            self.benchmarks.extend(b for b in config.samples if b not in self.benchmarks)
+        self.comparisons = OrderedDict()  # type: typing.Dict[str, typing.List[BenchmarkComparison]]
+        for config in configurations:
+            if config is self.baseline:
+                continue
+            comparisons = []
+            for benchmark in self.benchmarks:
+                for metric in self.metrics:
+                    baseline_values = self.baseline.values(benchmark, metric)
+                    values = config.values(benchmark, metric)
+                    if baseline_values and values:
+                        comparisons.append(BenchmarkComparison(benchmark, metric, baseline_values, values,
+                                                               alpha=alpha, threshold=threshold))
+            self.comparisons[config.name] = comparisons
+
+    @classmethod
+    def from_csv_files(cls, csv_files: "typing.Iterable[Path]", **kwargs) -> "BenchmarkReport":
+        configurations = OrderedDict()  # type: typing.Dict[str, StatcountersSamples]
+        for csv_file in csv_files:
+            name = statcounters_configuration_name(csv_file)
+            configurations.setdefault(name, StatcountersSamples(name)).load_csv(csv_file)
+        return cls(list(configurations.values()), **kwargs)
+
+    def geomean_overhead(self, config: str, metric: str) -> "typing.Optional[float]":
+        ratios = [c.median / c.baseline_median for c in self.comparisons[config]
+                  if c.metric == metric and c.baseline_median and c.median]
+        result = geometric_mean(ratios)
+        return None if result is None else result - 1.0
+
+    def geomean(self, config: StatcountersSamples, metric: str) -> "typing.Optional[float]":
+        return geometric_mean([median(config.values(b, metric)) for b in self.benchmarks if config.values(b, metric)])
+
+    @property
+    def regressions(self) -> "typing.List[typing.Tuple[str, BenchmarkComparison]]":
+        return [(config, c) for config, comparisons in self.comparisons.items() for c in comparisons if c.regression]
+
+    def summary_rows(self) -> "typing.List[typing.List[str]]":
+        rows = []
+        for config in self.configurations.values():
+            for benchmark in self.benchmarks:
+                for metric in self.metrics:
+                    values = config.values(benchmark, metric)
+                    if not values:
+                        continue
+                    low, high = median_confidence_interval(values)
+                    rows.append([config.name, benchmark, metric, str(len(values)), _format_number(median(values)),
+                                 _format_number(low), _format_number(high)])
+            for metric in self.metrics:
+                geomean = self.geomean(config, metric)
+                if geomean is not None:
+                    rows.append([config.name, "geomean", metric, "", _format_number(geomean), "", ""])
+        return rows
+
+    def comparison_rows(self) -> "typing.List[typing.List[str]]":
+        rows = []
+        for config, comparisons in self.comparisons.items():
+            for c in comparisons:
+                rows.append([config, c.benchmark, c.metric, _format_number(c.baseline_median),
+                             _format_number(c.median), _format_percent(c.overhead),
+                             "" if c.p_value is None else "{:.4f}".format(c.p_value),
+                             "REGRESSION" if c.regression else ("significant" if c.significant else "")])
+            for metric in self.metrics:
+                overhead = self.geomean_overhead(config, metric)
+                if overhead is not None:
+                    rows.append([config, "geomean", metric, "", "", _format_percent(overhead), "", ""])
+        return rows
+
+    SUMMARY_HEADER = ["configuration", "benchmark", "metric", "samples", "median", "ci95_low", "ci95_high"]
+    COMPARISON_HEADER = ["configuration", "benchmark", "metric", "baseline_median", "median", "overhead", "p_value",
+                         "status"]
+
+    def to_text(self) -> str:
+        out = io.StringIO()
+        out.write("Benchmark summary (median with 95% confidence interval)\n")
+        out.write(_text_table(self.SUMMARY_HEADER, self.summary_rows()))
+        if self.comparisons:
+            out.write("\nOverhead relative to " + self.baseline.name + " (Welch's t-test, alpha=" + str(self.alpha) +
+                      ")\n")
+            out.write(_text_table(self.COMPARISON_HEADER, self.comparison_rows()))
+        regressions = self.regressions
+        out.write("\n" + str(len(regressions)) + " statistically significant regression(s)\n")
+        for config, c in regressions:
+            out.write("  " + config + ": " + c.benchmark + " " + c.metric + " " + _format_percent(c.overhead) + "\n")
+        return out.getvalue()
+
+    def to_csv(self) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(self.COMPARISON_HEADER[:3] + ["baseline_median", "median", "ci95_low", "ci95_high",
+                                                      "overhead", "p_value", "status"])
+        for config in self.configurations.values():
+            comparisons = {(c.benchmark, c.metric): c for c in self.comparisons.get(config.name, [])}
+            for benchmark in self.benchmarks:
+                for metric in self.metrics:
+                    values = config.values(benchmark, metric)
+                    if not values:
+                        continue
+                    low, high = median_confidence_interval(values)
+                    c = comparisons.get((benchmark, metric))
+                    writer.writerow([config.name, benchmark, metric,
+                                     "" if c is None else repr(c.baseline_median), repr(median(values)), repr(low),
+                                     repr(high), "" if c is None or c.overhead is None else repr(c.overhead),
+                                     "" if c is None or c.p_value is None else repr(c.p_value),
+                                     "" if c is None else ("regression" if c.regression else
+                                                           ("significant" if c.significant else ""))])
+        return out.getvalue()
+
+    def to_html(self) -> str:
+        out = io.StringIO()
+        out.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>Benchmark report</title>\n"
+                  "<style>table { border-collapse: collapse; } td, th { border: 1px solid #ccc; padding: 2px 6px; }"
+                  " td { text-align: right; } tr.regression { background: #fcc; }</style>\n</head>\n<body>\n")
+        out.write("<h2>Benchmark summary</h2>\n")
+        out.write(_html_table(self.SUMMARY_HEADER, self.summary_rows()))
+        if self.comparisons:
+            out.write("<h2>Overhead relative to " + html.escape(self.baseline.name) + "</h2>\n")
+            out.write(_html_table(self.COMPARISON_HEADER, self.comparison_rows(), highlight="REGRESSION"))
+        out.write("<p>" + str(len(self.regressions)) + " statistically significant regression(s)</p>\n")
+        out.write("</body>\n</html>\n")
+        return out.getvalue()
+
+    def format(self, output_format: str) -> str:
+        if output_format == "csv":
+            return self.to_csv()
+        elif output_format == "html":
+            return self.to_html()
+        assert output_format == "text", "Invalid format " + output_format
+        return self.to_text()
+
+
+def _format_number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return "{:.2f}".format(value)
+
+
+def _format_percent(value: "typing.Optional[float]") -> str:
+    if value is None:
+        return "n/a"
+    return "{:+.2f}%".format(value * 100)
+
+
+def _text_table(header: "typing.List[str]", rows: "typing.List[typing.List[str]]") -> str:
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        lines.append("  ".join(value.ljust(width) if i < 3 else value.rjust(width)
+                               for i, (value, width) in enumerate(zip(row, widths))).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def _html_table(header: "typing.List[str]", rows: "typing.List[typing.List[str]]", highlight: str = None) -> str:
+    lines = ["<table>", "<tr>" + "".join("<th>" + html.escape(h) + "</th>" for h in header) + "</tr>"]
+    for row in rows:
+        row_class = ' class="regression"' if highlight and highlight in row else ""
+        lines.append("<tr" + row_class + ">" + "".join("<td>" + html.escape(v) + "</td>" for v in row) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines) + "\n"
+
+
+def find_statcounters_csvs(paths: "typing.Iterable[Path]") -> "typing.List[Path]":
+    result = []
+    for path in paths:
+        if path.is_dir():
+            result.extend(sorted(path.glob("*-statcounters*.csv")))
+        elif path.exists():
+            result.append(path)
+        else:
+            fatalError("statcounters CSV file", path, "does not exist")
+    return result
+
+
+def run_benchmark_report(config: "CheriConfig"):
+    csv_files = find_statcounters_csvs(Path(p).absolute() for p in (config.benchmark_report_csvs or []))
+    if not csv_files:
+        fatalError("No statcounters CSV files found", fixitHint="pass the CSV files written by --benchmark with "
+                                                               "--benchmark-report-csv")
+        return
+    metrics = [m.strip() for m in config.benchmark_report_metrics.split(",") if m.strip()]
+    try:
+        report = BenchmarkReport.from_csv_files(csv_files, baseline=config.benchmark_report_baseline, metrics=metrics,
+                                                threshold=config.benchmark_report_threshold)
+    except ValueError as e:
+        fatalError(str(e))
+        return
+    statusUpdate("Loaded", len(csv_files), "statcounters CSV files for configurations",
+                 ", ".join(report.configurations), "(baseline: " + report.baseline.name + ")")
+    for metric in metrics:
+        if not any(c.values(b, metric) for c in report.configurations.values() for b in report.benchmarks):
+            warningMessage("Metric", metric, "not found in any of the statcounters CSV files")
+    output = report.format(config.benchmark_report_format)
+    if not config.benchmark_report_output:
+        print(output, end="")
+        return
+    statusUpdate("Writing benchmark report to", config.benchmark_report_output)
+    with open(str(config.benchmark_report_output), "w", encoding="utf-8") as f:
+        f.write(output)
+    for name, comparison in report.regressions:
+        warningMessage("Regression in", name + ":", comparison.benchmark, comparison.metric,
+                       _format_percent(comparison.overhead), "(p={:.4f})".format(comparison.p_value))
@@ -36,6 +36,9 @@
 import argparse
 import atexit
 import datetime
+import fcntl
+import hashlib
+import json
 import os
 import pexpect
 import shlex
@@ -49,7 +52,9 @@ import traceback
 import typing
 from pathlib import Path
 from contextlib import closing
+from ..sysroot_clone import FileCloner
 from ..utils import find_free_port
+from .ssh_session import SSHSession
 
 STARTING_INIT = "start_init: trying /sbin/init"
 BOOT_FAILURE = "Enter full pathname of shell or RETURN for /bin/sh"
@@ -112,6 +117,7 @@ def parse_smb_mount(arg: str):
 class CheriBSDInstance(pexpect.spawn):
     EXIT_ON_KERNEL_PANIC = True
     smb_dirs = None  # type: typing.List[SmbMount]
+    ssh_session = None  # type: typing.Optional[SSHSession]
 
     def expect(self, pattern: list, timeout=-1, pretend_result=None, **kwargs):
         assert isinstance(pattern, list), "expected list and not " + str(pattern)
@@ -383,6 +389,7 @@ def set_posix_sh_prompt(child):
 class FakeSpawn(object):
     pid = -1
     should_quit = False
+    ssh_session = None  # type: typing.Optional[SSHSession]
 
     def expect(self, *args, pretend_result=None, **kwargs):
         print("Expecting", args, file=sys.stderr, flush=True)
@@ -428,8 +435,207 @@ def start_dhclient(qemu: CheriBSDInstance):
     qemu.expect_exact(PROMPT_SH, timeout=30)
 
 
+class QemuMonitor(object):
+    """
+    Minimal client for the QEMU human monitor exposed using -monitor unix:PATH,server,nowait
+    """
+    MONITOR_PROMPT = b"(qemu) "
+
+    def __init__(self, path: Path, timeout=60):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # QEMU might not have created the socket yet -> retry for a while
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.sock.connect(str(path))
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        self._read_until_prompt(timeout)
+
+    def _read_until_prompt(self, timeout) -> str:
+        self.sock.settimeout(timeout)
+        data = b""
+        while not data.endswith(self.MONITOR_PROMPT):
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("QEMU monitor closed the connection")
+            data += chunk
+        return data[:-len(self.MONITOR_PROMPT)].decode("utf-8", errors="replace")
+
+    def command(self, cmd: str, timeout=60) -> str:
+        self.sock.sendall(cmd.encode("utf-8") + b"\n")
+        return self._read_until_prompt(timeout)
+
+    def quit(self):
+        # QEMU exits without printing another prompt
+        self.sock.sendall(b"quit\n")
+        self.sock.close()
+
+
+def find_qemu_img(qemu_cmd: str) -> "typing.Optional[str]":
+    # Prefer the qemu-img that was installed together with the QEMU binary
+    qemu_binary = Path(shutil.which(qemu_cmd) or qemu_cmd)
+    return shutil.which(str(qemu_binary.parent / "qemu-img")) or shutil.which("qemu-img")
+
+
+def disk_image_format(path: Path) -> str:
+    if PRETEND and not path.exists():
+        return "raw"
+    with path.open("rb") as f:
+        return "qcow2" if f.read(4) == b"QFI\xfb" else "raw"
+
+
+def create_qcow2_overlay(qemu_img: str, backing_file: Path, path: Path):
+    backing_file = backing_file.absolute()
+    run_host_command([qemu_img, "create", "-f", "qcow2", "-F", disk_image_format(backing_file),
+                      "-b", str(backing_file), str(path)])
+
+
+class DiskImageOverlay(object):
+    """
+    A throwaway qcow2 overlay on top of a disk image that is shared between multiple test runs. QEMU only writes
+    to the overlay and opens the backing file read-only, so creating it is instant instead of copying the whole
+    image. The overlay is deleted once the run has finished unless it should be kept for debugging.
+    """
+
+    def __init__(self, qemu_img: str, base_image: Path, *, keep=False, keep_on_failure=False):
+        self.base_image = base_image.absolute()
+        self.path = self.base_image.with_name(self.base_image.name + ".runtests." +
+                                              datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".pid" +
+                                              str(os.getpid()) + ".qcow2")
+        self.keep = keep
+        self.keep_on_failure = keep_on_failure
+        self.succeeded = False
+        self._cleaned_up = False
+        assert not self.path.exists()
+        create_qcow2_overlay(qemu_img, self.base_image, self.path)
+        # Also clean up if the run is aborted (e.g. because booting failed)
+        atexit.register(self.cleanup)
+
+    def cleanup(self):
+        if self._cleaned_up:
+            return
+        self._cleaned_up = True
+        if self.keep or (self.keep_on_failure and not self.succeeded):
+            info("Keeping disk image overlay ", self.path, " (backing file ", self.base_image, ")")
+            return
+        run_host_command(["rm", "-f", str(self.path)])
+
+    @staticmethod
+    def remove_leftover_overlays(base_image: Path, pid: int, keep=False):
+        """
+        Delete the overlays created by process pid (e.g. a libc++ test shard that was killed before it could clean up)
+        """
+        base_image = base_image.absolute()
+        for path in sorted(base_image.parent.glob(base_image.name + ".runtests.*.pid" + str(pid) + ".qcow2")):
+            if keep:
+                info("Keeping disk image overlay ", path, " of process ", pid)
+            else:
+                run_host_command(["rm", "-f", str(path)])
+
+
+class BootSnapshotCache(object):
+    """
+    Caches a booted CheriBSD instance (logged in and with SSH set up) as a QEMU savevm snapshot inside a qcow2
+    overlay on top of the disk image. The overlay is keyed by the hashes of the QEMU binary, kernel and disk image
+    as well as the QEMU arguments that affect the guest state so it will be recreated if any of them change.
+    """
+    SNAPSHOT_NAME = "cheribuild-booted"
+
+    def __init__(self, cache_dir: Path, qemu_cmd: str, kernel: str, disk_image: str, key_args: "typing.List[str]"):
+        self.cache_dir = cache_dir
+        os.makedirs(str(cache_dir), exist_ok=True)
+        qemu_binary = Path(shutil.which(qemu_cmd) or qemu_cmd)
+        self.qemu_img = find_qemu_img(qemu_cmd)
+        if not self.qemu_img:
+            failure("Cannot use the boot snapshot cache without qemu-img", exit=True)
+        self.disk_image = Path(disk_image).absolute()
+        key_components = [self._file_digest(qemu_binary), self._file_digest(Path(kernel)),
+                          self._file_digest(self.disk_image)] + key_args
+        self.key = hashlib.sha256("\0".join(key_components).encode("utf-8")).hexdigest()[:24]
+        self.overlay = cache_dir / (self.key + ".qcow2")
+        self.metadata_path = cache_dir / (self.key + ".json")
+        self.run_copy = None  # type: typing.Optional[Path]
+
+    def _file_digest(self, path: Path) -> str:
+        # Hashing a multi-GB disk image is slow so remember the digest for as long as the file stays the same
+        if PRETEND and not path.exists():
+            return str(path)
+        st = path.stat()
+        identity = "{}:{}:{}:{}".format(path.absolute(), st.st_size, st.st_mtime_ns, st.st_ino)
+        digests_file = self.cache_dir / "digests.json"
+        try:
+            with digests_file.open("r", encoding="utf-8") as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            digests = dict()
+        if identity in digests:
+            return digests[identity]
+        sha256 = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digests[identity] = sha256.hexdigest()
+        tmpfile = digests_file.with_name(digests_file.name + ".tmp." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(digests, f)
+        os.replace(str(tmpfile), str(digests_file))
+        return digests[identity]
+
+    @property
+    def cold_boot_time(self) -> "typing.Optional[float]":
+        try:
+            with self.metadata_path.open("r", encoding="utf-8") as f:
+                return json.load(f)["cold_boot_seconds"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def has_snapshot(self) -> bool:
+        return self.overlay.is_file() and self.cold_boot_time is not None
+
+    def create_overlay(self, path: Path):
+        create_qcow2_overlay(self.qemu_img, self.disk_image, path)
+
+    def save(self, monitor: QemuMonitor, overlay: Path, cold_boot_time: datetime.timedelta):
+        info("Saving snapshot ", self.SNAPSHOT_NAME, " to ", self.overlay)
+        if PRETEND:
+            return
+        output = monitor.command("savevm " + self.SNAPSHOT_NAME, timeout=15 * 60)
+        if "Error" in output:
+            failure("Failed to save QEMU snapshot: ", output, exit=True)
+        monitor.quit()
+        os.replace(str(overlay), str(self.overlay))
+        with self.metadata_path.open("w", encoding="utf-8") as f:
+            json.dump(dict(cold_boot_seconds=cold_boot_time.total_seconds(), disk_image=str(self.disk_image)), f)
+
+    def make_copy(self) -> Path:
+        # The tests will modify the disk so every run needs a private copy of the overlay
+        assert self.run_copy is None
+        self.run_copy = self.overlay.with_suffix(".run." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".pid" +
+                                                 str(os.getpid()) + ".qcow2")
+        info("Copying ", self.overlay, " to ", self.run_copy)
+        if not PRETEND:
+            # Use a copy-on-write clone if the file system supports it (falls back to a normal copy otherwise)
+            FileCloner("reflink").clone(self.overlay, self.run_copy, self.overlay.stat())
+        return self.run_copy
+
+    def remove_copy(self, keep: bool):
+        # Called from main() since atexit handlers are not run when a libc++ test shard process exits
+        if self.run_copy is None:
+            return
+        if keep:
+            info("Keeping disk image copy ", self.run_copy)
+        else:
+            run_host_command(["rm", "-f", str(self.run_copy)])
+        self.run_copy = None
+
+
 def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: typing.Optional[int], *, smb_dirs: typing.List[SmbMount]=None,
-                  kernel_init_only=False, trap_on_unrepresentable=False, skip_ssh_setup=False) -> CheriBSDInstance:
+                  kernel_init_only=False, trap_on_unrepresentable=False, skip_ssh_setup=False,
+                  monitor_socket: Path=None, loadvm: str=None) -> CheriBSDInstance:
     user_network_args = "user,id=net0,ipv6=off"
     if smb_dirs is None:
         smb_dirs = []
@@ -451,6 +657,10 @@ def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: t
         qemu_args.append("cheribuild.skip_sshd=1 cheribuild.skip_entropy=1")
     if disk_image:
         qemu_args += ["-hda", disk_image]
+    if monitor_socket is not None:
+        qemu_args += ["-monitor", "unix:" + str(monitor_socket) + ",server,nowait"]
+    if loadvm is not None:
+        qemu_args += ["-loadvm", loadvm]
     success("Starting QEMU: ", qemu_cmd, " ", " ".join(qemu_args))
     qemu_starttime = datetime.datetime.now()
     global _SSH_SOCKET_PLACEHOLDER  # type: socket.socket
@@ -471,6 +681,15 @@ def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: t
     # ignore SIGINT for the python code, the child should still receive it
     # signal.signal(signal.SIGINT, signal.SIG_IGN)
     try:
+        if loadvm is not None:
+            # The snapshot was taken at the shell prompt so we only need to wait for a new one
+            child.sendline("")
+            i = child.expect([pexpect.TIMEOUT, PROMPT], timeout=5 * 60)
+            if i == 0:  # Timeout
+                failure("timeout restoring snapshot ", loadvm, ": ", str(child))
+            success("===> restored CheriBSD from snapshot ", loadvm, " (", datetime.datetime.now() - qemu_starttime,
+                    ")")
+            return child
         i = child.expect([pexpect.TIMEOUT, STARTING_INIT, BOOT_FAILURE] + FATAL_ERROR_MESSAGES, timeout=15 * 60)
         if i == 0:  # Timeout
             failure("timeout before booted: ", str(child))
@@ -530,12 +749,51 @@ def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: t
     return child
 
 
+def boot_cheribsd_from_snapshot(cache: BootSnapshotCache, args: argparse.Namespace, kernel: str) -> CheriBSDInstance:
+    """
+    Restore the cached snapshot (creating it first with a cold boot if needed) and return the running instance.
+    """
+    boot_args = dict(smb_dirs=args.smb_mount_directories, trap_on_unrepresentable=args.trap_on_unrepresentable,
+                     skip_ssh_setup=args.skip_ssh_setup)
+    # Lock the cache entry so that parallel jobs (e.g. libc++ test shards) only cold boot once
+    with (cache.cache_dir / (cache.key + ".lock")).open("w") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        if not cache.has_snapshot():
+            info("No boot snapshot found for ", cache.key, ", performing a cold boot")
+            cold_starttime = datetime.datetime.now()
+            new_overlay = cache.overlay.with_suffix(".tmp" + str(os.getpid()) + ".qcow2")
+            cache.create_overlay(new_overlay)
+            try:
+                with tempfile.TemporaryDirectory(prefix="cheribuild-qemu-monitor-") as monitor_dir:
+                    monitor_socket = Path(monitor_dir, "monitor.sock")
+                    qemu = boot_cheribsd(args.qemu_cmd, kernel, str(new_overlay), args.ssh_port,
+                                         monitor_socket=monitor_socket, **boot_args)
+                    if not args.skip_ssh_setup:
+                        setup_ssh(qemu, Path(args.ssh_key))
+                    monitor = None if PRETEND else QemuMonitor(monitor_socket)
+                    cache.save(monitor, new_overlay, datetime.datetime.now() - cold_starttime)
+                    if not PRETEND:
+                        qemu.expect([pexpect.EOF], timeout=60)
+            finally:
+                if new_overlay.exists():  # only left behind if saving the snapshot failed
+                    run_host_command(["rm", "-f", str(new_overlay)])
+        cold_boot_time = cache.cold_boot_time
+        diskimg = str(cache.make_copy())
+    warm_starttime = datetime.datetime.now()
+    qemu = boot_cheribsd(args.qemu_cmd, kernel, diskimg, args.ssh_port, loadvm=cache.SNAPSHOT_NAME, **boot_args)
+    # The guest clock stopped when the snapshot was taken
+    run_cheribsd_command(qemu, "date -u " + time.strftime("%Y%m%d%H%M.%S", time.gmtime()))
+    warm_boot_time = (datetime.datetime.now() - warm_starttime).total_seconds()
+    if cold_boot_time:
+        success("Boot times: cold ", round(cold_boot_time, 1), "s, warm (from snapshot) ", round(warm_boot_time, 1),
+                "s -> ", round(cold_boot_time / max(warm_boot_time, 0.001), 1), "x faster")
+    return qemu
+
+
 def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: list, test_ld_preload_files: list,
              test_setup_function: "typing.Callable[[CheriBSDInstance, argparse.Namespace], None]" = None,
              test_function: "typing.Callable[[CheriBSDInstance, argparse.Namespace], bool]" = None) -> bool:
     test_command = args.test_command
-    ssh_keyfile = args.ssh_key
-    ssh_port = args.ssh_port
     timeout = args.test_timeout
     smb_dirs = qemu.smb_dirs  # type: typing.List[SmbMount]
     setup_tests_starttime = datetime.datetime.now()
@@ -554,27 +812,17 @@ def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: li
     run_cheribsd_command(qemu, "df -ih")
     info("\nWill transfer the following archives: ", test_archives)
 
-    def do_scp(src, dst="/"):
-        # strip the .pub from the key file
-        private_key = str(Path(ssh_keyfile).with_suffix(""))
-        # CVE-2018-20685 -> Can no longer use '.' See https://superuser.com/questions/1403473/scp-error-unexpected-filename
-        scp_cmd = ["scp", "-B", "-r", "-P", str(ssh_port), "-o", "StrictHostKeyChecking=no",
-                   "-o", "UserKnownHostsFile=/dev/null",
-                   "-i", shlex.quote(private_key), str(src), "root@localhost:" + dst]
-        # use script for a fake tty to get progress output from scp
-        if sys.platform.startswith("linux"):
-            scp_cmd = ["script", "--quiet", "--return", "--command", " ".join(scp_cmd), "/dev/null"]
-        run_host_command(scp_cmd, cwd=str(src))
-
+    if not smb_dirs and (test_archives or test_ld_preload_files) and qemu.ssh_session is None:
+        failure("Cannot copy test files to the guest without SSH or SMB", exit=True)
     for archive in test_archives:
         if smb_dirs:
             run_host_command(["tar", "xJf", str(archive), "-C", str(smb_dirs[0].hostdir)])
         else:
-            # Extract to temporary directory and scp over
+            # Extract to temporary directory and stream it to the guest as a single tar pipe over SSH
             with tempfile.TemporaryDirectory(dir=os.getcwd(), prefix="test_files_") as tmp:
                 run_host_command(["tar", "xJf", str(archive), "-C", tmp])
                 run_host_command(["ls", "-la"], cwd=tmp)
-                do_scp(tmp)
+                qemu.ssh_session.copy_directory_to_guest(Path(tmp), "/")
     ld_preload_target_paths = []
     for lib in test_ld_preload_files:
         assert isinstance(lib, Path)
@@ -584,7 +832,7 @@ def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: li
             ld_preload_target_paths.append(str(Path(smb_dirs[0].in_target, "preload", lib.name)))
         else:
             run_cheribsd_command(qemu, "mkdir -p /tmp/preload")
-            do_scp(str(lib), "/tmp/preload/" + lib.name)
+            qemu.ssh_session.copy_to_guest(lib, "/tmp/preload/" + lib.name)
             ld_preload_target_paths.append(str(Path("/tmp/preload", lib.name)))
 
     for index, d in enumerate(smb_dirs):
@@ -602,8 +850,8 @@ def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: li
             checked_run_cheribsd_command(qemu, mount_command)
 
     if test_archives:
-        time.sleep(5)  # wait 5 seconds to make sure the disks have synced
-    # See how much space we have after running scp
+        run_cheribsd_command(qemu, "sync")  # make sure the disks have synced
+    # See how much space we have after copying the test files
     run_cheribsd_command(qemu, "df -h")
     # ensure that /tmp is world-writable
     run_cheribsd_command(qemu, "chmod 777 /tmp")
@@ -683,8 +931,20 @@ def get_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument("--keep-compressed-images", action="store_true", default=True, dest="keep_compressed_images")
     parser.add_argument("--no-keep-compressed-images", action="store_false", dest="keep_compressed_images")
     parser.add_argument("--make-disk-image-copy", default=True, action="store_true", help="Make a copy of the disk image before running tests")
-    parser.add_argument("--no-make-disk-image-copy", action="store_false", dest="disk_image_copy")
+    parser.add_argument("--no-make-disk-image-copy", action="store_false", dest="make_disk_image_copy")
     parser.add_argument("--keep-disk-image-copy", default=False, action="store_true", help="Keep the copy of the disk image (if a copy was made)")
+    parser.add_argument("--disk-image-overlay", action="store_true",
+                        help="Instead of copying the disk image create a throwaway qcow2 overlay on top of it "
+                             "(requires qemu-img). The disk image itself is never modified so it can be shared "
+                             "between parallel runs")
+    parser.add_argument("--keep-failed-overlay", action="store_true",
+                        help="Keep the disk image overlay for debugging if the tests failed")
+    parser.add_argument("--boot-cache", action="store_true",
+                        help="Boot from a QEMU snapshot that is taken after the first boot (once SSH is set up) "
+                             "instead of cold booting CheriBSD every time")
+    parser.add_argument("--boot-cache-dir", type=Path,
+                        default=Path(os.path.expanduser("~/.cache/cheribuild/qemu-boot-snapshots")),
+                        help="Directory where the boot snapshot overlays are stored")
     parser.add_argument("--trap-on-unrepresentable", action="store_true", help="CHERI trap on unrepresentable caps instead of detagging")
     parser.add_argument("--ssh-key", default=default_ssh_key())
     parser.add_argument("--ssh-port", type=int, default=None)
@@ -702,6 +962,8 @@ def get_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument('--test-ld-preload-variable', type=str, default=None,
                         help="The environment variable to set to LD_PRELOAD a library. should be set to either LD_PRELOAD or LD_CHERI_PRELOAD")
     parser.add_argument("--test-timeout", "-tt", type=int, default=60 * 60)
+    parser.add_argument("--architecture", help="Name of the tested architecture. Test durations of different "
+                                               "architectures are recorded separately (default: the kernel name)")
     parser.add_argument("--qemu-logfile", help="File to write all interactions with QEMU to", type=Path)
     parser.add_argument("--test-environment-only", action="store_true",
                         help="Setup mount paths + SSH for tests but don't actually run the tests (implies --interact)")
@@ -820,9 +1082,31 @@ def main(test_function:"typing.Callable[[CheriBSDInstance, argparse.Namespace],
     if args.disk_image:
         diskimg = str(maybe_decompress(Path(args.disk_image), force_decompression, keep_archive=keep_compressed_images, args=args, what="kernel"))
 
+    boot_cache = None
+    if args.boot_cache:
+        if diskimg is None or args.test_kernel_init_only:
+            failure("--boot-cache requires a disk image and cannot be used with --test-kernel-init-only", exit=False)
+        else:
+            # Only arguments that change the state of the guest need to be part of the key (the SSH port forwarding
+            # and smb shares are handled on the host side)
+            key_args = ["trap_on_unrepresentable=" + str(args.trap_on_unrepresentable),
+                        "skip_ssh_setup=" + str(args.skip_ssh_setup)]
+            if not args.skip_ssh_setup:
+                with open(args.ssh_key, "r", encoding="utf-8") as f:
+                    key_args.append(f.read().strip())
+            boot_cache = BootSnapshotCache(args.boot_cache_dir, args.qemu_cmd, kernel, diskimg, key_args)
+
     # Allow running multiple jobs in parallel by making a copy of the disk image
-    if diskimg is not None and args.make_disk_image_copy:
-        str(os.getpid())
+    # (not needed with the boot cache since every run gets a new overlay)
+    overlay = None
+    if diskimg is not None and args.disk_image_overlay and boot_cache is None:
+        qemu_img = find_qemu_img(args.qemu_cmd)
+        if not qemu_img:
+            failure("Cannot use --disk-image-overlay without qemu-img", exit=True)
+        overlay = DiskImageOverlay(qemu_img, Path(diskimg), keep=args.keep_disk_image_copy,
+                                   keep_on_failure=args.keep_failed_overlay)
+        diskimg = str(overlay.path)
+    elif diskimg is not None and args.make_disk_image_copy and boot_cache is None:
         new_img = Path(diskimg).with_suffix(".img.runtests." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".pid" + str(os.getpid()))
         assert not new_img.exists()
         run_host_command(["cp", "-fv", diskimg, str(new_img)])
@@ -830,50 +1114,73 @@ def main(test_function:"typing.Callable[[CheriBSDInstance, argparse.Namespace],
             atexit.register(run_host_command, ["rm", "-fv", str(new_img)])
         diskimg = str(new_img)
 
-    boot_starttime = datetime.datetime.now()
-    qemu = boot_cheribsd(args.qemu_cmd, kernel, diskimg, args.ssh_port, smb_dirs=args.smb_mount_directories,
-                         kernel_init_only=args.test_kernel_init_only, trap_on_unrepresentable=args.trap_on_unrepresentable,
-                         skip_ssh_setup=args.skip_ssh_setup)
-    success("Booting CheriBSD took: ", datetime.datetime.now() - boot_starttime)
-
-    tests_okay = True
-    if (test_archives or args.test_command or test_function) and not args.test_kernel_init_only:
-        # noinspection PyBroadException
-        try:
-            if not args.skip_ssh_setup:
-                setup_ssh_starttime = datetime.datetime.now()
-                setup_ssh(qemu, Path(args.ssh_key))
-                info("Setting up SSH took: ", datetime.datetime.now() - setup_ssh_starttime)
-            tests_okay = runtests(qemu, args, test_archives=test_archives, test_function=test_function,
-                                  test_setup_function=test_setup_function, test_ld_preload_files=test_ld_preload_files)
-        except CheriBSDCommandFailed as e:
-            failure("Command failed while runnings tests: ", str(e), "\n", str(qemu), exit=False)
-            traceback.print_exc(file=sys.stderr)
-        except Exception:
-            failure("FAILED to run tests!!\n", str(qemu), exit=False)
-            traceback.print_exc(file=sys.stderr)
-            tests_okay = False
-        except KeyboardInterrupt:
-            failure("Tests interrupted!!!", exit=False)
-            tests_okay = False
-
-    if args.interact:
-        success("===> Interacting with CheriBSD, use CTRL+A,x to exit")
-        # interac() prints all input+output -> disable logfile
-        qemu.logfile = None
-        qemu.logfile_read = None
-        qemu.logfile_send = None
-        while True:
+    tests_okay = False
+    try:
+        boot_starttime = datetime.datetime.now()
+        if boot_cache is not None:
+            qemu = boot_cheribsd_from_snapshot(boot_cache, args, kernel)
+        else:
+            qemu = boot_cheribsd(args.qemu_cmd, kernel, diskimg, args.ssh_port, smb_dirs=args.smb_mount_directories,
+                                 kernel_init_only=args.test_kernel_init_only,
+                                 trap_on_unrepresentable=args.trap_on_unrepresentable,
+                                 skip_ssh_setup=args.skip_ssh_setup)
+        success("Booting CheriBSD took: ", datetime.datetime.now() - boot_starttime)
+        if not args.skip_ssh_setup:
+            # All scp/ssh commands for this guest share one master connection (started on first use)
+            qemu.ssh_session = SSHSession("localhost", args.ssh_port, Path(args.ssh_key).with_suffix(""))
+            atexit.register(qemu.ssh_session.close)
+
+        tests_okay = True
+        if (test_archives or args.test_command or test_function) and not args.test_kernel_init_only:
+            # noinspection PyBroadException
             try:
-                qemu.should_quit = True
-                if not qemu.isalive():
-                    break
-                qemu.interact()
+                # SSH is already set up in the boot snapshot
+                if not args.skip_ssh_setup and boot_cache is None:
+                    setup_ssh_starttime = datetime.datetime.now()
+                    setup_ssh(qemu, Path(args.ssh_key))
+                    info("Setting up SSH took: ", datetime.datetime.now() - setup_ssh_starttime)
+                tests_okay = runtests(qemu, args, test_archives=test_archives, test_function=test_function,
+                                      test_setup_function=test_setup_function,
+                                      test_ld_preload_files=test_ld_preload_files)
+            except CheriBSDCommandFailed as e:
+                failure("Command failed while runnings tests: ", str(e), "\n", str(qemu), exit=False)
+                traceback.print_exc(file=sys.stderr)
+            except Exception:
+                failure("FAILED to run tests!!\n", str(qemu), exit=False)
+                traceback.print_exc(file=sys.stderr)
+                tests_okay = False
             except KeyboardInterrupt:
-                continue
-
-    success("===> DONE")
-    info("Total execution time: ", datetime.datetime.now() - starttime)
+                failure("Tests interrupted!!!", exit=False)
+                tests_okay = False
+
+        if args.interact:
+            success("===> Interacting with CheriBSD, use CTRL+A,x to exit")
+            # interac() prints all input+output -> disable logfile
+            qemu.logfile = None
+            qemu.logfile_read = None
+            qemu.logfile_send = None
+            while True:
+                try:
+                    qemu.should_quit = True
+                    if not qemu.isalive():
+                        break
+                    qemu.interact()
+                except KeyboardInterrupt:
+                    continue
+
+        success("===> DONE")
+        info("Total execution time: ", datetime.datetime.now() - starttime)
+        if qemu.ssh_session is not None:
+            if qemu.ssh_session.bytes_transferred:
+                info(qemu.ssh_session.statistics())
+            qemu.ssh_session.close()
+    finally:
+        # Delete the overlay here since atexit handlers are not run when a libc++ test shard process exits
+        if overlay is not None:
+            overlay.succeeded = tests_okay
+            overlay.cleanup()
+        if boot_cache is not None:
+            boot_cache.remove_copy(keep=args.keep_disk_image_copy)
     if not tests_okay:
         failure("ERROR: Some tests failed!", exit=True)
 
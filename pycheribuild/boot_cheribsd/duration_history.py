@@ -0,0 +1,349 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+#
+# A local SQLite database with the results of previous test runs. It is fed from the JUnit XML files written by the
+# test scripts and used to pick adaptive timeouts, estimate the remaining time of a run and find slow/regressed tests.
+#
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import typing
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+DEFAULT_DATABASE = Path(os.getenv("CHERIBUILD_TEST_HISTORY",
+                                  os.path.expanduser("~/.cache/cheribuild/test-history.sqlite3")))
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+SKIPPED = "skipped"
+
+
+def percentile(values: "typing.List[float]", p: float) -> "typing.Optional[float]":
+    """
+    :return: the p-th percentile (0-100) of values using linear interpolation or None if values is empty
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def history_key(suite: str, architecture: str = None, shards: int = None) -> str:
+    """
+    :return: the name under which runs of suite are recorded. The durations depend on the tested architecture and on
+    the number of shards the tests are split into, so runs with different values must not be used for each other's
+    timeouts (e.g. the p95 of a 16-shard run would kill a run on a single VM).
+    """
+    details = []
+    if architecture:
+        details.append(architecture)
+    if shards is not None:
+        details.append("shards=" + str(shards))
+    return suite + " [" + ", ".join(details) + "]" if details else suite
+
+
+def architecture_from_args(args) -> str:
+    """
+    :return: the --architecture passed to the test script or the name of the kernel (which also identifies the
+    architecture) if it was not specified
+    """
+    if getattr(args, "architecture", None):
+        return args.architecture
+    if getattr(args, "kernel", None):
+        return Path(args.kernel).name.split(".")[0]
+    return "native"
+
+
+def _testcase_status(testcase: ET.Element) -> str:
+    for child in testcase:
+        if child.tag == "failure":
+            return FAILED
+        if child.tag == "error":
+            return ERROR
+        if child.tag == "skipped":
+            return SKIPPED
+    return PASSED
+
+
+class DurationHistory(object):
+    SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, suite TEXT NOT NULL, label TEXT, timestamp REAL NOT NULL,
+                                 wall_time REAL, tests INTEGER, failures INTEGER, errors INTEGER, skipped INTEGER);
+CREATE TABLE IF NOT EXISTS results (run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+                                    name TEXT NOT NULL, time REAL NOT NULL, status TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS results_by_run ON results(run_id);
+CREATE INDEX IF NOT EXISTS results_by_name ON results(name);
+CREATE INDEX IF NOT EXISTS runs_by_suite ON runs(suite, timestamp);
+"""
+
+    def __init__(self, path: Path = DEFAULT_DATABASE):
+        self.path = path
+        if str(path) != ":memory:":
+            os.makedirs(str(path.parent), exist_ok=True)
+        # Parallel test jobs (e.g. libc++ shards) might write at the same time -> wait for the lock
+        self.db = sqlite3.connect(str(path), timeout=60)
+        self.db.executescript(self.SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record_junit(self, suite: str, xml_file: Path, wall_time: float = None, label: str = None) -> int:
+        """
+        Add all testcases in xml_file as a new run of suite.
+        :param wall_time: the time it took to run the suite (default: the sum of all test durations)
+        :return: the id of the new run
+        """
+        results = []
+        for testcase in ET.parse(str(xml_file)).iter("testcase"):
+            name = testcase.get("name", "")
+            classname = testcase.get("classname")
+            if classname:
+                name = classname + "." + name
+            results.append((name, float(testcase.get("time") or 0), _testcase_status(testcase)))
+        return self.record_results(suite, results, wall_time=wall_time, label=label)
+
+    def record_results(self, suite: str, results: "typing.List[typing.Tuple[str, float, str]]",
+                       wall_time: float = None, label: str = None) -> int:
+        if wall_time is None:
+            wall_time = sum(r[1] for r in results)
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (suite, label, timestamp, wall_time, tests, failures, errors, skipped) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (suite, label, time.time(), wall_time, len(results), sum(1 for r in results if r[2] == FAILED),
+                 sum(1 for r in results if r[2] == ERROR), sum(1 for r in results if r[2] == SKIPPED)))
+            run_id = cursor.lastrowid
+            self.db.executemany("INSERT INTO results (run_id, name, time, status) VALUES (?, ?, ?, ?)",
+                                ((run_id,) + tuple(r) for r in results))
+        return run_id
+
+    def runs(self, suite: str = None, limit: int = 20) -> "typing.List[sqlite3.Row]":
+        query = "SELECT id, suite, label, timestamp, wall_time, tests, failures, errors, skipped FROM runs"
+        params = ()  # type: tuple
+        if suite:
+            query += " WHERE suite = ?"
+            params = (suite,)
+        return self.db.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+
+    def _recent_run_ids(self, suite: str, last_runs: int) -> "typing.List[int]":
+        return [r[0] for r in self.db.execute("SELECT id FROM runs WHERE suite = ? ORDER BY id DESC LIMIT ?",
+                                              (suite, last_runs))]
+
+    def test_statistics(self, suite: str, last_runs: int = 20) -> "typing.Dict[str, dict]":
+        """
+        :return: p50/p95 durations and the number of flaky status changes for every test in the last runs of suite
+        """
+        run_ids = self._recent_run_ids(suite, last_runs)
+        if not run_ids:
+            return dict()
+        per_test = dict()  # type: typing.Dict[str, typing.List[typing.Tuple[int, float, str]]]
+        query = "SELECT run_id, name, time, status FROM results WHERE run_id IN ({}) ORDER BY run_id".format(
+            ",".join("?" * len(run_ids)))
+        for run_id, name, duration, status in self.db.execute(query, run_ids):
+            per_test.setdefault(name, []).append((run_id, duration, status))
+        result = dict()
+        for name, values in per_test.items():
+            durations = [v[1] for v in values]
+            statuses = [v[2] for v in values if v[2] != SKIPPED]
+            # A test is flaky if it changes between passing and failing without being modified
+            flips = sum(1 for a, b in zip(statuses, statuses[1:]) if (a == PASSED) != (b == PASSED))
+            result[name] = dict(p50=percentile(durations, 50), p95=percentile(durations, 95), runs=len(values),
+                                failures=sum(1 for s in statuses if s != PASSED), flips=flips)
+        return result
+
+    def suite_wall_times(self, suite: str, last_runs: int = 20) -> "typing.List[float]":
+        return [r[0] for r in self.db.execute(
+            "SELECT wall_time FROM runs WHERE suite = ? AND wall_time IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (suite, last_runs))]
+
+    def adaptive_timeout(self, suite: str, default: float, factor: float = 2.0, minimum: float = 10 * 60) -> float:
+        """
+        :return: factor times the p95 of the recorded wall times of suite (or default if there are no runs yet)
+        """
+        p95 = percentile(self.suite_wall_times(suite), 95)
+        if p95 is None:
+            return default
+        return max(minimum, p95 * factor)
+
+    def estimate_remaining(self, suite: str, elapsed: float) -> "typing.Optional[float]":
+        p50 = percentile(self.suite_wall_times(suite), 50)
+        if p50 is None:
+            return None
+        return max(0.0, p50 - elapsed)
+
+    def _run_durations(self, run_id: int) -> "typing.Dict[str, float]":
+        return dict(self.db.execute("SELECT name, time FROM results WHERE run_id = ?", (run_id,)))
+
+    def slowest(self, run_id: int, count: int = 20) -> "typing.List[typing.Tuple[str, float]]":
+        return self.db.execute("SELECT name, time FROM results WHERE run_id = ? ORDER BY time DESC LIMIT ?",
+                               (run_id, count)).fetchall()
+
+    def regressions(self, old_run: int, new_run: int,
+                    count: int = 20) -> "typing.List[typing.Tuple[str, float, float]]":
+        """
+        :return: (name, old duration, new duration) for the tests that got slower the most between two runs
+        """
+        old = self._run_durations(old_run)
+        new = self._run_durations(new_run)
+        common = [(name, old[name], new[name]) for name in new.keys() & old.keys()]
+        common.sort(key=lambda x: x[2] - x[1], reverse=True)
+        return [x for x in common[:count] if x[2] > x[1]]
+
+    def latest_run(self, suite: str) -> "typing.Optional[int]":
+        run_ids = self._recent_run_ids(suite, 1)
+        return run_ids[0] if run_ids else None
+
+
+def record_junit_results(suite: str, xml_files: "typing.Iterable[Path]", wall_time: float = None,
+                         label: str = None, database: Path = DEFAULT_DATABASE):
+    """
+    Helper for the test scripts: adds the results and never raises an exception since failing to record the history
+    should not cause the test run to fail.
+    """
+    from . import info, failure
+    try:
+        history = DurationHistory(database)
+        try:
+            for xml_file in xml_files:
+                if xml_file.exists():
+                    run_id = history.record_junit(suite, xml_file, wall_time=wall_time, label=label)
+                    info("Recorded test durations from ", xml_file, " as run ", run_id, " of ", suite)
+        finally:
+            history.close()
+    except Exception as e:
+        failure("Could not record test durations in ", database, ": ", e, exit=False)
+
+
+def adaptive_timeout(suite: str, default: float, database: Path = DEFAULT_DATABASE) -> float:
+    from . import info
+    try:
+        history = DurationHistory(database)
+        try:
+            result = history.adaptive_timeout(suite, default)
+            remaining = history.estimate_remaining(suite, 0)
+        finally:
+            history.close()
+    except Exception as e:
+        info("Could not read test history from ", database, ": ", e)
+        return default
+    if remaining is not None:
+        info("Based on previous runs ", suite, " is expected to take ", _format_seconds(remaining),
+             ", using a timeout of ", _format_seconds(result))
+    return result
+
+
+def report_eta(suite: str, elapsed: float, database: Path = DEFAULT_DATABASE):
+    from . import info
+    try:
+        history = DurationHistory(database)
+        try:
+            remaining = history.estimate_remaining(suite, elapsed)
+        finally:
+            history.close()
+    except Exception as e:
+        info("Could not read test history from ", database, ": ", e)
+        return
+    if remaining is not None:
+        info(suite, " has been running for ", _format_seconds(elapsed), ", estimated time remaining: ",
+             _format_seconds(remaining))
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    return "{}:{:02}:{:02}".format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the history of test durations recorded by the test scripts")
+    parser.add_argument("--database", type=Path, default=DEFAULT_DATABASE, help="default: " + str(DEFAULT_DATABASE))
+    subparsers = parser.add_subparsers(dest="command")
+    runs_parser = subparsers.add_parser("runs", help="List the recorded runs")
+    runs_parser.add_argument("suite", nargs="?")
+    runs_parser.add_argument("-n", type=int, default=20)
+    slowest_parser = subparsers.add_parser("slowest", help="Show the slowest tests of a run")
+    slowest_parser.add_argument("suite")
+    slowest_parser.add_argument("--run", type=int, help="Run id (default: latest run)")
+    slowest_parser.add_argument("-n", type=int, default=20)
+    regressed_parser = subparsers.add_parser("regressed", help="Show the tests that got slower between two runs")
+    regressed_parser.add_argument("old_run", type=int)
+    regressed_parser.add_argument("new_run", type=int)
+    regressed_parser.add_argument("-n", type=int, default=20)
+    stats_parser = subparsers.add_parser("stats", help="Show p50/p95 durations and flakiness for a suite")
+    stats_parser.add_argument("suite")
+    stats_parser.add_argument("--last-runs", type=int, default=20)
+    stats_parser.add_argument("--flaky-only", action="store_true")
+    import_parser = subparsers.add_parser("import", help="Add a JUnit XML file to the history")
+    import_parser.add_argument("suite")
+    import_parser.add_argument("xml_files", nargs="+", type=Path)
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return 1
+    history = DurationHistory(args.database)
+    if args.command == "runs":
+        for run in history.runs(args.suite, args.n):
+            print("{:5} {:30} {} wall={} tests={} failures={} errors={} skipped={} {}".format(
+                run[0], run[1], time.strftime("%Y-%m-%d %H:%M", time.localtime(run[3])), _format_seconds(run[4] or 0),
+                run[5], run[6], run[7], run[8], run[2] or ""))
+    elif args.command == "slowest":
+        run_id = args.run or history.latest_run(args.suite)
+        if run_id is None:
+            sys.exit("No runs recorded for " + args.suite)
+        for name, duration in history.slowest(run_id, args.n):
+            print("{:10.2f}s {}".format(duration, name))
+    elif args.command == "regressed":
+        for name, old, new in history.regressions(args.old_run, args.new_run, args.n):
+            print("{:10.2f}s -> {:10.2f}s (+{:.2f}s) {}".format(old, new, new - old, name))
+    elif args.command == "stats":
+        stats = history.test_statistics(args.suite, args.last_runs)
+        wall_times = history.suite_wall_times(args.suite, args.last_runs)
+        print("Suite", args.suite, "- runs:", len(wall_times), "p50:", _format_seconds(percentile(wall_times, 50) or 0),
+              "p95:", _format_seconds(percentile(wall_times, 95) or 0))
+        for name, s in sorted(stats.items(), key=lambda x: x[1]["p95"], reverse=True):
+            if args.flaky_only and not s["flips"]:
+                continue
+            print("p50={:8.2f}s p95={:8.2f}s runs={} failures={} flaky={} {}".format(
+                s["p50"], s["p95"], s["runs"], s["failures"], s["flips"], name))
+    elif args.command == "import":
+        for xml_file in args.xml_files:
+            print("Recorded", xml_file, "as run", history.record_junit(args.suite, xml_file))
+    history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# Converts the SQLite results database written by `kyua test` to JUnit XML on the host. The output follows the format
+# of `kyua report-junit` followed by kyua_db_to_junit_xml.fixup_kyua_generated_junit_xml() but does not need kyua to
+# be installed on the host (so the conversion no longer has to run inside QEMU) and streams the XML output instead of
+# rewriting the whole file multiple times. Use kyua_db_to_junit_xml.py --use-kyua to compare it with kyua's output.
+#
+import argparse
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import time
+import typing
+from pathlib import Path
+
+# XML 1.0 does not allow (even escaped) control characters so we use the same \xNN; escapes as the fixup script
+CONTROL_CHARACTER_ESCAPES = {i: "\\x" + format(i, "02x") + ";" for i in range(32) if chr(i) not in ("\n", "\t")}
+_XML_ESCAPES = dict(CONTROL_CHARACTER_ESCAPES)
+_XML_ESCAPES.update({ord("&"): "&amp;", ord("<"): "&lt;", ord(">"): "&gt;", ord('"'): "&quot;", ord("'"): "&#39;"})
+
+STDOUT_FILE = "__STDOUT__"
+STDERR_FILE = "__STDERR__"
+
+_RESULTS_QUERY = """
+SELECT test_programs.relative_path, test_cases.name, test_cases.metadata_id, test_results.result_type,
+       test_results.result_reason, test_results.start_time, test_results.end_time,
+       (SELECT files.contents FROM test_case_files JOIN files ON test_case_files.file_id = files.file_id
+        WHERE test_case_files.test_case_id = test_cases.test_case_id AND test_case_files.file_name = ?),
+       (SELECT files.contents FROM test_case_files JOIN files ON test_case_files.file_id = files.file_id
+        WHERE test_case_files.test_case_id = test_cases.test_case_id AND test_case_files.file_name = ?)
+FROM test_programs
+    JOIN test_cases ON test_programs.test_program_id = test_cases.test_program_id
+    JOIN test_results ON test_cases.test_case_id = test_results.test_case_id
+ORDER BY test_programs.absolute_path, test_cases.name
+"""
+
+
+def escape_xml(value: str) -> str:
+    return value.translate(_XML_ESCAPES)
+
+
+def escape_control_characters(value: str) -> str:
+    return value.translate(CONTROL_CHARACTER_ESCAPES)
+
+
+def _decode(contents: "typing.Optional[bytes]") -> str:
+    if contents is None:
+        return ""
+    if isinstance(contents, str):
+        return contents
+    return contents.decode("utf-8", errors="backslashreplace")
+
+
+def _iso8601(timestamp_usec: int) -> str:
+    seconds, usec = divmod(timestamp_usec, 1000000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + ".{:06}Z".format(usec)
+
+
+def _duration(start_usec: int, end_usec: int) -> str:
+    return "{:.3f}".format((end_usec - start_usec) / 1000000.0)
+
+
+def _metadata_text(properties: "typing.List[typing.Tuple[str, str]]") -> str:
+    if not properties:
+        return ""
+    lines = ["Test case metadata", "------------------", ""]
+    for name, value in properties:
+        lines.append(name + " is empty" if not value else name + " = " + value)
+    return "\n".join(lines) + "\n\n"
+
+
+class KyuaResultsStatistics(object):
+    def __init__(self, tests=0, failures=0, errors=0, skipped=0, time=0.0):
+        self.tests = tests
+        self.failures = failures
+        self.errors = errors
+        self.skipped = skipped
+        self.time = time
+
+    def __repr__(self):
+        return "<{} tests, {} failures, {} errors, {} skipped in {}s>".format(self.tests, self.failures, self.errors,
+                                                                            self.skipped, self.time)
+
+
+def read_statistics(db: sqlite3.Connection) -> KyuaResultsStatistics:
+    # Kyua only writes the result once the test has finished so this can be computed before streaming the test cases
+    row = db.execute("SELECT count(*), sum(result_type = 'failed'), sum(result_type = 'broken'),"
+                     " sum(result_type = 'skipped'), sum(round((end_time - start_time) / 1000000.0, 3))"
+                     " FROM test_results").fetchone()
+    return KyuaResultsStatistics(row[0], row[1] or 0, row[2] or 0, row[3] or 0, round(row[4] or 0.0, 3))
+
+
+def write_junit_xml(db: sqlite3.Connection, output: "typing.TextIO") -> KyuaResultsStatistics:
+    stats = read_statistics(db)
+    output.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    output.write('<testsuite errors="{}" failures="{}" skipped="{}" tests="{}" time="{}">\n'.format(
+        stats.errors, stats.failures, stats.skipped, stats.tests, stats.time))
+    output.write("<properties>\n")
+    for (cwd,) in db.execute("SELECT cwd FROM contexts"):
+        output.write('<property name="cwd" value="' + escape_xml(cwd) + '"/>\n')
+    for name, value in db.execute("SELECT var_name, var_value FROM env_vars ORDER BY var_name"):
+        output.write('<property name="env.' + escape_xml(name) + '" value="' + escape_xml(value) + '"/>\n')
+    output.write("</properties>\n")
+
+    metadata = dict()  # type: typing.Dict[int, typing.List[typing.Tuple[str, str]]]
+    for metadata_id, name, value in db.execute("SELECT metadata_id, property_name, property_value FROM metadatas"
+                                               " ORDER BY metadata_id, property_name"):
+        metadata.setdefault(metadata_id, []).append((name, value))
+
+    for (relative_path, name, metadata_id, result_type, reason, start_time, end_time, stdout,
+         stderr) in db.execute(_RESULTS_QUERY, (STDOUT_FILE, STDERR_FILE)):
+        output.write('<testcase classname="' + escape_xml(relative_path.replace("/", ".")) + '" name="' +
+                     escape_xml(name) + '" time="' + _duration(start_time, end_time) + '">\n')
+        reason = reason or ""
+        stderr_prefix = ""
+        if result_type == "failed":
+            output.write('<failure message="' + escape_xml(reason) + '"/>\n')
+        elif result_type == "broken":
+            output.write('<error message="' + escape_xml(reason) + '"/>\n')
+        elif result_type == "skipped":
+            output.write("<skipped/>\n")
+            stderr_prefix = "Skipped result details\n----------------------\n\n" + reason + "\n\n"
+        elif result_type == "expected_failure":
+            stderr_prefix = "Expected failure result details\n-------------------------------\n\n" + reason + "\n\n"
+        else:
+            assert result_type == "passed", "Unknown kyua result type " + result_type
+        output.write("<system-out>" + escape_xml(_decode(stdout)) + "</system-out>\n")
+        output.write("<system-err>" + escape_xml(
+            stderr_prefix + _metadata_text(metadata.get(metadata_id)) +
+            "Timing information\n------------------\n\n" +
+            "Start time: " + _iso8601(start_time) + "\nEnd time:   " + _iso8601(end_time) +
+            "\nDuration:   " + _duration(start_time, end_time) + "s\n\n" +
+            "Original stderr\n---------------\n\n" + _decode(stderr)) + "</system-err>\n")
+        output.write("</testcase>\n")
+    output.write("</testsuite>\n")
+    return stats
+
+
+def open_kyua_db(db_file: Path) -> sqlite3.Connection:
+    # Open read-only to ensure we never modify the results that were copied from the guest
+    return sqlite3.connect("file:" + str(db_file.absolute()) + "?mode=ro", uri=True)
+
+
+def convert_kyua_db(db_file: Path, output_file: Path) -> KyuaResultsStatistics:
+    assert output_file.resolve() != db_file.resolve()
+    db = open_kyua_db(db_file)
+    try:
+        # Write to a temporary file first to avoid leaving a truncated XML file if conversion fails
+        tmpfile = output_file.with_name(output_file.name + ".tmp." + str(os.getpid()))
+        try:
+            with tmpfile.open("w", encoding="ascii", errors="xmlcharrefreplace", buffering=1024 * 1024) as output:
+                result = write_junit_xml(db, output)
+            os.replace(str(tmpfile), str(output_file))
+        finally:
+            if tmpfile.exists():
+                tmpfile.unlink()
+        return result
+    finally:
+        db.close()
+
+
+def convert_kyua_dbs(db_files: "typing.List[Path]", jobs: int = None) -> "typing.Dict[Path, KyuaResultsStatistics]":
+    """
+    Convert each database to a .xml file next to it. The conversion is CPU bound so multiple files are converted in
+    separate processes.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(db_files)))
+    if jobs == 1:
+        return {db: convert_kyua_db(db, db.with_suffix(".xml")) for db in db_files}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {db: executor.submit(convert_kyua_db, db, db.with_suffix(".xml")) for db in db_files}
+        return {db: future.result() for db, future in futures.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert kyua results databases to JUnit XML without using kyua")
+    parser.add_argument("db", type=Path, help="The database to convert")
+    parser.add_argument("xml", nargs=argparse.OPTIONAL, type=Path,
+                        help="The output file. Defaults to the db file with suffix .xml")
+    args = parser.parse_args()
+    stats = convert_kyua_db(args.db, args.xml or args.db.with_suffix(".xml"))
+    print("Converted", args.db, stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
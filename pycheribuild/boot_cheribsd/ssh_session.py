@@ -0,0 +1,226 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# Multiplexes all ssh/scp commands for one guest (QEMU or FPGA) over a single SSH ControlMaster connection so that
+# only the first command has to pay for the key exchange. Connection errors (e.g. because the guest network was
+# turned off in between) are retried with exponential backoff after re-establishing the master connection.
+#
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+# ssh uses exit code 255 for connection errors (all other exit codes are the status of the remote command)
+SSH_CONNECTION_ERROR = 255
+
+
+def _path_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(str(path)) for f in files
+                   if not os.path.islink(os.path.join(root, f)))
+    return path.stat().st_size
+
+
+def format_throughput(num_bytes: int, seconds: float) -> str:
+    mib = num_bytes / (1024.0 * 1024.0)
+    return "{:.1f} MiB in {:.1f}s ({:.1f} MiB/s)".format(mib, seconds, mib / max(seconds, 0.001))
+
+
+class SSHSession(object):
+    def __init__(self, host: str, port: int, identity_file: Path, *, user: str = "root", retries: int = 3,
+                 retry_delay: float = 1.0, connect_timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.identity_file = identity_file
+        self.user = user
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.connect_timeout = connect_timeout
+        # Keep the socket path short since it must fit into sockaddr_un.sun_path
+        self.control_dir = Path(tempfile.mkdtemp(prefix="cheribuild-ssh-"))
+        self.control_path = self.control_dir / "master.sock"
+        self.bytes_transferred = 0
+        self.transfer_time = 0.0
+
+    @property
+    def destination(self) -> str:
+        return self.user + "@" + self.host
+
+    def remote_path(self, path: str) -> str:
+        return self.destination + ":" + path
+
+    def options(self) -> "typing.List[str]":
+        # The host keys change every time the disk image is rebuilt -> disable host key checking
+        return ["-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "BatchMode=yes",
+                "-o", "LogLevel=ERROR", "-o", "ConnectTimeout=" + str(self.connect_timeout),
+                "-o", "ControlPath=" + str(self.control_path), "-o", "ControlMaster=no", "-i", str(self.identity_file)]
+
+    def ssh_command(self, *remote_command: str, ssh_flags: "typing.List[str]" = None) -> "typing.List[str]":
+        return ["ssh", "-p", str(self.port)] + self.options() + (ssh_flags or []) + [self.destination, "--"] + \
+            list(remote_command)
+
+    def scp_command(self, src: str, dst: str) -> "typing.List[str]":
+        return ["scp", "-B", "-r", "-P", str(self.port)] + self.options() + [src, dst]
+
+    def is_alive(self) -> bool:
+        from . import PRETEND
+        if PRETEND or not self.control_path.exists():
+            return False
+        return subprocess.call(["ssh", "-O", "check", "-o", "ControlPath=" + str(self.control_path), self.destination],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+    def start(self):
+        """Start the master connection (or reconnect if it was dropped)"""
+        if self.is_alive():
+            return
+        from . import info
+        if self.control_path.exists():
+            info("SSH master connection to ", self.destination, " was closed, reconnecting")
+            self.control_path.unlink()
+        # -f backgrounds the master after authentication so this returns once the connection is usable
+        cmd = ["ssh", "-p", str(self.port)] + self.options() + ["-o", "ControlMaster=yes", "-o", "ControlPersist=yes",
+                                                                # exit if the guest stops responding
+                                                                "-o", "ServerAliveInterval=5",
+                                                                "-o", "ServerAliveCountMax=3",
+                                                                "-M", "-N", "-f", self.destination]
+        self._with_retries("Starting SSH master connection",
+                           lambda: self._run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL), reconnect=False)
+
+    def stop(self):
+        """Close the master connection (e.g. before turning off the guest network). It is restarted on next use."""
+        if self.control_path.exists():
+            subprocess.call(["ssh", "-O", "exit", "-o", "ControlPath=" + str(self.control_path), self.destination],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(str(self.control_dir), ignore_errors=True)
+
+    def __enter__(self) -> "SSHSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _with_retries(self, what: str, function: "typing.Callable[[], typing.Any]", reconnect=True):
+        from . import failure
+        delay = self.retry_delay
+        for attempt in range(1, self.retries + 1):
+            try:
+                return function()
+            except subprocess.CalledProcessError as e:
+                # Only connection errors are retried and not failures of the remote command or the local scp/tar
+                if attempt == self.retries or e.returncode != SSH_CONNECTION_ERROR:
+                    raise
+                failure(what, " failed (", e, "), retrying in ", delay, " seconds (attempt ", attempt + 1, " of ",
+                        self.retries, ")", exit=False)
+                time.sleep(delay)
+                delay *= 2
+                if reconnect:
+                    self.start()
+
+    @staticmethod
+    def _run(cmd: "typing.List[str]", timeout: int = None, **kwargs):
+        from . import run_host_command
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        run_host_command(cmd, **kwargs)
+
+    def run(self, command: str, timeout: int = None, **kwargs):
+        """Run command in the guest. Only connection errors are retried and not failures of the command itself."""
+        self.start()
+        self._with_retries("Running " + command, lambda: self._run(self.ssh_command(command), timeout, **kwargs))
+
+    def _transfer(self, what: str, num_bytes: "typing.Callable[[], int]", function: "typing.Callable[[], None]"):
+        from . import PRETEND, info
+        self.start()
+        start = time.time()
+        self._with_retries(what, function)
+        if PRETEND:
+            return
+        elapsed = time.time() - start
+        size = num_bytes()
+        self.bytes_transferred += size
+        self.transfer_time += elapsed
+        info(what, ": transferred ", format_throughput(size, elapsed))
+
+    def copy_to_guest(self, src: Path, dst: str, timeout: int = None):
+        self._transfer("Copying " + str(src) + " to " + self.remote_path(dst), lambda: _path_size(src),
+                       lambda: self._run(self.scp_command(str(src), self.remote_path(dst)), timeout))
+
+    def copy_from_guest(self, src: str, dst: Path, timeout: int = None):
+        # scp into a directory keeps the remote basename
+        local = dst / Path(src).name if dst.is_dir() else dst
+        self._transfer("Copying " + self.remote_path(src) + " to " + str(dst), lambda: _path_size(local),
+                       lambda: self._run(self.scp_command(self.remote_path(src), str(dst)), timeout))
+
+    def copy_directory_to_guest(self, src_dir: Path, dst_dir: str, timeout: int = None):
+        """Stream the contents of src_dir to dst_dir as a single tar pipe instead of one scp per file"""
+        self._transfer("Copying " + str(src_dir) + "/ to " + self.remote_path(dst_dir), lambda: _path_size(src_dir),
+                       lambda: self._tar_pipe(src_dir, dst_dir, timeout))
+
+    def _tar_pipe(self, src_dir: Path, dst_dir: str, timeout: int = None):
+        from . import PRETEND, info
+        # Archive the entries of src_dir instead of "." since extracting the "./" entry as root would change the
+        # owner and permissions of dst_dir (e.g. to the 0700 of a temporary directory if dst_dir is "/")
+        entries = sorted(os.listdir(str(src_dir))) if src_dir.is_dir() else []
+        if not entries and not PRETEND:
+            self._run(self.ssh_command("mkdir -p " + shlex.quote(dst_dir)), timeout)
+            return
+        remote_cmd = "mkdir -p {dir} && tar -xf - --no-same-owner -C {dir}".format(dir=shlex.quote(dst_dir))
+        tar_cmd = ["tar", "-cf", "-", "-C", str(src_dir)] + ["./" + e for e in entries]
+        ssh_cmd = self.ssh_command(remote_cmd)
+        info("\033[0;33mRunning ", " ".join(shlex.quote(s) for s in tar_cmd), " | ",
+             " ".join(shlex.quote(s) for s in ssh_cmd), "\033[0m")
+        if PRETEND:
+            return
+        tar = subprocess.Popen(tar_cmd, stdout=subprocess.PIPE)
+        try:
+            ssh = subprocess.Popen(ssh_cmd, stdin=tar.stdout)
+            tar.stdout.close()  # ensure tar gets SIGPIPE if ssh exits
+            try:
+                ssh_status = ssh.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                ssh.kill()
+                ssh.wait()
+                raise
+        finally:
+            tar_status = tar.wait()
+        if tar_status != 0:
+            raise subprocess.CalledProcessError(tar_status, tar_cmd)
+        if ssh_status != 0:
+            raise subprocess.CalledProcessError(ssh_status, ssh_cmd)
+
+    def statistics(self) -> str:
+        return "SSH transfers to " + self.destination + ": " + format_throughput(self.bytes_transferred,
+                                                                                 self.transfer_time)
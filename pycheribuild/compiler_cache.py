@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+from pathlib import Path
+
+from .utils import *
+
+COMPILER_CACHE_KINDS = ("none", "ccache", "sccache")
+# Matches the lines of `ccache -s` for ccache versions that do not support --print-stats
+_CCACHE_SUMMARY_PATTERNS = (
+    ("hits", re.compile(r"^\s*cache hit \((?:direct|preprocessed)\)\s+(\d+)", re.MULTILINE)),
+    ("misses", re.compile(r"^\s*cache miss\s+(\d+)", re.MULTILINE)),
+)
+
+
+class CompilerCacheStatistics(object):
+    def __init__(self, hits: int, misses: int):
+        self.hits = hits
+        self.misses = misses
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return "{} hits, {} misses ({:.1f}% hit rate)".format(self.hits, self.misses, self.hit_rate * 100)
+
+
+def _count(value) -> int:
+    # sccache reports per-language counts ({"counts": {"C/C++": 10}}) but older versions only a plain number
+    if isinstance(value, dict):
+        return sum(_count(v) for v in value.get("counts", value).values())
+    return int(value or 0)
+
+
+def parse_sccache_statistics(output: str) -> CompilerCacheStatistics:
+    """:param output: the output of `sccache --show-stats --stats-format=json`"""
+    stats = json.loads(output)
+    stats = stats.get("stats", stats)
+    return CompilerCacheStatistics(_count(stats.get("cache_hits")), _count(stats.get("cache_misses")))
+
+
+def parse_ccache_statistics(output: str) -> CompilerCacheStatistics:
+    """:param output: the output of `ccache --print-stats` (or `ccache -s` for old versions)"""
+    values = dict()
+    for line in output.splitlines():
+        key, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            values[key.strip()] = int(value)
+    if values:
+        # ccache 4.x and 3.7 use different key names
+        hits = sum(values.get(k, 0) for k in ("direct_cache_hit", "preprocessed_cache_hit", "cache_hit_direct",
+                                               "cache_hit_preprocessed"))
+        misses = values.get("cache_miss", 0)
+        return CompilerCacheStatistics(hits, misses)
+    counts = dict((name, sum(int(m) for m in pattern.findall(output))) for name, pattern in _CCACHE_SUMMARY_PATTERNS)
+    return CompilerCacheStatistics(counts["hits"], counts["misses"])
+
+
+def common_parent_dir(*paths: Path) -> Path:
+    """:return: the longest common parent directory of paths (os.path.commonpath() needs Python 3.5)"""
+    result = []
+    for components in zip(*(p.parts for p in paths)):
+        if any(c != components[0] for c in components):
+            break
+        result.append(components[0])
+    return Path(*result) if result else Path("/")
+
+
+def _unused_tcp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class CompilerCache(object):
+    """
+    A ccache or sccache launcher for the compiler invocations of one target. Every target uses a separate cache
+    directory (below --compiler-cache-dir) so that the size limit and hit-rate statistics are per target.
+
+    The sccache server only reads SCCACHE_DIR on startup and by default there is one server per user. Every target
+    therefore starts its own server on a separate port (SCCACHE_SERVER_PORT) so that targets that are built
+    concurrently (--parallel-targets) neither share the statistics nor stop each other's server.
+    """
+
+    def __init__(self, kind: str, directory: Path, max_size: str, *, base_dir: "typing.Optional[Path]"=None,
+                 executable: str=None, server_port: int=None, pretend=False):
+        assert kind in ("ccache", "sccache"), kind
+        self.kind = kind
+        self.directory = directory
+        self.max_size = max_size
+        self.base_dir = base_dir
+        self.executable = executable or shutil.which(kind) or kind
+        self.pretend = pretend
+        self._server_port = server_port
+
+    @property
+    def server_port(self) -> int:
+        # Only allocated when needed since the port could be reused by the time the server is started otherwise
+        if self._server_port is None:
+            self._server_port = _unused_tcp_port()
+        return self._server_port
+
+    @classmethod
+    def for_project(cls, project: "SimpleProject") -> "typing.Optional[CompilerCache]":
+        config = project.config
+        if config.compiler_cache == "none":
+            return None
+        cache_root = config.compiler_cache_dir or config.buildRoot / "compiler-cache"
+        # Paths below the base directory are rewritten to relative ones so that the cache can also be used if the
+        # source and build directories move (e.g. different Jenkins workspaces)
+        base_dir = common_parent_dir(config.sourceRoot.absolute(), config.buildRoot.absolute())
+        return cls(config.compiler_cache, cache_root / project.target, config.compiler_cache_size,
+                   base_dir=base_dir if base_dir != Path("/") else None, pretend=config.pretend)
+
+    def environment(self) -> "typing.Dict[str, str]":
+        if self.kind == "sccache":
+            return dict(SCCACHE_DIR=str(self.directory), SCCACHE_CACHE_SIZE=self.max_size,
+                        SCCACHE_SERVER_PORT=str(self.server_port))
+        result = dict(CCACHE_DIR=str(self.directory), CCACHE_MAXSIZE=self.max_size)
+        if self.base_dir:
+            result["CCACHE_BASEDIR"] = str(self.base_dir)
+        return result
+
+    def _run(self, *args, capture=False, quiet=False) -> "typing.Optional[str]":
+        # The environment() variables must already be set when this is called
+        try:
+            result = runCmd([self.executable] + list(args), captureOutput=capture, captureError=quiet,
+                            printVerboseOnly=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            if not quiet:
+                warningMessage("Could not run", self.kind, "->", e)
+            return None
+        if capture and not self.pretend:
+            return result.stdout.decode("utf-8", errors="replace")
+        return None
+
+    def start(self):
+        if not self.pretend:
+            os.makedirs(str(self.directory), exist_ok=True)
+        if self.kind == "sccache":
+            # A new server (on this target's port) that uses this target's cache directory and starts with no stats
+            self._run("--start-server")
+        else:
+            self._run("--zero-stats", capture=True)
+
+    def statistics(self) -> "typing.Optional[CompilerCacheStatistics]":
+        if self.kind == "sccache":
+            output = self._run("--show-stats", "--stats-format=json", capture=True)
+            parser = parse_sccache_statistics
+        else:
+            output = self._run("--print-stats", capture=True, quiet=True)  # not supported before ccache 3.7
+            if output is None and not self.pretend:
+                output = self._run("--show-stats", capture=True)
+            parser = parse_ccache_statistics
+        if not output:
+            return None
+        try:
+            return parser(output)
+        except (ValueError, AttributeError) as e:
+            warningMessage("Could not parse", self.kind, "statistics:", e)
+            return None
+
+    def stop(self):
+        if self.kind == "sccache":
+            self._run("--stop-server", capture=True, quiet=True)
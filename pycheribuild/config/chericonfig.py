@@ -27,6 +27,7 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
+import argparse
 import itertools
 import getpass
 import grp
@@ -161,6 +162,58 @@ class CheriConfig(object):
         self.cheri_cap_table_abi = loader.addOption("cap-table-abi", helpHidden=True, default="pcrel",
                                                     choices=("pcrel", "plt", "legacy", "fn-desc"),
                                                     help="The ABI to use for cap-table mode")
+        self.parallel_targets = loader.addOption("parallel-targets", type=int, default=1, metavar="N",
+            help="Build up to N independent targets concurrently. Every target is built by a separate cheribuild "
+                 "process whose output is written to a per-target logfile and the --make-jobs budget is split between "
+                 "the targets that are running at the same time.")
+        self.fetch_jobs = loader.addOption("fetch-jobs", type=int, default=8, metavar="N",
+            help="Run git fetch for up to N repositories at the same time before updating the chosen targets. The "
+                 "local rebase and submodule update steps are still run one repository at a time. Set to 1 to update "
+                 "every repository with git pull just before it is built.")
+        self.output_pipeline = loader.addBoolOption("output-pipeline", default=True,
+            help="Read the output of build commands in large chunks from a single thread, apply the output filters "
+                 "only to the terminal output and flush the terminal on a timer instead of after every line. Use "
+                 "--no-output-pipeline to fall back to line-by-line processing with a separate stderr thread.")
+        self.logfile_compression = loader.addOption("logfile-compression", default="none",
+            choices=("none", "gzip", "zstd"), help="Compress the build logfiles (zstd requires the zstandard module)")
+        self.trace_file = loader.addCommandLineOnlyOption("trace-file", type=Path, metavar="JSON",
+            help="Record the time spent in every target, build phase and subprocess (including the command line, exit "
+                 "code, CPU time and maximum RSS) and write it to JSON in Chrome trace event format (can be opened in "
+                 "https://ui.perfetto.dev)")
+        self.use_build_cache = loader.addBoolOption("build-cache",
+            help="Skip targets whose sources, configuration, compiler and dependencies are unchanged since the last "
+                 "successful build (fingerprints are stored in $BUILD_ROOT/.cheribuild-fingerprints.json)")
+        self.force_rebuild = loader.addCommandLineOnlyBoolOption("force-rebuild",
+            help="Build all chosen targets even if --build-cache is set and their fingerprints are unchanged")
+        self.explain_build_cache = loader.addCommandLineOnlyBoolOption("explain-cache",
+            help="Print why a target was not skipped by --build-cache")
+        self.use_tool_probe_cache = loader.addBoolOption("tool-probe-cache", default=True,
+            help="Cache the output of compiler and tool version checks in $BUILD_ROOT/.cheribuild-tool-probes.json "
+                 "(entries are invalidated when the size, mtime or inode of the program changes)")
+        self.clear_tool_probe_cache = loader.addCommandLineOnlyBoolOption("clear-tool-probe-cache",
+            help="Delete the cached compiler and tool version checks before doing anything else")
+        self.compiler_cache = loader.addOption("compiler-cache", default="none", choices=("none", "ccache", "sccache"),
+            help="Use ccache or sccache as a compiler launcher for CMake, autotools and FreeBSD make builds (each "
+                 "target uses a separate cache directory and hit-rate statistics are printed after each target)")
+        self.compiler_cache_dir = loader.addPathOption("compiler-cache-dir",
+            help="The directory for the per-target compiler caches (default: $BUILD_ROOT/compiler-cache)")
+        self.compiler_cache_size = loader.addOption("compiler-cache-size", default="5G",
+            help="The maximum size of the compiler cache of each target (e.g. 500M or 5G)")
+        self.recheck_system_deps = loader.addCommandLineOnlyBoolOption("recheck-system-deps",
+            help="Ignore the cached results of the system dependency checks in "
+                 "$BUILD_ROOT/.cheribuild-system-deps.json and check all required tools and libraries again")
+        self.detach_deletions = loader.addBoolOption("detach-deletions", default=True,
+            help="Delete old build directories (e.g. when using --clean) in a detached low-priority process that keeps "
+                 "running after cheribuild has exited instead of waiting for the deletion at the end of each target")
+        # Delete the directories queued in $BUILD_ROOT/.cheribuild-deletion-queue.json and exit (this is run in the
+        # background by --detach-deletions). Not a bool option since argparse can't format the usage message if all
+        # options of the --foo/--no-foo group are hidden.
+        loader._parser.add_argument("--reap-deletion-queue", action="store_true", help=argparse.SUPPRESS)
+        self.reap_deletion_queue = False
+        # Build only the targets on the command line, even if they are normally built with all their dependencies
+        # (e.g. sdk). Used by the worker processes of --parallel-targets since all dependencies are built first.
+        loader._parser.add_argument("--parallel-worker", action="store_true", help=argparse.SUPPRESS)
+        self.parallel_worker = False
         self.cross_target_suffix = loader.addOption("cross-target-suffix", helpHidden=True, default="",
                                                     help="Add a suffix to the cross build and install directories. "
                                                          "With VALUE=-pcrel it will use /opt/cheriXXX-pcrel/$PROJECT")
@@ -289,6 +342,26 @@ class CheriConfig(object):
                                                           "Note: not all benchmarks support this option")
         self.benchmark_with_qemu = loader.addBoolOption("benchmark-with-qemu", group=loader.benchmarkGroup,
                                                          help="Run the benchmarks on QEMU instead of the FPGA (only useful to collect instruction counts or test the benchmarks)")
+        self.benchmark_report_csvs = loader.addCommandLineOnlyOption("benchmark-report-csv", group=loader.benchmarkGroup,
+            type=list, action="append", metavar="CSV",
+            help="statcounters CSV file (or directory containing them) to include in --benchmark-report. Can be passed "
+                 "multiple times. Files are grouped into configurations based on their name.")
+        self.benchmark_report_baseline = loader.addCommandLineOnlyOption("benchmark-report-baseline",
+            group=loader.benchmarkGroup, metavar="CONFIGURATION",
+            help="The configuration (e.g. mibench-mips) that overheads are computed against in --benchmark-report. "
+                 "Defaults to the configuration of the first CSV file.")
+        self.benchmark_report_metrics = loader.addCommandLineOnlyOption("benchmark-report-metrics",
+            group=loader.benchmarkGroup, default="cycles,instructions", metavar="METRICS",
+            help="Comma-separated list of statcounters columns to include in --benchmark-report")
+        self.benchmark_report_threshold = loader.addCommandLineOnlyOption("benchmark-report-threshold", type=float,
+            group=loader.benchmarkGroup, default=1.0, metavar="PERCENT",
+            help="Only report statistically significant overheads larger than PERCENT as regressions")
+        self.benchmark_report_format = loader.addCommandLineOnlyOption("benchmark-report-format",
+            group=loader.benchmarkGroup, default="text", choices=["text", "csv", "html"],
+            help="Output format for --benchmark-report")
+        self.benchmark_report_output = loader.addCommandLineOnlyOption("benchmark-report-output", type=Path,
+            group=loader.benchmarkGroup, metavar="FILE",
+            help="Write the --benchmark-report output to FILE instead of stdout")
         self.shallow_clone = loader.addBoolOption("shallow-clone", default=True,
             help="Perform a shallow `git clone` when cloning new projects. This can save a lot of time for large"
             "repositories such as FreeBSD or LLVM. Use `git fetch --unshallow` to convert to a non-shallow clone")
@@ -299,6 +372,8 @@ class CheriConfig(object):
 
     def load(self):
         self.loader.load()
+        self.reap_deletion_queue = bool(getattr(self.loader._parsedArgs, "reap_deletion_queue", False))
+        self.parallel_worker = bool(getattr(self.loader._parsedArgs, "parallel_worker", False))
         if self.print_targets_only:
             self.pretend = True
         if self.debug_output:
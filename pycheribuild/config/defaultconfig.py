@@ -39,6 +39,8 @@ class CheribuildAction(Enum):
     BUILD = ("--build", "Run (usually build+install) chosen targets (default)")
     TEST = ("--test", "Run tests for the passed targets instead of building them", "--run-tests")
     BENCHMARK = ("--benchmark", "Run tests for the passed targets instead of building them")
+    BENCHMARK_REPORT = ("--benchmark-report", "Summarise the statcounters CSV files passed with "
+                                              "--benchmark-report-csv and compare the configurations")
     BUILD_AND_TEST = ("--build-and-test", "Run chosen targets and then run any tests afterwards", None,
                       # can get the other instances yet -> use strings
                       ["build", "test"])
@@ -64,6 +66,10 @@ class DefaultCheriConfig(CheriConfig):
         # The run mode:
         self.getConfigOption = loader.addOption("get-config-option", type=str, metavar="KEY", group=loader.actionGroup,
                                                 help="Print the value of config option KEY and exit")
+        self.explain_deps = loader.addCommandLineOnlyOption("explain-deps", type=str, metavar="TARGET",
+                                                            group=loader.actionGroup,
+                                                            help="Print the dependencies of TARGET in build order "
+                                                                 "together with the targets that require them and exit")
         # boolean flags
         self.quiet = loader.addBoolOption("quiet", "q", help="Don't show stdout of the commands that are executed")
         self.verbose = loader.addBoolOption("verbose", "v", help="Print all commmands that are executed")
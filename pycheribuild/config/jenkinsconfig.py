@@ -106,6 +106,9 @@ class JenkinsConfig(CheriConfig):
                                                               help="Override the path to the CHERI SDK (default is $WORKSPACE/cherisdk)")  # type: Path
         self.extract_compiler_only = loader.addCommandLineOnlyBoolOption("extract-compiler-only",
                                                                          help="Don't attempt to extract the CheriBSD sysroot")
+        self.parallel_sdk_extraction = loader.addCommandLineOnlyBoolOption(
+            "parallel-sdk-extraction", default=True,
+            help="Extract multiple SDK archives at the same time (using pixz or multi-threaded xz if available)")
         self.tarball_name = loader.addCommandLineOnlyOption("tarball-name",
             default=lambda conf, cls: conf.targets[0] + "-" + conf.cpu + ".tar.xz")
 
@@ -123,6 +126,7 @@ class JenkinsConfig(CheriConfig):
                                                          help="Clean build directory before building")
         self.force = True  # no user input in jenkins
         self.write_logfile = False  # jenkins stores the output anyway
+        self.detach_deletions = False  # jenkins may kill processes that are still running after the build
         self.skipConfigure = False
         self.forceConfigure = True
         # self.listTargets = False
@@ -104,6 +104,8 @@ class ConfigLoaderBase(object):
     _cheriConfig = None  # type: CheriConfig
 
     options = dict()  # type: typing.Dict[str, ConfigOptionBase]
+    # Names of the options of projects that have not been loaded yet (see target_index.py)
+    lazy_option_names = set()  # type: typing.Set[str]
     _parsedArgs = None
     _JSON = {}  # type: dict
 
@@ -196,6 +198,70 @@ class ConfigLoaderBase(object):
     def targets(self) -> "typing.List[str]":
         return self._parsedArgs.targets
 
+    POSITIONAL = object()  # returned by _split_arguments() for the target names
+
+    def _find_option_action(self, arg: str) -> "typing.Optional[argparse.Action]":
+        # noinspection PyProtectedMember
+        action = self._parser._option_string_actions.get(arg.partition("=")[0])
+        if action is None and arg.startswith("--"):
+            # argparse also accepts unique prefixes of long options
+            prefix = arg.partition("=")[0]
+            matches = [a for name, a in self._parser._option_string_actions.items() if name.startswith(prefix)]
+            action = matches[0] if len(matches) == 1 else None
+        return action
+
+    def _split_arguments(self, args: "typing.List[str]") -> "typing.Iterator[typing.Tuple[int, int, typing.Any]]":
+        """
+        :return: (start, end, action) for every argument in args. The values of an option are the indices up to end,
+        action is None for unknown options and POSITIONAL for positional arguments (i.e. the target names).
+        """
+        i = 0
+        while i < len(args):
+            start = i
+            arg = args[i]
+            i += 1
+            if arg == "--":
+                for j in range(start, len(args)):
+                    yield j, j + 1, self.POSITIONAL
+                break
+            if not arg.startswith("-") or arg == "-":
+                yield start, i, self.POSITIONAL
+                continue
+            action = self._find_option_action(arg)
+            if action is None or "=" in arg:
+                # --option=value, unknown option or short option with an attached value (e.g. -j4)
+                yield start, i, action
+                continue
+            if action.nargs is None:
+                i += 1
+            elif isinstance(action.nargs, int):
+                i += action.nargs
+            elif action.nargs in (argparse.OPTIONAL, argparse.ZERO_OR_MORE, argparse.ONE_OR_MORE):
+                # Like argparse, consume the following arguments until the next option
+                while i < len(args) and not args[i].startswith("-"):
+                    i += 1
+                    if action.nargs == argparse.OPTIONAL:
+                        break
+            yield start, min(i, len(args)), action
+
+    def positional_argument_indices(self, args: "typing.List[str]") -> "typing.Set[int]":
+        """
+        :return: the indices of the positional arguments (i.e. the target names) in args. Unlike a comparison with
+        self.targets this does not include option values that happen to be the same as a target name.
+        """
+        return set(start for start, _, action in self._split_arguments(args) if action is self.POSITIONAL)
+
+    def option_argument_indices(self, args: "typing.List[str]", dest: str) -> "typing.Set[int]":
+        """
+        :return: the indices of all arguments in args that set dest (including the option values and the negated
+        --no-foo options)
+        """
+        result = set()
+        for start, end, action in self._split_arguments(args):
+            if action is not None and action is not self.POSITIONAL and action.dest == dest:
+                result.update(range(start, end))
+        return result
+
 
 class ConfigOptionBase(object):
     def __init__(self, name: str, shortname: str, default, valueType: "typing.Type", _owningClass=None,
@@ -374,8 +440,10 @@ class CommandLineConfigOption(ConfigOptionBase):
     def loadFromCommandLine(self):
         assert self._loader._parsedArgs  # load() must have been called before using this object
         # FIXME: check the fallback name here
-        assert hasattr(self._loader._parsedArgs, self.action.dest)
-        return getattr(self._loader._parsedArgs, self.action.dest)  # from command line
+        # Options of lazily loaded projects are added after the command line has been parsed. This is only done if
+        # they were not passed on the command line, so returning None is correct.
+        assert hasattr(self._loader._parsedArgs, self.action.dest) or self._loader.lazy_option_names
+        return getattr(self._loader._parsedArgs, self.action.dest, None)  # from command line
 
 
 # noinspection PyProtectedMember
@@ -532,7 +600,7 @@ class JsonAndCommandLineConfigLoader(ConfigLoaderBase):
                 if not stripped.startswith("#") and not stripped.startswith("//"):
                     json_lines.append(line)
             # print("".join(jsonLines))
-            result = json.loads("".join(json_lines), object_pairs_hook=dict_raise_on_duplicates, encoding="utf-8")
+            result = json.loads("".join(json_lines), object_pairs_hook=dict_raise_on_duplicates)
             if self._parsedArgs and self._parsedArgs.verbose is True:
                 print("Parsed", config_path, "as", coloured(AnsiColour.cyan, json.dumps(result)))
             return result
@@ -613,7 +681,7 @@ class JsonAndCommandLineConfigLoader(ConfigLoaderBase):
         if fullname == "#include":
             return True
 
-        if fullname in self.options:
+        if fullname in self.options or "--" + fullname in self.lazy_option_names:
             return True
         # see if it is one of the alternate names is valid
         for option in self.options.values():
@@ -0,0 +1,404 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import errno
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .utils import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TRASH_SUFFIX = ".delete-me-pls"
+# Subdirectories up to this depth are deleted by separate tasks, deeper ones by the task for their parent
+_PARALLEL_DEPTH = 2
+
+
+def trash_directory_name(path: Path) -> Path:
+    """
+    :return: a new name for path (in the same directory and therefore on the same file system) that it can be renamed
+    to before it is deleted
+    """
+    result = path.with_suffix(TRASH_SUFFIX)
+    counter = 1
+    while result.exists():
+        # The previous one might still be deleted by the reaper process
+        counter += 1
+        result = path.with_suffix("." + str(counter) + TRASH_SUFFIX)
+    return result
+
+
+class RemovalStatistics(object):
+    def __init__(self, directories=0, files=0, size=0, seconds=0.0):
+        self.directories = directories
+        self.files = files
+        self.size = size
+        self.seconds = seconds
+
+    def add(self, other: "RemovalStatistics"):
+        self.directories += other.directories
+        self.files += other.files
+        self.size += other.size
+        self.seconds += other.seconds
+
+    def as_dict(self) -> dict:
+        return dict(directories=self.directories, files=self.files, size=self.size, seconds=self.seconds)
+
+    def __str__(self):
+        if self.directories and not self.files:
+            # Directories deleted using `rm -rf` (the number of files and bytes is not known)
+            return "Deleted {} directories in {:.1f}s".format(self.directories, self.seconds)
+        return "Reclaimed {:.1f} MiB ({} files in {} directories) in {:.1f}s".format(
+            self.size / 1024 / 1024, self.files, self.directories, self.seconds)
+
+
+def _reclaimed_size(st: os.stat_result) -> int:
+    # Blocks of files with multiple links are only freed once the last link is removed
+    if st.st_nlink > 1:
+        return 0
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def _ignore_missing(function, path: str):
+    try:
+        function(path)
+    except FileNotFoundError:
+        pass  # already deleted by someone else (e.g. the reaper of a previous run)
+
+
+def _remove_files(directory: str) -> "typing.Tuple[int, int, typing.List[str]]":
+    """Removes all non-directory entries of directory and returns (files, bytes, subdirectories)"""
+    files = 0
+    size = 0
+    subdirs = []
+    try:
+        names = os.listdir(directory)  # os.scandir() needs Python 3.5
+    except FileNotFoundError:
+        return 0, 0, []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.lstat(path)
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append(path)
+                continue
+            size += _reclaimed_size(st)
+            os.unlink(path)
+            files += 1
+        except FileNotFoundError:
+            pass
+    return files, size, subdirs
+
+
+def _remove_recursively(directory: str) -> "typing.Tuple[int, int]":
+    files, size, subdirs = _remove_files(directory)
+    for subdir in subdirs:
+        sub_files, sub_size = _remove_recursively(subdir)
+        files += sub_files
+        size += sub_size
+    _ignore_missing(os.rmdir, directory)
+    return files, size
+
+
+def remove_tree(path: Path, jobs=4) -> "typing.Tuple[int, int]":
+    """
+    Delete path (which can also be a file). Unlike shutil.rmtree() this deletes the subdirectories of the first
+    levels in parallel (unlink() and rmdir() release the GIL).
+
+    :return: the number of files and the number of bytes that were reclaimed
+    """
+    if not path.is_dir() or path.is_symlink():
+        if not os.path.lexists(str(path)):
+            return 0, 0
+        size = _reclaimed_size(path.lstat())
+        _ignore_missing(os.unlink, str(path))
+        return 1, size
+    lock = threading.Lock()
+    totals = [0, 0]
+    split_dirs = []  # type: typing.List[typing.Tuple[int, str]]
+    futures = []
+
+    def remove(directory: str, depth: int, executor: ThreadPoolExecutor):
+        if depth >= _PARALLEL_DEPTH:
+            files, size = _remove_recursively(directory)
+        else:
+            files, size, subdirs = _remove_files(directory)
+            with lock:
+                split_dirs.append((depth, directory))
+                futures.extend(executor.submit(remove, d, depth + 1, executor) for d in subdirs)
+        with lock:
+            totals[0] += files
+            totals[1] += size
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures.append(executor.submit(remove, str(path), 0, executor))
+        waited = 0
+        # The tasks add new tasks for their subdirectories -> wait until no more are added
+        while True:
+            with lock:
+                if waited == len(futures):
+                    break
+                future = futures[waited]
+            future.result()  # raises the exception of the task (if any)
+            waited += 1
+    # The subdirectories have been deleted by now -> remove the directories that were split (deepest first)
+    for depth, directory in sorted(split_dirs, reverse=True):
+        _ignore_missing(os.rmdir, directory)
+    return totals[0], totals[1]
+
+
+class DeletionQueue(object):
+    """
+    Directories that have been renamed to *.delete-me-pls and still need to be deleted. The queue is stored in
+    $BUILD_ROOT/.cheribuild-deletion-queue.json and processed by a detached low-priority reaper process, so deleting
+    large build directories does not delay the end of a cheribuild run. Directories left behind by crashed or
+    interrupted runs are added again by find_stale_directories().
+    """
+    FILENAME = ".cheribuild-deletion-queue.json"
+    VERSION = 1
+    MAX_ERRORS = 10
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock_path = path.with_name(path.name + ".lock")
+        # Held by the reaper while it is running (see start_reaper())
+        self._reaper_lock_path = path.with_name(path.name + ".reaper-lock")
+        self.reaper_log = path.with_name(path.name.replace(".json", ".log"))
+
+    @staticmethod
+    def _lock(lock_path: Path, blocking=True) -> "typing.Optional[typing.IO]":
+        """:return: the open lock file or None if blocking is False and the lock is held by another process"""
+        f = lock_path.open("a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                f.close()
+                if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                    raise
+                return None
+        return f
+
+    @staticmethod
+    def _unlock(lock_file: "typing.IO"):
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextlib.contextmanager
+    def _locked_queue(self):
+        lock_file = self._lock(self._lock_path)
+        try:
+            yield
+        finally:
+            self._unlock(lock_file)
+
+    def _load(self) -> dict:
+        state = dict(version=self.VERSION, pending=[], reclaimed=RemovalStatistics().as_dict(), errors=[])
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                state.update(data)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            warningMessage("Could not load the deletion queue", self.path, "->", e)
+        return state
+
+    def _save(self, state: dict):
+        tmpfile = self.path.with_name(self.path.name + ".tmp." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        os.replace(str(tmpfile), str(self.path))
+
+    def pending(self) -> "typing.List[Path]":
+        with self._locked_queue():
+            return [Path(p) for p in self._load()["pending"]]
+
+    def enqueue(self, *directories: Path, start_reaper_command: "typing.List[str]"=None) -> bool:
+        """
+        Add directories to the queue and start a reaper process with start_reaper_command if none is running yet.
+        :return: whether a reaper process is now responsible for deleting the directories
+        """
+        with self._locked_queue():
+            state = self._load()
+            for d in directories:
+                if str(d.absolute()) not in state["pending"]:
+                    state["pending"].append(str(d.absolute()))
+            self._save(state)
+            if start_reaper_command is None:
+                return False
+            # This happens with the queue locked: a running reaper only exits after checking that the queue is
+            # empty (also with the queue locked) so it will delete these directories too
+            reaper_lock = self._lock(self._reaper_lock_path, blocking=False)
+            if reaper_lock is None:
+                return True
+            self._unlock(reaper_lock)
+            return self._spawn_reaper(start_reaper_command)
+
+    def _spawn_reaper(self, command: "typing.List[str]") -> bool:
+        # Run with the lowest CPU and I/O priority so that the reaper does not slow down the next build
+        prefix = ["nice", "-n", "19"] if shutil.which("nice") else []
+        if shutil.which("ionice"):
+            prefix += ["ionice", "-c", "3"]
+        try:
+            with self.reaper_log.open("a") as log:
+                subprocess.Popen(prefix + command, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                 start_new_session=True, close_fds=True)
+        except OSError as e:
+            warningMessage("Could not start the background deletion process:", e)
+            return False
+        return True
+
+    def find_stale_directories(self, search_dirs: "typing.Iterable[Path]") -> "typing.List[Path]":
+        """
+        Add the *.delete-me-pls directories in search_dirs (e.g. left behind by a crashed run) to the queue
+        :return: all directories that are in the queue now
+        """
+        found = []
+        for search_dir in search_dirs:
+            try:
+                names = os.listdir(str(search_dir))
+            except OSError:
+                continue
+            for name in names:
+                path = search_dir / name
+                if name.endswith(TRASH_SUFFIX) and path.is_dir() and not path.is_symlink():
+                    found.append(path)
+        with self._locked_queue():
+            state = self._load()
+            pending = [p for p in state["pending"] if os.path.lexists(p)]
+            pending.extend(str(p) for p in found if str(p) not in pending)
+            if pending != state["pending"]:
+                state["pending"] = pending
+                self._save(state)
+        return [Path(p) for p in pending]
+
+    def take_reclaimed_statistics(self) -> "typing.Tuple[RemovalStatistics, typing.List[str]]":
+        """:return: the statistics and errors of the reaper processes since the last call"""
+        with self._locked_queue():
+            state = self._load()
+            result = RemovalStatistics(**state["reclaimed"]), state["errors"]
+            if result[0].directories or result[1]:
+                state["reclaimed"] = RemovalStatistics().as_dict()
+                state["errors"] = []
+                self._save(state)
+        return result
+
+    def reap(self, jobs=4, blocking=True, record_statistics=True) -> "typing.Optional[RemovalStatistics]":
+        """
+        Delete all queued directories (including the ones that are added while this is running)
+        :param blocking: wait for other reapers to finish instead of returning None
+        :param record_statistics: store the statistics so that the next cheribuild run can report them
+        """
+        result = RemovalStatistics()
+        reaper_lock = self._lock(self._reaper_lock_path, blocking=blocking)
+        if reaper_lock is None:
+            return None
+        try:
+            while True:
+                with self._locked_queue():
+                    pending = self._load()["pending"]
+                    if not pending:
+                        # Release the reaper lock before the queue lock: enqueue() has either added its directories
+                        # before this check or will see that no reaper is running and start a new one
+                        self._unlock(reaper_lock)
+                        reaper_lock = None
+                        break
+                directory = pending[0]
+                start = time.time()
+                error = None
+                stats = RemovalStatistics(directories=1)
+                try:
+                    stats.files, stats.size = remove_tree(Path(directory), jobs=jobs)
+                except OSError as e:
+                    # Leave it on disk, find_stale_directories() will add it again in the next run
+                    error = "Could not delete {}: {}".format(directory, e)
+                    print(error, file=sys.stderr)
+                stats.seconds = time.time() - start
+                result.add(stats)
+                with self._locked_queue():
+                    state = self._load()
+                    if directory in state["pending"]:
+                        state["pending"].remove(directory)
+                    if record_statistics:
+                        reclaimed = RemovalStatistics(**state["reclaimed"])
+                        reclaimed.add(stats)
+                        state["reclaimed"] = reclaimed.as_dict()
+                        if error:
+                            state["errors"] = (state["errors"] + [error])[-self.MAX_ERRORS:]
+                    self._save(state)
+        finally:
+            if reaper_lock is not None:
+                self._unlock(reaper_lock)
+        return result
+
+
+def reaper_command(config: "CheriConfig") -> "typing.List[str]":
+    """:return: the command line that runs cheribuild as a reaper process for the deletion queue of config"""
+    if Path(sys.argv[0]).name == "__main__.py":
+        cheribuild = [sys.executable, "-m", "pycheribuild"]
+    else:
+        cheribuild = [sys.executable, str(Path(sys.argv[0]).absolute())]
+    result = cheribuild + ["--reap-deletion-queue", "--build-root=" + str(config.buildRoot),
+                           "--make-jobs=" + str(config.makeJobs)]
+    # Load the same config file so that the reaper does not complain about a missing or different one. --pretend
+    # does not need to be forwarded since the reaper is never started in pretend mode.
+    config_file = getattr(config.loader, "_configPath", None)
+    if config_file is not None:
+        result.append("--config-file=" + str(config_file))
+    if config.verbose:
+        result.append("--verbose")
+    return result
+
+
+_deletion_queue = None  # type: typing.Optional[DeletionQueue]
+
+
+def deletion_queue() -> DeletionQueue:
+    global _deletion_queue
+    config = get_global_config()
+    path = config.buildRoot / DeletionQueue.FILENAME
+    if _deletion_queue is None or _deletion_queue.path != path:
+        _deletion_queue = DeletionQueue(path)
+    return _deletion_queue
@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .utils import *
+
+ELF_MAGIC = b"\x7fELF"
+
+
+def is_elf_file(path: "typing.Union[Path, str]") -> bool:
+    try:
+        with open(str(path), "rb") as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError as e:
+        warningMessage("Failed to detect type of file:", path, e)
+        return False
+
+
+def _check_elf_batch(paths: "typing.List[str]") -> "typing.List[str]":
+    return [p for p in paths if is_elf_file(p)]
+
+
+def find_elf_files(directory: Path, executor: ThreadPoolExecutor = None,
+                   batch_size: int = 256) -> "typing.List[typing.Tuple[Path, typing.List[Path]]]":
+    """
+    Find all ELF files below directory. Symlinks are ignored and files with multiple hardlinks are only returned once.
+    :return: a list of (path, [other hardlinks to the same inode]) tuples sorted by path
+    """
+    inodes = dict()  # type: typing.Dict[typing.Tuple[int, int], typing.List[str]]
+    for root, dirs, files in os.walk(str(directory)):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                warningMessage("Failed to stat file:", path, e)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue  # skip symlinks, sockets, etc.
+            inodes.setdefault((st.st_dev, st.st_ino), []).append(path)
+    # Only read the first four bytes of one path per inode, in batches on the worker pool
+    candidates = sorted(min(paths) for paths in inodes.values())
+    batches = [candidates[i:i + batch_size] for i in range(0, len(candidates), batch_size)]
+    if executor is not None:
+        elf_files = [p for batch in executor.map(_check_elf_batch, batches) for p in batch]
+    else:
+        elf_files = [p for batch in batches for p in _check_elf_batch(batch)]
+    result = []
+    by_path = {min(paths): paths for paths in inodes.values()}
+    for path in elf_files:
+        aliases = sorted(p for p in by_path[path] if p != path)
+        result.append((Path(path), [Path(p) for p in aliases]))
+    return result
+
+
+class ElfStripper(object):
+    """
+    Strips all ELF files in a directory tree by running llvm-strip on a bounded pool of workers with multiple files
+    per invocation. Hardlinked files are only stripped once and the hardlinks are restored afterwards (llvm-strip
+    writes a new file instead of modifying the existing inode).
+    """
+    def __init__(self, strip_tool: Path, jobs: int = None, files_per_invocation: int = 32, pretend: bool = False):
+        self.strip_tool = strip_tool
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.files_per_invocation = max(1, files_per_invocation)
+        self.pretend = pretend
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.files_stripped = 0
+        self.elapsed_time = 0.0
+        self._lock = threading.Lock()
+
+    def _strip_batch(self, batch: "typing.List[typing.Tuple[Path, typing.List[Path]]]"):
+        before = sum(path.stat().st_size for path, _ in batch)
+        runCmd([self.strip_tool] + [path for path, _ in batch], printVerboseOnly=True,
+               runInPretendMode=not self.pretend)
+        if self.pretend:
+            return
+        after = 0
+        for path, aliases in batch:
+            st = path.stat()
+            after += st.st_size
+            for alias in aliases:
+                # llvm-strip replaces the file -> update the other hardlinks to point to the stripped inode
+                if os.path.samefile(str(alias), str(path)):
+                    continue
+                tmp = alias.with_name(alias.name + ".strip-tmp")
+                os.link(str(path), str(tmp))
+                os.replace(str(tmp), str(alias))
+        with self._lock:
+            self.bytes_before += before
+            self.bytes_after += after
+            self.files_stripped += len(batch)
+
+    def strip_tree(self, directory: Path) -> "ElfStripper":
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            elf_files = find_elf_files(directory, executor)
+            # Distribute the files so that every worker gets some work even if there are only a few files
+            per_invocation = max(1, min(self.files_per_invocation, -(-len(elf_files) // self.jobs)))
+            batches = [elf_files[i:i + per_invocation] for i in range(0, len(elf_files), per_invocation)]
+            # list() to re-raise the first exception
+            list(executor.map(self._strip_batch, batches))
+        self.elapsed_time = time.time() - start
+        return self
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def summary(self) -> str:
+        return "Stripped {} ELF files in {:.1f}s, saved {:.1f} MiB ({:.1f} MiB -> {:.1f} MiB)".format(
+            self.files_stripped, self.elapsed_time, self.bytes_saved / 1024 / 1024, self.bytes_before / 1024 / 1024,
+            self.bytes_after / 1024 / 1024)
+
+
+def strip_elf_files_in(config: "CheriConfig", directory: Path) -> ElfStripper:
+    statusUpdate("Stripping all ELF files in", directory)
+    stripper = ElfStripper(config.sdkBinDir / "llvm-strip", jobs=config.makeJobs, pretend=config.pretend)
+    stripper.strip_tree(directory)
+    statusUpdate(stripper.summary())
+    return stripper
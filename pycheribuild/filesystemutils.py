@@ -32,9 +32,12 @@ import os
 import threading
 import shutil
 import subprocess
+import time
 
 from pathlib import Path
 from .config.chericonfig import CheriConfig
+from .deletion_queue import DeletionQueue, RemovalStatistics, deletion_queue, reaper_command
+from .deletion_queue import remove_tree, trash_directory_name
 from .utils import *
 
 
@@ -47,10 +50,22 @@ class FileSystemUtils(object):
             printCommand("mkdir", "-p", path, printVerboseOnly=True)
             os.makedirs(str(path), exist_ok=True)
 
-    def _deleteDirectories(self, *dirs):
+    def _deleteDirectories(self, *dirs) -> RemovalStatistics:
         # http://stackoverflow.com/questions/5470939/why-is-shutil-rmtree-so-slow
         # shutil.rmtree(path) # this is slooooooooooooooooow for big trees
-        runCmd("rm", "-rf", *dirs)
+        result = RemovalStatistics()
+        start = time.time()
+        try:
+            runCmd("rm", "-rf", *dirs)
+            result.directories = len(dirs)
+        except (subprocess.CalledProcessError, OSError) as e:
+            # rm is not available (or failed to delete some files) -> delete the remaining files in-process
+            warningMessage("Could not delete", " ".join(map(str, dirs)), "using rm -rf:", e)
+            for d in dirs:
+                files, size = remove_tree(Path(d), jobs=max(1, min(8, self.config.makeJobs)))
+                result.add(RemovalStatistics(directories=1, files=files, size=size))
+        result.seconds = time.time() - start
+        return result
 
     def cleanDirectory(self, path: Path, keepRoot=False, ensure_dir_exists=True) -> None:
         """ After calling this function path will be an empty directory
@@ -75,9 +90,10 @@ class FileSystemUtils(object):
             try:
                 if self.parent.config.verbose:
                     statusUpdate("Deleting", self.path, "asynchronously")
-                self.parent._deleteDirectories(self.path)
+                with trace_span("async clean", "phase", path=str(self.path)):
+                    stats = self.parent._deleteDirectories(self.path)
                 if self.parent.config.verbose:
-                    statusUpdate("Async delete of", self.path, "finished")
+                    statusUpdate("Async delete of", self.path, "finished.", stats)
             except Exception as e:
                 warningMessage("Could not remove directory", self.path, e)
 
@@ -99,7 +115,12 @@ class FileSystemUtils(object):
         elif len(list(path.iterdir())) == 0:
             statusUpdate("Not cleaning", path, "it is already empty")
         else:
-            if tempdir.is_dir():
+            if tempdir.is_dir() and self.config.detach_deletions:
+                # Probably still being deleted by the reaper process of a previous run -> use a different name
+                if not self.config.pretend:
+                    deletion_queue().enqueue(tempdir)
+                tempdir = trash_directory_name(path)
+            elif tempdir.is_dir():
                 warningMessage("Previous async cleanup of ", path, "failed. Cleaning up now")
                 self._deleteDirectories(tempdir)
             if keepRoot:
@@ -130,9 +151,57 @@ class FileSystemUtils(object):
                 assert len(list(path.iterdir())) == 0, list(path.iterdir())
         if tempdir.is_dir() or self.config.pretend:
             # we now have an empty directory, start background deleter and return to caller
-            deleterThread = FileSystemUtils.DeleterThread(self, tempdir)
+            if not self.config.detach_deletions or not self._delete_detached(tempdir):
+                deleterThread = FileSystemUtils.DeleterThread(self, tempdir)
         return ThreadJoiner(deleterThread)
 
+    def _delete_detached(self, path: Path) -> bool:
+        """
+        Queue path for deletion by the reaper process that keeps running after cheribuild has exited
+        :return: False if the reaper could not be started and path must be deleted by this process instead
+        """
+        printCommand("rm", "-rf", path)
+        if self.config.pretend:
+            return True
+        return deletion_queue().enqueue(path, start_reaper_command=reaper_command(self.config))
+
+    def reclaim_stale_directories(self) -> ThreadJoiner:
+        """
+        Delete the *.delete-me-pls directories that were left behind by crashed runs (or that could not be
+        deleted by the reaper) and report how much space the reaper processes reclaimed since the last run.
+        """
+        if self.config.pretend or not self.config.buildRoot.is_dir():
+            return ThreadJoiner(None)
+        queue = deletion_queue()
+        stats, errors = queue.take_reclaimed_statistics()
+        if stats.directories:
+            statusUpdate("Deleted", stats.directories, "directories in the background since the last run.", stats)
+        for error in errors:
+            warningMessage(error)
+        pending = queue.find_stale_directories([self.config.buildRoot, self.config.outputRoot, self.config.sdkDir])
+        if not pending:
+            return ThreadJoiner(None)
+        statusUpdate("Deleting", len(pending), "directories left behind by previous runs in the background")
+        if self.config.detach_deletions and queue.enqueue(start_reaper_command=reaper_command(self.config)):
+            return ThreadJoiner(None)
+        return ThreadJoiner(FileSystemUtils.ReaperThread(self, queue))
+
+    class ReaperThread(threading.Thread):
+        def __init__(self, parent: "FileSystemUtils", queue: DeletionQueue):
+            super().__init__(name="Deleting directories left behind by previous runs")
+            self.parent = parent
+            self.queue = queue
+
+        def run(self):
+            try:
+                jobs = max(1, min(8, self.parent.config.makeJobs))
+                # Don't wait if a reaper process is already deleting them
+                stats = self.queue.reap(jobs=jobs, blocking=False, record_statistics=False)
+                if stats is not None and stats.directories:
+                    statusUpdate("Deleted", stats.directories, "directories left behind by previous runs.", stats)
+            except Exception as e:
+                warningMessage("Could not remove stale directories", e)
+
     def deleteFile(self, file: Path, printVerboseOnly=False):
         if not file.is_file():
             return
@@ -0,0 +1,224 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .utils import *
+
+
+def hash_components(components: "typing.Dict[str, typing.Any]") -> str:
+    """
+    :return: the SHA256 of the JSON representation of components (keys are sorted to make it deterministic)
+    """
+    encoded = json.dumps(components, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def git_head_revision(srcdir: Path) -> "typing.Optional[str]":
+    """
+    :return: the commit hash of HEAD in srcdir or None if srcdir is not a git repository (much cheaper than
+    git_source_revision() since it does not look at uncommitted changes)
+    """
+    if not (srcdir / ".git").exists():
+        return None
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(srcdir),
+                                       stderr=subprocess.DEVNULL).strip().decode("utf-8")
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def git_source_revision(srcdir: Path) -> "typing.Optional[str]":
+    """
+    :return: A string identifying the current state of the git repository in srcdir (HEAD plus a hash of the
+    uncommitted changes and the names of untracked files) or None if srcdir is not a git repository.
+    """
+    if not (srcdir / ".git").exists():
+        return None
+    try:
+        head = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(srcdir),
+                                       stderr=subprocess.DEVNULL).strip().decode("utf-8")
+        diff = subprocess.check_output(["git", "diff", "HEAD", "--binary", "--ignore-submodules=dirty"],
+                                       cwd=str(srcdir), stderr=subprocess.DEVNULL)
+        untracked = subprocess.check_output(["git", "ls-files", "--others", "--exclude-standard"],
+                                            cwd=str(srcdir), stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    if not diff and not untracked:
+        return head
+    dirty = hashlib.sha256(diff)
+    dirty.update(untracked)
+    return head + "-dirty-" + dirty.hexdigest()[:16]
+
+
+def file_identity(path: "typing.Optional[Path]") -> "typing.Optional[str]":
+    """
+    :return: A string that changes whenever the file is replaced (size, mtime and inode) or None if it is missing
+    """
+    if path is None:
+        return None
+    try:
+        st = os.stat(str(path))
+    except OSError:
+        return None
+    return "{}:{}:{}:{}".format(Path(path).resolve(), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class FingerprintStore(object):
+    """
+    A persistent JSON file that maps target names to the fingerprint of the last successful build. Each entry also
+    contains the individual components that were hashed so that the reason for a rebuild can be explained (and the
+    file can be inspected offline using `python3 -m pycheribuild.fingerprints`).
+    """
+    FILENAME = ".cheribuild-fingerprints.json"
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None  # type: typing.Optional[typing.Dict[str, dict]]
+
+    @classmethod
+    def for_config(cls, config: "CheriConfig") -> "FingerprintStore":
+        path = config.buildRoot / cls.FILENAME
+        store = _stores.get(path)
+        if store is None:
+            store = cls(path)
+            _stores[path] = store
+        return store
+
+    @property
+    def entries(self) -> "typing.Dict[str, dict]":
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self) -> "typing.Dict[str, dict]":
+        if not self.path.is_file():
+            return OrderedDict()
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError) as e:
+            warningMessage("Could not load build fingerprints from", self.path, "->", e)
+            return OrderedDict()
+        if data.get("version") != self.VERSION:
+            warningMessage("Ignoring build fingerprints in", self.path, "since they were written by a different "
+                                                                        "version of cheribuild")
+            return OrderedDict()
+        return data.get("targets", OrderedDict())
+
+    def get(self, target: str) -> "typing.Optional[dict]":
+        with self._lock:
+            return self.entries.get(target)
+
+    def fingerprint(self, target: str) -> "typing.Optional[str]":
+        entry = self.get(target)
+        return entry["fingerprint"] if entry else None
+
+    def update(self, target: str, fingerprint: str, components: dict):
+        with self._lock:
+            self.entries[target] = OrderedDict(fingerprint=fingerprint, timestamp=time.time(), components=components)
+            self._save()
+
+    def invalidate(self, target: str):
+        with self._lock:
+            if self.entries.pop(target, None) is not None:
+                self._save()
+
+    def _save(self):
+        os.makedirs(str(self.path.parent), exist_ok=True)
+        tmpfile = self.path.with_name(self.path.name + ".tmp")
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(OrderedDict(version=self.VERSION, targets=self.entries), f, indent=2, default=str)
+        os.replace(str(tmpfile), str(self.path))
+
+    @staticmethod
+    def explain(old_components: "typing.Optional[dict]", new_components: dict) -> "typing.List[str]":
+        """
+        :return: a list of human readable reasons why new_components do not match old_components
+        """
+        if old_components is None:
+            return ["no previous successful build recorded"]
+        result = []
+        for key in sorted(set(old_components.keys()) | set(new_components.keys())):
+            old = old_components.get(key)
+            new = new_components.get(key)
+            if old == new:
+                continue
+            if isinstance(old, dict) and isinstance(new, dict):
+                for subkey in sorted(set(old.keys()) | set(new.keys())):
+                    if old.get(subkey) != new.get(subkey):
+                        result.append("{}/{} changed: {!r} -> {!r}".format(key, subkey, old.get(subkey),
+                                                                           new.get(subkey)))
+            else:
+                result.append("{} changed: {!r} -> {!r}".format(key, old, new))
+        return result
+
+
+_stores = dict()  # type: typing.Dict[Path, FingerprintStore]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the cheribuild build fingerprint store")
+    parser.add_argument("store", type=Path, nargs="?", default=Path(os.path.expanduser("~/cheri/build"),
+                                                                      FingerprintStore.FILENAME),
+                        help="The fingerprint file (default: ~/cheri/build/" + FingerprintStore.FILENAME + ")")
+    parser.add_argument("targets", nargs="*", help="Only show these targets")
+    parser.add_argument("--remove", action="store_true", help="Remove the fingerprints for the given targets")
+    args = parser.parse_args()
+    store = FingerprintStore(args.store)
+    if args.remove:
+        for target in args.targets:
+            store.invalidate(target)
+        return
+    for target, entry in store.entries.items():
+        if args.targets and target not in args.targets:
+            continue
+        print(target + ":", entry["fingerprint"], time.strftime("(%Y-%m-%d %H:%M:%S)",
+                                                                time.localtime(entry["timestamp"])))
+        for key, value in sorted(entry["components"].items()):
+            if isinstance(value, dict):
+                for subkey, subvalue in sorted(value.items()):
+                    print("    ", key + "/" + subkey, "=", subvalue)
+            else:
+                print("    ", key, "=", value)
+
+
+if __name__ == "__main__":  # no-combine
+    sys.exit(main())  # no-combine
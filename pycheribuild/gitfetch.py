@@ -0,0 +1,159 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from .utils import *
+
+
+class FetchRequest(object):
+    def __init__(self, name: str, source_dir: Path, recurse_submodules: bool = True):
+        self.name = name
+        self.source_dir = source_dir
+        self.recurse_submodules = recurse_submodules
+
+    def fetch_command(self) -> "typing.List[str]":
+        cmd = ["git", "fetch", "--progress"]
+        cmd.append("--recurse-submodules=on-demand" if self.recurse_submodules else "--no-recurse-submodules")
+        return cmd
+
+
+class FetchResult(object):
+    def __init__(self, request: FetchRequest):
+        self.request = request
+        self.success = False
+        self.bytes_received = 0
+        self.updated_refs = 0
+        self.elapsed_time = 0.0
+        self.error = ""
+
+    def summary(self) -> str:
+        if not self.success:
+            return "failed to fetch " + self.request.name + ": " + self.error
+        if self.updated_refs == 0:
+            return self.request.name + " is up to date ({:.1f}s)".format(self.elapsed_time)
+        return "{}: {} updated ref{}, received {} in {:.1f}s".format(
+            self.request.name, self.updated_refs, "" if self.updated_refs == 1 else "s",
+            format_byte_count(self.bytes_received), self.elapsed_time)
+
+
+def format_byte_count(count: int) -> str:
+    if count < 1024:
+        return str(count) + " bytes"
+    if count < 1024 * 1024:
+        return "{:.1f} KiB".format(count / 1024)
+    return "{:.1f} MiB".format(count / 1024 / 1024)
+
+
+_COUNT_OBJECTS_SIZE = re.compile(br"^size(?:-pack)?: (\d+)$", re.MULTILINE)
+
+
+def git_object_store_size(source_dir: Path) -> int:
+    """
+    :return: the size in bytes of the loose and packed objects in the repository (as reported by git count-objects)
+    """
+    try:
+        output = subprocess.check_output(["git", "count-objects", "-v"], cwd=str(source_dir),
+                                         stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return 0
+    return sum(int(kib) for kib in _COUNT_OBJECTS_SIZE.findall(output)) * 1024
+
+
+class ConcurrentGitFetcher(object):
+    """
+    Runs `git fetch` for many repositories on a bounded pool of worker threads. Fetching is the only part of
+    updating a repository that needs the network so doing it concurrently hides the round-trip latency of the
+    individual remotes. The local steps (rebasing onto the new upstream, updating submodules) are still done one
+    repository at a time afterwards since they may need to ask the user how to handle local changes.
+    """
+    def __init__(self, jobs: int, pretend: bool = False):
+        self.jobs = max(1, jobs)
+        self.pretend = pretend
+        self.results = []  # type: typing.List[FetchResult]
+        self.elapsed_time = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch(self, request: FetchRequest) -> FetchResult:
+        result = FetchResult(request)
+        start = time.time()
+        size_before = git_object_store_size(request.source_dir)
+        try:
+            output = runCmd(request.fetch_command(), cwd=request.source_dir, captureOutput=True, captureError=True,
+                            printVerboseOnly=True, runInPretendMode=not self.pretend, raiseInPretendMode=True)
+            # git fetch prints one "old..new  branch -> origin/branch" line per updated ref
+            result.updated_refs = sum(1 for line in output.stderr.splitlines() if b" -> " in line)
+            result.success = True
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr or e.output or b""
+            lines = [l.strip() for l in stderr.decode("utf-8", errors="replace").splitlines() if l.strip()]
+            errors = [l for l in lines if l.startswith(("fatal:", "error:"))]
+            result.error = (errors or lines or [str(e)])[0]
+        if result.updated_refs:
+            result.bytes_received = max(0, git_object_store_size(request.source_dir) - size_before)
+        result.elapsed_time = time.time() - start
+        return result
+
+    def fetch_all(self, requests: "typing.List[FetchRequest]") -> "typing.List[FetchResult]":
+        start = time.time()
+        jobs = min(self.jobs, len(requests))
+        statusUpdate("Fetching", len(requests), "repositories using", jobs, "concurrent jobs")
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(self._fetch, request) for request in requests]
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                with self._lock:
+                    self.results.append(result)
+                progress = "[" + str(i + 1) + "/" + str(len(requests)) + "]"
+                if result.success:
+                    statusUpdate(progress, result.summary())
+                else:
+                    warningMessage(progress, result.summary())
+        self.elapsed_time = time.time() - start
+        # Return the results in the order of the requests
+        order = {id(request): i for i, request in enumerate(requests)}
+        self.results.sort(key=lambda r: order[id(r.request)])
+        return self.results
+
+    @property
+    def bytes_received(self) -> int:
+        return sum(r.bytes_received for r in self.results)
+
+    def summary(self) -> str:
+        failed = sum(1 for r in self.results if not r.success)
+        result = "Fetched {} repositories in {:.1f}s, received {}".format(
+            len(self.results) - failed, self.elapsed_time, format_byte_count(self.bytes_received))
+        if failed:
+            result += " ({} failed and will be updated with git pull)".format(failed)
+        return result
@@ -28,14 +28,18 @@
 # SUCH DAMAGE.
 #
 import argparse
+import hashlib
 import inspect
+import json
 import os
 import shlex
 import subprocess
 import sys
 import shutil
 import pprint
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from .config.loader import ConfigLoaderBase, CommandLineConfigOption
@@ -47,10 +51,14 @@ from .projects import *  # make sure all projects are loaded so that targetManag
 from .projects.cross import *  # make sure all projects are loaded so that targetManager gets populated
 from .projects.cross.crosscompileproject import CrossCompileMixin
 from .projects.cross.cheribsd import BuildFreeBSDBase
+from .elfstrip import strip_elf_files_in
+from .fingerprints import file_identity
 from .targets import targetManager, Target
 from .utils import *
 
 EXTRACT_SDK_TARGET = "extract-sdk"
+# Digests of the archives that were used to create $WORKSPACE/cherisdk
+SDK_ARCHIVE_RECORDS = ".cheribuild-sdk-archives.json"
 
 class JenkinsConfigLoader(ConfigLoaderBase):
     """
@@ -85,17 +93,99 @@ class JenkinsConfigLoader(ConfigLoaderBase):
         super().__init__(CommandLineConfigOption)
 
 
+def _parallel_decompressor() -> "typing.Optional[typing.List[str]]":
+    if shutil.which("pixz"):
+        return ["pixz", "-d"]
+    if shutil.which("xz"):
+        return ["xz", "--decompress", "--stdout", "-T0"]
+    return None
+
+
+def _merge_directory(src: str, dest: str):
+    # Move all files from src to dest (later archives overwrite files from earlier ones just like tar would)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.isdir(dest_path) and not os.path.islink(dest_path) and not os.path.islink(src_path) and \
+                os.path.isdir(src_path):
+            _merge_directory(src_path, dest_path)
+        else:
+            os.replace(src_path, dest_path)
+    os.rmdir(src)
+
+
 class SdkArchive(object):
     def __init__(self, cheriConfig: JenkinsConfig, name, *, required_globs: list=None, extra_args:list=None):
         self.cheriConfig = cheriConfig
         self.archive = cheriConfig.workspace / name  # type: Path
         self.required_globs = [] if required_globs is None else required_globs  # type: list
         self.extra_args = [] if extra_args is None else extra_args  # type: list
-
-    def extract(self):
+        self.digest = None  # type: typing.Optional[str]
+        self.extract_time = 0.0
+
+    def compute_digest(self, record: dict=None) -> str:
+        """
+        :param record: the record of a previous extraction. If the archive has not been replaced since then (same
+        size, mtime and inode) the previous digest is returned instead of reading the whole archive again.
+        """
+        if record and record.get("identity") == file_identity(self.archive):
+            return record["digest"]
+        digest = hashlib.sha256()
+        with self.archive.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def matches_record(self, record: "typing.Optional[dict]") -> bool:
+        if not record or record.get("extra_args") != [str(a) for a in self.extra_args]:
+            return False
+        self.digest = self.compute_digest(record)
+        return self.digest == record.get("digest")
+
+    def record(self) -> dict:
+        return {"digest": self.digest, "identity": file_identity(self.archive),
+                "extra_args": [str(a) for a in self.extra_args]}
+
+    def extract(self, destination: Path=None):
         assert self.archive.exists(), str(self.archive)
-        runCmd(["tar", "Jxf", self.archive, "-C", self.cheriConfig.sdkDir] + self.extra_args, cwd=self.cheriConfig.workspace)
-        self.check_required_files()
+        if destination is None:
+            destination = self.cheriConfig.sdkDir
+        start = time.time()
+        decompressor = _parallel_decompressor()
+        if decompressor is None:
+            runCmd(["tar", "Jxf", self.archive, "-C", destination] + self.extra_args, cwd=self.cheriConfig.workspace)
+            if not self.cheriConfig.pretend:
+                self.digest = self.compute_digest()
+        else:
+            tar_cmd = ["tar", "xf", "-", "-C", str(destination)] + [str(a) for a in self.extra_args]
+            printCommand(decompressor + ["<", self.archive, "|"] + tar_cmd, cwd=self.cheriConfig.workspace)
+            if not self.cheriConfig.pretend:
+                self.digest = self._extract_with_pipeline(decompressor, tar_cmd)
+        self.extract_time = time.time() - start
+
+    def _extract_with_pipeline(self, decompressor: "typing.List[str]", tar_cmd: "typing.List[str]") -> str:
+        # Feed the archive to the decompressor ourselves so that we can compute the digest while extracting
+        digest = hashlib.sha256()
+        cwd = str(self.cheriConfig.workspace)
+        with subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=cwd) as xz:
+            with subprocess.Popen(tar_cmd, stdin=xz.stdout, cwd=cwd) as tar:
+                xz.stdout.close()  # only tar should read from the pipe
+                try:
+                    with self.archive.open("rb") as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                            digest.update(chunk)
+                            xz.stdin.write(chunk)
+                except BrokenPipeError:
+                    pass  # decompressor or tar failed -> the exit code is checked below
+                finally:
+                    try:
+                        xz.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                for process in (tar, xz):
+                    if process.wait():
+                        raise subprocess.CalledProcessError(process.returncode, process.args)
+        return digest.hexdigest()
 
     def check_required_files(self, fatal=True) -> bool:
         for glob in self.required_globs:
@@ -153,14 +243,62 @@ def get_sdk_archives(cheriConfig, needs_cheribsd_sysroot: bool) -> "typing.List[
         return [clang_archive, sysroot_archive]
 
 
+def load_sdk_archive_records(cheriConfig) -> dict:
+    try:
+        with (cheriConfig.sdkDir / SDK_ARCHIVE_RECORDS).open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_sdk_archive_records(cheriConfig, archives: "typing.List[SdkArchive]"):
+    if cheriConfig.pretend:
+        return
+    records = load_sdk_archive_records(cheriConfig)
+    records.update((a.archive.name, a.record()) for a in archives if a.digest)
+    with (cheriConfig.sdkDir / SDK_ARCHIVE_RECORDS).open("w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2, sort_keys=True)
+
+
+def _extract_archives_in_parallel(cheriConfig, archives: "typing.List[SdkArchive]"):
+    # Extract every archive into a separate staging directory inside the SDK dir (so that we can rename the files
+    # instead of copying them) and merge them in order afterwards.
+    staging_dirs = [cheriConfig.sdkDir / (".extract-" + a.archive.name) for a in archives]
+    for staging_dir in staging_dirs:
+        cheriConfig.FS.cleanDirectory(staging_dir)
+    with ThreadPoolExecutor(max_workers=len(archives)) as executor:
+        # list() to re-raise the first exception
+        list(executor.map(lambda args: args[0].extract(args[1]), zip(archives, staging_dirs)))
+    for staging_dir in staging_dirs:
+        printCommand("mv", str(staging_dir) + "/*", cheriConfig.sdkDir, printVerboseOnly=True)
+        if not cheriConfig.pretend:
+            _merge_directory(str(staging_dir), str(cheriConfig.sdkDir))
+
+
 def extract_sdk_archives(cheriConfig, archives: "typing.List[SdkArchive]"):
     if cheriConfig.sdkBinDir.is_dir():
         statusUpdate(cheriConfig.sdkBinDir, "already exists, not extracting SDK archives")
         return
 
     cheriConfig.FS.makedirs(cheriConfig.sdkDir)
+    start = time.time()
+    if cheriConfig.parallel_sdk_extraction and len(archives) > 1:
+        _extract_archives_in_parallel(cheriConfig, archives)
+    else:
+        for archive in archives:
+            archive.extract()
+    elapsed = time.time() - start
     for archive in archives:
-        archive.extract()
+        archive.check_required_files()
+    save_sdk_archive_records(cheriConfig, archives)
+    if archives and not cheriConfig.pretend:
+        total_mb = sum(a.archive.stat().st_size for a in archives) / 1024 / 1024
+        for archive in archives:
+            size_mb = archive.archive.stat().st_size / 1024 / 1024
+            statusUpdate("Extracted {} ({:.1f} MiB) in {:.1f}s ({:.1f} MiB/s)".format(
+                archive.archive.name, size_mb, archive.extract_time, size_mb / max(archive.extract_time, 0.001)))
+        statusUpdate("Extracted {} SDK archives ({:.1f} MiB) in {:.1f}s ({:.1f} MiB/s)".format(
+            len(archives), total_mb, elapsed, total_mb / max(elapsed, 0.001)))
 
     if not cheriConfig.sdkBinDir.exists():
         fatalError("SDK bin dir does not exist after extracting sysroot archives!")
@@ -191,14 +329,27 @@ def create_sdk_from_archives(cheriConfig, needs_cheribsd_sysroot=True):
         statusUpdate("Required files missing -> recreating SDK")
         possiblyDeleteSdkJob = cheriConfig.FS.asyncCleanDirectory(cheriConfig.sdkDir)
     elif cheriConfig.sdkDir.exists() and all(a.archive.exists() for a in archives):
+        records = load_sdk_archive_records(cheriConfig)
         for a in archives:
-            if cheriConfig.sdkDir.stat().st_ctime < a.archive.stat().st_ctime:
+            if records:
+                # Compare the content instead of the ctime since the archives are copied to the workspace every time
+                changed = not a.matches_record(records.get(a.archive.name))
+                reason = "has changed since the existing SDK directory was created"
+            else:
+                changed = cheriConfig.sdkDir.stat().st_ctime < a.archive.stat().st_ctime
+                reason = "is newer than the existing SDK directory"
+            if changed:
                 msgkind = statusUpdate if not cheriConfig.keepSdkDir else warningMessage
-                msgkind("SDK archive", a.archive, "is newer than the existing SDK directory")
+                msgkind("SDK archive", a.archive, reason)
                 if not cheriConfig.keepSdkDir:
                     statusUpdate("Deleting old SDK and extracting archive")
                     possiblyDeleteSdkJob = cheriConfig.FS.asyncCleanDirectory(cheriConfig.sdkDir)
                 break
+        else:
+            if records:
+                statusUpdate("SDK archives are unchanged, reusing existing SDK directory")
+                # Update the recorded file identities so that we don't have to compute the digests next time
+                save_sdk_archive_records(cheriConfig, archives)
     # unpack the SDK if it has not been extracted yet:
     with possiblyDeleteSdkJob:
         extract_sdk_archives(cheriConfig, archives)
@@ -330,19 +481,8 @@ def _jenkins_main():
 def strip_binaries(cheriConfig: JenkinsConfig, directory: Path):
     statusUpdate("Tarball size before stripping ELF files:")
     runCmd("du", "-sh", directory)
-    for root, dirs, files in os.walk(str(directory)):
-        for file in files:
-            # Try to shrink the size by stripping all elf binaries
-            filepath = Path(root, file)
-            if filepath.is_symlink():
-                continue
-            try:
-                with filepath.open("rb") as f:
-                    if f.read(4) == b"\x7fELF":
-                        # self.verbose_print("Stripping ELF binary", filepath)
-                        runCmd(cheriConfig.sdkBinDir / "llvm-strip", filepath)
-            except Exception as e:
-                warningMessage("Failed to detect type of file:", filepath, e)
+    # Try to shrink the size by stripping all elf binaries
+    strip_elf_files_in(cheriConfig, directory)
     statusUpdate("Tarball size after stripping ELF files:")
     runCmd("du", "-sh", directory)
 
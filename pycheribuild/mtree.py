@@ -31,13 +31,33 @@
 from .utils import *
 from pathlib import Path
 from collections import OrderedDict
+import heapq
 import os
 import shlex
 import stat
 import sys
 
+# Dictionaries keep insertion order since python 3.6 and use a lot less memory than OrderedDict
+_AttributeDict = dict if sys.version_info >= (3, 6) else OrderedDict
+# Characters that require the (much slower) shlex tokenizer
+_QUOTING_CHARS = ("\"", "'", "\\")
+_IGNORED_KEYS = ("tags", "time")
+# Interning the most common values avoids storing hundreds of thousands of copies of "root", "wheel", etc.
+_INTERNED_VALUES = frozenset(("dir", "file", "link", "root", "wheel", "0755", "0644", "0555", "0444", "0600", "0700",
+                              "0750", "0775", "01777", "04555", "02555", "bin", "operator", "tty", "kmem", "games"))
+
+
+def _normalize_mtree_path(path: str) -> str:
+    # os.path.normpath() is expensive and almost all paths are already normalized -> only call it when needed
+    if path == "." or ("//" not in path and "/./" not in path and "/../" not in path and
+                       not path.endswith(("/", "/.", "/..")) and not path.startswith(("./.", "../"))):
+        return path
+    return path[:2] + os.path.normpath(path[2:])
+
 
 class MtreeEntry(object):
+    __slots__ = ("path", "attributes")
+
     def __init__(self, path: str, attributes: "typing.Dict[str, str]"):
         self.path = path
         self.attributes = attributes
@@ -50,26 +70,33 @@ class MtreeEntry(object):
 
     @classmethod
     def parse(cls, line: str, contents_root: Path=None) -> "MtreeEntry":
-        elements = shlex.split(line)
+        if any(c in line for c in _QUOTING_CHARS):
+            elements = shlex.split(line)
+        else:
+            elements = line.split()  # fast path for the common case
         path = elements[0]
         # Ensure that the path is normalized:
         if path != ".":
             # print("Before:", path)
             assert path[:2] == "./"
-            path = path[:2] + os.path.normpath(path[2:])
+            path = _normalize_mtree_path(path)
             # print("After:", path)
-        attrDict = OrderedDict()  # keep them in insertion order
-        for k,v in map(lambda s: s.split(sep="=", maxsplit=1), elements[1:]):
+        attrDict = _AttributeDict()  # keep them in insertion order
+        intern = sys.intern
+        for element in elements[1:]:
+            k, _, v = element.partition("=")
             # ignore some tags that makefs doesn't like
             # sometimes there will be time with nanoseconds in the manifest, makefs can't handle that
             # also the tags= key is not supported
-            if k in ("tags", "time"):
+            if k in _IGNORED_KEYS:
                 continue
             # convert relative contents=keys to absolute ones
             if contents_root and k == "contents":
                 if not os.path.isabs(v):
                     v = str(contents_root / v)
-            attrDict[k] = v
+            elif v in _INTERNED_VALUES:
+                v = intern(v)
+            attrDict[intern(k)] = v
         return MtreeEntry(path, attrDict)
         # FIXME: use contents=
 
@@ -77,7 +104,7 @@ class MtreeEntry(object):
     def parseAllDirsInMtree(cls, mtreeFile: Path) -> "typing.List[MtreeEntry]":
         with mtreeFile.open("r", encoding="utf-8") as f:
             result = []
-            for line in f.readlines():
+            for line in f:
                 if " type=dir" in line:
                     try:
                         result.append(MtreeEntry.parse(line))
@@ -94,17 +121,23 @@ class MtreeEntry(object):
 
 class MtreeFile(object):
     def __init__(self, file: "typing.Union[io.StringIO,Path,typing.IO]"=None, contents_root: Path=None):
-        self._mtree = OrderedDict()  # type: typing.Dict[str, MtreeEntry]
+        self._mtree = dict()  # type: typing.Dict[str, MtreeEntry]
+        # Keys that are known to be sorted and the ones added since the last write() -> merge instead of full sort
+        self._sorted_keys = []  # type: typing.List[str]
+        self._unsorted_keys = []  # type: typing.List[str]
         if file:
             self.load(file, contents_root)
 
     def load(self, file: "typing.Union[io.StringIO,Path,typing.IO]", contents_root: Path=None):
         if isinstance(file, Path):
-            with file.open("r") as f:
-                self.load(f)
+            with file.open("r", encoding="utf-8") as f:
+                self.load(f, contents_root)
                 return
         self._mtree.clear()
-        for line in file.readlines():
+        self._sorted_keys = []
+        self._unsorted_keys = []
+        # Iterate over the file instead of calling readlines() to avoid keeping a copy of the whole file in memory
+        for line in file:
             line = line.strip()
             if not line or line.startswith("#"):
                 continue
@@ -114,10 +147,39 @@ class MtreeFile(object):
                 assert key == "." or os.path.normpath(key[2:]) == key[2:]
                 if key in self._mtree:
                     warningMessage("Found duplicate definition for", entry.path)
+                else:
+                    self._unsorted_keys.append(key)
                 self._mtree[key] = entry
             except Exception as e:
                 warningMessage("Could not parse line", line, "in mtree file", file, ":", e)
 
+    def _add_entry(self, mtree_path: str, entry: MtreeEntry):
+        if mtree_path not in self._mtree:
+            self._unsorted_keys.append(mtree_path)
+        self._mtree[mtree_path] = entry
+
+    def sorted_paths(self) -> "typing.List[str]":
+        """
+        :return: All paths in sorted order. Only the paths added since the last call need to be sorted, the result
+        is then merged with the previously sorted paths.
+        """
+        if self._unsorted_keys:
+            self._unsorted_keys.sort()
+            if self._sorted_keys:
+                self._sorted_keys = list(heapq.merge(self._sorted_keys, self._unsorted_keys))
+            else:
+                self._sorted_keys = self._unsorted_keys
+            self._unsorted_keys = []
+        return self._sorted_keys
+
+    def get(self, mtree_path: str) -> "typing.Optional[MtreeEntry]":
+        """:return: the entry for mtree_path (in the normalized ./foo/bar form used by sorted_paths()) or None"""
+        return self._mtree.get(mtree_path)
+
+    def entries(self) -> "typing.Iterable[typing.Tuple[str, MtreeEntry]]":
+        """:return: all (path, entry) pairs in insertion order (use sorted_paths() for a sorted list)"""
+        return self._mtree.items()
+
     @staticmethod
     def _ensure_mtree_mode_fmt(mode: "typing.Union[str, int]") -> str:
         if not isinstance(mode, str):
@@ -133,7 +195,7 @@ class MtreeFile(object):
         mtree_path = path
         if mtree_path != ".":
             # ensure we normalize paths to avoid conflicting duplicates:
-            mtree_path = "./" + os.path.normpath(path)
+            mtree_path = _normalize_mtree_path("./" + path)
         return mtree_path
 
     @staticmethod
@@ -175,10 +237,11 @@ class MtreeFile(object):
             contents_path = str(file.absolute())
             assert shlex.quote(contents_path) == contents_path, "Invalid special chars: " + contents_path
             last_attrib = ("contents", contents_path)
-        attribs = OrderedDict([("type", mtree_type), ("uname", uname), ("gname", gname), ("mode", mode), last_attrib])
+        attribs = _AttributeDict([("type", mtree_type), ("uname", uname), ("gname", gname), ("mode", mode),
+                                  last_attrib])
         if print_status:
             statusUpdate("Adding file", file, "to mtree as", mtree_path, file=sys.stderr)
-        self._mtree[mtree_path] = MtreeEntry(mtree_path, attribs)
+        self._add_entry(mtree_path, MtreeEntry(mtree_path, attribs))
 
     def add_dir(self, path, mode=None, uname="root", gname="wheel", print_status=True, reference_dir=None):
         assert not path.startswith("/"), path
@@ -208,10 +271,10 @@ class MtreeFile(object):
             else:
                 self.add_dir(parent, mode, uname, gname, print_status=print_status, reference_dir=None)
         # now add the actual entry
-        attribs = OrderedDict([("type", "dir"), ("uname", uname), ("gname", gname), ("mode", mode)])
+        attribs = _AttributeDict([("type", "dir"), ("uname", uname), ("gname", gname), ("mode", mode)])
         if print_status:
             statusUpdate("Adding dir", path, "to mtree", file=sys.stderr)
-        self._mtree[mtree_path] = MtreeEntry(mtree_path, attribs)
+        self._add_entry(mtree_path, MtreeEntry(mtree_path, attribs))
 
     def __contains__(self, item):
         mtree_path = self._ensure_mtree_path_fmt(str(item))
@@ -227,8 +290,16 @@ class MtreeFile(object):
                 self.write(f)
                 return
         output.write("#mtree 2.0\n")
-        for path in sorted(self._mtree.keys()):
-            output.write(str(self._mtree[path]))
-            output.write("\n")
+        # Write the entries in blocks instead of calling write() twice for every line
+        block = []
+        for path in self.sorted_paths():
+            block.append(str(self._mtree[path]))
+            if len(block) >= 4096:
+                block.append("")
+                output.write("\n".join(block))
+                block = []
+        if block:
+            block.append("")
+            output.write("\n".join(block))
         output.write("# END\n")
 
@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import gzip
+import io
+import os
+import selectors
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .utils import *
+
+LOGFILE_COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_logfile(path: Path, compression: str = "none", *, buffer_size: int = 1024 * 1024) -> "typing.BinaryIO":
+    """
+    Opens path for appending with a large write buffer. Appending to a compressed logfile adds a new gzip member or
+    zstd frame which the standard decompression tools handle transparently.
+    """
+    if compression == "none":
+        return path.open("ab", buffering=buffer_size)
+    raw = path.open("ab")
+    if compression == "gzip":
+        # Use a fast compression level, the logfiles are large and mostly read when something went wrong
+        compressed = gzip.GzipFile(filename=path.name, mode="ab", compresslevel=3, fileobj=raw)
+    elif compression == "zstd":
+        try:
+            # noinspection PyUnresolvedReferences
+            import zstandard
+        except ImportError:
+            raw.close()
+            fatalError("Cannot write zstd compressed logfiles since the zstandard module is missing.",
+                       fixitHint="Run `pip3 install --user zstandard` or use --logfile-compression=gzip")
+            return path.open("ab", buffering=buffer_size)
+        compressed = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+    else:
+        raise ValueError("Invalid logfile compression " + compression)
+    writer = io.BufferedWriter(compressed, buffer_size=buffer_size)
+    return writer
+
+
+class ProcessOutputPipeline(object):
+    """
+    Forwards the stdout and stderr of a process to the terminal and a logfile from a single thread. Instead of
+    handling the output line by line it reads large chunks from both pipes once the selector reports that they are
+    readable. The logfile receives complete lines (so that stdout and stderr lines are never interleaved), the
+    stdout filter is only applied to the lines that are shown on the terminal and the terminal is flushed at most
+    every flush_interval seconds (and before anything is written to stderr).
+    """
+    def __init__(self, proc: subprocess.Popen, logfile: "typing.Optional[typing.BinaryIO]", *,
+                 stdout_filter: "typing.Callable[[bytes], None]" = None,
+                 before_stderr: "typing.Callable[[], None]" = None, flush_interval: float = 0.1,
+                 chunk_size: int = 256 * 1024, echo: bool = True, terminal_stdout: "typing.BinaryIO" = None,
+                 terminal_stderr: "typing.BinaryIO" = None):
+        self.proc = proc
+        self.logfile = logfile
+        self.stdout_filter = stdout_filter
+        self.before_stderr = before_stderr
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.echo = echo  # if false the output is only written to the logfile
+        self.terminal_stdout = terminal_stdout if terminal_stdout is not None else sys.stdout.buffer
+        self.terminal_stderr = terminal_stderr if terminal_stderr is not None else sys.stderr.buffer
+        self.bytes_read = 0
+        self._partial_lines = {}  # type: typing.Dict[int, bytes]
+        self._stdout_dirty = False
+        self._last_flush = time.time()
+
+    def _flush_stdout(self):
+        if self._stdout_dirty:
+            flushStdio(self.terminal_stdout)
+            self._stdout_dirty = False
+        self._last_flush = time.time()
+
+    def _handle_lines(self, lines: bytes, is_stderr: bool):
+        if self.logfile:
+            self.logfile.write(lines)
+        if not self.echo:
+            return
+        if is_stderr:
+            self._flush_stdout()
+            if self.before_stderr:
+                self.before_stderr()
+            self.terminal_stderr.write(lines)
+            flushStdio(self.terminal_stderr)
+        elif self.stdout_filter:
+            for line in lines.splitlines(keepends=True):
+                self.stdout_filter(line)
+            self._stdout_dirty = True
+        else:
+            self.terminal_stdout.write(lines)
+            self._stdout_dirty = True
+
+    def _handle_chunk(self, fd: int, chunk: bytes, is_stderr: bool):
+        data = self._partial_lines.pop(fd, b"") + chunk
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            self._partial_lines[fd] = data[end:]
+        if end:
+            self._handle_lines(data[:end], is_stderr)
+
+    def run(self) -> int:
+        """
+        :return: the exit code of the process
+        """
+        with selectors.DefaultSelector() as selector:
+            for stream, is_stderr in ((self.proc.stdout, False), (self.proc.stderr, True)):
+                if stream is not None:
+                    selector.register(stream.fileno(), selectors.EVENT_READ, is_stderr)
+            while selector.get_map():
+                for key, _ in selector.select(timeout=self.flush_interval):
+                    chunk = os.read(key.fd, self.chunk_size)
+                    if chunk:
+                        self.bytes_read += len(chunk)
+                        self._handle_chunk(key.fd, chunk, key.data)
+                        continue
+                    # EOF -> handle a final line without a trailing newline
+                    selector.unregister(key.fd)
+                    remaining = self._partial_lines.pop(key.fd, b"")
+                    if remaining:
+                        self._handle_lines(remaining, key.data)
+                if time.time() - self._last_flush >= self.flush_interval:
+                    self._flush_stdout()
+        self._flush_stdout()
+        return self.proc.wait()
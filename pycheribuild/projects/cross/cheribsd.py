@@ -28,22 +28,108 @@
 # SUCH DAMAGE.
 #
 import inspect
+import json
 import os
 import shlex
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 
+from collections import OrderedDict
 from pathlib import Path
 from .multiarchmixin import MultiArchBaseMixin
 from ..project import *
 from ..llvm import BuildUpstreamLLVM
 from ...config.loader import ComputedDefaultValue
 from ...config.chericonfig import CrossCompileTarget, MipsFloatAbi
+from ...fingerprints import file_identity, git_head_revision, hash_components
+from ...sysroot_clone import POPULATE_MODES, populate_sysroot
 from ...utils import *
 
 
+class BuildenvQueryCache(object):
+    """
+    Caches the make variables queried with `make buildenv` (e.g. .OBJDIR) in the build directory since every query
+    has to evaluate the top-level Makefile which takes a few seconds. Entries are keyed by a hash of the full make
+    command line and environment, the crosscompile target, the bmake binary and the source revision (including the
+    Makefiles that define the object directory layout) so changing any of the make options results in a new query.
+    """
+    FILENAME = ".cheribuild-buildenv-cache.json"
+    VERSION = 1
+    MAX_ENTRIES = 32  # keep the values for the most recently used sets of make options
+    INPUT_FILES = ("Makefile", "Makefile.inc1", "share/mk/bsd.obj.mk", "share/mk/src.sys.obj.mk")
+
+    def __init__(self, path: "typing.Optional[Path]", readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._entries = None  # type: typing.Optional[typing.Dict[str, typing.Dict[str, str]]]
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def entries(self) -> "typing.Dict[str, typing.Dict[str, str]]":
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self) -> "typing.Dict[str, typing.Dict[str, str]]":
+        if self.path is None or not self.path.is_file():
+            return OrderedDict()
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError) as e:
+            warningMessage("Could not load cached buildenv variables from", self.path, "->", e)
+            return OrderedDict()
+        if data.get("version") != self.VERSION:
+            return OrderedDict()
+        return data.get("entries", OrderedDict())
+
+    def _save(self):
+        if self.path is None or self.readonly or not self.path.parent.is_dir():
+            return
+        tmpfile = self.path.with_name(self.path.name + ".tmp." + str(os.getpid()))
+        try:
+            with tmpfile.open("w", encoding="utf-8") as f:
+                json.dump(dict(version=self.VERSION, entries=self.entries), f, indent=1)
+            os.replace(str(tmpfile), str(self.path))
+        except OSError as e:
+            warningMessage("Could not save cached buildenv variables to", self.path, "->", e)
+
+    @staticmethod
+    def compute_key(command: "typing.List[str]", env: dict, crosscompile_target: str, source_dir: Path) -> str:
+        return hash_components(dict(command=command, env=env, target=crosscompile_target,
+                                    bmake=file_identity(Path(command[0])), revision=git_head_revision(source_dir),
+                                    inputs={f: file_identity(source_dir / f) for f in BuildenvQueryCache.INPUT_FILES}))
+
+    def lookup(self, key: str, variables: "typing.Iterable[str]") -> "typing.Optional[typing.Dict[str, str]]":
+        """
+        :return: the cached values for all variables or None if any of them has not been queried with these options
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and all(var in entry for var in variables):
+                self.hits += 1
+                return {var: entry[var] for var in variables}
+            self.misses += 1
+            return None
+
+    def store(self, key: str, values: "typing.Dict[str, str]"):
+        with self._lock:
+            entry = self.entries.pop(key, dict())
+            entry.update(values)
+            self.entries[key] = entry  # move to the end (most recently used)
+            while len(self.entries) > self.MAX_ENTRIES:
+                del self.entries[next(iter(self.entries))]
+            self._save()
+
+    def statistics(self) -> str:
+        return "buildenv queries: {} from cache, {} executed".format(self.hits, self.misses)
+
+
 # noinspection PyUnusedLocal
 def defaultKernelConfig(config: CheriConfig, project: "BuildFreeBSD"):
     assert isinstance(project, BuildFreeBSD)
@@ -223,6 +309,7 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
     repository = GitRepository("https://github.com/freebsd/freebsd.git")
     crossbuild = False
     baremetal = True  # We are building the full OS so we don't need a sysroot
+    _buildenv_query_cache = None  # type: BuildenvQueryCache
     # Only CheriBSD can target CHERI, upstream FreeBSD won't work
     supported_architectures = [CrossCompileTarget.NATIVE, CrossCompileTarget.MIPS]
     default_architecture = CrossCompileTarget.NATIVE
@@ -231,6 +318,7 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
                                              asString="$INSTALL_ROOT/freebsd-{mips/x86}")
     hide_options_from_help = True  # hide this for now (only show cheribsd)
     add_custom_make_options = True
+    supported_compiler_caches = ("ccache",)
 
     @classmethod
     def rootfsDir(cls, caller, config=None, cross_target: CrossCompileTarget = None):
@@ -306,7 +394,7 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
             if self._lastStdoutLineCanBeOverwritten:
                 sys.stdout.buffer.write(Project._clearLineSequence)
             sys.stdout.buffer.write(line)
-            flushStdio(sys.stdout)
+            self._flushStdout()
             self._lastStdoutLineCanBeOverwritten = False
         elif line.startswith(b"===> "):  # new subdirectory
             self._lineNotImportantStdoutFilter(line)
@@ -378,6 +466,14 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
         if self.subdirOverride:
             self.make_args.set(SUBDIR_OVERRIDE=self.subdirOverride)
 
+        if self.compiler_cache is not None:
+            # bsd.compiler.mk prefixes CC/CXX/CPP with ${CCACHE_BIN} (default is the ccache port path)
+            self.make_args.set_with_options(CCACHE_BUILD=True)
+            self.make_args.set(CCACHE_BIN=self.compiler_cache.executable)
+        elif self.config.compiler_cache != "none":
+            self.warning("The FreeBSD build system only supports ccache, not using", self.config.compiler_cache,
+                         "for", self.target)
+
         self.destdir = self.installDir
         self._installPrefix = Path("/")
         self.kernelToolchainAlreadyBuilt = False
@@ -632,38 +728,62 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
             raise FileNotFoundError(make_cmd)
         return make_cmd
 
-    def _query_buildenv_path(self, args, var):
+    @property
+    def buildenv_query_cache(self) -> BuildenvQueryCache:
+        if self._buildenv_query_cache is None:
+            self._buildenv_query_cache = BuildenvQueryCache(self.buildDir / BuildenvQueryCache.FILENAME,
+                                                            readonly=self.config.pretend)
+        return self._buildenv_query_cache
+
+    def _query_buildenv_paths(self, args: MakeOptions,
+                              variables: "typing.Sequence[str]") -> "typing.Optional[typing.Dict[str, Path]]":
+        """
+        Query the values of multiple make variables (that must be absolute paths) with a single buildenv invocation
+        :return: a dict mapping the variable names to their values or None on error
+        """
         try:
             try:
                 bmake_binary = self.find_real_bmake_binary()
             except FileNotFoundError:
                 self.verbose_print("Cannot query buildenv path if bmake hasn't been bootstrapped")
                 return None
-            buildenv_cmd = str(bmake_binary) + " -V " + var
-            bw_flags = args.all_commandline_args + ["BUILD_WITH_STRICT_TMPPATH=0", "buildenv",
-                                                    "BUILDENV_SHELL=" + buildenv_cmd]
+            buildenv_cmd = " ".join([str(bmake_binary)] + ["-V " + var for var in variables])
+            bw_flags = args.all_commandline_args + ["BUILD_WITH_STRICT_TMPPATH=0", "buildenv"]
             if self.crossbuild:
                 bw_flags.append("PATH=" + os.getenv("PATH"))
             if not self.sourceDir.exists():
                 assert self.config.pretend, "This should only happen when running in a test environment"
                 return None
+            cache = self.buildenv_query_cache
+            key = cache.compute_key([str(bmake_binary)] + bw_flags, args.env_vars,
+                                    str(self.get_crosscompile_target(self.config)), self.sourceDir)
+            cached = cache.lookup(key, variables)
+            if cached is not None:
+                self.verbose_print("BUILDENV vars", " ".join(variables), "found in cache:", cache.statistics())
+                return {var: Path(value) for var, value in cached.items()}
             # https://github.com/freebsd/freebsd/commit/1edb3ba87657e28b017dffbdc3d0b3a32999d933
-            cmd = runCmd([bmake_binary] + bw_flags, env=args.env_vars, cwd=self.sourceDir,
-                         runInPretendMode=True, captureOutput=True, printVerboseOnly=True)
+            with trace_span("buildenv query", "phase", target=self.target, variables=list(variables)):
+                cmd = runCmd([bmake_binary] + bw_flags + ["BUILDENV_SHELL=" + buildenv_cmd], env=args.env_vars,
+                             cwd=self.sourceDir, runInPretendMode=True, captureOutput=True, printVerboseOnly=True)
             lines = cmd.stdout.strip().split(b"\n")
-            last_line = lines[-1].decode("utf-8").strip()
-            if last_line.startswith("/") and cmd.returncode == 0:
-                self.verbose_print("BUILDENV var", var, "was", last_line)
-                return Path(last_line)
-            warningMessage("Failed to query", var, "-- output was:", lines)
+            values = [line.decode("utf-8").strip() for line in lines[-len(variables):]]
+            if len(values) == len(variables) and all(v.startswith("/") for v in values) and cmd.returncode == 0:
+                result = OrderedDict(zip(variables, values))
+                self.verbose_print("BUILDENV vars were", result, "--", cache.statistics())
+                cache.store(key, result)
+                return {var: Path(value) for var, value in result.items()}
+            warningMessage("Failed to query", " ".join(variables), "-- output was:", lines)
             return None
         except subprocess.CalledProcessError as e:
-            warningMessage("Could not query make variable", var, "for buildworld root objdir: ", e)
+            warningMessage("Could not query make variables", " ".join(variables), "for buildworld root objdir: ", e)
             return None
 
+    def _query_buildenv_path(self, args: MakeOptions, var: str) -> "typing.Optional[Path]":
+        result = self._query_buildenv_paths(args, [var])
+        return result[var] if result else None
+
     @property
     def objdir(self):
-        # TODO use https://github.com/pydanny/cached-property ?
         objdir = self._query_buildenv_path(self.buildworldArgs, ".OBJDIR")
         if not objdir or objdir == Path():
             # just clean the whole directory instead
@@ -1420,6 +1540,18 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
         cls.use_cheribsd_purecap_rootfs = cls.addBoolOption("use-cheribsd-purecap-rootfs", default=False,
                                                             help="Use the rootfs built by cheribsd-purecap instead")
         cls.install_dir_override = cls.addPathOption("install-directory", help="Override for the sysroot install directory")
+        cls.populate_mode = cls.addConfigOption("populate-mode", default="tar", choices=POPULATE_MODES,
+                                                help="How to copy the files from the rootfs to the sysroot. 'tar' "
+                                                     "extracts a bsdtar archive of the METALOG files into an empty "
+                                                     "sysroot. 'reflink' (copy-on-write clones on btrfs/xfs) and "
+                                                     "'hardlink' only update the paths that changed since the last "
+                                                     "run and fall back to copying if the file system does not "
+                                                     "support it. 'copy' also updates incrementally. NOTE: since hard "
+                                                     "links share the inode with the rootfs, 'hardlink' only links "
+                                                     "read-only files and copies (or reflinks) writable ones.")
+        cls.create_archive = cls.addBoolOption("create-archive", default=True,
+                                               help="Create a tar.gz archive of the sysroot that can be copied to "
+                                                    "other machines using --remote-sdk-path")
 
     @property
     def crossSysrootPath(self) -> Path:
@@ -1456,20 +1588,25 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
     def sysroot_archive(self):
         return self.crossSysrootPath.parent / self.sysrootArchiveName
 
+    @property
+    def sysroot_state_file(self) -> Path:
+        return self.crossSysrootPath.with_name(self.crossSysrootPath.name + ".populate-state.json")
+
+    @property
+    def _sysroot_include_prefixes(self) -> "typing.List[str]":
+        result = ["./lib/", "./usr/include/", "./usr/lib/", "./usr/libdata/"]
+        if self.compiling_for_cheri():
+            result.append("./usr/libcheri")
+        return result
+
+    def _can_update_sysroot_incrementally(self) -> bool:
+        if self.populate_mode == "tar" or self.config.clean:
+            return False
+        return self.crossSysrootPath.is_dir() and self.sysroot_state_file.is_file()
+
     def createSysroot(self):
         # we need to add include files and libraries to the sysroot directory
         self.makedirs(self.crossSysrootPath / "usr")
-        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
-        # Since we are using the metalog argument we need to use BSD tar and not GNU tar!
-        bsdtar_path = shutil.which(str(self.bsdtar_cmd))
-        if not bsdtar_path:
-            bsdtar_path = str(self.bsdtar_cmd)
-        archiveCmd = [bsdtar_path, "cf", "-", "--include=./lib/", "--include=./usr/include/",
-                      "--include=./usr/lib/", "--include=./usr/libdata/"]
-        if self.compiling_for_cheri():
-            archiveCmd.append("--include=./usr/libcheri")
-        # only pack those files that are mentioned in METALOG
-        archiveCmd.append("@METALOG")
         if self.compiling_for_mips() and self.use_cheri_sysroot_for_mips:
             rootfs_target = self.rootfs_source_class.get_instance_for_cross_target(CrossCompileTarget.CHERI, self.config)
         else:
@@ -1483,21 +1620,49 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
             else:
                 fixit = "Run `cheribuild.py " + rootfs_target.target + "` first"
             self.fatal("Sysroot source directory", rootfs_dir, "does not contain libc.so.7", fixitHint=fixit)
+        if self.populate_mode == "tar":
+            changed = self._extract_sysroot_archive(rootfs_dir)
+        else:
+            changed = self._clone_sysroot_files(rootfs_dir)
+        if not (self.crossSysrootPath / "lib/libc.so.7").is_file():
+            self.fatal(self.crossSysrootPath, "is missing the libc library, install seems to have failed!")
+        if self.create_archive and (changed or not self.sysroot_archive.is_file()):
+            # create an archive to make it easier to copy the sysroot to another machine
+            self.deleteFile(self.sysroot_archive, printVerboseOnly=True)
+            runCmd("tar", "-czf", self.sysroot_archive, self.crossSysrootPath.name, cwd=self.crossSysrootPath.parent)
+        print("Successfully populated sysroot")
+
+    def _extract_sysroot_archive(self, rootfs_dir: Path) -> bool:
+        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
+        # Since we are using the metalog argument we need to use BSD tar and not GNU tar!
+        bsdtar_path = shutil.which(str(self.bsdtar_cmd))
+        if not bsdtar_path:
+            bsdtar_path = str(self.bsdtar_cmd)
+        archiveCmd = [bsdtar_path, "cf", "-"] + ["--include=" + prefix for prefix in self._sysroot_include_prefixes]
+        # only pack those files that are mentioned in METALOG
+        archiveCmd.append("@METALOG")
         printCommand(archiveCmd, cwd=rootfs_dir)
         if not self.config.pretend:
             tar_cwd = str(rootfs_dir)
             with subprocess.Popen(archiveCmd, stdout=subprocess.PIPE, cwd=tar_cwd) as tar:
                 runCmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=self.crossSysrootPath)
-        if not (self.crossSysrootPath / "lib/libc.so.7").is_file():
-            self.fatal(self.crossSysrootPath, "is missing the libc library, install seems to have failed!")
-
+        # The state file is only valid for the clone modes
+        self.deleteFile(self.sysroot_state_file, printVerboseOnly=True)
         # fix symbolic links in the sysroot:
         print("Fixing absolute paths in symbolic links inside lib directory...")
         self.fixSymlinks()
-        # create an archive to make it easier to copy the sysroot to another machine
-        self.deleteFile(self.sysroot_archive, printVerboseOnly=True)
-        runCmd("tar", "-czf", self.sysroot_archive, self.crossSysrootPath.name, cwd=self.crossSysrootPath.parent)
-        print("Successfully populated sysroot")
+        return True
+
+    def _clone_sysroot_files(self, rootfs_dir: Path) -> bool:
+        # Absolute symlink targets are rewritten while populating so the fixlinks pass is not needed
+        statusUpdate("Populating", self.crossSysrootPath, "from", rootfs_dir / "METALOG", "using", self.populate_mode)
+        if self.config.pretend:
+            return True
+        with trace_span("populate sysroot", "phase", mode=self.populate_mode):
+            stats = populate_sysroot(rootfs_dir, rootfs_dir / "METALOG", self.crossSysrootPath,
+                                     self.sysroot_state_file, self._sysroot_include_prefixes, self.populate_mode)
+        statusUpdate("Sysroot population:", stats)
+        return stats.changed > 0
 
     def process(self):
         if self.config.skipBuildworld:
@@ -1512,8 +1677,15 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
                     unprefixed_sysroot.rmdir()
                 self.createSymlink(self.crossSysrootPath, unprefixed_sysroot)
 
-        with self.asyncCleanDirectory(self.crossSysrootPath):
-            building_on_host = IS_FREEBSD or self.rootfs_source_class.get_instance(self).crossbuild
+        building_on_host = IS_FREEBSD or self.rootfs_source_class.get_instance(self).crossbuild
+        if building_on_host and not self.copy_remote_sysroot and self._can_update_sysroot_incrementally():
+            statusUpdate("Updating", self.crossSysrootPath, "incrementally (state recorded in",
+                         self.sysroot_state_file.name + ")")
+            cleaner = ThreadJoiner(None)
+        else:
+            self.deleteFile(self.sysroot_state_file, printVerboseOnly=True)
+            cleaner = self.asyncCleanDirectory(self.crossSysrootPath)
+        with cleaner:
             if self.copy_remote_sysroot or not building_on_host:
                 self.copySysrootFromRemoteMachine()
             else:
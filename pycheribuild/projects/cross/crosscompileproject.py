@@ -41,6 +41,7 @@ from pathlib import Path
 
 from ...config.loader import ComputedDefaultValue, ConfigOptionBase
 from ...config.chericonfig import CrossCompileTarget, MipsFloatAbi, Linkage, BuildType
+from ...elfstrip import strip_elf_files_in
 from .multiarchmixin import MultiArchBaseMixin
 from ..llvm import BuildCheriLLVM
 from ..project import *
@@ -555,19 +556,14 @@ class CrossCompileMixin(MultiArchBaseMixin):
         :param benchmark_dir: The directory containing multiple ELF binaries
         """
         assert isinstance(self, Project) and isinstance(self, CrossCompileMixin)
-        self.info("Stripping all ELF files in", benchmark_dir)
         self.run_cmd("du", "-sh", benchmark_dir)
         for root, dirnames, filenames in os.walk(str(benchmark_dir)):
             for filename in filenames:
-                file = Path(root, filename)
-                if file.suffix == ".dump":
+                if filename.endswith(".dump"):
                     # TODO: make this an error since we should have deleted them
-                    self.warning("Will copy a .dump file to the FPGA:", file)
-                # Try to reduce the amount of copied data
-                with file.open("rb") as f:
-                    if f.read(4) == b"\x7fELF":
-                        self.verbose_print("Stripping ELF binary", file)
-                        runCmd(self.config.sdkBinDir / "llvm-strip", file)
+                    self.warning("Will copy a .dump file to the FPGA:", Path(root, filename))
+        # Try to reduce the amount of copied data
+        strip_elf_files_in(self.config, benchmark_dir)
         self.run_cmd("du", "-sh", benchmark_dir)
 
     def run_fpga_benchmark(self, benchmarks_dir: Path, *, output_file: str = None, benchmark_script: str = None,
@@ -857,7 +853,7 @@ class CrossCompileAutotoolsProject(CrossCompileMixin, AutotoolsProject):
             self.add_configure_env_arg(k, v)
 
     def set_prog_with_args(self, prog: str, path: Path, args: list):
-        fullpath = str(path)
+        fullpath = self.compiler_launcher_command(path) if prog in ("CC", "CXX") else str(path)
         if args:
             fullpath += " " + commandline_to_str(args)
         self.configureEnvironment[prog] = fullpath
@@ -44,6 +44,7 @@ class BuildQtWithConfigureScript(CrossCompileProject):
     make_kind = MakeCommandKind.GnuMake
     needs_mxcaptable_static = True  # Currently over the limit, maybe we need -ffunction-sections/-fdata-sections
     hide_options_from_help = True  # hide this for now
+    supported_compiler_caches = ("ccache",)
 
     default_build_type = BuildType.MINSIZERELWITHDEBINFO # Default to -Os with debug info:
 
@@ -69,6 +70,11 @@ class BuildQtWithConfigureScript(CrossCompileProject):
     def configure(self, **kwargs):
         if self.force_static_linkage:
             self.configureArgs.append("-static")
+        if self.compiler_cache is not None:
+            self.configureArgs.append("-ccache")  # Qt's ccache feature uses the ccache binary in $PATH
+        elif self.config.compiler_cache != "none":
+            self.warning("The Qt configure script only supports ccache, not using", self.config.compiler_cache,
+                         "for", self.target)
 
         if self.compiling_for_host():
             self.configureArgs.extend(["-prefix", str(self.installDir)])
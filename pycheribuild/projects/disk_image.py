@@ -28,6 +28,8 @@
 # SUCH DAMAGE.
 #
 import datetime
+import hashlib
+import json
 import shlex
 import stat
 import io
@@ -42,6 +44,7 @@ from ..config.chericonfig import MipsFloatAbi
 from .project import *
 from ..utils import *
 from ..mtree import MtreeFile
+from ..fingerprints import hash_components
 
 # Notes:
 # Mount the filesystem of a BSD VM: guestmount -a /foo/bar.qcow2 -m /dev/sda1:/:ufstype=ufs2:ufs --ro /mnt/foo
@@ -57,6 +60,68 @@ OLD_LIBRARIES_BASE_URL = "https://people.freebsd.org/~arichardson/cheri-files/{f
 PKG_REPO_NEEDS_UPDATE = datetime.datetime(day=28, month=7, year=2019)
 
 
+class DiskImageManifest(object):
+    """
+    The state of all entries that were written to a disk image (mtree attributes plus the identity of the file
+    that provides the contents). It is stored next to the image so that incremental builds can skip makefs if
+    nothing changed since the last build and report which paths changed otherwise.
+    """
+    VERSION = 1
+
+    def __init__(self, entries: "typing.Dict[str, str]"=None, options: "typing.Dict[str, str]"=None):
+        self.entries = entries if entries is not None else dict()  # type: typing.Dict[str, str]
+        self.options = options if options is not None else dict()  # type: typing.Dict[str, str]
+
+    @property
+    def digest(self) -> str:
+        return hash_components(dict(version=self.VERSION, options=self.options, entries=self.entries))
+
+    @classmethod
+    def load(cls, path: Path) -> "typing.Optional[DiskImageManifest]":
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != cls.VERSION:
+            return None
+        result = cls(data.get("entries", dict()), data.get("options", dict()))
+        if result.digest != data.get("digest"):
+            warningMessage("Ignoring corrupted disk image manifest", path)
+            return None
+        return result
+
+    def save(self, path: Path):
+        tmpfile = path.with_name(path.name + ".tmp")
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(dict(version=self.VERSION, digest=self.digest, options=self.options, entries=self.entries), f,
+                      sort_keys=True)
+        os.replace(str(tmpfile), str(path))
+
+    def diff(self, previous: "DiskImageManifest") -> "typing.List[str]":
+        """
+        :return: a human readable list of the changes since previous (empty if the image does not need rebuilding)
+        """
+        result = []
+        for key in sorted(set(self.options.keys()) | set(previous.options.keys())):
+            old = previous.options.get(key)
+            new = self.options.get(key)
+            if old != new:
+                result.append("option {} changed: {!r} -> {!r}".format(key, old, new))
+        for path in sorted(set(self.entries.keys()) | set(previous.entries.keys())):
+            old = previous.entries.get(path)
+            new = self.entries.get(path)
+            if old == new:
+                continue
+            if old is None:
+                result.append("added: " + path)
+            elif new is None:
+                result.append("removed: " + path)
+            else:
+                result.append("modified: " + path)
+        return result
+
+
 # noinspection PyMethodMayBeStatic
 class _AdditionalFileTemplates(object):
     def get_fstab_template(self):
@@ -99,6 +164,12 @@ class _BuildDiskImageBase(SimpleProject):
                                 help="Use a directory in /tmp for recursive wget operations;"
                                       "of interest in rare cases, like extra-files on smbfs.")
         cls.include_gdb = cls.addBoolOption("include-gdb", default=True, help="Include GDB in the disk image (if it exists)")
+        cls.incremental = cls.addBoolOption("incremental",
+                                            help="Record a digest of the image contents next to the disk image and "
+                                                 "only run makefs if the contents changed since the last build")
+        cls.incremental_dry_run = cls.addBoolOption("incremental-dry-run",
+                                                    help="List the paths that changed since the disk image was last "
+                                                         "built but do not rebuild it")
         cls.disableTMPFS = None
 
     def __init__(self, config, source_class: "typing.Type[BuildFreeBSD]"):
@@ -128,6 +199,8 @@ class _BuildDiskImageBase(SimpleProject):
         # used during process to generated files
         self.tmpdir = None  # type: Path
         self.file_templates = _AdditionalFileTemplates()
+        # paths in the image whose contents are regenerated on every build (ignored for incremental builds)
+        self.volatile_image_files = set()  # type: typing.Set[str]
         if self.needs_special_pkg_repo:
             self._addRequiredSystemTool("wget")  # Needed to recursively fetch the pkg repo
 
@@ -369,6 +442,7 @@ class _BuildDiskImageBase(SimpleProject):
                     random_data = os.urandom(4096)
                     f.write(random_data)
             self.addFileToImage(entropy_file, baseDirectory=self.tmpdir)
+            self.volatile_image_files.add("./" + i)
 
     def add_all_files_in_dir(self, root_dir: Path):
         for root, dirnames, filenames in os.walk(str(root_dir)):
@@ -497,6 +571,70 @@ class _BuildDiskImageBase(SimpleProject):
             if self.config.verbose:
                 runCmd(qemuImgCommand, "info", self.diskImagePath)
 
+    @property
+    def image_manifest_path(self) -> Path:
+        return self.diskImagePath.with_name(self.diskImagePath.name + ".manifest.json")
+
+    def _file_state(self, path: Path) -> str:
+        if self.tmpdir in path.parents:
+            # Generated files are written to a new temporary directory every time -> use the file contents
+            try:
+                with path.open("rb") as f:
+                    return "sha256:" + hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                return "missing"
+        try:
+            st = os.stat(str(path))
+        except OSError:
+            return "missing"
+        return "{}:{}:{}:{}".format(path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def create_image_manifest(self) -> DiskImageManifest:
+        entries = dict()
+        for mtree_path, entry in self.mtree.entries():
+            attributes = " ".join(k + "=" + v for k, v in sorted(entry.attributes.items()) if k != "contents")
+            if entry.attributes.get("type") != "file":
+                entries[mtree_path] = attributes
+                continue
+            if mtree_path in self.volatile_image_files:
+                entries[mtree_path] = attributes + " <volatile>"
+                continue
+            # Files without contents= (or with a relative path) are resolved relative to the rootfs by makefs
+            contents = entry.attributes.get("contents", mtree_path)
+            entries[mtree_path] = attributes + " " + self._file_state(self.rootfsDir / contents)
+        makefs_state = self._file_state(Path(self.makefs_cmd)) if self.makefs_cmd else "missing"
+        # The image can be modified after it has been created (e.g. by booting it) -> record its identity as well
+        options = dict(image=self._file_state(self.diskImagePath), makefs=makefs_state, minimal=str(self.is_minimal),
+                       x86=str(self.is_x86), big_endian=str(self.bigEndian), qcow2=str(self.useQCOW2),
+                       minimum_size=str(self.minimumImageSize),
+                       passwd=self._file_state(self.userGroupDbDir / "master.passwd"),
+                       group=self._file_state(self.userGroupDbDir / "group"))
+        return DiskImageManifest(entries, options)
+
+    def _image_needs_rebuild(self, manifest: DiskImageManifest) -> bool:
+        previous = None
+        if self.diskImagePath.is_file():
+            previous = DiskImageManifest.load(self.image_manifest_path)
+        if previous is None:
+            changes = ["no manifest recorded for " + str(self.diskImagePath)]
+        else:
+            changes = manifest.diff(previous)
+        if not changes:
+            statusUpdate("Disk image", self.diskImagePath, "is up-to-date (manifest digest", manifest.digest[:16] +
+                         "), not running makefs")
+            return False
+        statusUpdate("Disk image ", self.diskImagePath, " needs to be rebuilt (", len(changes), " changes):", sep="")
+        max_changes = len(changes) if self.incremental_dry_run or self.config.verbose else 50
+        for change in changes[:max_changes]:
+            print("\t", change)
+        if len(changes) > max_changes:
+            print("\t ... and", len(changes) - max_changes, "more (use --verbose to see all)")
+        if self.incremental_dry_run:
+            statusUpdate("Not rebuilding", self.diskImagePath, "since --" + self.target + "/incremental-dry-run",
+                         "was passed")
+            return False
+        return True
+
     def copyFromRemoteHost(self):
         statusUpdate("Cannot build disk image on non-FreeBSD systems, will attempt to copy instead.")
         if not self.remotePath:
@@ -523,7 +661,9 @@ class _BuildDiskImageBase(SimpleProject):
             # Given a directory, derive the default file name inside it
             self.diskImagePath = _defaultDiskImagePath(self.config, self.diskImagePath)
 
-        if self.diskImagePath.is_file():
+        # --clean always rebuilds the image from scratch
+        incremental = (self.incremental or self.incremental_dry_run) and not self.config.clean
+        if self.diskImagePath.is_file() and not incremental:
             # only show prompt if we can actually input something to stdin
             if not self.config.clean:
                 # with --clean always delete the image
@@ -585,8 +725,17 @@ class _BuildDiskImageBase(SimpleProject):
                 # skip adding to the metalog in the git push hook since it takes a long time and isn't that useful
                 self.add_unlisted_files_to_metalog()
 
-            # finally create the disk image
-            self.makeImage()
+            # finally create the disk image (unless nothing changed since the last build)
+            manifest = self.create_image_manifest()
+            if not incremental or self._image_needs_rebuild(manifest):
+                # The old manifest no longer matches the image once we start modifying it
+                self.deleteFile(self.image_manifest_path, printVerboseOnly=True)
+                self.deleteFile(self.diskImagePath, printVerboseOnly=True)
+                with trace_span("disk image creation", "phase", target=self.target, image=str(self.diskImagePath)):
+                    self.makeImage()
+                if not self.config.pretend:
+                    manifest.options["image"] = self._file_state(self.diskImagePath)
+                    manifest.save(self.image_manifest_path)
         self.tmpdir = None
         self.manifestFile = None
 
@@ -737,7 +886,7 @@ class BuildMinimalCheriBSDDiskImage(_BuildDiskImageBase):
 
     def makeImage(self):
         # update cheribsdbox link in case we stripped it:
-        cheribsdbox_entry = self.mtree._mtree.get("./bin/cheribsdbox")
+        cheribsdbox_entry = self.mtree.get("./bin/cheribsdbox")
         if not cheribsdbox_entry:
             self.fatal("Could not find cheribsdbox entry in mtree file!")
         else:
@@ -751,7 +900,7 @@ class BuildMinimalCheriBSDDiskImage(_BuildDiskImageBase):
                     self.fatal("Need at least one hardlink to cheribsdbox so that makefs can detect deduplicate. "
                                "This should have been created by cheribuild but something must have gone wrong")
             print("Relocating mtree path ./bin/cheribsdbox to use", cheribsdbox_path)
-            for i in self.mtree._mtree.values():
+            for _, i in self.mtree.entries():
                 if i.attributes.get("contents", None) == "./bin/cheribsdbox":
                     i.attributes["contents"] = cheribsdbox_path
 
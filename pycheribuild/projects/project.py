@@ -46,9 +46,14 @@ from pathlib import Path
 from copy import deepcopy
 
 from ..config.loader import ConfigLoaderBase, ComputedDefaultValue, ConfigOptionBase
+from ..compiler_cache import CompilerCache
 from ..config.chericonfig import CheriConfig, CrossCompileTarget, MipsFloatAbi
 from ..targets import Target, MultiArchTarget, MultiArchTargetAlias, targetManager
 from ..filesystemutils import FileSystemUtils
+from ..fingerprints import FingerprintStore, file_identity, git_source_revision, hash_components
+from ..gitfetch import FetchRequest
+from ..outputpipeline import LOGFILE_COMPRESSION_SUFFIXES, ProcessOutputPipeline, open_logfile
+from ..system_deps import system_dependency_checker
 from ..utils import *
 
 __all__ = ["Project", "CMakeProject", "AutotoolsProject", "TargetAlias", "TargetAliasWithDependencies", # no-combine
@@ -56,18 +61,6 @@ __all__ = ["Project", "CMakeProject", "AutotoolsProject", "TargetAlias", "Target
            "CrossCompileTarget", "GitRepository", "ComputedDefaultValue", "commandline_to_str", "ReuseOtherProjectRepository"]  # no-combine
 
 
-def flushStdio(stream):
-    while True:
-        try:
-            # can lead to EWOULDBLOCK if stream cannot be flushed immediately
-            stream.flush()
-            break
-        except BlockingIOError as e:
-            if e.errno != errno.EWOULDBLOCK:
-                raise
-            else:
-                time.sleep(0.1)
-
 def _default_stdout_filter(arg: bytes):
     raise NotImplementedError("Should never be called, this is a dummy")
 
@@ -132,6 +125,10 @@ class ProjectSubclassDefinitionHook(type):
         # print("Adding target", targetName, "with deps:", cls.dependencies)
 
 
+# The classes whose recursive_dependencies() are currently being computed (used to report dependency cycles)
+_resolving_dependencies = []  # type: typing.List[typing.Type[SimpleProject]]
+
+
 class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
     _configLoader = None  # type: ConfigLoaderBase
 
@@ -219,17 +216,22 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
         _cached = cls.__dict__.get("_cached_deps", None)
         if _cached is not None:
             return _cached
-        result = []  # type: typing.List[Target]
-        for target in cls.direct_dependencies(config):
-            if target not in result:
-                result.append(target)
-            # now recursively add the other deps:
-            recursive_deps = target.projectClass.recursive_dependencies(config)
-            for r in recursive_deps:
-                if r not in result:
-                    result.append(r)
-        cls._cached_deps = result
-        return result
+        if cls in _resolving_dependencies:
+            cycle = _resolving_dependencies[_resolving_dependencies.index(cls):] + [cls]
+            sys.exit(coloured(AnsiColour.red, "Dependency cycle detected:", " -> ".join(c.target for c in cycle)))
+        _resolving_dependencies.append(cls)
+        try:
+            # Use an OrderedDict as an ordered set to avoid quadratic membership checks
+            result = OrderedDict()  # type: typing.Dict[Target, bool]
+            for target in cls.direct_dependencies(config):
+                result[target] = True
+                # now recursively add the other deps (these are cached so every class is only visited once):
+                for r in target.projectClass.recursive_dependencies(config):
+                    result[r] = True
+        finally:
+            _resolving_dependencies.pop()
+        cls._cached_deps = list(result.keys())
+        return cls._cached_deps
 
     @classmethod
     def _cached_dependencies(cls) -> "typing.List[Target]":
@@ -292,6 +294,8 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
     # ANSI escape sequence \e[2k clears the whole line, \r resets to beginning of line
     # However, if the output is just a plain text file don't attempt to do any line clearing
     _clearLineSequence = b"\x1b[2K\r" if sys.__stdout__.isatty() else b"\n"
+    # Set while the ProcessOutputPipeline is running since it flushes stdout on a timer instead of after every line
+    _deferStdoutFlush = False
 
     __commandLineOptionGroup = None
 
@@ -449,20 +453,24 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
                     continue
 
 
+    def _flushStdout(self):
+        if not self._deferStdoutFlush:
+            flushStdio(sys.stdout)
+
     def _lineNotImportantStdoutFilter(self, line: bytes):
         # by default we don't keep any line persistent, just have updating output
         if self._lastStdoutLineCanBeOverwritten:
             sys.stdout.buffer.write(Project._clearLineSequence)
         sys.stdout.buffer.write(line[:-1])  # remove the newline at the end
         sys.stdout.buffer.write(b" ")  # add a space so that there is a gap before error messages
-        flushStdio(sys.stdout)
+        self._flushStdout()
         self._lastStdoutLineCanBeOverwritten = True
 
     def _showLineStdoutFilter(self, line: bytes):
         if self._lastStdoutLineCanBeOverwritten:
             sys.stdout.buffer.write(b"\n")
         sys.stdout.buffer.write(line)
-        flushStdio(sys.stdout)
+        self._flushStdout()
         self._lastStdoutLineCanBeOverwritten = False
 
     def _stdoutFilter(self, line: bytes):
@@ -489,8 +497,9 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
         else:
             newEnv = None
         assert not logfileName.startswith("/")
+        compression = self.config.logfile_compression
         if self.config.write_logfile:
-            logfilePath = self.buildDir / (logfileName + ".log")
+            logfilePath = self.buildDir / (logfileName + ".log" + LOGFILE_COMPRESSION_SUFFIXES[compression])
             print("Saving build log to", logfilePath)
         else:
             logfilePath = Path(os.devnull)
@@ -514,22 +523,55 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
             return
 
         # open file in append mode
-        with logfilePath.open("ab") as logfile:
+        with open_logfile(logfilePath, compression) as logfile:
             # print the command and then the logfile
             if appendToLogfile:
                 logfile.write(b"\n\n")
             if cwd:
                 logfile.write(("cd " + shlex.quote(str(cwd)) + " && ").encode("utf-8"))
             logfile.write(cmdStr.encode("utf-8") + b"\n\n")
-            if self.config.quiet:
+            if self.config.quiet and compression == "none":
                 # a lot more efficient than filtering every line
+                logfile.flush()
                 check_call_handle_noexec(args, cwd=str(cwd), stdout=logfile, stderr=logfile, env=newEnv)
                 return
             make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=newEnv)
-            self.__runProcessWithFilteredOutput(make, logfile, stdoutFilter, cmdStr)
+            self.__runProcessWithFilteredOutput(make, logfile, stdoutFilter, cmdStr, logfilePath=logfilePath)
 
     def __runProcessWithFilteredOutput(self, proc: subprocess.Popen, logfile: "typing.Optional[typing.IO]",
-                                       stdoutFilter: "typing.Callable[[bytes], None]", cmdStr: str):
+                                       stdoutFilter: "typing.Callable[[bytes], None]", cmdStr: str,
+                                       logfilePath: Path = None):
+        if self.config.output_pipeline or (logfile and self.config.quiet):
+            retcode = self.__runOutputPipeline(proc, logfile, stdoutFilter)
+        else:
+            retcode = self.__runLineBasedOutputLoop(proc, logfile, stdoutFilter)
+        if stdoutFilter and self._lastStdoutLineCanBeOverwritten:
+            # add the final new line after the filtering
+            sys.stdout.buffer.write(b"\n")
+        if retcode:
+            message = "Command \"%s\" failed with exit code %d.\n" % (cmdStr, retcode)
+            if logfile:
+                message += "See " + str(logfilePath) + " for details."
+            raise SystemExit(message)
+
+    def __runOutputPipeline(self, proc: subprocess.Popen, logfile: "typing.Optional[typing.IO]",
+                            stdoutFilter: "typing.Callable[[bytes], None]") -> int:
+        def beforeStdErr():
+            if self._lastStdoutLineCanBeOverwritten:
+                sys.stdout.buffer.write(b"\n")
+                flushStdio(sys.stdout)
+                self._lastStdoutLineCanBeOverwritten = False
+
+        pipeline = ProcessOutputPipeline(proc, logfile, stdout_filter=stdoutFilter, before_stderr=beforeStdErr,
+                                         echo=not self.config.quiet)
+        self._deferStdoutFlush = True
+        try:
+            return pipeline.run()
+        finally:
+            self._deferStdoutFlush = False
+
+    def __runLineBasedOutputLoop(self, proc: subprocess.Popen, logfile: "typing.Optional[typing.IO]",
+                                 stdoutFilter: "typing.Callable[[bytes], None]") -> int:
         logfileLock = threading.Lock()  # we need a mutex so the logfile line buffer doesn't get messed up
         stderrThread = None
         if logfile:
@@ -560,14 +602,7 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
             sys.stdout.buffer.write(remainingOut)
             if logfile:
                 logfile.write(remainingErr)
-        if stdoutFilter and self._lastStdoutLineCanBeOverwritten:
-            # add the final new line after the filtering
-            sys.stdout.buffer.write(b"\n")
-        if retcode:
-            message = "Command \"%s\" failed with exit code %d.\n" % (cmdStr, retcode)
-            if logfile:
-                message += "See " + logfile.name + " for details."
-            raise SystemExit(message)
+        return retcode
 
     def dependencyError(self, *args, installInstructions: str = None):
         self._systemDepsChecked = True  # make sure this is always set
@@ -575,33 +610,44 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
             installInstructions = installInstructions()
         self.fatal("Dependency for", self.target, "missing:", *args, fixitHint=installInstructions)
 
+    def system_dependency_requirements(self) -> "typing.Tuple[typing.List[str], typing.List[str], typing.List[str]]":
+        """
+        :return: the required tools, pkg-config packages and headers (used to check all targets at once)
+        """
+        return ([str(t) for t in self.__requiredSystemTools.keys()], list(self.__requiredPkgConfig.keys()),
+                list(self.__requiredSystemHeaders.keys()))
+
     def checkSystemDependencies(self) -> None:
         """
         Checks that all the system dependencies (required tool, etc) are available
         :return: Throws an error if dependencies are missing
         """
+        checker = system_dependency_checker()
         for (tool, installInstructions) in self.__requiredSystemTools.items():
-            if not shutil.which(str(tool)):
+            if not checker.which(str(tool)):
                 if installInstructions is None or installInstructions == "":
                     installInstructions = "Try installing `" + tool + "` using your system package manager."
                 self.dependencyError("Required program", tool, "is missing!", installInstructions=installInstructions)
-        for (package, instructions) in self.__requiredPkgConfig.items():
-            if not shutil.which("pkg-config"):
-                # error should already have printed above
-                break
-            check_cmd = ["pkg-config", "--exists", package]
-            printCommand(check_cmd, printVerboseOnly=True)
-            exit_code = subprocess.call(check_cmd)
-            if exit_code != 0:
-                self.dependencyError("Required library", package, "is missing!", installInstructions=instructions)
+        if self.__requiredPkgConfig and checker.which("pkg-config"):  # otherwise the error was printed above
+            found = checker.check_pkg_config_packages(self.__requiredPkgConfig.keys())
+            for (package, instructions) in self.__requiredPkgConfig.items():
+                if not found[package]:
+                    self.dependencyError("Required library", package, "is missing!", installInstructions=instructions)
         for (header, instructions) in self.__requiredSystemHeaders.items():
-            if not Path("/usr/include", header).exists() and not Path("/usr/local/include", header).exists():
+            if not checker.has_header(header):
                 self.dependencyError("Required C header", header, "is missing!", installInstructions=instructions)
         self._systemDepsChecked = True
 
     def process(self):
         raise NotImplementedError()
 
+    def git_fetch_request(self) -> "typing.Optional[FetchRequest]":
+        """
+        :return: a FetchRequest if the sources of this project can be fetched concurrently with the other targets
+        before update() is called (see TargetManager.prefetch_sources())
+        """
+        return None
+
     def run_tests(self):
         # for the --test option
         statusUpdate("No tests defined for target", self.target)
@@ -665,6 +711,11 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
                 if not qemu_path.exists():
                     self.fatal("QEMU binary", qemu_path, "doesn't exist")
                 cmd.extend(["--qemu-cmd", qemu_path])
+            # The run targets are not cross-compiled so there is no architecture to pass
+            if xtarget is not None and "--architecture" not in self.config.test_extra_args:
+                # Used to record the test durations of each architecture separately
+                arch = xtarget.value + (self.config.cheriBitsStr if xtarget == CrossCompileTarget.CHERI else "")
+                cmd.extend(["--architecture", arch])
         if mount_builddir and self.buildDir and "--build-dir" not in self.config.test_extra_args:
             cmd.extend(["--build-dir", self.buildDir])
         if mount_sourcedir and self.sourceDir and "--source-dir" not in self.config.test_extra_args:
@@ -915,6 +966,9 @@ class MakeOptions(object):
 
 
 class SourceRepository(object):
+    def canBePrefetched(self, current_project: "Project", *, srcDir: Path) -> bool:
+        return False
+
     def ensureCloned(self, current_project: "Project", *, srcDir: Path, initialBranch=None,
                      skipSubmodules=False):
         raise NotImplementedError
@@ -975,10 +1029,16 @@ class GitRepository(SourceRepository):
             #    runCmd(["git", "config", "remote.origin.fetch", "+refs/heads/*:refs/remotes/origin/*"], cwd=srcDir)
 
 
+    def canBePrefetched(self, current_project: "Project", *, srcDir: Path) -> bool:
+        # Missing repositories are cloned in updateRepo() since that may need to ask the user first
+        return not current_project.skipUpdate and (srcDir / ".git").exists()
+
     def updateRepo(self, current_project: "Project", *, srcDir: Path, revision=None, initialBranch=None, skipSubmodules=False):
         self.ensureCloned(current_project, srcDir=srcDir, initialBranch=initialBranch, skipSubmodules=skipSubmodules)
         if current_project.skipUpdate:
             return
+        # If the remote has already been fetched by TargetManager.prefetch_sources() we only need to rebase
+        prefetched = current_project.sources_prefetched
         # handle repositories that have moved
         if srcDir.exists() and self.old_urls:
             # Update from the old url:
@@ -989,12 +1049,13 @@ class GitRepository(SourceRepository):
                     warningMessage(current_project.projectName, "still points to old repository", remote_url)
                     if self.queryYesNo("Update to correct URL?"):
                         runCmd("git", "remote", "set-url", "origin", self.url, runInPretendMode=True, cwd=srcDir)
+                        prefetched = False  # the prefetch used the old URL
 
         # make sure we run git stash if we discover any local changes
         hasChanges = len(runCmd("git", "diff", "--stat", "--ignore-submodules",
                                 captureOutput=True, cwd=srcDir, printVerboseOnly=True).stdout) > 1
 
-        pullCmd = ["git", "pull"]
+        pullCmd = ["git", "rebase"] if prefetched else ["git", "pull"]
         has_autostash = False
         git_version = get_program_version(Path(shutil.which("git"))) if shutil.which("git") else (0, 0, 0)
         # Use the autostash flag for Git >= 2.14 (https://stackoverflow.com/a/30209750/894271)
@@ -1019,9 +1080,13 @@ class GitRepository(SourceRepository):
                     # print("NO REAL CHANGES")
                     hasChanges = False  # probably git diff showed something from a submodule
 
-        if not skipSubmodules:
-            pullCmd.append("--recurse-submodules")
-        runCmd(pullCmd + ["--rebase"], cwd=srcDir, printVerboseOnly=True)
+        if prefetched:
+            # git rebase without an argument rebases onto the (already fetched) upstream branch
+            runCmd(pullCmd, cwd=srcDir, printVerboseOnly=True)
+        else:
+            if not skipSubmodules:
+                pullCmd.append("--recurse-submodules")
+            runCmd(pullCmd + ["--rebase"], cwd=srcDir, printVerboseOnly=True)
         if not skipSubmodules:
             runCmd("git", "submodule", "update", "--recursive", cwd=srcDir, printVerboseOnly=True)
         if hasChanges and not has_autostash:
@@ -1051,7 +1116,10 @@ class Project(SimpleProject):
     skipGitSubmodules = False
     compileDBRequiresBear = True
     doNotAddToTargets = True
+    sources_prefetched = False  # set by TargetManager.prefetch_sources() if `git fetch` has already been run
     build_dir_suffix = ""   # add a suffix to the build dir (e.g. for freebsd-with-bootstrap-clang)
+    # The compiler caches (--compiler-cache) that the build system can use as a compiler launcher
+    supported_compiler_caches = tuple()  # type: typing.Tuple[str, ...]
 
 
     defaultSourceDir = ComputedDefaultValue(
@@ -1266,6 +1334,12 @@ class Project(SimpleProject):
             else:
                 self._addRequiredSystemTool("bear", installInstructions="Run `cheribuild.py bear`")
                 self._compiledb_tool = "bear"
+        self.compiler_cache = None  # type: typing.Optional[CompilerCache]
+        if self.config.compiler_cache in self.supported_compiler_caches:
+            self.compiler_cache = CompilerCache.for_project(self)
+        if self.compiler_cache is not None:
+            self._addRequiredSystemTool(self.compiler_cache.kind, apt=self.compiler_cache.kind,
+                                        homebrew=self.compiler_cache.kind, freebsd=self.compiler_cache.kind)
         self._force_clean = False
         self._preventAssign = True
 
@@ -1355,6 +1429,11 @@ class Project(SimpleProject):
         # add a newline at the end in case it ended with a filtered line (no final newline)
         print("Running", make_command, makeTarget, "took", time.time() - starttime, "seconds")
 
+    def git_fetch_request(self) -> "typing.Optional[FetchRequest]":
+        if self.repository is None or not self.repository.canBePrefetched(self, srcDir=self.sourceDir):
+            return None
+        return FetchRequest(self.target, self.sourceDir, recurse_submodules=not self.skipGitSubmodules)
+
     def update(self):
         if not self.repository and not self.config.skipUpdate:
             self.fatal("Cannot update", self.projectName, "as it is missing a repository source", fatalWhenPretending=True)
@@ -1502,6 +1581,97 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
     def csetbounds_stats_file(self) -> Path:
         return self.buildDir / "csetbounds-stats.csv"
 
+    def _compiler_for_fingerprint(self) -> "typing.Optional[Path]":
+        compiler = getattr(self, "CC", None)
+        if isinstance(compiler, Path):
+            return compiler
+        return self.config.clangPath
+
+    # Global options (and prefixes) that only control how cheribuild runs and not what is being built
+    _build_cache_ignored_global_options = (
+        "action", "benchmark", "build-cache", "clean", "clear-tool-probe-cache", "compilation-db", "compiler-cache",
+        "configure-only", "debug-output", "detach-deletions", "explain-", "fetch-jobs", "force", "get-config-option",
+        "include-dependencies", "interact-after-tests", "logfile", "make-jobs", "make-without-nice",
+        "output-pipeline", "parallel-targets", "pass-k-to-make", "pretend", "print-targets-only", "quiet",
+        "recheck-system-deps", "reconfigure", "run-mips-tests-with-cheri-image", "shallow-clone", "skip-",
+        "test-", "tool-probe-cache", "trace-file", "verbose")
+
+    def _fingerprint_options(self) -> "typing.Tuple[typing.Dict[str, str], typing.Dict[str, str]]":
+        """:return: the values of the options of this target and of the global options that affect the build"""
+        options = OrderedDict()
+        global_options = OrderedDict()
+        for name, option in sorted(self._configLoader.options.items()):
+            # noinspection PyProtectedMember
+            if option._owningClass is None:
+                # Global options (e.g. --cheri-bits) can affect the build of every project and configure() can add
+                # arguments that depend on them -> include all of them except the ones that don't change the output
+                if not name.startswith(self._build_cache_ignored_global_options):
+                    global_options[name] = str(option.__get__(self.config, self.config.__class__))
+            elif issubclass(self.__class__, option._owningClass) and name.startswith(self.target + "/"):
+                options[name] = str(option.__get__(self, self.__class__))
+        return options, global_options
+
+    def build_fingerprint_components(self) -> "typing.Optional[typing.Dict[str, typing.Any]]":
+        """
+        :return: All the inputs that determine the result of building this project or None if they can't be
+        determined (in which case the project will always be rebuilt)
+        """
+        revision = git_source_revision(self.sourceDir) if self.sourceDir else None
+        if revision is None:
+            return None
+        options, global_options = self._fingerprint_options()
+        store = FingerprintStore.for_config(self.config)
+        dependencies = OrderedDict()
+        for dep in self.direct_dependencies(self.config):
+            dependencies[dep.name] = store.fingerprint(dep.name)
+        return OrderedDict(
+            source_revision=revision,
+            build_configuration=self.build_configuration_suffix(),
+            directories=OrderedDict(build=str(self.buildDir), install=str(self.installDir)),
+            options=options,
+            global_options=global_options,
+            configure_args=commandline_to_str(self.configureArgs),
+            configure_environment=commandline_to_str(k + "=" + str(v) for k, v in self.configureEnvironment.items()),
+            make_args=commandline_to_str(self.make_args.all_commandline_args),
+            make_env=commandline_to_str(k + "=" + str(v) for k, v in self.make_args.env_vars.items()),
+            compiler=file_identity(self._compiler_for_fingerprint()),
+            dependencies=dependencies,
+        )
+
+    def _can_use_build_cache(self) -> bool:
+        # Only skip full builds, partial runs such as --configure-only must always run
+        config = self.config
+        if not config.use_build_cache or config.pretend:
+            return False
+        if config.clean or self._force_clean or config.forceConfigure or config.configureOnly or \
+                config.skipBuild or config.skipInstall:
+            return False
+        return True
+
+    def _check_build_cache(self) -> "typing.Optional[typing.Tuple[str, dict]]":
+        """
+        :return: None if the build can be skipped, otherwise the new fingerprint and components (if known)
+        """
+        components = self.build_fingerprint_components()
+        if components is None:
+            if self.config.explain_build_cache:
+                self.info("Cannot use the build cache for", self.target, "since the source revision is unknown")
+            return "", dict()
+        fingerprint = hash_components(components)
+        store = FingerprintStore.for_config(self.config)
+        previous = store.get(self.target)
+        if previous and previous["fingerprint"] == fingerprint and self.installDir and self.installDir.exists():
+            if self.config.force_rebuild:
+                self.info("Rebuilding", self.target, "even though it is unchanged since --force-rebuild was passed")
+                return fingerprint, components
+            return None
+        if self.config.explain_build_cache:
+            reasons = store.explain(previous["components"] if previous else None, components)
+            if previous and not reasons:
+                reasons = ["install directory " + str(self.installDir) + " is missing"]
+            self.info("Not skipping", self.target + ":", "\n    ".join([""] + reasons))
+        return fingerprint, components
+
     def process(self):
         if self.generate_cmakelists:
             self._do_generate_cmakelists()
@@ -1509,11 +1679,45 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             print(self.projectName, "directories: source=%s, build=%s, install=%s" %
                   (self.sourceDir, self.buildDir, self.installDir))
         if not self.config.skipUpdate:
-            self.update()
+            with trace_span("update", "phase", target=self.target):
+                self.update()
         if not self._systemDepsChecked:
             self.checkSystemDependencies()
         assert self._systemDepsChecked, "self._systemDepsChecked must be set by now!"
+        new_fingerprint = None
+        if self._can_use_build_cache():
+            new_fingerprint = self._check_build_cache()
+            if new_fingerprint is None:
+                statusUpdate("Skipping", self.display_name, "(cached): sources, configuration, compiler and "
+                             "dependencies are unchanged since the last build")
+                return
+            # Forget the old fingerprint in case this build fails
+            FingerprintStore.for_config(self.config).invalidate(self.target)
+        if self.compiler_cache is None:
+            self._process_uncached()
+        else:
+            self._process_with_compiler_cache()
+        if new_fingerprint and new_fingerprint[0]:
+            FingerprintStore.for_config(self.config).update(self.target, *new_fingerprint)
 
+    def _process_with_compiler_cache(self):
+        with setEnv(printVerboseOnly=True, **self.compiler_cache.environment()):
+            self.compiler_cache.start()
+            try:
+                self._process_uncached()
+                stats = self.compiler_cache.statistics()
+                if stats is not None:
+                    statusUpdate(self.compiler_cache.kind, "statistics for", self.target + ":", stats)
+            finally:
+                self.compiler_cache.stop()
+
+    def compiler_launcher_command(self, compiler: "typing.Union[str, Path]") -> str:
+        """:return: compiler prefixed with the compiler cache launcher (for CC/CXX variables)"""
+        if self.compiler_cache is None or str(compiler).startswith(self.compiler_cache.executable + " "):
+            return str(compiler)
+        return self.compiler_cache.executable + " " + str(compiler)
+
+    def _process_uncached(self):
         last_build_file = Path(self.buildDir, ".last_build_kind")
         if self.build_in_source_dir and not self.config.clean:
             if not last_build_file.exists():
@@ -1541,7 +1745,8 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             if not self.config.skipConfigure or self.config.configureOnly:
                 if self.should_run_configure():
                     statusUpdate("Configuring", self.display_name, "... ")
-                    self.configure()
+                    with trace_span("configure", "phase", target=self.target):
+                        self.configure()
             if self.config.configureOnly:
                 return
             if not self.config.skipBuild:
@@ -1550,10 +1755,12 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                                   force=True)
                     # move any csetbounds stats from configuration (since they are not useful)
                 statusUpdate("Building", self.display_name, "... ")
-                self.compile()
+                with trace_span("compile", "phase", target=self.target):
+                    self.compile()
             if not self.config.skipInstall:
                 statusUpdate("Installing", self.display_name, "... ")
-                self.install()
+                with trace_span("install", "phase", target=self.target):
+                    self.install()
 
 
 class CMakeProject(Project):
@@ -1564,6 +1771,7 @@ class CMakeProject(Project):
     """
     doNotAddToTargets = True
     compileDBRequiresBear = False  # cmake -DCMAKE_EXPORT_COMPILE_COMMANDS=ON does it
+    supported_compiler_caches = ("ccache", "sccache")
     generate_cmakelists = False  # There is already a CMakeLists.txt
 
     class Generator(Enum):
@@ -1641,6 +1849,10 @@ class CMakeProject(Project):
         return not cmakeCache.exists() or not (self.buildDir / buildFile).exists()
 
     def configure(self, **kwargs):
+        if self.compiler_cache is not None:
+            # Needs CMake 3.4. Note: existing build directories are only updated when CMake is rerun
+            self.add_cmake_options(CMAKE_C_COMPILER_LAUNCHER=self.compiler_cache.executable,
+                                   CMAKE_CXX_COMPILER_LAUNCHER=self.compiler_cache.executable)
         if self.installPrefix != self.installDir:
             assert self.destdir, "custom install prefix requires DESTDIR being set!"
             self.add_cmake_options(CMAKE_INSTALL_PREFIX=self.installPrefix)
@@ -1700,6 +1912,7 @@ class CMakeProject(Project):
 class AutotoolsProject(Project):
     doNotAddToTargets = True
     _configure_supports_prefix = True
+    supported_compiler_caches = ("ccache", "sccache")
 
     @classmethod
     def setupConfigOptions(cls, **kwargs):
@@ -1725,6 +1938,11 @@ class AutotoolsProject(Project):
                 self.configureArgs.append("--prefix=" + str(self.installDir))
         if self.extraConfigureFlags:
             self.configureArgs.extend(self.extraConfigureFlags)
+        if self.compiler_cache is not None:
+            # Cross-compiling projects have already set CC/CXX, for native ones wrap the default compilers
+            for var, default in (("CC", "cc"), ("CXX", "c++")):
+                compiler = self.configureEnvironment.get(var) or os.getenv(var, default)
+                self.configureEnvironment[var] = self.compiler_launcher_command(compiler)
         super().configure(**kwargs)
 
     def needsConfigure(self):
@@ -0,0 +1,246 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import errno
+import json
+import os
+import shutil
+import stat
+import sys
+from pathlib import Path
+
+from .fingerprints import hash_components
+from .mtree import MtreeFile
+from .utils import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# FICLONE from <linux/fs.h>: share all extents of the source file (supported by btrfs and xfs)
+FICLONE = 0x40049409
+POPULATE_MODES = ("tar", "reflink", "hardlink", "copy")
+# errno values returned by the FICLONE ioctl/link() if the file system (or the pair of file systems) can't share data
+_CLONE_UNSUPPORTED_ERRORS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EPERM, errno.EMLINK)
+
+
+class SysrootState(object):
+    """
+    The METALOG entries (and the identity of the rootfs file that provides the contents) that were last used to
+    populate a sysroot. It is stored next to the sysroot so that the next population only needs to touch the paths
+    whose entries changed.
+    """
+    VERSION = 1
+
+    def __init__(self, entries: "typing.Dict[str, str]"=None):
+        self.entries = entries if entries is not None else dict()  # type: typing.Dict[str, str]
+
+    @property
+    def digest(self) -> str:
+        return hash_components(dict(version=self.VERSION, entries=self.entries))
+
+    @classmethod
+    def load(cls, path: Path) -> "typing.Optional[SysrootState]":
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != cls.VERSION:
+            return None
+        result = cls(data.get("entries", dict()))
+        if result.digest != data.get("digest"):
+            warningMessage("Ignoring corrupted sysroot state file", path)
+            return None
+        return result
+
+    def save(self, path: Path):
+        tmpfile = path.with_name(path.name + ".tmp")
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(dict(version=self.VERSION, digest=self.digest, entries=self.entries), f, sort_keys=True)
+        os.replace(str(tmpfile), str(path))
+
+
+class CloneStatistics(object):
+    def __init__(self):
+        self.bytes_reflinked = 0
+        self.bytes_hardlinked = 0
+        self.bytes_copied = 0
+        self.files_reflinked = 0
+        self.files_hardlinked = 0
+        self.files_copied = 0
+        self.symlinks = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    @property
+    def changed(self) -> int:
+        return self.files_reflinked + self.files_hardlinked + self.files_copied + self.symlinks + self.removed
+
+    def __str__(self):
+        mib = 1024.0 * 1024.0
+        return ("{:.1f} MiB copied ({} files), {:.1f} MiB reflinked ({} files), {:.1f} MiB hardlinked ({} files), "
+                "{} symlinks created, {} entries unchanged, {} removed").format(
+            self.bytes_copied / mib, self.files_copied, self.bytes_reflinked / mib, self.files_reflinked,
+            self.bytes_hardlinked / mib, self.files_hardlinked, self.symlinks, self.unchanged, self.removed)
+
+
+class FileCloner(object):
+    """
+    Creates files that share their data with the source file: "reflink" uses copy-on-write clones (FICLONE) and
+    "hardlink" creates hard links. If the file system does not support that the file is copied instead (and no
+    further attempts are made for the remaining files).
+
+    Hard links share the inode with the source file, so writing to the clone would also modify the source. Only
+    files that are already read-only are hardlinked, writable files are cloned with FICLONE or copied instead.
+    """
+    WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+    def __init__(self, mode: str):
+        assert mode in ("reflink", "hardlink", "copy"), mode
+        self.mode = mode
+        # Writable files are not hardlinked so they are cloned with FICLONE if possible
+        self.reflink_supported = mode in ("reflink", "hardlink") and fcntl is not None and \
+            sys.platform.startswith("linux")
+        self.hardlink_supported = mode == "hardlink"
+        self.stats = CloneStatistics()
+
+    def _reflink(self, src: Path, dst: Path) -> bool:
+        with src.open("rb") as s, dst.open("wb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return True
+            except OSError as e:
+                if e.errno not in _CLONE_UNSUPPORTED_ERRORS:
+                    raise
+        warningMessage("Cannot create reflinks in", dst.parent, "-> falling back to copying files")
+        self.reflink_supported = False
+        dst.unlink()
+        return False
+
+    def _hardlink(self, src: Path, dst: Path) -> bool:
+        try:
+            os.link(str(src), str(dst))
+            return True
+        except OSError as e:
+            if e.errno not in _CLONE_UNSUPPORTED_ERRORS:
+                raise
+        warningMessage("Cannot create hard links from", src.parent, "to", dst.parent, "-> falling back to copying files")
+        self.hardlink_supported = False
+        return False
+
+    def clone(self, src: Path, dst: Path, src_stat: os.stat_result):
+        if os.path.lexists(str(dst)):
+            # Also needed for hardlinks: rename() on two links to the same inode is a no-op
+            dst.unlink()
+        read_only = not src_stat.st_mode & self.WRITE_BITS
+        if read_only and self.hardlink_supported and self._hardlink(src, dst):
+            self.stats.files_hardlinked += 1
+            self.stats.bytes_hardlinked += src_stat.st_size
+            return
+        if self.reflink_supported and self._reflink(src, dst):
+            shutil.copystat(str(src), str(dst))
+            self.stats.files_reflinked += 1
+            self.stats.bytes_reflinked += src_stat.st_size
+            return
+        shutil.copy2(str(src), str(dst))
+        self.stats.files_copied += 1
+        self.stats.bytes_copied += src_stat.st_size
+
+    def symlink(self, target: str, dst: Path):
+        if os.path.lexists(str(dst)):
+            dst.unlink()
+        os.symlink(target, str(dst))
+        self.stats.symlinks += 1
+
+
+def _entry_state(entry_type: str, src_stat: os.stat_result, link_target: str=None) -> str:
+    if entry_type == "link":
+        return "link:" + link_target
+    return "file:{}:{}:{}:{:o}".format(src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_ino,
+                                        stat.S_IMODE(src_stat.st_mode))
+
+
+def sysroot_link_target(target: str, mtree_path: str) -> str:
+    """
+    :return: the symlink target made relative to the sysroot (absolute targets would point to the host libraries)
+    """
+    if not target.startswith("/"):
+        return target
+    return os.path.relpath("." + target, os.path.dirname(mtree_path))
+
+
+def populate_sysroot(source_root: Path, metalog: Path, sysroot: Path, state_file: Path,
+                     include_prefixes: "typing.Iterable[str]", mode: str) -> CloneStatistics:
+    """
+    Populate sysroot with all files listed in METALOG (below one of include_prefixes) by cloning them from
+    source_root. Only the entries that changed since the state recorded in state_file are updated.
+    """
+    include_prefixes = tuple(include_prefixes)
+    previous = SysrootState.load(state_file) or SysrootState()
+    if not previous.entries and sysroot.is_dir() and any(sysroot.iterdir()):
+        warningMessage("No sysroot state file found at", state_file, "-> overwriting all files in", sysroot)
+    cloner = FileCloner(mode)
+    new_state = SysrootState()
+    created_dirs = set()
+    mtree = MtreeFile(metalog)
+    for mtree_path in mtree.sorted_paths():
+        entry_type = mtree.get(mtree_path).attributes.get("type")
+        if entry_type not in ("file", "link") or not mtree_path.startswith(include_prefixes):
+            continue
+        src = source_root / mtree_path
+        dst = sysroot / mtree_path
+        try:
+            src_stat = os.lstat(str(src))
+        except OSError:
+            warningMessage("File", src, "listed in", metalog, "does not exist")
+            continue
+        link_target = None
+        if entry_type == "link":
+            link_target = sysroot_link_target(os.readlink(str(src)), mtree_path)
+        state = _entry_state(entry_type, src_stat, link_target)
+        new_state.entries[mtree_path] = state
+        if previous.entries.get(mtree_path) == state and os.path.lexists(str(dst)):
+            cloner.stats.unchanged += 1
+            continue
+        if dst.parent not in created_dirs:
+            os.makedirs(str(dst.parent), exist_ok=True)
+            created_dirs.add(dst.parent)
+        if entry_type == "link":
+            cloner.symlink(link_target, dst)
+        else:
+            cloner.clone(src, dst, src_stat)
+    for mtree_path in previous.entries.keys() - new_state.entries.keys():
+        dst = sysroot / mtree_path
+        if os.path.lexists(str(dst)):
+            dst.unlink()
+        cloner.stats.removed += 1
+    new_state.save(state_file)
+    return cloner.stats
@@ -0,0 +1,302 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .fingerprints import hash_components
+from .utils import *
+
+# Directories searched for system headers by SimpleProject.checkSystemDependencies()
+SYSTEM_HEADER_DIRS = ("/usr/include", "/usr/local/include")
+
+
+def _stat_identity(path: str) -> "typing.Optional[str]":
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return "{}:{}:{}".format(st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _split_search_path(value: "typing.Optional[str]") -> "typing.List[str]":
+    return [d for d in (value or "").split(os.pathsep) if d]
+
+
+class SystemDependencyChecker(object):
+    """
+    Checks for the tools, pkg-config packages and headers required by the selected targets. The requirements of all
+    targets are checked up-front (all pkg-config packages in a single invocation and the PATH lookups concurrently)
+    so that the per-target checks only need to look up the results.
+
+    Positive results are cached in $BUILD_ROOT/.cheribuild-system-deps.json. Cache entries are keyed by PATH and the
+    pkg-config search path and are only used if the size, mtime and inode of the tool (or the mtime of all pkg-config
+    search directories) is unchanged. Negative results are always checked again.
+    """
+    FILENAME = ".cheribuild-system-deps.json"
+    VERSION = 1
+    MAX_ENVIRONMENTS = 8  # only keep the cached results for the most recently used PATHs
+
+    def __init__(self, path: "typing.Optional[Path]", readonly=False, use_cached_results=True):
+        self.path = path
+        self.readonly = readonly
+        self.use_cached_results = use_cached_results
+        self._lock = threading.Lock()
+        self._environments = None  # type: typing.Optional[typing.Dict[str, dict]]
+        self._dirty = False
+        # Results for this process keyed by (environment, name)
+        self._tools = dict()  # type: typing.Dict[typing.Tuple[str, str], typing.Optional[str]]
+        self._packages = dict()  # type: typing.Dict[typing.Tuple[str, str], bool]
+        self._headers = dict()  # type: typing.Dict[str, bool]
+        self.cache_hits = 0
+        self.checks = 0
+        self.processes = 0
+        self.check_time = 0.0
+
+    @staticmethod
+    def environment_key() -> str:
+        return hash_components(dict(PATH=os.getenv("PATH"), PKG_CONFIG_PATH=os.getenv("PKG_CONFIG_PATH"),
+                                    PKG_CONFIG_LIBDIR=os.getenv("PKG_CONFIG_LIBDIR"),
+                                    PKG_CONFIG_SYSROOT_DIR=os.getenv("PKG_CONFIG_SYSROOT_DIR")))[:32]
+
+    @property
+    def environments(self) -> "typing.Dict[str, dict]":
+        if self._environments is None:
+            self._environments = self._load()
+        return self._environments
+
+    def _load(self) -> "typing.Dict[str, dict]":
+        if self.path is None or not self.use_cached_results or not self.path.is_file():
+            return OrderedDict()
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError) as e:
+            warningMessage("Could not load cached system dependency checks from", self.path, "->", e)
+            return OrderedDict()
+        if data.get("version") != self.VERSION:
+            return OrderedDict()
+        return data.get("environments", OrderedDict())
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or self.path is None or self.readonly or not self.path.parent.is_dir():
+                return
+            environments = self.environments
+            while len(environments) > self.MAX_ENVIRONMENTS:
+                environments.popitem(last=False)
+            tmpfile = self.path.with_name(self.path.name + ".tmp." + str(os.getpid()))
+            try:
+                with tmpfile.open("w", encoding="utf-8") as f:
+                    json.dump(dict(version=self.VERSION, environments=environments), f, indent=1)
+                os.replace(str(tmpfile), str(self.path))
+                self._dirty = False
+            except OSError as e:
+                warningMessage("Could not save cached system dependency checks to", self.path, "->", e)
+
+    def _cached(self, env: str) -> dict:
+        # Must be called with self._lock held
+        entry = self.environments.get(env)
+        if entry is None:
+            entry = OrderedDict(tools=OrderedDict(), pkg_config=OrderedDict(state=None, packages=[]))
+            self.environments[env] = entry
+        else:
+            self.environments.move_to_end(env)  # keep the most recently used ones when trimming
+        return entry
+
+    def which(self, tool: str) -> "typing.Optional[str]":
+        """:return: the path to tool (same as shutil.which()) or None if it could not be found"""
+        env = self.environment_key()
+        with self._lock:
+            if (env, tool) in self._tools:
+                return self._tools[(env, tool)]
+            cached = self._cached(env)["tools"].get(tool)
+        if cached and _stat_identity(cached["path"]) == cached["identity"]:
+            result = cached["path"]
+            with self._lock:
+                # check_all() looks up pkg-config concurrently with the other tools -> only count it once
+                if (env, tool) not in self._tools:
+                    self.cache_hits += 1
+                    self._tools[(env, tool)] = result
+            return result
+        start = time.time()
+        result = shutil.which(tool)
+        identity = _stat_identity(result) if result else None
+        with self._lock:
+            if (env, tool) in self._tools:
+                return self._tools[(env, tool)]
+            self.checks += 1
+            self.check_time += time.time() - start
+            self._tools[(env, tool)] = result
+            if identity is not None:
+                self._cached(env)["tools"][tool] = OrderedDict(path=result, identity=identity)
+                self._dirty = True
+        return result
+
+    def _pkg_config_state(self, env: str) -> "typing.Optional[str]":
+        """
+        :return: A string that changes whenever pkg-config or the contents of one of its search directories change
+        """
+        pkg_config = self.which("pkg-config")
+        if not pkg_config:
+            return None
+        pkg_config_identity = _stat_identity(pkg_config)
+        with self._lock:
+            cached = self._cached(env)["pkg_config"]
+            pc_path = cached.get("pc_path") if cached.get("identity") == pkg_config_identity else None
+        if pc_path is None:
+            # The default search path is compiled into pkg-config -> only query it when the binary changes
+            pc_path = self._run_pkg_config(["--variable", "pc_path", "pkg-config"], capture=True) or ""
+            with self._lock:
+                cached = self._cached(env)["pkg_config"]
+                cached["identity"] = pkg_config_identity
+                cached["pc_path"] = pc_path
+                cached["state"] = None
+                cached["packages"] = []
+                self._dirty = True
+        search_dirs = _split_search_path(os.getenv("PKG_CONFIG_PATH")) + \
+            _split_search_path(os.getenv("PKG_CONFIG_LIBDIR", pc_path))
+        dir_states = []
+        for d in search_dirs:
+            try:
+                dir_states.append(d + ":" + str(os.stat(d).st_mtime_ns))
+            except OSError:
+                dir_states.append(d + ":missing")
+        return pkg_config_identity + "|" + "|".join(dir_states)
+
+    def _run_pkg_config(self, args: "typing.List[str]", capture=False) -> "typing.Union[bool, str, None]":
+        cmd = ["pkg-config"] + args
+        printCommand(cmd, printVerboseOnly=True)
+        start = time.time()
+        try:
+            if capture:
+                return subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode("utf-8").strip()
+            return subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+        except (subprocess.CalledProcessError, OSError):
+            return None
+        finally:
+            with self._lock:
+                self.processes += 1
+                self.check_time += time.time() - start
+
+    def check_pkg_config_packages(self, packages: "typing.Iterable[str]", jobs=1) -> "typing.Dict[str, bool]":
+        """
+        Check all packages using one pkg-config invocation. Only if one of them is missing they are checked
+        individually to find out which ones.
+        """
+        env = self.environment_key()
+        with self._lock:
+            todo = [p for p in OrderedDict.fromkeys(packages) if (env, p) not in self._packages]
+        if todo:
+            state = self._pkg_config_state(env)
+            with self._lock:
+                cached = self._cached(env)["pkg_config"]
+                if state is not None and cached.get("state") != state:
+                    cached["state"] = state
+                    cached["packages"] = []
+                    self._dirty = True
+                known = set(cached["packages"]) if state is not None else set()
+                for package in todo:
+                    if package in known:
+                        self._packages[(env, package)] = True
+                        self.cache_hits += 1
+                todo = [p for p in todo if p not in known]
+                if state is not None:
+                    self.checks += len(todo)
+        if todo and state is not None:
+            if len(todo) > 1 and self._run_pkg_config(["--exists"] + todo):
+                results = dict((p, True) for p in todo)
+            else:
+                with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+                    results = dict(zip(todo, executor.map(lambda p: bool(self._run_pkg_config(["--exists", p])),
+                                                          todo)))
+            with self._lock:
+                cached = self._cached(env)["pkg_config"]
+                for package, found in results.items():
+                    self._packages[(env, package)] = found
+                    if found:
+                        cached["packages"].append(package)
+                        self._dirty = True
+        elif todo:
+            with self._lock:
+                for package in todo:
+                    self._packages[(env, package)] = False
+        with self._lock:
+            return dict((p, self._packages[(env, p)]) for p in packages)
+
+    def has_pkg_config_package(self, package: str) -> bool:
+        return self.check_pkg_config_packages([package])[package]
+
+    def has_header(self, header: str) -> bool:
+        # Checking for the file is as cheap as validating a cache entry -> only remembered for this process
+        with self._lock:
+            if header in self._headers:
+                return self._headers[header]
+        result = any(Path(d, header).exists() for d in SYSTEM_HEADER_DIRS)
+        with self._lock:
+            self._headers[header] = result
+        return result
+
+    def check_all(self, tools: "typing.Iterable[str]", packages: "typing.Iterable[str]",
+                  headers: "typing.Iterable[str]", jobs: int):
+        """
+        Check the requirements of all targets at once. The results are then returned by which(),
+        has_pkg_config_package() and has_header() without running any further processes.
+        """
+        tools = list(OrderedDict.fromkeys(tools))
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            pkg_config_future = executor.submit(self.check_pkg_config_packages, list(packages), jobs)
+            list(executor.map(self.which, tools))
+            list(executor.map(self.has_header, headers))
+            pkg_config_future.result()
+        self.save()
+
+    def statistics(self) -> str:
+        return "System dependency checks: {} from cache, {} checked ({} processes, {:.3f}s)".format(
+            self.cache_hits, self.checks, self.processes, self.check_time)
+
+
+_system_dependency_checker = None  # type: typing.Optional[SystemDependencyChecker]
+
+
+def system_dependency_checker() -> SystemDependencyChecker:
+    global _system_dependency_checker
+    if _system_dependency_checker is None:
+        config = get_global_config()
+        path = None if config.pretend else config.buildRoot / SystemDependencyChecker.FILENAME
+        _system_dependency_checker = SystemDependencyChecker(
+            path, use_cached_results=not getattr(config, "recheck_system_deps", False))
+    return _system_dependency_checker
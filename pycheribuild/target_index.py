@@ -0,0 +1,261 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import ast
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .utils import *
+
+PACKAGE_DIR = Path(__file__).parent
+PROJECT_PACKAGES = ("pycheribuild.projects", "pycheribuild.projects.cross")
+
+
+def default_index_path() -> Path:
+    if os.getenv("CHERIBUILD_TARGET_INDEX"):
+        return Path(os.getenv("CHERIBUILD_TARGET_INDEX"))
+    cache_dir = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(cache_dir, "cheribuild", "target-index.json")
+
+
+def lazy_loading_enabled() -> bool:
+    return os.getenv("CHERIBUILD_LAZY_LOADING", "1") not in ("0", "false", "no")
+
+
+def source_stamp() -> str:
+    """
+    :return: a hash that changes whenever any of the cheribuild source files is modified (or a different python
+    version/host platform is used since the set of options can depend on those)
+    """
+    h = hashlib.sha256(repr((TargetIndex.VERSION, sys.version_info[:2], sys.platform)).encode("utf-8"))
+    for path in sorted(PACKAGE_DIR.glob("**/*.py")):
+        st = path.stat()
+        h.update("{}:{}:{}\n".format(path.relative_to(PACKAGE_DIR), st.st_size, st.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()
+
+
+def project_module_names() -> "typing.List[str]":
+    result = []
+    for package in PROJECT_PACKAGES:
+        package_dir = PACKAGE_DIR.joinpath(*package.split(".")[1:])
+        result.extend(package + "." + f.name[:-3] for f in sorted(package_dir.glob("*.py")) if f.name != "__init__.py")
+    return result
+
+
+def load_all_projects():
+    # make sure all projects are loaded so that targetManager gets populated
+    for module in project_module_names():
+        importlib.import_module(module)
+
+
+def _relative_imports(module: str) -> "typing.List[str]":
+    """
+    :return: all project modules that are imported by module (including imports inside functions)
+    """
+    spec = importlib.util.find_spec(module)
+    with open(spec.origin, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), spec.origin)
+    package = module.rpartition(".")[0]
+    result = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.ImportFrom) or not node.level:
+            continue
+        base = importlib.util.resolve_name("." * node.level + (node.module or ""), package)
+        candidates = [base] + [base + "." + alias.name for alias in node.names]
+        result.update(c for c in candidates if c.rpartition(".")[0] in PROJECT_PACKAGES and c != module)
+    return sorted(result)
+
+
+def _command_line_option_names(option) -> "typing.List[str]":
+    action = getattr(option, "action", None)
+    if action is None:
+        return ["--" + option.name]
+    return list(action.option_strings)
+
+
+class TargetIndex(object):
+    """
+    A cache of the target names, target aliases, static dependencies and command line options of all projects
+    together with the module that defines them. It allows cheribuild to only import the project modules that are
+    needed for the targets and options on the command line instead of importing all of them and registering
+    thousands of options on every startup. The index is regenerated whenever any of the source files changes.
+    """
+    VERSION = 1
+
+    def __init__(self, stamp: str, targets: dict, aliases: dict, options: dict, imports: dict):
+        self.stamp = stamp
+        self.targets = targets  # type: typing.Dict[str, dict]
+        self.aliases = aliases  # type: typing.Dict[str, typing.List[str]]
+        self.options = options  # type: typing.Dict[str, typing.Optional[str]]
+        self.imports = imports  # type: typing.Dict[str, typing.List[str]]
+
+    @property
+    def target_names(self) -> "typing.List[str]":
+        return sorted(self.targets.keys())
+
+    @classmethod
+    def generate(cls, target_manager, config_loader, stamp: str=None) -> "TargetIndex":
+        from .targets import MultiArchTargetAlias
+        targets = OrderedDict()
+        aliases = OrderedDict()
+        for target in sorted(target_manager.targets, key=lambda t: t.name):
+            dependencies = target.projectClass.dependencies
+            static_deps = [d for d in dependencies if isinstance(d, str)] if isinstance(dependencies, (list, tuple)) else []
+            targets[target.name] = OrderedDict(module=target.projectClass.__module__, dependencies=static_deps)
+            if isinstance(target, MultiArchTargetAlias):
+                aliases[target.name] = [t.name for t in target.derived_targets]
+        options = OrderedDict()
+        # Options such as --help or --list-targets are added to the argument parser directly
+        for action in config_loader._parser._actions:
+            for name in action.option_strings:
+                options[name] = None
+        for option in config_loader.options.values():
+            owner = option._owningClass.__module__ if option._owningClass is not None else None
+            for name in _command_line_option_names(option):
+                options[name] = owner
+        modules = sorted(set(t["module"] for t in targets.values()))
+        imports = OrderedDict((m, _relative_imports(m)) for m in modules)
+        return cls(stamp or source_stamp(), targets, aliases, options, imports)
+
+    def save(self, path: Path):
+        data = OrderedDict(version=self.VERSION, stamp=self.stamp, targets=self.targets, aliases=self.aliases,
+                           options=self.options, imports=self.imports)
+        os.makedirs(str(path.parent), exist_ok=True)
+        tmpfile = path.with_name(path.name + ".tmp." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(str(tmpfile), str(path))
+
+    @classmethod
+    def load(cls, path: Path, stamp: str=None) -> "typing.Optional[TargetIndex]":
+        """
+        :return: the index stored in path or None if it does not exist or was generated from different sources
+        """
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != cls.VERSION or data.get("stamp") != (stamp or source_stamp()):
+            return None
+        return cls(data["stamp"], data["targets"], data["aliases"], data["options"], data["imports"])
+
+    def _lookup_option(self, name: str) -> "typing.Tuple[bool, typing.Optional[str]]":
+        if name in self.options:
+            return True, self.options[name]
+        # negated boolean options (--foo/no-bar) are not stored separately
+        prefix, slash, basename = name.rpartition("/")
+        if basename.startswith("no-"):
+            positive = prefix + slash + basename[3:]
+            positive = positive if positive.startswith("-") else "--" + positive
+            if positive in self.options:
+                return True, self.options[positive]
+        return False, None
+
+    def modules_for_arguments(self, args: "typing.List[str]") -> "typing.Optional[typing.List[str]]":
+        """
+        :return: The project modules that must be imported before the command line arguments can be parsed or None
+        if all modules are needed (e.g. for --help or if one of the options is not known to the index).
+        """
+        seeds = set()
+        for arg in args:
+            if arg == "--":
+                break
+            if arg.startswith("-"):
+                name = arg.split("=", 1)[0]
+                if name in ("-h", "--help", "--help-all", "--help-hidden", "--dump-config", "--get-config-option"):
+                    return None
+                found, module = self._lookup_option(name)
+                if not found and not name.startswith("--") and len(name) > 2:
+                    # Short options with a value (e.g. -j4) or multiple short flags (-pv)
+                    found, module = self._lookup_option(name[:2])
+                if not found:
+                    return None
+                if module:
+                    seeds.add(module)
+            elif arg in self.targets:
+                seeds.add(self.targets[arg]["module"])
+            elif arg == "__run_everything__":
+                return None
+        return self._module_closure(seeds)
+
+    def _module_closure(self, seeds: "typing.Iterable[str]") -> "typing.List[str]":
+        modules_by_target = {name: t["module"] for name, t in self.targets.items()}
+        targets_by_module = dict()  # type: typing.Dict[str, typing.List[str]]
+        for name, module in modules_by_target.items():
+            targets_by_module.setdefault(module, []).append(name)
+        result = set()
+        pending = list(seeds)
+        while pending:
+            module = pending.pop()
+            if module in result:
+                continue
+            result.add(module)
+            pending.extend(self.imports.get(module, []))
+            for target in targets_by_module.get(module, []):
+                pending.extend(modules_by_target[d] for d in self.targets[target]["dependencies"]
+                               if d in modules_by_target)
+        return sorted(result)
+
+    def import_module_for_target(self, name: str) -> bool:
+        target = self.targets.get(name)
+        if target is None:
+            return False
+        importlib.import_module(target["module"])
+        return True
+
+
+class StartupTimer(object):
+    """
+    Records how long the different phases of the cheribuild startup take (printed to stderr if the environment
+    variable CHERIBUILD_STARTUP_TIMING is set).
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = OrderedDict()  # type: typing.Dict[str, float]
+
+    def phase_done(self, name: str):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self.last)
+        self.last = now
+
+    def report(self):
+        if not os.getenv("CHERIBUILD_STARTUP_TIMING"):
+            return
+        parts = ["{}={:.1f}ms".format(name, value * 1000) for name, value in self.phases.items()]
+        print("cheribuild startup:", " ".join(parts), "total={:.1f}ms".format((self.last - self.start) * 1000),
+              file=sys.stderr)
@@ -27,12 +27,19 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
-import functools
+import os
+import subprocess
 import sys
+import threading
 import time
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from pathlib import Path
 from .config.chericonfig import CheriConfig, CrossCompileTarget
+from .gitfetch import ConcurrentGitFetcher
+from .system_deps import system_dependency_checker
+from .target_index import load_all_projects
+from .tracing import get_trace_recorder
 from .utils import *
 
 
@@ -63,7 +70,7 @@ class Target(object):
         if self._completed:
             return
         project = self.get_or_create_project(None, config)
-        with setEnv(PATH=config.dollarPathWithOtherTools):
+        with setEnv(PATH=config.dollarPathWithOtherTools), trace_span("dependency check", "phase", target=self.name):
             # make sure all system dependencies exist first
             project.checkSystemDependencies()
 
@@ -89,7 +96,7 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
+        with setEnv(**new_env), trace_span(self.name, "target", action="build"):
             project.process()
         statusUpdate("Built target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._completed = True
@@ -105,7 +112,7 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
+        with setEnv(**new_env), trace_span(self.name, "target", action="test"):
             project.run_tests()
         statusUpdate("Ran tests for target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._tests_have_run = True
@@ -121,7 +128,7 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
+        with setEnv(**new_env), trace_span(self.name, "target", action="benchmark"):
             project.run_benchmarks()
         statusUpdate("Ran benchmarks for target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._benchmarks_have_run = True
@@ -133,37 +140,6 @@ class Target(object):
         self.__project = None
         self._creating_project = False
 
-    def __lt__(self, other: "Target"):
-        # print(self, "__lt__", other)
-        # if this target is one of the dependencies order it before
-        otherDeps = other.projectClass._cached_dependencies()
-        # print("other deps:", otherDeps)
-        if self in otherDeps:
-            # print(self, "is in", other, "deps -> is less")
-            return True
-        # and if it is the other way around we are not less
-        if other in self.projectClass._cached_dependencies():
-            # print(other, "is in", self, "deps -> is greater")
-            return False
-        if other.name.startswith("run") and not self.name.startswith("run"):
-            return True  # run must be executed last
-        elif self.name.startswith("run"):
-            return False
-        if other.name.startswith("disk-image") and not self.name.startswith("disk-image"):
-            return True  # disk-image should be done just before run
-        elif self.name.startswith("disk-image"):
-            return False
-        # print(self, "is not in", other, "deps -> is not less")
-        # otherwise just keep everything in order
-        return False
-        # This was previously done
-        # ownDeps = self.projectClass.allDependencyNames()
-        # if len(ownDeps) < len(otherDeps):
-        #     return True
-        # if len(ownDeps) > len(otherDeps):
-        #     return False
-        # return self.name < other.name  # not a dep and number of deps is the same -> compare name
-
     def __repr__(self):
         return "<Target " + self.name + ">"
 
@@ -232,9 +208,104 @@ class MultiArchTargetAlias(Target):
         return "<Cross target alias " + self.name + ">"
 
 
+def _ordering_phase(target: Target) -> int:
+    # Targets that do not depend on each other keep their order, except that disk images should be created after
+    # all other targets have been built and run targets must be executed last.
+    if target.name.startswith("run"):
+        return 2
+    if target.name.startswith("disk-image"):
+        return 1
+    return 0
+
+
+class DependencyGraph(object):
+    """
+    The dependency graph between targets. The direct dependencies of every target are only computed once and all
+    queries are a single depth-first search over the graph, i.e. they are linear in the number of targets and edges.
+    """
+
+    def __init__(self, config: CheriConfig):
+        self.config = config
+        self._edges = dict()  # type: typing.Dict[Target, typing.List[Target]]
+
+    def direct_dependencies(self, target: Target) -> "typing.List[Target]":
+        result = self._edges.get(target)
+        if result is None:
+            result = list(OrderedDict.fromkeys(target.projectClass.direct_dependencies(self.config)))
+            self._edges[target] = result
+        return result
+
+    def _depth_first_search(self, roots: "typing.Iterable[Target]", callback: "typing.Callable[[Target], None]"):
+        """Calls callback for every target reachable from roots in post-order (i.e. after all its dependencies)"""
+        done = set()  # type: typing.Set[Target]
+        path = []  # type: typing.List[Target]
+
+        def visit(target: Target):
+            if target in done:
+                return
+            if target in path:
+                cycle = path[path.index(target):] + [target]
+                sys.exit(coloured(AnsiColour.red, "Dependency cycle detected:", " -> ".join(t.name for t in cycle)))
+            path.append(target)
+            for dep in self.direct_dependencies(target):
+                visit(dep)
+            path.pop()
+            done.add(target)
+            callback(target)
+
+        for root in roots:
+            visit(root)
+
+    def topological_order(self, targets: "typing.List[Target]") -> "typing.List[Target]":
+        """
+        :return: targets without duplicates and ordered such that every target comes after its dependencies. The
+        result only depends on the order of the targets argument and not on the iteration order of any set.
+        """
+        chosen = list(OrderedDict.fromkeys(targets))
+        index = dict((t, i) for i, t in enumerate(chosen))
+        result = []  # type: typing.List[Target]
+
+        def add_if_chosen(target: Target):
+            if target in index:
+                result.append(target)
+
+        self._depth_first_search(sorted(chosen, key=lambda t: (_ordering_phase(t), index[t])), add_if_chosen)
+        return result
+
+    def explain(self, target: Target) -> "typing.List[typing.Tuple[Target, typing.List[Target], typing.List[Target]]]":
+        """
+        :return: A (dependency, direct dependents, shortest dependency chain from target) tuple for every recursive
+        dependency of target in build order
+        """
+        build_order = []  # type: typing.List[Target]
+        self._depth_first_search([target], build_order.append)
+        # Breadth-first search to find the shortest chain that pulls in each dependency
+        parents = {target: None}  # type: typing.Dict[Target, typing.Optional[Target]]
+        required_by = dict()  # type: typing.Dict[Target, typing.List[Target]]
+        queue = deque([target])
+        while queue:
+            current = queue.popleft()
+            for dep in self.direct_dependencies(current):
+                required_by.setdefault(dep, []).append(current)
+                if dep not in parents:
+                    parents[dep] = current
+                    queue.append(dep)
+        result = []
+        for dep in build_order[:-1]:  # the last one is target itself
+            chain = [dep]
+            while parents[chain[-1]] is not None:
+                chain.append(parents[chain[-1]])
+            result.append((dep, required_by[dep], list(reversed(chain))))
+        return result
+
+
 class TargetManager(object):
     def __init__(self):
         self._allTargets = {}
+        self._registeredTargets = set()  # type: typing.Set[str]
+        # Called with a target name that is not known yet. Should import the module that defines it and return True
+        # if the target could be added (used to load projects lazily)
+        self.lazy_loader = None  # type: typing.Optional[typing.Callable[[str], bool]]
 
     def addTarget(self, target: Target) -> None:
         self._allTargets[target.name] = target
@@ -243,8 +314,11 @@ class TargetManager(object):
         # this cannot be done in the Project metaclass as otherwise we get
         # RuntimeError: super(): empty __class__ cell
         # https://stackoverflow.com/questions/13126727/how-is-super-in-python-3-implemented/28605694#28605694
-        for tgt in self._allTargets.values():
-            tgt.projectClass.setupConfigOptions()
+        # Only register the targets that were added since the last call (more can be added by lazy loading)
+        for tgt in list(self._allTargets.values()):
+            if tgt.name not in self._registeredTargets:
+                self._registeredTargets.add(tgt.name)
+                tgt.projectClass.setupConfigOptions()
 
     @property
     def targetNames(self):
@@ -256,6 +330,13 @@ class TargetManager(object):
 
     def get_target_raw(self, name: str):
         # return the actual target without resolving MultiArchTargetAlias
+        if self.lazy_loader is not None:
+            if name not in self._allTargets:
+                self.lazy_loader(name)
+            # The module can also have been imported after the options were registered (e.g. by an import inside a
+            # function such as "from ..cherisim import BuildCheriSim" followed by BuildCheriSim.get_instance())
+            if name not in self._registeredTargets:
+                self.registerCommandLineOptions()
         return self._allTargets[name]
 
     def get_target(self, name: str, arch: "typing.Optional[CrossCompileTarget]", config: CheriConfig) -> Target:
@@ -270,35 +351,13 @@ class TargetManager(object):
         # print(" ->", target)
         return target
 
-    def topologicalSort(self, targets: "typing.List[Target]") -> "typing.Iterable[typing.List[Target]]":
-        # based on http://rosettacode.org/wiki/Topological_sort#Python
-        data = dict((t.name, set(t.get_dependencies(None))) for t in targets)
-
-        # add all the targets that aren't included yet
-        allDependencyNames = [t.projectClass.allDependencyNames() for t in targets]
-        possiblyMissingDependencies = functools.reduce(set.union, allDependencyNames, set())
-        for dep in possiblyMissingDependencies:
-            if dep not in data:
-                data[dep] = self._allTargets[dep].dependencies
-
-        # do the actual sorting
-        while True:
-            ordered = set(item for item, dep in data.items() if not dep)
-            if not ordered:
-                break
-            yield list(sorted(ordered))
-            data = {item: (dep - ordered) for item, dep in data.items()
-                    if item not in ordered}
-        assert not data, "A cyclic dependency exists amongst %r" % data
-
     @staticmethod
-    def sort_in_dependency_order(targets: "typing.List[Target]") -> "typing.List[Target]":
-        # pythons sorted() is guaranteed to be stable:
-        sorted_targets = list(sorted(targets))
-        # remove duplicates (insert into an orderdict to keep order
-        return list(OrderedDict((x, True) for x in sorted_targets).keys())
+    def sort_in_dependency_order(targets: "typing.List[Target]", config: CheriConfig) -> "typing.List[Target]":
+        return DependencyGraph(config).topological_order(targets)
 
     def get_all_targets(self, explicit_targets: "typing.List[Target]", config: CheriConfig) -> "typing.List[Target]":
+        if config.parallel_worker:
+            return list(explicit_targets)  # the dependencies have already been built by the parent process
         add_dependencies = config.includeDependencies
         chosen_targets = []  # type: typing.List[Target]
         for t in explicit_targets:
@@ -323,14 +382,21 @@ class TargetManager(object):
                     continue
                 chosen_targets.append(dep_target)
 
-        sort = self.sort_in_dependency_order(chosen_targets)
-        return sort
+        return self.sort_in_dependency_order(chosen_targets, config)
 
     def run(self, config: CheriConfig):
         chosenTargets = self.get_all_chosen_targets(config)
-
-        for target in chosenTargets:
-            target.checkSystemDeps(config)
+        # Deletes the directories that previous runs did not manage to delete while the targets are being built
+        with config.FS.reclaim_stale_directories():
+            self._run_targets(config, chosenTargets)
+
+    def _run_targets(self, config: CheriConfig, chosenTargets: "typing.List[Target]"):
+        system_deps_summary = self.check_system_dependencies(config, chosenTargets)
+        if config.parallel_targets > 1 and len(chosenTargets) > 1 and not config.print_targets_only:
+            ParallelTargetExecutor(config, chosenTargets, system_deps_summary=system_deps_summary).run()
+            return
+        if not config.skipUpdate and config.fetch_jobs > 1 and not config.print_targets_only:
+            self.prefetch_sources(config, chosenTargets)
         # all dependencies exist -> run the targets
         for target in chosenTargets:
             if config.print_targets_only:
@@ -338,25 +404,72 @@ class TargetManager(object):
                 print("    Dependencies for", target.name, "are", target.projectClass.allDependencyNames(config))
             else:
                 target.execute(config)
+        if not config.print_targets_only:
+            statusUpdate(system_deps_summary)
+
+    @staticmethod
+    def check_system_dependencies(config: CheriConfig, targets: "typing.List[Target]") -> str:
+        """
+        :return: a summary of the time spent on the checks (printed at the end of the build)
+        """
+        # Check the requirements of all targets at once (concurrently and with a single pkg-config invocation), the
+        # per-target checks below then only report the missing ones
+        starttime = time.time()
+        checker = system_dependency_checker()
+        tools, packages, headers = [], [], []
+        for target in targets:
+            if target._completed:
+                continue
+            target_tools, target_packages, target_headers = \
+                target.get_or_create_project(None, config).system_dependency_requirements()
+            tools.extend(target_tools)
+            packages.extend(target_packages)
+            headers.extend(target_headers)
+        with setEnv(PATH=config.dollarPathWithOtherTools), trace_span("system dependency checks", "phase"):
+            checker.check_all(tools, packages, headers, jobs=max(1, config.makeJobs))
+        for target in targets:
+            target.checkSystemDeps(config)
+        checker.save()
+        return "Checked system dependencies of {} targets in {:.3f} seconds. {}".format(
+            len(targets), time.time() - starttime, checker.statistics())
+
+    @staticmethod
+    def prefetch_sources(config: CheriConfig, targets: "typing.List[Target]"):
+        # Run git fetch for all chosen targets concurrently, the local rebase happens serially in Project.update()
+        projects_by_dir = OrderedDict()  # type: typing.Dict[Path, typing.List[SimpleProject]]
+        requests = []
+        for target in targets:
+            project = target.get_or_create_project(None, config)
+            request = project.git_fetch_request()
+            if request is None:
+                continue
+            if request.source_dir not in projects_by_dir:
+                requests.append(request)
+            # Multiple targets can share the same source directory (e.g. cheribsd-purecap and cheribsd)
+            projects_by_dir.setdefault(request.source_dir, []).append(project)
+        if len(requests) < 2:
+            return  # nothing to be gained from fetching first
+        fetcher = ConcurrentGitFetcher(config.fetch_jobs, pretend=config.pretend)
+        with trace_span("fetch sources", "phase", repositories=len(requests)):
+            results = fetcher.fetch_all(requests)
+        for result in results:
+            if result.success:
+                for project in projects_by_dir[result.request.source_dir]:
+                    project.sources_prefetched = True
+        statusUpdate(fetcher.summary())
+
+    def _get_chosen_target(self, name: str, config: CheriConfig) -> Target:
+        if name not in self._allTargets and not (self.lazy_loader and self.lazy_loader(name)):
+            if self.lazy_loader is not None:
+                load_all_projects()  # only the targets of the modules that have been imported are known so far
+            sys.exit(coloured(AnsiColour.red, "Target", name, "does not exist. Valid choices are",
+                              ",".join(self.targetNames)))
+        self.registerCommandLineOptions()
+        return self.get_target(name, None, config)
 
     def get_all_chosen_targets(self, config) -> "typing.Iterable[Target]":
-        # check that all target dependencies are correct:
-        for t in self._allTargets.values():
-            for dep in t.get_dependencies(config):
-                if dep.name not in self._allTargets:
-                    sys.exit("Invalid dependency " + dep.name + " for " + t.projectClass.__name__)
-        # targetsSorted = sorted(self._allTargets.values())
-        # print(" ".join(t.name for t in targetsSorted))
-        # assert self._allTargets["llvm"] < self._allTargets["cheribsd"]
-        # assert self._allTargets["llvm"] < self._allTargets["all"]
-        # assert self._allTargets["disk-image"] > self._allTargets["qemu"]
-        # assert self._allTargets["sdk"] > self._allTargets["sdk-sysroot"]
-        explicitlyChosenTargets = []  # type: typing.List[Target]
-        for targetName in config.targets:
-            if targetName not in self._allTargets:
-                sys.exit(coloured(AnsiColour.red, "Target", targetName, "does not exist. Valid choices are",
-                                  ",".join(self.targetNames)))
-            explicitlyChosenTargets.append(self.get_target(targetName, None, config))
+        # Invalid dependencies are reported by SimpleProject.direct_dependencies() when resolving the chosen targets
+        explicitlyChosenTargets = [self._get_chosen_target(name, config) for name in config.targets]
         chosenTargets = self.get_all_targets(explicitlyChosenTargets, config)
         if config.verbose:
             print("Will execute the following targets:", " ".join(t.name for t in chosenTargets))
@@ -364,8 +477,194 @@ class TargetManager(object):
         Target.instantiating_targets_should_warn = False  # Fine to instantiate Project() now
         return chosenTargets
 
+    def explain_dependencies(self, config: CheriConfig, name: str):
+        target = self._get_chosen_target(name, config)
+        explanation = DependencyGraph(config).explain(target)
+        if not explanation:
+            print(target.name, "does not have any dependencies")
+            return
+        print("Dependencies of", target.name, "in build order:")
+        width = max(len(dep.name) for dep, _, _ in explanation)
+        for dep, required_by, chain in explanation:
+            print("  ", dep.name.ljust(width), "  required by ", ", ".join(t.name for t in required_by),
+                  " (", " -> ".join(t.name for t in chain), ")", sep="")
+        if config.includeDependencies or target.projectClass.dependenciesMustBeBuilt:
+            return
+        if target.projectClass.isAlias:
+            print("Note: Only the direct dependencies of", target.name, "are built unless --include-dependencies "
+                  "is passed")
+        else:
+            print("Note: The dependencies of", target.name, "are only built if --include-dependencies is passed")
+
     def reset(self):
         for i in self._allTargets.values():
             i.reset()
 
+
+class ParallelTargetExecutor(object):
+    """
+    Executes the chosen targets on a pool of worker threads as soon as all targets they depend on have completed.
+    Every target is built by a separate cheribuild process (so that environment variables, the current working
+    directory and terminal output of one target cannot affect the others) and the output of that process is
+    written to a per-target logfile. The --make-jobs budget is split between all targets that are running at the
+    same time.
+    """
+    def __init__(self, config: CheriConfig, targets: "typing.List[Target]", system_deps_summary: str=None):
+        self.config = config
+        self.targets = targets  # already sorted in dependency order
+        self.system_deps_summary = system_deps_summary
+        self.max_workers = max(1, min(config.parallel_targets, len(targets)))
+        self.log_dir = config.buildRoot / "parallel-build-logs"
+        self.dependencies = self._compute_dependencies(config, targets)
+        self.priorities = self._compute_priorities(targets, self.dependencies)
+        self.durations = OrderedDict()  # type: typing.Dict[Target, float]
+        self.make_jobs = OrderedDict()  # type: typing.Dict[Target, int]
+        self.failed = []  # type: typing.List[Target]
+
+    @staticmethod
+    def _compute_dependencies(config: CheriConfig, targets: "typing.List[Target]") -> "typing.Dict[Target, set]":
+        chosen = set(targets)
+        result = OrderedDict()
+        for i, target in enumerate(targets):
+            deps = set(d for d in target.get_dependencies(config) if d in chosen)
+            # Keep the ordering constraints of DependencyGraph.topological_order() that are not real dependencies: disk
+            # images must be created after all other targets have been built and run targets must be executed last.
+            if target.name.startswith("run"):
+                deps.update(t for t in targets[:i] if not t.name.startswith("run"))
+            elif target.name.startswith("disk-image"):
+                deps.update(t for t in targets[:i] if not t.name.startswith(("run", "disk-image")))
+            result[target] = deps
+        return result
+
+    @staticmethod
+    def _compute_priorities(targets: "typing.List[Target]", dependencies: "typing.Dict[Target, set]"):
+        # Prefer starting targets with the longest chain of targets depending on them (i.e. the critical path)
+        priorities = dict((t, 1) for t in targets)
+        for target in reversed(targets):
+            for dep in dependencies[target]:
+                priorities[dep] = max(priorities[dep], priorities[target] + 1)
+        return priorities
+
+    def worker_command(self, target: Target, make_jobs: int) -> "typing.List[str]":
+        # Pass through all arguments except the target names and --include-dependencies and build exactly one target
+        # without dependencies
+        loader = self.config.loader
+        skipped = loader.positional_argument_indices(sys.argv[1:])
+        skipped.update(loader.option_argument_indices(sys.argv[1:], "include_dependencies"))
+        args = [arg for i, arg in enumerate(sys.argv[1:]) if i not in skipped]
+        if self.config.trace_file:
+            # Every worker writes a separate trace that is merged into the --trace-file of this process
+            args.append("--trace-file=" + str(self.trace_file(target)))
+        return [sys.argv[0]] + args + ["--parallel-worker", "--parallel-targets=1", "--make-jobs=" + str(make_jobs),
+                                       target.name]
+
+    def trace_file(self, target: Target) -> Path:
+        return self.log_dir / (target.name + ".trace.json")
+
+    def logfile(self, target: Target) -> Path:
+        return self.log_dir / (target.name + ".log")
+
+    def run_target(self, target: Target, make_jobs: int) -> int:
+        cmd = self.worker_command(target, make_jobs)
+        printCommand(cmd, outputFile=self.logfile(target))
+        if self.config.pretend:
+            return 0
+        env = os.environ.copy()
+        env["_CHERIBUILD_PARALLEL_WORKER"] = "1"
+        with self.logfile(target).open("wb") as logfile:
+            logfile.write(commandline_to_str(cmd).encode("utf-8") + b"\n\n")
+            logfile.flush()
+            result = subprocess.call(cmd, stdin=subprocess.DEVNULL, stdout=logfile, stderr=subprocess.STDOUT, env=env)
+        recorder = get_trace_recorder()
+        if recorder is not None and self.trace_file(target).exists():
+            recorder.merge(self.trace_file(target))
+        return result
+
+    def _print_log_tail(self, target: Target, lines=50):
+        logfile = self.logfile(target)
+        if not logfile.exists():
+            return
+        with logfile.open("r", encoding="utf-8", errors="replace") as f:
+            tail = f.readlines()[-lines:]
+        print(coloured(AnsiColour.red, "Last", len(tail), "lines of", logfile) + ":", file=sys.stderr)
+        sys.stderr.write("".join(tail))
+        sys.stderr.flush()
+
+    def run(self):
+        statusUpdate("Building", len(self.targets), "targets with up to", self.max_workers,
+                     "concurrent targets. Logfiles will be saved to", self.log_dir)
+        if not self.config.pretend:
+            os.makedirs(str(self.log_dir), exist_ok=True)
+        starttime = time.time()
+        pending = list(self.targets)
+        completed = set()
+        running = dict()  # type: typing.Dict[Target, int]
+        condition = threading.Condition()
+
+        def worker(target: Target, make_jobs: int):
+            target_start = time.time()
+            try:
+                retcode = self.run_target(target, make_jobs)
+            except Exception as e:
+                warningMessage("Failed to run target", target.name, e)
+                retcode = -1
+            with condition:
+                self.durations[target] = time.time() - target_start
+                del running[target]
+                if retcode != 0:
+                    self.failed.append(target)
+                    warningMessage("Target", target.name, "failed with exit code", retcode)
+                else:
+                    completed.add(target)
+                    statusUpdate("Built target '" + target.name + "' in", self.durations[target], "seconds")
+                condition.notify_all()
+
+        threads = []
+        with condition:
+            while pending or running:
+                ready = [t for t in pending if self.dependencies[t] <= completed]
+                ready.sort(key=lambda t: -self.priorities[t])
+                free_slots = self.max_workers - len(running)
+                if ready and free_slots > 0 and not self.failed:
+                    to_start = ready[:free_slots]
+                    free_jobs = max(0, self.config.makeJobs - sum(running.values()))
+                    for target in to_start:
+                        # Give the remaining jobs to the targets that are being started (at least one each)
+                        make_jobs = int(max(1, free_jobs // len(to_start)))
+                        pending.remove(target)
+                        running[target] = make_jobs
+                        self.make_jobs[target] = make_jobs
+                        statusUpdate("Starting target", coloured(AnsiColour.yellow, target.name), "with -j" +
+                                     str(make_jobs), "(" + str(len(running)), "running,", len(pending), "pending)")
+                        thread = threading.Thread(target=worker, args=(target, make_jobs),
+                                                  name="Building " + target.name)
+                        threads.append(thread)
+                        thread.start()
+                    continue
+                if not running:
+                    break  # either a target failed or there are unsatisfiable dependencies
+                condition.wait()
+        for thread in threads:
+            thread.join()
+        self._print_summary(time.time() - starttime)
+        if self.failed:
+            for target in self.failed:
+                self._print_log_tail(target)
+            fatalError("Failed to build target(s)", ", ".join(t.name for t in self.failed),
+                       fixitHint="See the logfiles in " + str(self.log_dir) + " for details.")
+        elif pending:
+            fatalError("Could not build target(s)", ", ".join(t.name for t in pending),
+                       "since their dependencies could not be resolved.")
+
+    def _print_summary(self, wall_time: float):
+        total = sum(self.durations.values())
+        statusUpdate("Built", len(self.durations), "targets in", wall_time, "seconds (sum of the target build times:",
+                     total, "seconds, speedup", "%.2fx)" % (total / wall_time if wall_time > 0 else 1.0))
+        for target, duration in self.durations.items():
+            status = "FAILED" if target in self.failed else "ok"
+            print("   ", target.name.ljust(40), "%8.1fs" % duration, " -j" + str(self.make_jobs[target]), status)
+        if self.system_deps_summary:
+            statusUpdate(self.system_deps_summary)
+
+
 targetManager = TargetManager()
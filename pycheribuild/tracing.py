@@ -0,0 +1,206 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Note: this module must not import utils.py since that uses TracedPopen
+
+try:
+    import typing
+except ImportError:
+    typing = {}
+
+
+def _timestamp_us() -> float:
+    # Use the wall clock so that traces written by --parallel-targets worker processes can be merged
+    return time.time() * 1000000
+
+
+class TraceRecorder(object):
+    """
+    Records spans for targets, build phases and subprocesses and writes them as a Chrome trace event file which
+    can be loaded in Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []  # type: typing.List[dict]
+        self._thread_names = dict()  # type: typing.Dict[int, str]
+        self._lock = threading.Lock()
+
+    def _current_thread_id(self) -> int:
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._thread_names:
+            self._thread_names[tid] = "cheribuild" if thread is threading.main_thread() else thread.name
+        return tid
+
+    def add_complete_event(self, name: str, category: str, start_us: float, end_us: float, args: dict = None,
+                           tid: int = None):
+        event = {"name": name, "cat": category, "ph": "X", "ts": start_us, "dur": max(0.0, end_us - start_us),
+                 "pid": self.pid, "tid": tid if tid is not None else self._current_thread_id()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args):
+        """
+        Records the time spent in the with block. The yielded dict can be used to add further arguments to the span
+        """
+        tid = self._current_thread_id()
+        start = _timestamp_us()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__ + ": " + str(e)
+            raise
+        finally:
+            self.add_complete_event(name, category, start, _timestamp_us(), args, tid=tid)
+
+    def merge(self, path: Path):
+        """Add the events from the trace written by another cheribuild process (e.g. a --parallel-targets worker)"""
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                events = json.load(f)["traceEvents"]
+        except (OSError, ValueError, KeyError) as e:
+            print("Could not merge trace file", path, "-", e, file=sys.stderr)
+            return
+        with self._lock:
+            self.events.extend(events)
+
+    def trace_events(self) -> "typing.List[dict]":
+        with self._lock:
+            result = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "cheribuild"}}]
+            for tid, name in sorted(self._thread_names.items()):
+                result.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}})
+            return result + sorted(self.events, key=lambda e: e.get("ts", 0))
+
+    def write(self):
+        tmpfile = self.path.with_name(self.path.name + ".tmp")
+        if not self.path.parent.is_dir():
+            os.makedirs(str(self.path.parent), exist_ok=True)
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+        os.replace(str(tmpfile), str(self.path))
+
+
+_recorder = None  # type: typing.Optional[TraceRecorder]
+
+
+def start_tracing(path: Path) -> TraceRecorder:
+    global _recorder
+    _recorder = TraceRecorder(path)
+    return _recorder
+
+
+def stop_tracing() -> "typing.Optional[TraceRecorder]":
+    """Writes the trace file (if --trace-file was passed) and stops recording"""
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    if recorder is not None:
+        recorder.write()
+    return recorder
+
+
+def get_trace_recorder() -> "typing.Optional[TraceRecorder]":
+    return _recorder
+
+
+def trace_span(name: str, category: str, **args):
+    """
+    :return: a context manager that records a span if --trace-file was passed (and does nothing otherwise)
+    """
+    if _recorder is None:
+        return _NullSpan(args)
+    return _recorder.span(name, category, **args)
+
+
+class _NullSpan(object):
+    def __init__(self, args: dict):
+        self.args = args
+
+    def __enter__(self):
+        return self.args
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class TracedPopen(subprocess.Popen):
+    """
+    A subprocess.Popen that records a span with the command line, exit code and resource usage (from wait4()) of the
+    process once it has been waited for.
+    """
+    def __init__(self, args, **kwargs):
+        self._trace_recorder = _recorder
+        self._trace_start = _timestamp_us()
+        self._trace_tid = _recorder._current_thread_id() if _recorder is not None else None
+        self._trace_cwd = kwargs.get("cwd")
+        self.rusage = None
+        super().__init__(args, **kwargs)
+
+    def _try_wait(self, wait_flags):
+        if self._trace_recorder is None or not hasattr(os, "wait4"):
+            return super()._try_wait(wait_flags)
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return super()._try_wait(wait_flags)
+        if pid == self.pid:
+            self.rusage = rusage
+            self._record_span(_exit_code(status))
+        return pid, status
+
+    def _record_span(self, exit_code: int):
+        argv = [str(a) for a in self.args] if isinstance(self.args, (list, tuple)) else [str(self.args)]
+        args = {"argv": argv, "exit_code": exit_code}
+        if self._trace_cwd is not None:
+            args["cwd"] = str(self._trace_cwd)
+        if self.rusage is not None:
+            args.update(user_time=self.rusage.ru_utime, system_time=self.rusage.ru_stime,
+                        # ru_maxrss is in KiB on Linux and FreeBSD but in bytes on macOS
+                        max_rss_kb=self.rusage.ru_maxrss // (1024 if sys.platform == "darwin" else 1))
+        self._trace_recorder.add_complete_event(os.path.basename(argv[0]), "subprocess", self._trace_start,
+                                                _timestamp_us(), args, tid=self._trace_tid)
@@ -28,6 +28,8 @@
 # SUCH DAMAGE.
 #
 import contextlib
+import errno
+import json
 import os
 import socket
 import functools
@@ -38,8 +40,10 @@ import subprocess
 import sys
 import tempfile
 import threading
+import time
 import traceback
 from .colour import coloured, AnsiColour, statusUpdate, warningMessage
+from .tracing import TracedPopen, get_trace_recorder, trace_span
 from collections import namedtuple
 from pathlib import Path
 
@@ -60,7 +64,8 @@ __all__ = ["typing", "IS_LINUX", "IS_FREEBSD", "IS_MAC", "printCommand", "includ
            "warningMessage", "Type_T", "typing", "popen_handle_noexec", "extract_version", "get_program_version", # no-combine
            "check_call_handle_noexec", "ThreadJoiner", "getCompilerInfo", "latestClangTool", "SafeDict", # no-combine
            "defaultNumberOfMakeJobs", "commandline_to_str", "OSInfo", "is_jenkins_build", "get_global_config",  # no-combine
-           "get_version_output", "classproperty", "find_free_port"]  # no-combine
+           "get_version_output", "classproperty", "find_free_port", "ToolProbeCache",  # no-combine
+           "tool_probe_cache", "flushStdio", "trace_span"]  # no-combine
 
 
 _TEST_MODE = False
@@ -183,24 +188,26 @@ def _make_called_process_error(retcode, args, *, stdout=None, stderr=None, cwd=N
 
 
 def check_call_handle_noexec(cmdline: "typing.List[str]", **kwargs):
-    try:
-        return subprocess.check_call(cmdline, **kwargs)
-    except PermissionError as e:
-        interpreter = getInterpreter(cmdline)
-        if interpreter:
-            return subprocess.check_call(interpreter + cmdline, **kwargs)
-        raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
-    except FileNotFoundError as e:
-        raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
+    # Same as subprocess.check_call() but uses popen_handle_noexec() so that the process shows up in --trace-file
+    with popen_handle_noexec(cmdline, **kwargs) as process:
+        try:
+            retcode = process.wait()
+        except:  # Including KeyboardInterrupt, wait handled that.
+            process.kill()
+            raise
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, process.args)
+    return 0
 
 
 def popen_handle_noexec(cmdline: "typing.List[str]", **kwargs) -> subprocess.Popen:
+    popen = TracedPopen if get_trace_recorder() is not None else subprocess.Popen
     try:
-        return subprocess.Popen(cmdline, **kwargs)
+        return popen(cmdline, **kwargs)
     except PermissionError as e:
         interpreter = getInterpreter(cmdline)
         if interpreter:
-            return subprocess.Popen(interpreter + cmdline, **kwargs)
+            return popen(interpreter + cmdline, **kwargs)
         raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
     except FileNotFoundError as e:
         raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
@@ -274,10 +281,24 @@ def runCmd(*args, captureOutput=False, captureError=False, input: "typing.Union[
                 fatalError("Command ", "`" + commandline_to_str(process.args) +
                            "` failed with non-zero exit code ", retcode, *cwd, sep="")
             else:
-                raise _make_called_process_error(retcode, process.args, stdout=stdout, cwd=kwargs["cwd"])
+                raise _make_called_process_error(retcode, process.args, stdout=stdout, stderr=stderr,
+                                                cwd=kwargs["cwd"])
         return CompletedProcess(process.args, retcode, stdout, stderr)
 
 
+def flushStdio(stream):
+    while True:
+        try:
+            # can lead to EWOULDBLOCK if stream cannot be flushed immediately
+            stream.flush()
+            break
+        except BlockingIOError as e:
+            if e.errno != errno.EWOULDBLOCK:
+                raise
+            else:
+                time.sleep(0.1)
+
+
 def commandline_to_str(args: "typing.Iterable[str]") -> str:
     return " ".join((shlex.quote(str(s)) for s in args))
 
@@ -342,6 +363,126 @@ class CompilerInfo(object):
     def is_clang(self):
         return self.compiler in ("clang", "apple-clang")
 
+
+class ToolProbeCache(object):
+    """
+    Caches the output of compiler and tool version checks (e.g. `clang -v` or `cmake --version`) across cheribuild
+    invocations. Entries are keyed by the command line and are only used if the size, mtime and inode of the
+    program are unchanged. The cache also records how long the probes took so that --verbose can show how much
+    startup time was spent on them.
+    """
+    FILENAME = ".cheribuild-tool-probes.json"
+    VERSION = 1
+
+    def __init__(self, path: "typing.Optional[Path]", readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._entries = None  # type: typing.Optional[typing.Dict[str, dict]]
+        self.hits = 0
+        self.misses = 0
+        self.probe_time = 0.0  # time spent running probes in this process
+        self.saved_time = 0.0  # time the probes that were found in the cache took when they were executed
+
+    @property
+    def entries(self) -> "typing.Dict[str, dict]":
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self) -> "typing.Dict[str, dict]":
+        if self.path is None or not self.path.is_file():
+            return dict()
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            warningMessage("Could not load cached tool versions from", self.path, "->", e)
+            return dict()
+        if data.get("version") != self.VERSION:
+            return dict()
+        return data.get("probes", dict())
+
+    def _save(self):
+        if self.path is None or self.readonly or not self.path.parent.is_dir():
+            return
+        tmpfile = self.path.with_name(self.path.name + ".tmp." + str(os.getpid()))
+        try:
+            with tmpfile.open("w", encoding="utf-8") as f:
+                json.dump(dict(version=self.VERSION, probes=self.entries), f, indent=1, sort_keys=True)
+            os.replace(str(tmpfile), str(self.path))
+        except OSError as e:
+            warningMessage("Could not save cached tool versions to", self.path, "->", e)
+
+    @staticmethod
+    def program_identity(program: "typing.Union[str, Path]") -> "typing.Optional[str]":
+        path = shutil.which(str(program))
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return "{}:{}:{}:{}".format(os.path.realpath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def run(self, kind: str, program: "typing.Union[str, Path]", args: "typing.Sequence[str]",
+            probe: "typing.Callable[[], typing.Tuple[int, bytes, bytes]]") -> "typing.Tuple[int, bytes, bytes]":
+        """
+        :param kind: distinguishes probes that run the same command line but handle the output differently
+        :param probe: the function that runs the command and returns (exit code, stdout, stderr)
+        """
+        key = kind + ":" + commandline_to_str([str(program)] + [str(a) for a in args])
+        identity = self.program_identity(program)
+        if identity is not None:
+            with self._lock:
+                entry = self.entries.get(key)
+            if entry and entry["identity"] == identity:
+                self.hits += 1
+                self.saved_time += entry["time"]
+                return (entry["returncode"], entry["stdout"].encode("utf-8", "surrogateescape"),
+                        entry["stderr"].encode("utf-8", "surrogateescape"))
+        start = time.time()
+        returncode, stdout, stderr = probe()
+        elapsed = time.time() - start
+        self.misses += 1
+        self.probe_time += elapsed
+        if identity is not None and returncode == 0:
+            with self._lock:
+                self.entries[key] = dict(identity=identity, time=elapsed, returncode=returncode,
+                                         stdout=(stdout or b"").decode("utf-8", "surrogateescape"),
+                                         stderr=(stderr or b"").decode("utf-8", "surrogateescape"))
+                self._save()
+        return returncode, stdout, stderr
+
+    def clear(self):
+        with self._lock:
+            self._entries = dict()
+            if self.path is not None and self.path.exists():
+                self.path.unlink()
+
+    def statistics(self) -> str:
+        return "Tool version checks: {} from cache (took {:.3f}s when executed), {} executed ({:.3f}s)".format(
+            self.hits, self.saved_time, self.misses, self.probe_time)
+
+
+_tool_probe_cache = None  # type: typing.Optional[ToolProbeCache]
+
+
+def tool_probe_cache() -> ToolProbeCache:
+    global _tool_probe_cache
+    path = None
+    if _cheriConfig is not None and not _TEST_MODE and getattr(_cheriConfig, "use_tool_probe_cache", False):
+        path = _cheriConfig.buildRoot / ToolProbeCache.FILENAME
+    if _tool_probe_cache is None or _tool_probe_cache.path != path:
+        previous = _tool_probe_cache
+        _tool_probe_cache = ToolProbeCache(path, readonly=path is None or _cheriConfig.pretend)
+        if previous is not None:
+            # Keep the statistics of the probes that were run before the config was loaded
+            for attr in ("hits", "misses", "probe_time", "saved_time"):
+                setattr(_tool_probe_cache, attr, getattr(previous, attr))
+    return _tool_probe_cache
+
+
 _cached_compiler_infos = dict()  # type: typing.Dict[Path, CompilerInfo]
 
 
@@ -354,14 +495,20 @@ def getCompilerInfo(compiler: "typing.Union[str, Path]") -> CompilerInfo:
         # TODO: could also use -dumpmachine to get the triple
         targetPattern = re.compile(b"Target: (.+)")
         # clang prints this output to stderr
-        try:
-            # Use -v instead of --version to support both gcc and clang
-            # Note: for clang-cpp/cpp we need to have stdin as devnull
-            versionCmd = runCmd(compiler, "-v", captureError=True, printVerboseOnly=True, runInPretendMode=True,
+
+        def probe_compiler():
+            try:
+                # Use -v instead of --version to support both gcc and clang
+                # Note: for clang-cpp/cpp we need to have stdin as devnull
+                result = runCmd(compiler, "-v", captureError=True, printVerboseOnly=True, runInPretendMode=True,
                                 stdin=subprocess.DEVNULL, captureOutput=True)
-        except subprocess.CalledProcessError as e:
-            stderr = e.stderr if e.stderr else b"FAILED: " + str(e).encode("utf-8")
-            versionCmd = CompletedProcess(e.cmd, e.returncode, e.output, stderr)
+                return result.returncode, result.stdout, result.stderr
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr if getattr(e, "stderr", None) else b"FAILED: " + str(e).encode("utf-8")
+                return e.returncode, e.output, stderr
+
+        returncode, stdout, stderr = tool_probe_cache().run("compiler-info", compiler, ["-v"], probe_compiler)
+        versionCmd = CompletedProcess([compiler, "-v"], returncode, stdout, stderr)
 
         clangVersion = clangVersionPattern.search(versionCmd.stderr)
         appleLlvmVersion = appleLlvmVersionPattern.search(versionCmd.stderr)
@@ -394,9 +541,13 @@ def getCompilerInfo(compiler: "typing.Union[str, Path]") -> CompilerInfo:
 def get_version_output(program: Path, command_args: tuple=None) -> "bytes":
     if command_args is None:
         command_args = ["--version"]
-    prog = runCmd([program] + list(command_args), stdin=subprocess.DEVNULL,
-                  stderr=subprocess.STDOUT, captureOutput=True, runInPretendMode=True)
-    return prog.stdout
+
+    def probe_version():
+        prog = runCmd([program] + list(command_args), stdin=subprocess.DEVNULL,
+                      stderr=subprocess.STDOUT, captureOutput=True, runInPretendMode=True)
+        return prog.returncode, prog.stdout, b""
+
+    return tool_probe_cache().run("version", program, command_args, probe_version)[1]
 
 
 @functools.lru_cache(maxsize=20)
@@ -31,11 +31,25 @@
 import sys
 import subprocess
 import tempfile
+import typing
+from contextlib import closing
 from pathlib import Path
 from run_tests_common import boot_cheribsd, junitparser
+from pycheribuild.boot_cheribsd import kyua_junit
+
+
+def convert_kyua_dbs_to_junit_xml(db_files: "typing.List[Path]", jobs: int = None):
+    """Convert kyua databases to .xml files next to them without needing kyua on the host"""
+    for db_file in db_files:
+        boot_cheribsd.info("Converting ", db_file, " to ", db_file.with_suffix(".xml"))
+    if boot_cheribsd.PRETEND:
+        return
+    for db_file, stats in kyua_junit.convert_kyua_dbs(db_files, jobs=jobs).items():
+        boot_cheribsd.info("Converted ", db_file, ": ", stats)
 
 
 def convert_kyua_db_to_junit_xml(db_file: Path, output_file: Path):
+    # Uses kyua report-junit (mostly useful to compare the output with the host-native converter)
     assert output_file.resolve() != db_file.resolve()
     with output_file.open("w") as output_stream:
         command = ["kyua", "report-junit", "--results-file=" + str(db_file)]
@@ -49,12 +63,8 @@ def fixup_kyua_generated_junit_xml(xml_file: Path):
     # Process junit xml file with junitparser to update the number of tests, failures, total time, etc.
     orig_xml_bytes = xml_file.read_bytes()
     orig_xml_str = xml_file.read_text("utf-8", errors='backslashreplace')
-    xml_str = orig_xml_str
-    for i in range(32):
-        if chr(i) not in ("\n", "\t"):
-            # Can't reference NULL character -> backslashescape instead
-            # xml_str = xml_str.replace(chr(i), "&#" + str(i) + ";")
-            xml_str = xml_str.replace(chr(i), "\\x" + format(i, '02x') + ";")
+    # Can't reference NULL character -> backslashescape instead
+    xml_str = kyua_junit.escape_control_characters(orig_xml_str)
     with tempfile.NamedTemporaryFile("wb") as tf:
         # create a temporary file first to avoid clobbering the original one if we fail to parse it
         tf.write(xml_str.encode("ascii", errors="xmlcharrefreplace"))
@@ -72,6 +82,8 @@ if __name__ == "__main__":
     parser.add_argument("db", help="The database to convert")
     parser.add_argument("xml", nargs=argparse.OPTIONAL, help="The output file (or - for stdout). Defaults to the db file with suffix .xml")
     parser.add_argument("--update-stats", action="store_true", help="Only update stats instead of parsing a kyua db")
+    parser.add_argument("--use-kyua", action="store_true",
+                        help="Use kyua report-junit instead of reading the database directly")
     args = parser.parse_args()
     if not args.xml:
         output = Path(args.db).with_suffix(".xml")
@@ -81,5 +93,10 @@ if __name__ == "__main__":
         output = Path(args.xml)
     if args.update_stats:
         fixup_kyua_generated_junit_xml(Path(args.db))
-    else:
+    elif args.use_kyua:
         convert_kyua_db_to_junit_xml(Path(args.db), output)
+    elif args.xml == "-":
+        with closing(kyua_junit.open_kyua_db(Path(args.db))) as db:
+            kyua_junit.write_junit_xml(db, sys.stdout)
+    else:
+        kyua_junit.convert_kyua_db(Path(args.db), output)
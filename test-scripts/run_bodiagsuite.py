@@ -32,8 +32,9 @@
 import argparse
 import os
 import sys
+import time
 from pathlib import Path
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from run_tests_common import junitparser, run_tests_main, boot_cheribsd, duration_history
 
 LONG_NAME_FOR_BUILDDIR = "/build-dir-with-long-name-to-ensure-cwd-causes-buffer-overflow"
 
@@ -197,18 +198,25 @@ def run_bodiagsuite(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespa
     boot_cheribsd.info("Running BODiagSuite")
     assert not args.use_valgrind, "Not support for CheriBSD"
 
+    history_suite = duration_history.history_key("bodiagsuite:" + args.junit_testsuite_name,
+                                                 duration_history.architecture_from_args(args))
+    test_start = time.time()
     if not args.junit_xml_only:
         boot_cheribsd.checked_run_cheribsd_command(qemu, "rm -rf {}/run".format(LONG_NAME_FOR_BUILDDIR))
         boot_cheribsd.checked_run_cheribsd_command(qemu, "cd {} && mkdir -p run".format(LONG_NAME_FOR_BUILDDIR))
         # Don't log all the CHERI traps while running (should speed up the tests a bit and produce shorter logfiles)
         boot_cheribsd.run_cheribsd_command(qemu, "sysctl machdep.log_cheri_exceptions=0 || true")
         boot_cheribsd.checked_run_cheribsd_command(qemu, "{} -r -f {}/Makefile.bsd-run all".format(args.bmake_path, LONG_NAME_FOR_BUILDDIR),
-                                                   timeout=120*60, ignore_cheri_trap=True)
+                                                   timeout=duration_history.adaptive_timeout(history_suite, 120 * 60),
+                                                   ignore_cheri_trap=True)
         # restore old behaviour
         boot_cheribsd.run_cheribsd_command(qemu, "sysctl machdep.log_cheri_exceptions=1 || true")
 
     if not create_junit_xml(Path(args.build_dir), args.junit_testsuite_name, args.tools):
         return False
+    if not args.junit_xml_only and not boot_cheribsd.PRETEND:
+        duration_history.record_junit_results(history_suite, [Path(args.build_dir, "test-results.xml")],
+                                              wall_time=time.time() - test_start)
     return True
 
 
@@ -35,12 +35,15 @@ import functools
 import os
 import operator
 import shlex
-import shutil
 import time
 import sys
 from pathlib import Path
-from run_tests_common import boot_cheribsd, run_tests_main, junitparser, pexpect
-from kyua_db_to_junit_xml import convert_kyua_db_to_junit_xml, fixup_kyua_generated_junit_xml
+from run_tests_common import boot_cheribsd, run_tests_main, junitparser, pexpect, duration_history
+from kyua_db_to_junit_xml import convert_kyua_dbs_to_junit_xml
+
+
+def _history_suite_name(tests_file: str, args: argparse.Namespace) -> str:
+    return duration_history.history_key("cheribsd-kyua:" + tests_file, duration_history.architecture_from_args(args))
 
 
 def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace):
@@ -52,7 +55,7 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
     qemu.run("/libexec/ld-cheri-elf.so.1 -h", cheri_trap_fatal=True)
 
     tests_successful = True
-    host_has_kyua = shutil.which("kyua") is not None
+    test_wall_times = dict()  # type: typing.Dict[str, float]
 
     try:
         # potentially bootstrap kyua for later testing
@@ -63,33 +66,24 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
         for i, tests_file in enumerate(args.kyua_tests_files):
             # TODO: is the results file too big for tmpfs? No should be fine, only a few megabytes
             qemu.checked_run("rm -f /tmp/results.db")
-            # Allow up to 24 hours to run the full testsuite
+            # Allow up to 24 hours to run the full testsuite (unless we have recorded durations of previous runs)
             # Not a checked run since it might return false if some tests fail
+            timeout = duration_history.adaptive_timeout(_history_suite_name(tests_file, args), 24 * 60 * 60)
             test_start = datetime.datetime.now()
             qemu.run("kyua test --results-file=/tmp/results.db -k {}".format(shlex.quote(tests_file)),
-                     ignore_cheri_trap=True, cheri_trap_fatal=False, timeout=24 * 60 * 60)
+                     ignore_cheri_trap=True, cheri_trap_fatal=False, timeout=timeout)
             if i == 0:
                 results_db = Path("/kyua-results/test-results.db")
             else:
                 results_db = Path("/kyua-results/test-results-{}.db".format(i))
-            results_xml = results_db.with_suffix(".xml")
+            test_wall_times[results_db.stem] = (datetime.datetime.now() - test_start).total_seconds()
             assert shlex.quote(str(results_db)) == str(results_db), "Should not contain any special chars"
             qemu.checked_run("cp -v /tmp/results.db {}".format(results_db))
             qemu.checked_run("fsync " + str(results_db))
             boot_cheribsd.success("Running tests for ", tests_file, " took: ", datetime.datetime.now() - test_start)
 
-            # run: kyua report-junit --results-file=test-results.db | vis -os > ${CPU}-${TEST_NAME}-test-results.xml
-            # Not sure how much we gain by running it on the host instead.
-            # Converting the full test suite to xml can take over an hour (probably a lot faster without the vis -os pipe)
-            # TODO: should escape the XML file but that's probably faster on the host
-            if host_has_kyua:
-                boot_cheribsd.info("KYUA installed on the host, no need to do slow conversion in QEMU")
-            else:
-                xml_conversion_start = datetime.datetime.now()
-                qemu.checked_run("kyua report-junit --results-file=/tmp/results.db > /tmp/results.xml", timeout=200 * 60)
-                qemu.checked_run("cp -v /tmp/results.xml {}".format(results_xml))
-                qemu.checked_run("fsync " + str(results_xml))
-                boot_cheribsd.success("Creating JUnit XML ", results_xml, " took: ", datetime.datetime.now() - xml_conversion_start)
+            # The JUnit XML is created on the host by reading the database directly since running
+            # kyua report-junit in QEMU can take over an hour for the full test suite.
     except boot_cheribsd.CheriBSDCommandTimeout as e:
         boot_cheribsd.failure("Timeout running tests: " + str(e), exit=False)
         qemu.sendintr()
@@ -109,14 +103,16 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
             time.sleep(2)  # sleep two seconds to ensure the files exist
         junit_dir = Path(args.kyua_tests_output)
         try:
-            if host_has_kyua:
-                boot_cheribsd.info("Converting kyua databases to JUNitXML in output directory ", junit_dir)
-                for host_kyua_db_path in junit_dir.glob("*.db"):
-                    convert_kyua_db_to_junit_xml(host_kyua_db_path, host_kyua_db_path.with_suffix(".xml"))
-            else:
-                boot_cheribsd.info("Updating statistics in JUnit output directory ", junit_dir)
-                for host_xml_path in junit_dir.glob("*.xml"):
-                    fixup_kyua_generated_junit_xml(host_xml_path)
+            xml_conversion_start = datetime.datetime.now()
+            boot_cheribsd.info("Converting kyua databases to JUnit XML in output directory ", junit_dir)
+            convert_kyua_dbs_to_junit_xml(sorted(junit_dir.glob("*.db")))
+            boot_cheribsd.success("Creating JUnit XML took: ", datetime.datetime.now() - xml_conversion_start)
+            if not boot_cheribsd.PRETEND:
+                for i, tests_file in enumerate(args.kyua_tests_files):
+                    stem = "test-results" if i == 0 else "test-results-" + str(i)
+                    duration_history.record_junit_results(_history_suite_name(tests_file, args),
+                                                          [junit_dir / (stem + ".xml")],
+                                                          wall_time=test_wall_times.get(stem))
         except Exception as e:
             boot_cheribsd.failure("Could not update stats in ", junit_dir, ": ", e, exit=False)
             tests_successful = False
@@ -34,8 +34,9 @@ import argparse
 import os
 import shutil
 import subprocess
+import time
 from pathlib import Path
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from run_tests_common import junitparser, run_tests_main, boot_cheribsd, duration_history
 
 def output_to_junit_suite(xml, output_path, suite_name, good=True):
     suite = junitparser.TestSuite(suite_name)
@@ -93,11 +94,17 @@ def run_juliet_tests(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namesp
 
 
     build_dir = Path(args.build_dir)
-    boot_cheribsd.checked_run_cheribsd_command(qemu, run_command, ignore_cheri_trap=True, timeout=60000)
+    history_suite = duration_history.history_key("juliet", duration_history.architecture_from_args(args))
+    test_start = time.time()
+    boot_cheribsd.checked_run_cheribsd_command(qemu, run_command, ignore_cheri_trap=True,
+                                               timeout=duration_history.adaptive_timeout(history_suite, 60000))
     xml = junitparser.JUnitXml()
     output_to_junit_suite(xml, build_dir / "bin" / "good.run", "good", True)
     output_to_junit_suite(xml, build_dir / "bin" / "bad.run", "bad", False)
     xml.write(build_dir / "results.xml")
+    if not boot_cheribsd.PRETEND:
+        duration_history.record_junit_results(history_suite, [build_dir / "results.xml"],
+                                              wall_time=time.time() - test_start)
 
     return True
 
@@ -34,16 +34,18 @@ import atexit
 import datetime
 import os
 import signal
+import subprocess
 import sys
 import tempfile
 import time
 import traceback
+import xml.etree.ElementTree as ET
 from multiprocessing import Process, Queue, Barrier
 from pathlib import Path
 from queue import Empty
 
 # To combine the test result xmls
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from run_tests_common import junitparser, run_tests_main, boot_cheribsd, duration_history
 import run_remote_lit_test
 from run_remote_lit_test import mp_debug
 
@@ -53,12 +55,21 @@ def add_cmdline_args(parser: argparse.ArgumentParser):
     parser.add_argument("--multiprocessing-debug", action="store_true")
     parser.add_argument("--xunit-output", default="qemu-libcxx-test-results.xml")
     parser.add_argument("--parallel-jobs", metavar="N", type=int, help="Split up the testsuite into N parallel jobs")
+    parser.add_argument("--dynamic-sharding", action="store_true",
+                        help="Instead of splitting the testsuite into N equal parts up front, let each parallel job "
+                             "fetch batches of tests (longest first based on previous JUnit results) until all "
+                             "tests have been run")
+    parser.add_argument("--dynamic-batch-size", metavar="N", type=int, default=5,
+                        help="Number of tests that are passed to each lit invocation with --dynamic-sharding")
+    parser.add_argument("--test-durations", metavar="XML", action="append", default=[],
+                        help="JUnit XML file with the test durations of a previous run (default: --xunit-output)")
     # For the parallel jobs
     parser.add_argument("--internal-num-shards", type=int, help=argparse.SUPPRESS)
     parser.add_argument("--internal-shard", type=int, help=argparse.SUPPRESS)
 
 
-def run_shard(q: Queue, barrier: Barrier, num, total, ssh_port_queue, kernel, disk_image, build_dir):
+def run_shard(q: Queue, barrier: Barrier, num, total, ssh_port_queue, kernel, disk_image, build_dir,
+              test_queue: Queue = None):
     sys.argv.append("--internal-num-shards=" + str(total))
     sys.argv.append("--internal-shard=" + str(num))
     if kernel is not None:
@@ -72,15 +83,20 @@ def run_shard(q: Queue, barrier: Barrier, num, total, ssh_port_queue, kernel, di
     boot_cheribsd.QEMU_LOGFILE = Path(build_dir, "shard-" + str(num) + ".log")
     boot_cheribsd.info("writing CheriBSD output to ", boot_cheribsd.QEMU_LOGFILE)
     try:
-        libcxx_main(barrier=barrier, mp_queue=q, ssh_port_queue=ssh_port_queue, shard_num=num)
+        libcxx_main(barrier=barrier, mp_queue=q, ssh_port_queue=ssh_port_queue, shard_num=num, test_queue=test_queue)
         boot_cheribsd.success("====> Job ", num, " completed")
     except Exception as e:
         boot_cheribsd.failure("Job ", num, " failed: ", e, exit=False)
         raise
 
 
+def _history_suite_name(args: argparse.Namespace, num_vms: int) -> str:
+    # A run on a single VM takes much longer than one that is split across many shards
+    return duration_history.history_key("libcxx", duration_history.architecture_from_args(args), num_vms)
+
+
 def libcxx_main(barrier: Barrier = None, mp_queue: Queue = None, ssh_port_queue: Queue = None,
-                shard_num: int = None):
+                shard_num: int = None, test_queue: Queue = None):
     def set_cmdline_args(args: argparse.Namespace):
         boot_cheribsd.info("Setting args:", args)
         if mp_queue:
@@ -98,7 +114,15 @@ def libcxx_main(barrier: Barrier = None, mp_queue: Queue = None, ssh_port_queue:
         with tempfile.TemporaryDirectory(prefix="cheribuild-libcxx-tests-") as tempdir:
             # TODO: do we need lit_extra_args=["-Denable_filesystem=False"]?
             # Some of the tests might fail on a SMBFS directory.
-            return run_remote_lit_test.run_remote_lit_tests("libcxx", qemu, args, tempdir, mp_q=mp_queue, barrier=barrier)
+            starttime = time.time()
+            result = run_remote_lit_test.run_remote_lit_tests("libcxx", qemu, args, tempdir, mp_q=mp_queue,
+                                                              barrier=barrier, test_queue=test_queue)
+            # For parallel runs the main process records the merged results
+            if args.xunit_output and shard_num is None and not args.pretend:
+                duration_history.record_junit_results(_history_suite_name(args, 1),
+                                                      [Path(args.xunit_output).absolute()],
+                                                      wall_time=time.time() - starttime)
+            return result
 
     try:
         run_tests_main(test_function=run_libcxx_tests, need_ssh=True, # we need ssh running to execute the tests
@@ -114,6 +138,91 @@ def libcxx_main(barrier: Barrier = None, mp_queue: Queue = None, ssh_port_queue:
         boot_cheribsd.info("Finished running ", " ".join(sys.argv))
 
 
+def _junit_test_key(classname: str, name: str) -> str:
+    # lit uses "<suite>.<dirs with . replaced by _>" as the classname (or "<suite>.<suite>" for top-level tests)
+    suite, _, dirs = classname.partition(".")
+    if not dirs or dirs == suite:
+        return name
+    return dirs + "/" + name
+
+
+def _lit_test_key(path_in_suite: str) -> str:
+    dirs, _, name = path_in_suite.rpartition("/")
+    if not dirs:
+        return name
+    return dirs.replace(".", "_") + "/" + name
+
+
+def load_test_durations(xml_files: "typing.List[Path]") -> "typing.Dict[str, float]":
+    result = dict()
+    for xml_file in xml_files:
+        if not xml_file.exists():
+            continue
+        try:
+            for testcase in ET.parse(str(xml_file)).iter("testcase"):
+                key = _junit_test_key(testcase.get("classname", ""), testcase.get("name", ""))
+                result[key] = float(testcase.get("time", 0))
+        except (ET.ParseError, ValueError) as e:
+            boot_cheribsd.failure("Could not parse test durations from ", xml_file, ": ", e, exit=False)
+    return result
+
+
+def discover_tests(args: argparse.Namespace) -> "typing.List[str]":
+    """
+    :return: the paths (relative to the test suite root) of all tests that lit would run
+    """
+    lit_cmd = ["python3", str(Path(args.build_dir, "bin/llvm-lit")), "--show-tests", "test"]
+    if args.pretend:
+        boot_cheribsd.run_host_command(lit_cmd, cwd=args.build_dir)
+        return ["std/pretend/test" + str(i) + ".pass.cpp" for i in range(20)]
+    boot_cheribsd.info("Finding tests: ", " ".join(lit_cmd))
+    output = subprocess.check_output(lit_cmd, cwd=args.build_dir).decode("utf-8")
+    # The output contains lines of the form "  libc++ :: std/foo/bar.pass.cpp"
+    return [line.partition(" :: ")[2].strip() for line in output.splitlines() if " :: " in line]
+
+
+def schedule_tests(tests: "typing.List[str]", durations: "typing.Dict[str, float]",
+                   batch_size: int) -> "typing.List[typing.List[str]]":
+    """
+    :return: batches of tests with the longest running tests first. Tests without a recorded duration are assumed
+    to take as long as the median test.
+    """
+    known = sorted(durations.values())
+    default_duration = known[len(known) // 2] if known else 1.0
+    ordered = sorted(tests, key=lambda t: (-durations.get(_lit_test_key(t), default_duration), t))
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+def estimate_static_shard_times(tests: "typing.List[str]", durations: "typing.Dict[str, float]",
+                                num_shards: int) -> "typing.List[float]":
+    # lit --num-shards/--run-shard assigns every Nth test (sorted by path) to the same shard
+    known = sorted(durations.values())
+    default_duration = known[len(known) // 2] if known else 1.0
+    result = [0.0] * num_shards
+    for i, test in enumerate(sorted(tests)):
+        result[i % num_shards] += durations.get(_lit_test_key(test), default_duration)
+    return result
+
+
+def report_dynamic_sharding(processes: "typing.List[Process]", static_estimate: "typing.List[float]"):
+    stats = [getattr(p, "stats", None) for p in processes]
+    if not all(stats):
+        boot_cheribsd.failure("Not all shards reported statistics, cannot compute utilization", exit=False)
+        return
+    start = min(s["started"] for s in stats)
+    end = max(s["finished"] for s in stats)
+    wall_time = max(end - start, 0.001)
+    for i, s in enumerate(stats):
+        boot_cheribsd.info("Shard ", i + 1, ": ", s["tests"], " tests in ", s["batches"], " batches, busy for ",
+                           round(s["busy"]), "s of ", round(wall_time), "s (", round(100 * s["busy"] / wall_time),
+                           "% utilization)")
+    dynamic_tail = end - min(s["finished"] for s in stats)
+    static_tail = max(static_estimate) - min(static_estimate) if static_estimate else 0
+    boot_cheribsd.success("Dynamic sharding: idle time between first and last shard finishing: ",
+                          round(dynamic_tail), "s. Estimated for static sharding (based on recorded durations): ",
+                          round(static_tail), "s -> saved ", round(static_tail - dynamic_tail), "s of tail latency")
+
+
 def run_parallel(args: argparse.Namespace):
     if args.pretend:
         boot_cheribsd.PRETEND = True
@@ -129,11 +238,28 @@ def run_parallel(args: argparse.Namespace):
     # Extract the kernel + disk image in the main process to avoid race condition:
     kernel_path = boot_cheribsd.maybe_decompress(Path(args.kernel), True, True, args) if args.kernel else None
     disk_image_path = boot_cheribsd.maybe_decompress(Path(args.disk_image), True, True, args) if args.disk_image else None
+    test_queue = None
+    static_estimate = []
+    if args.dynamic_sharding:
+        tests = discover_tests(args)
+        duration_files = [Path(f) for f in args.test_durations]
+        if not duration_files and args.xunit_output:
+            duration_files = [Path(args.xunit_output).absolute()]
+        durations = load_test_durations(duration_files)
+        batches = schedule_tests(tests, durations, max(1, args.dynamic_batch_size))
+        boot_cheribsd.success("Distributing ", len(tests), " tests (", len(durations), " with known durations) in ",
+                              len(batches), " batches")
+        static_estimate = estimate_static_shard_times(tests, durations, args.parallel_jobs)
+        test_queue = Queue()
+        for batch in batches:
+            test_queue.put(batch)
+        for i in range(args.parallel_jobs):
+            test_queue.put(None)  # tell the shards that there are no more tests
     for i in range(args.parallel_jobs):
         shard_num = i + 1
         boot_cheribsd.info(args)
         p = Process(target=run_shard, args=(mp_q, mp_barrier, shard_num, args.parallel_jobs, ssh_port_queue,
-                                            kernel_path, disk_image_path, args.build_dir))
+                                            kernel_path, disk_image_path, args.build_dir, test_queue))
         p.stage = run_remote_lit_test.MultiprocessStages.FINDING_SSH_PORT
         p.daemon = True  # kill process on parent exit
         p.name = "<LIBCXX test shard " + str(shard_num) + ">"
@@ -141,13 +267,22 @@ def run_parallel(args: argparse.Namespace):
         processes.append(p)
         atexit.register(p.terminate)
     dump_processes(processes)
+    starttime = time.time()
     try:
-        return run_parallel_impl(args, processes, mp_q, mp_barrier, ssh_port_queue)
+        result = run_parallel_impl(args, processes, mp_q, mp_barrier, ssh_port_queue)
+        if test_queue is not None:
+            report_dynamic_sharding(processes, static_estimate)
+        return result
     except BaseException as e:
         boot_cheribsd.info("Got error while running run_parallel_impl (", type(e), "): ", e)
         raise
     finally:
         wait_or_terminate_all_shards(processes, max_time=5, timed_out=False)
+        if args.disk_image_overlay and disk_image_path is not None:
+            # Shards that were killed (or crashed) did not get a chance to delete their disk image overlay
+            for p in processes:
+                boot_cheribsd.DiskImageOverlay.remove_leftover_overlays(disk_image_path, p.pid,
+                                                                        keep=args.keep_failed_overlay)
         # merge junit xml files
         if args.xunit_output:
             boot_cheribsd.success("Merging JUnit XML outputs")
@@ -183,6 +318,9 @@ def run_parallel(args: argparse.Namespace):
             result.write(str(xunit_file))
             if args.pretend:
                 print(xunit_file.read_text())
+            else:
+                duration_history.record_junit_results(_history_suite_name(args, args.parallel_jobs), [xunit_file],
+                                                      wall_time=time.time() - starttime)
             boot_cheribsd.success("Done merging JUnit XML outputs into ", xunit_file)
             print("Duration: ", result.time)
             print("Tests: ", result.tests)
@@ -249,8 +387,11 @@ def run_parallel_impl(args: argparse.Namespace, processes: "typing.List[Process]
     # wait for the success/failure message from the process:
     # if the shard takes longer than 4 hours to run something went wrong
     start_time = datetime.datetime.utcnow()
-    max_test_duration = datetime.timedelta(seconds=4 * 60 * 60)
+    # Use the durations of previous runs to choose the timeout (defaulting to 4 hours)
+    max_test_duration = datetime.timedelta(seconds=duration_history.adaptive_timeout(
+        _history_suite_name(args, len(processes)), 4 * 60 * 60))
     test_end_time = start_time + max_test_duration
+    next_eta_report = start_time + datetime.timedelta(minutes=10)
     # If any shard has not yet booted CheriBSD after 10 minutes something went horribly wrong
     max_boot_time = datetime.timedelta(seconds=10 * 60) if not args.pretend else datetime.timedelta(seconds=5)
     boot_cheribsd.info("Waiting for all shards to boot...")
@@ -276,7 +417,11 @@ def run_parallel_impl(args: argparse.Namespace, processes: "typing.List[Process]
                 continue
 
         mp_debug(args, "Still waiting for ", remaining_processes, " to finish")
-        if boot_end_time > test_end_time:
+        if loop_start_time > next_eta_report:
+            next_eta_report = loop_start_time + datetime.timedelta(minutes=10)
+            duration_history.report_eta(_history_suite_name(args, len(processes)),
+                                        (loop_start_time - start_time).total_seconds())
+        if loop_start_time > test_end_time:
             timed_out = True
             boot_cheribsd.failure("Reached test timeout of", max_test_duration, " with ", len(remaining_processes),
                                   "shards remaining: ", remaining_processes, exit=False)
@@ -292,6 +437,8 @@ def run_parallel_impl(args: argparse.Namespace, processes: "typing.List[Process]
             if shard_result[0] == run_remote_lit_test.COMPLETED:
                 boot_cheribsd.success("===> Shard ", shard_result[1], " completed successfully.")
                 mp_debug(args, "Shard ", target_process, "exited!")
+                if len(shard_result) > 2:
+                    target_process.stats = shard_result[2]
                 if target_process in remaining_processes:
                     remaining_processes.remove(target_process)
                 target_process.stage = run_remote_lit_test.MultiprocessStages.EXITED
@@ -41,6 +41,7 @@ import sys
 import typing
 from pathlib import Path
 from enum import Enum
+from queue import Empty
 from run_tests_common import *
 
 KERNEL_PANIC = False
@@ -105,7 +106,8 @@ def flush_thread(f, qemu: pexpect.spawn, should_exit_event: threading.Event):
 
 def run_remote_lit_tests(testsuite: str, qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace, tempdir: str,
                          mp_q: multiprocessing.Queue = None, barrier: multiprocessing.Barrier = None,
-                         llvm_lit_path: str = None, lit_extra_args: list = None) -> bool:
+                         llvm_lit_path: str = None, lit_extra_args: list = None,
+                         test_queue: multiprocessing.Queue = None) -> bool:
     try:
         import psutil
     except ImportError:
@@ -113,10 +115,12 @@ def run_remote_lit_tests(testsuite: str, qemu: boot_cheribsd.CheriBSDInstance, a
     try:
         if mp_q:
             assert barrier is not None
+        stats = dict()
         result = run_remote_lit_tests_impl(testsuite=testsuite, qemu=qemu, args=args, tempdir=tempdir, barrier=barrier,
-                                           mp_q=mp_q, llvm_lit_path=llvm_lit_path, lit_extra_args=lit_extra_args)
+                                           mp_q=mp_q, llvm_lit_path=llvm_lit_path, lit_extra_args=lit_extra_args,
+                                           test_queue=test_queue, stats=stats)
         if mp_q:
-            mp_q.put((COMPLETED, args.internal_shard))
+            mp_q.put((COMPLETED, args.internal_shard, stats))
         return result
     except:
         if mp_q:
@@ -126,8 +130,62 @@ def run_remote_lit_tests(testsuite: str, qemu: boot_cheribsd.CheriBSDInstance, a
         raise
 
 
+def run_lit_batches(lit_cmd: list, test_queue: multiprocessing.Queue, xunit_file: "typing.Optional[Path]",
+                    test_build_dir: Path, shard_prefix: str, stats: dict) -> bool:
+    """
+    Keep running batches of tests from test_queue until the main process sends None (i.e. the queue is empty).
+    Each batch writes a separate JUnit XML file, these are merged into xunit_file once all batches are done.
+    """
+    start = time.time()
+    busy_time = 0.0
+    all_passed = True
+    batch_xunit_files = []
+    num_tests = 0
+    while True:
+        try:
+            batch = test_queue.get(timeout=60)
+        except Empty:
+            boot_cheribsd.failure(shard_prefix, "Timed out waiting for the next batch of tests", exit=False)
+            break
+        if batch is None:
+            break
+        cmd = lit_cmd.copy()
+        if xunit_file:
+            batch_xunit = xunit_file.with_name("batch-" + str(len(batch_xunit_files) + 1) + "-" + xunit_file.name)
+            batch_xunit_files.append(batch_xunit)
+            cmd.extend(["--xunit-xml-output", str(batch_xunit)])
+        # lit maps paths inside the build directory test suite back to the source directory
+        cmd.extend("test/" + test for test in batch)
+        boot_cheribsd.info(shard_prefix, "Running batch of ", len(batch), " tests (", num_tests, " done so far)")
+        batch_start = time.time()
+        try:
+            boot_cheribsd.run_host_command(cmd, cwd=str(test_build_dir))
+        except subprocess.CalledProcessError as e:
+            # Should only ever return 1 (otherwise something else went wrong!)
+            if e.returncode != 1:
+                raise
+            boot_cheribsd.failure(shard_prefix + "SOME TESTS FAILED: ", e, exit=False)
+            all_passed = False
+        busy_time += time.time() - batch_start
+        num_tests += len(batch)
+        if KERNEL_PANIC:
+            boot_cheribsd.failure(shard_prefix, "Not running any more tests after kernel panic", exit=False)
+            break
+    if xunit_file:
+        result = junitparser.JUnitXml()
+        for f in batch_xunit_files:
+            if f.exists():
+                result += junitparser.JUnitXml.fromfile(str(f))
+                f.unlink()
+        result.update_statistics()
+        result.write(str(xunit_file))
+    stats.update(started=start, finished=time.time(), busy=busy_time, batches=len(batch_xunit_files), tests=num_tests)
+    return all_passed
+
+
 def run_remote_lit_tests_impl(testsuite: str, qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace, tempdir: str,
-                              mp_q: multiprocessing.Queue = None, barrier: multiprocessing.Barrier = None, llvm_lit_path: str = None, lit_extra_args: list = None) -> bool:
+                              mp_q: multiprocessing.Queue = None, barrier: multiprocessing.Barrier = None, llvm_lit_path: str = None, lit_extra_args: list = None,
+                              test_queue: multiprocessing.Queue = None, stats: dict = None) -> bool:
     qemu.EXIT_ON_KERNEL_PANIC = False # since we run multiple threads we shouldn't use sys.exit()
     boot_cheribsd.info("PID of QEMU: ", qemu.pid)
 
@@ -206,7 +264,7 @@ Host cheribsd-test-instance
     if llvm_lit_path is None:
         llvm_lit_path = str(test_build_dir / "bin/llvm-lit")
     # Note: we require python 3 since otherwise it seems to deadlock in Jenkins
-    lit_cmd = ["python3", llvm_lit_path, "-j1", "-vv", "-Dexecutor=" + executor, "test"]
+    lit_cmd = ["python3", llvm_lit_path, "-j1", "-vv", "-Dexecutor=" + executor]
     if lit_extra_args:
         lit_cmd.extend(lit_extra_args)
     if args.lit_debug_output:
@@ -215,16 +273,21 @@ Host cheribsd-test-instance
     lit_cmd.append("--timeout=120")  # 2 minutes max per test (in case there is an infinite loop)
     xunit_file = None  # type: Path
     if args.xunit_output:
-        lit_cmd.append("--xunit-xml-output")
         xunit_file = Path(args.xunit_output).absolute()
         if args.internal_shard:
             xunit_file = xunit_file.with_name("shard-" + str(args.internal_shard) + "-" + xunit_file.name)
-        lit_cmd.append(str(xunit_file))
+        if test_queue is None:
+            lit_cmd.append("--xunit-xml-output")
+            lit_cmd.append(str(xunit_file))
     qemu_logfile = qemu.logfile
+    if test_queue is None:
+        # Otherwise the main process sends us the test files to run (instead of lit's static sharding)
+        lit_cmd.append("test")
     if args.internal_shard:
         assert args.internal_num_shards, "Invalid call!"
-        lit_cmd.append("--num-shards=" + str(args.internal_num_shards))
-        lit_cmd.append("--run-shard=" + str(args.internal_shard))
+        if test_queue is None:
+            lit_cmd.append("--num-shards=" + str(args.internal_num_shards))
+            lit_cmd.append("--run-shard=" + str(args.internal_shard))
         if xunit_file:
             assert qemu_logfile is not None, "Should have a valid logfile when running multiple shards"
             boot_cheribsd.success("Writing QEMU output to ", qemu_logfile)
@@ -238,6 +301,10 @@ Host cheribsd-test-instance
     t.start()
     shard_prefix = "SHARD" + str(args.internal_shard) + ": " if args.internal_shard else ""
     try:
+        if test_queue is not None:
+            boot_cheribsd.success("Starting llvm-lit batches: cd ", test_build_dir, " && ", " ".join(lit_cmd))
+            return run_lit_batches(lit_cmd, test_queue, xunit_file, test_build_dir, shard_prefix,
+                                   stats if stats is not None else dict())
         boot_cheribsd.success("Starting llvm-lit: cd ", test_build_dir, " && ", " ".join(lit_cmd))
         boot_cheribsd.run_host_command(lit_cmd, cwd=str(test_build_dir))
         # lit_proc = pexpect.spawnu(lit_cmd[0], lit_cmd[1:], echo=True, timeout=60, cwd=str(test_build_dir))
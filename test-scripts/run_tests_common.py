@@ -43,8 +43,9 @@ sys.path.insert(1, str(_cheribuild_root))
 import junitparser
 import pexpect
 from pycheribuild import boot_cheribsd
+from pycheribuild.boot_cheribsd import duration_history
 
-__all__ = ["run_tests_main", "boot_cheribsd", "junitparser", "pexpect"]
+__all__ = ["run_tests_main", "boot_cheribsd", "duration_history", "junitparser", "pexpect"]
 
 def run_tests_main(test_function: typing.Callable[[boot_cheribsd.CheriBSDInstance, argparse.Namespace], bool] = None, need_ssh=False,
                    test_setup_function: typing.Callable[[boot_cheribsd.CheriBSDInstance, argparse.Namespace], None] = None,
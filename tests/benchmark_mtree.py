@@ -0,0 +1,99 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+#
+# Parse and write a synthetic METALOG to measure the performance of pycheribuild.mtree.
+# Usage: python3 tests/benchmark_mtree.py [--entries N]
+#
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.mtree import MtreeFile
+
+
+def generate_metalog(entries: int) -> str:
+    """
+    :return: a METALOG similar to the one created by installworld/distribution (unsorted, with tags= and time=
+    attributes) containing the requested number of entries
+    """
+    lines = ["#mtree 2.0", "./usr type=dir uname=root gname=wheel mode=0755 tags=package=runtime"]
+    dirs = []
+    count = 1
+    while count < entries:
+        d = "./usr/dir{}".format(len(dirs))
+        dirs.append(d)
+        lines.append(d + " type=dir uname=root gname=wheel mode=0755 tags=package=runtime")
+        count += 1
+        for i in range(min(100, entries - count)):
+            if i % 50 == 49:
+                # Some entries require the slow path for quoting
+                lines.append(d + "/file\\ with\\ space{} type=file uname=root gname=wheel mode=0644 size=42".format(i))
+            else:
+                lines.append(d + "/file{} type=file uname=root gname=wheel mode=0444 size={} time=1553167427.0 "
+                                 "tags=package=runtime".format(i, i * 17))
+            count += 1
+    # installworld writes the files in a mostly random order
+    lines.reverse()
+    return "\n".join(lines) + "\n# END\n"
+
+
+def run_benchmark(entries: int, verbose=True) -> "typing.Dict[str, float]":
+    metalog = generate_metalog(entries)
+    start = time.perf_counter()
+    mtree = MtreeFile(io.StringIO(metalog))
+    parsed = time.perf_counter()
+    # Adding a few files after loading should only require merging and not a full sort
+    for i in range(1000):
+        mtree.add_dir("extra/dir{}".format(i), print_status=False)
+    output = io.StringIO()
+    mtree.write(output)
+    written = time.perf_counter()
+    result = {"entries": len(mtree._mtree), "parse": parsed - start, "write": written - parsed}
+    if verbose:
+        print("Parsed {} entries in {:.2f}s ({:.0f} entries/s)".format(entries, result["parse"],
+                                                                     entries / result["parse"]))
+        print("Wrote {} entries in {:.2f}s ({:.0f} entries/s)".format(result["entries"], result["write"],
+                                                                    result["entries"] / result["write"]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark METALOG parsing and writing")
+    parser.add_argument("--entries", type=int, default=500000, help="Number of entries in the synthetic METALOG")
+    args = parser.parse_args()
+    run_benchmark(args.entries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from pycheribuild.projects.project import Project, SourceRepository
+from setup_mock_chericonfig import setup_mock_chericonfig, MockConfig
+
+
+class ReplayProject(Project):
+    doNotAddToTargets = True
+    projectName = "replay-build-log"
+    target = "replay-build-log"
+
+    def __init__(self, config: MockConfig):
+        self.sourceDir = config.sourceRoot / "source"
+        self.buildDir = config.sourceRoot / "build"
+        self.installDir = config.sourceRoot / "install"
+        self.repository = SourceRepository()
+        super().__init__(config)
+        os.makedirs(str(self.buildDir), exist_ok=True)
+
+
+def generate_build_log(path: Path, size: int):
+    """Writes a log that looks like the output of a CheriBSD buildworld"""
+    rng = random.Random(42)
+    dirs = ["lib/libc", "lib/libc++", "usr.bin/clang/clang", "sys/modules/zfs", "bin/sh", "usr.sbin/bhyve"]
+    written = 0
+    with path.open("wb") as f:
+        while written < size:
+            subdir = rng.choice(dirs)
+            lines = [b"--------------------------------------------------------------\n",
+                     b">>> stage 4.2: building libraries\n"] if rng.random() < 0.001 else []
+            lines.append(b"===> " + subdir.encode("utf-8") + b" (all)\n")
+            for i in range(rng.randint(5, 50)):
+                source = "{}/file{}.c".format(subdir, rng.randint(0, 1000)).encode("utf-8")
+                lines.append(b"/usr/local/bin/clang -target mips64-unknown-freebsd -O2 -pipe -fno-common "
+                             b"-DNO__SCCSID -I/src/include -Wall -Wno-error=unused -c " + source + b" -o " +
+                             source[:-1] + b"o\n")
+                if rng.random() < 0.01:
+                    lines.append(source + b":12:5: warning: unused variable 'x' [-Wunused-variable]\n")
+            chunk = b"".join(lines)
+            f.write(chunk)
+            written += len(chunk)
+
+
+def replay(project: ReplayProject, log: Path, pipeline: bool, compression: str) -> "typing.Tuple[float, float]":
+    project.config.output_pipeline = pipeline
+    project.config.logfile_compression = compression
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    project.runWithLogfile(["cat", str(log)], "replay", stdoutFilter=project._stdoutFilter, cwd=project.buildDir)
+    return time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a build log through the line-based and the chunked output "
+                                                 "handling of Project.runWithLogfile()")
+    parser.add_argument("--log", type=Path, help="Recorded build log to replay (default: generate a synthetic "
+                                                 "buildworld log)")
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of the generated log (default: 1024)")
+    parser.add_argument("--compression", default="none", choices=("none", "gzip", "zstd"))
+    args = parser.parse_args()
+    if os.getenv("PYTHONUNBUFFERED"):
+        print("Warning: PYTHONUNBUFFERED is set, every write to stdout will be a separate system call",
+              file=sys.stderr)
+    with tempfile.TemporaryDirectory() as td:
+        config = setup_mock_chericonfig(Path(td))
+        config.pretend = False
+        config.verbose = False
+        config.quiet = False
+        ReplayProject.setupConfigOptions()
+        project = ReplayProject(config)
+        log = args.log
+        if log is None:
+            log = Path(td, "recorded.log")
+            print("Generating a", args.size_mb, "MiB build log in", log, file=sys.stderr)
+            generate_build_log(log, args.size_mb * 1024 * 1024)
+        # Send the terminal output to /dev/null (the flushes still cost system calls)
+        saved_stdout = os.dup(1)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        results = dict()
+        try:
+            os.dup2(devnull, 1)
+            for name, pipeline in (("line-based", False), ("pipeline", True)):
+                results[name] = replay(project, log, pipeline, args.compression)
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_stdout, 1)
+        for name, (wall, cpu) in results.items():
+            print("{:10} wall={:.2f}s cpu={:.2f}s".format(name + ":", wall, cpu))
+        print("Speedup: {:.1f}x wall time, {:.1f}x cpu time".format(
+            results["line-based"][0] / results["pipeline"][0], results["line-based"][1] / results["pipeline"][1]))
+
+
+if __name__ == "__main__":
+    main()
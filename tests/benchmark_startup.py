@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CHERIBUILD = Path(__file__).parent.parent / "cheribuild.py"
+
+
+def _parse_timings(stderr: str) -> "typing.Dict[str, float]":
+    for line in stderr.splitlines():
+        if line.startswith("cheribuild startup:"):
+            return {k: float(v[:-2]) for k, v in (part.split("=") for part in line.split()[2:])}
+    raise ValueError("Could not find startup timings in output: " + stderr)
+
+
+def time_startup(args: "typing.List[str]", lazy: bool, index_path: Path) -> "typing.Dict[str, float]":
+    env = os.environ.copy()
+    env.update(CHERIBUILD_STARTUP_TIMING="1", CHERIBUILD_LAZY_LOADING="1" if lazy else "0",
+               CHERIBUILD_TARGET_INDEX=str(index_path))
+    process = subprocess.Popen([sys.executable, str(CHERIBUILD)] + args, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    _, stderr = process.communicate()
+    return _parse_timings(stderr)
+
+
+def run_benchmark(args: "typing.List[str]", runs: int, verbose=True) -> "typing.Dict[str, typing.Dict[str, float]]":
+    """
+    :return: the median startup phase times (in ms) for eager and lazy loading of the project modules
+    """
+    result = dict()
+    with tempfile.TemporaryDirectory() as td:
+        index_path = Path(td, "target-index.json")
+        time_startup(args, lazy=True, index_path=index_path)  # generate the index
+        for mode in ("eager", "lazy"):
+            samples = [time_startup(args, mode == "lazy", index_path) for _ in range(runs)]
+            result[mode] = {phase: statistics.median(s[phase] for s in samples) for phase in samples[0]}
+            if verbose:
+                print("{:6} {}".format(mode + ":", " ".join("{}={:.1f}ms".format(k, v)
+                                                            for k, v in result[mode].items())))
+    if verbose:
+        print("Lazy loading speedup: {:.1f}x".format(result["eager"]["total"] / result["lazy"]["total"]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cheribuild startup time (importing the project "
+                                                 "modules and registering their command line options)")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per mode")
+    parser.add_argument("cheribuild_args", nargs="*", default=["--pretend", "--skip-update", "qemu"],
+                        help="Arguments to pass to cheribuild (default: --pretend --skip-update qemu)")
+    args = parser.parse_args()
+    run_benchmark(args.cheribuild_args, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+#
+# Measure the overhead of cheribuild itself (startup, target resolution, config loading, METALOG handling and
+# async deletion) and store the results as JSON so that two commits can be compared offline:
+#   python3 tests/benchmark_suite.py --output before.json
+#   git checkout ...; python3 tests/benchmark_suite.py --output after.json
+#   python3 tests/benchmark_suite.py --compare before.json after.json
+#
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+try:
+    import typing
+except ImportError:
+    typing = {}
+
+RESULTS_VERSION = 1
+
+
+# python 3.4 compatibility
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+class BenchmarkParameters(object):
+    def __init__(self, quick=False):
+        self.startup_args = ["--pretend", "--skip-update", "qemu"]
+        self.config_include_depth = 5 if quick else 50
+        self.config_keys = 20 if quick else 500
+        self.metalog_entries = 5000 if quick else 500000
+        self.delete_files = 500 if quick else 100000
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def bench_startup(params: BenchmarkParameters) -> "typing.Dict[str, float]":
+    """Run cheribuild with all project modules loaded eagerly (as if the target index was missing)"""
+    from benchmark_startup import time_startup
+    with tempfile.TemporaryDirectory() as td:
+        timings = time_startup(params.startup_args, lazy=False, index_path=Path(td, "target-index.json"))
+    # time_startup() reports milliseconds
+    return {phase: value / 1000 for phase, value in timings.items()}
+
+
+def _resolve_targets(config, targets: "typing.List[str]", include_dependencies: bool) -> int:
+    from pycheribuild.targets import targetManager
+    targetManager.reset()
+    # Start with cold caches, otherwise only the first run would compute the dependencies
+    for t in targetManager.targets:
+        t.projectClass._cached_deps = None
+    config.targets = targets
+    config.includeDependencies = include_dependencies
+    return len(targetManager.get_all_chosen_targets(config))
+
+
+def bench_target_resolution(params: BenchmarkParameters) -> "typing.Dict[str, float]":
+    from pycheribuild.targets import targetManager
+    from pycheribuild.target_index import load_all_projects
+    from setup_mock_chericonfig import setup_mock_chericonfig
+    config = setup_mock_chericonfig(Path("/this/path/does/not/exist"))
+    config.verbose = False
+    load_all_projects()  # make sure targetManager contains all targets
+    targetManager.registerCommandLineOptions()
+    result = dict()
+    for name in ("run", "sdk"):
+        start = time.perf_counter()
+        _resolve_targets(config, [name], include_dependencies=False)
+        result[name] = time.perf_counter() - start
+    all_targets = sorted(targetManager.targetNames)
+    start = time.perf_counter()
+    for name in all_targets:
+        _resolve_targets(config, [name], include_dependencies=True)
+    result["include-dependencies-all"] = time.perf_counter() - start
+    return result
+
+
+def generate_config_chain(directory: Path, depth: int, keys: int) -> Path:
+    """
+    :return: the first file of a chain of depth JSON config files that each #include the next one and set the
+    same (nested) options so that every level has to be merged
+    """
+    for level in range(depth):
+        contents = {"#include": "level{}.json".format(level + 1)} if level + 1 < depth else {}
+        for i in range(keys):
+            contents["option-{}".format(i)] = "value-{}-{}".format(level, i)
+            contents["target-{}".format(i)] = {"build-directory": "/build/{}/{}".format(level, i),
+                                               "nested": {"flag": level % 2 == 0, "jobs": level}}
+        with Path(directory, "level{}.json".format(level)).open("w", encoding="utf-8") as f:
+            f.write("// generated by benchmark_suite.py\n")
+            json.dump(contents, f, indent=4)
+    return Path(directory, "level0.json")
+
+
+def bench_config_loading(params: BenchmarkParameters) -> "typing.Dict[str, float]":
+    from pycheribuild.config.loader import JsonAndCommandLineConfigLoader
+    with tempfile.TemporaryDirectory() as td:
+        config_file = generate_config_chain(Path(td), params.config_include_depth, params.config_keys)
+        loader = JsonAndCommandLineConfigLoader()
+        loader._configPath = config_file
+        start = time.perf_counter()
+        # noinspection PyProtectedMember
+        loader._load_json_config_file()
+        elapsed = time.perf_counter() - start
+        # noinspection PyProtectedMember
+        assert len(loader._JSON) >= 2 * params.config_keys, "config was not loaded correctly"
+    return {"load": elapsed}
+
+
+def bench_mtree(params: BenchmarkParameters) -> "typing.Dict[str, float]":
+    from benchmark_mtree import run_benchmark
+    result = run_benchmark(params.metalog_entries, verbose=False)
+    del result["entries"]
+    return result
+
+
+def bench_async_delete(params: BenchmarkParameters) -> "typing.Dict[str, float]":
+    from pycheribuild.filesystemutils import FileSystemUtils
+    from setup_mock_chericonfig import setup_mock_chericonfig
+    with tempfile.TemporaryDirectory() as td:
+        config = setup_mock_chericonfig(Path(td))
+        config.pretend = False
+        config.verbose = False
+        config.quiet = True
+        tree = config.buildRoot / "tree"
+        for i in range(params.delete_files):
+            if i % 100 == 0:
+                subdir = tree / "dir{}".format(i // 100)
+                subdir.mkdir(parents=True)
+            # noinspection PyUnboundLocalVariable
+            write_bytes(subdir / "file{}".format(i), b"x" * 64)
+        start = time.perf_counter()
+        cleaner = FileSystemUtils(config).asyncCleanDirectory(tree)
+        returned = time.perf_counter()
+        with cleaner:
+            pass
+        finished = time.perf_counter()
+        assert tree.is_dir() and not list(tree.iterdir())
+    # How long the caller is blocked and how long until the tree is actually gone
+    return {"blocking": returned - start, "total": finished - start}
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "target-resolution": bench_target_resolution,
+    "config-loading": bench_config_loading,
+    "mtree": bench_mtree,
+    "async-delete": bench_async_delete,
+}
+
+
+def _git_commit() -> "typing.Optional[str]":
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(Path(__file__).parent),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def run_benchmarks(names: "typing.List[str]", params: BenchmarkParameters, runs: int, verbose=True) -> dict:
+    results = dict()
+    for name in names:
+        samples = [BENCHMARKS[name](params) for _ in range(runs)]
+        results[name] = {metric: {"median": statistics.median(s[metric] for s in samples),
+                                  "min": min(s[metric] for s in samples),
+                                  "samples": [s[metric] for s in samples]} for metric in samples[0]}
+        if verbose:
+            print("{:20} {}".format(name + ":", " ".join("{}={:.4f}s".format(k, v["median"])
+                                                         for k, v in results[name].items())))
+    return {
+        "version": RESULTS_VERSION,
+        "commit": _git_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+        "parameters": params.as_dict(),
+        "results": results,
+    }
+
+
+def compare_results(old: dict, new: dict, threshold: float) -> "typing.List[typing.Tuple[str, float, float, bool]]":
+    """
+    :return: (benchmark/metric, old median, new median, regressed) for all metrics that exist in both results
+    """
+    if old.get("parameters") != new.get("parameters"):
+        print("Warning: results were generated with different parameters", file=sys.stderr)
+    comparison = []
+    for name, metrics in sorted(new["results"].items()):
+        for metric, value in sorted(metrics.items()):
+            old_value = old["results"].get(name, {}).get(metric)
+            if old_value is None:
+                continue
+            before, after = old_value["median"], value["median"]
+            comparison.append((name + "/" + metric, before, after, after > before * (1 + threshold)))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of cheribuild itself")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per benchmark (default: 5)")
+    parser.add_argument("--quick", action="store_true", help="Use small inputs (e.g. to check that the suite works)")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"),
+                        help="Compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="Percentage slowdown that is reported as a regression by --compare (default: 10)")
+    parser.add_argument("benchmarks", nargs="*", choices=sorted(BENCHMARKS.keys()) + [[]],
+                        help="Benchmarks to run (default: all)")
+    args = parser.parse_args()
+    if args.compare:
+        with args.compare[0].open("r", encoding="utf-8") as f:
+            old = json.load(f)
+        with args.compare[1].open("r", encoding="utf-8") as f:
+            new = json.load(f)
+        print("Comparing", old.get("commit"), "->", new.get("commit"))
+        regressions = 0
+        for name, before, after, regressed in compare_results(old, new, args.threshold / 100):
+            change = (after - before) / before * 100 if before else 0.0
+            print("{:45} {:10.4f}s {:10.4f}s {:+7.1f}%{}".format(name, before, after, change,
+                                                                 "  REGRESSION" if regressed else ""))
+            regressions += regressed
+        sys.exit(1 if regressions else 0)
+    results = run_benchmarks(args.benchmarks or sorted(BENCHMARKS.keys()), BenchmarkParameters(args.quick),
+                             args.runs)
+    if args.output:
+        with args.output.open("w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Wrote results to", args.output)
+
+
+if __name__ == "__main__":
+    main()
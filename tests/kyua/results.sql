@@ -0,0 +1,62 @@
+-- A small kyua results database (schema version 3 as written by `kyua test`) used to check that the host-native
+-- JUnit converter produces the same test cases as `kyua report-junit` (see results-report-junit.xml).
+CREATE TABLE metadata (schema_version INTEGER PRIMARY KEY CHECK (schema_version >= 1), timestamp TIMESTAMP NOT NULL);
+CREATE TABLE contexts (cwd TEXT NOT NULL);
+CREATE TABLE env_vars (var_name TEXT PRIMARY KEY, var_value TEXT NOT NULL);
+CREATE TABLE metadatas (metadata_id INTEGER NOT NULL, property_name TEXT NOT NULL, property_value TEXT,
+                        PRIMARY KEY (metadata_id, property_name));
+CREATE TABLE test_programs (test_program_id INTEGER PRIMARY KEY AUTOINCREMENT, absolute_path TEXT NOT NULL,
+                            root TEXT NOT NULL, relative_path TEXT NOT NULL, test_suite_name TEXT NOT NULL,
+                            metadata_id INTEGER REFERENCES metadatas, interface TEXT NOT NULL);
+CREATE TABLE test_cases (test_case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         test_program_id INTEGER REFERENCES test_programs, name TEXT NOT NULL,
+                         metadata_id INTEGER REFERENCES metadatas);
+CREATE TABLE test_results (test_case_id INTEGER PRIMARY KEY REFERENCES test_cases, result_type TEXT NOT NULL,
+                           result_reason TEXT, start_time INTEGER NOT NULL, end_time INTEGER NOT NULL);
+CREATE TABLE files (file_id INTEGER PRIMARY KEY, contents BLOB NOT NULL);
+CREATE TABLE test_case_files (test_case_id INTEGER NOT NULL REFERENCES test_cases, file_name TEXT NOT NULL,
+                              file_id INTEGER NOT NULL REFERENCES files, PRIMARY KEY (test_case_id, file_name));
+
+INSERT INTO metadata VALUES (3, 1562000000000000);
+INSERT INTO contexts VALUES ('/usr/tests');
+INSERT INTO env_vars VALUES ('HOME', '/root');
+INSERT INTO env_vars VALUES ('PATH', '/sbin:/bin:/usr/sbin:/usr/bin');
+
+INSERT INTO metadatas VALUES (1, 'allowed_architectures', '');
+INSERT INTO metadatas VALUES (1, 'has_cleanup', 'false');
+INSERT INTO metadatas VALUES (1, 'timeout', '300');
+INSERT INTO metadatas VALUES (2, 'description', 'Checks that <, > and & are escaped');
+INSERT INTO metadatas VALUES (2, 'has_cleanup', 'true');
+INSERT INTO metadatas VALUES (2, 'timeout', '300');
+INSERT INTO metadatas VALUES (3, 'required_user', 'root');
+
+INSERT INTO test_programs VALUES (1, '/usr/tests/lib/libc/string/strcmp_test', '/usr/tests',
+                                  'lib/libc/string/strcmp_test', 'FreeBSD', 1, 'atf');
+INSERT INTO test_programs VALUES (2, '/usr/tests/bin/sh/builtins', '/usr/tests', 'bin/sh/builtins', 'FreeBSD', 1,
+                                  'tap');
+
+-- Inserted out of order to check that the output is sorted by test program path and test case name
+INSERT INTO test_cases VALUES (1, 1, 'strcmp_simple', 1);
+INSERT INTO test_cases VALUES (2, 1, 'strcmp_escape', 2);
+INSERT INTO test_cases VALUES (3, 1, 'strcmp_unaligned', 1);
+INSERT INTO test_cases VALUES (4, 2, 'main', 3);
+INSERT INTO test_cases VALUES (5, 1, 'strcmp_broken', 1);
+INSERT INTO test_cases VALUES (6, 2, 'xfail', 3);
+
+INSERT INTO test_results VALUES (1, 'passed', NULL, 1562000000000000, 1562000001500000);
+INSERT INTO test_results VALUES (2, 'failed', 'strcmp("<a>", "&b") != 0', 1562000001500000, 1562000001500400);
+INSERT INTO test_results VALUES (3, 'skipped', 'Requires a 64-bit platform', 1562000002000000, 1562000002000000);
+INSERT INTO test_results VALUES (4, 'broken', 'Premature exit; test case received signal 34 (core dumped)',
+                                 1562000003000000, 1562000013250000);
+INSERT INTO test_results VALUES (5, 'broken', 'Test case timed out', 1562000020000000, 1562000320001000);
+INSERT INTO test_results VALUES (6, 'expected_failure', 'Known bug', 1562000400000000, 1562000400012345);
+
+INSERT INTO files VALUES (1, CAST('Testing strcmp' || char(10) || 'caf' || char(233) || ' ok' || char(10) AS BLOB));
+INSERT INTO files VALUES (2, X'6265666f726501061b5b306d0d0a6166746572090a');
+INSERT INTO files VALUES (3, CAST('Assertion failed: a < b && "x"' || char(10) AS BLOB));
+INSERT INTO files VALUES (4, X'696e76616c6964207574662d383a20ff0a');
+
+INSERT INTO test_case_files VALUES (1, '__STDOUT__', 1);
+INSERT INTO test_case_files VALUES (2, '__STDOUT__', 2);
+INSERT INTO test_case_files VALUES (2, '__STDERR__', 3);
+INSERT INTO test_case_files VALUES (4, '__STDERR__', 4);
@@ -47,6 +47,7 @@ class MockConfig(CheriConfig):
         self.force = True
         self.write_logfile = True
         self.test_extra_args = []
+        self.detach_deletions = False
         self.load()
 
         # for the async delete test:
@@ -486,3 +486,67 @@ def test_default_arch(target: str, args: list, expected: str):
     builddir = target.get_or_create_project(None, config).buildDir
     assert isinstance(builddir, Path)
     assert builddir.name == expected
+
+
+def test_parallel_worker_command():
+    from pycheribuild.targets import ParallelTargetExecutor
+    args = ["--cheribsd/subdir", "qemu", "llvm", "--skip-update", "--explain-deps=run", "-j4", "sdk"]
+    config = _parse_arguments(args)
+    assert config.targets == ["llvm", "sdk"]
+    assert config.loader.positional_argument_indices(args) == {2, 6}
+    config.parallel_targets = 2
+    executor = ParallelTargetExecutor(config, [targetManager.get_target_raw("llvm")])
+    worker_args = executor.worker_command(targetManager.get_target_raw("llvm"), make_jobs=8)[1:]
+    # The option value "qemu" must be kept even though it is also the name of a target
+    assert worker_args == ["--cheribsd/subdir", "qemu", "--skip-update", "--explain-deps=run", "-j4",
+                           "--parallel-worker", "--parallel-targets=1", "--make-jobs=8", "llvm"]
+
+
+@pytest.mark.parametrize("include_deps_args", [["-d"], ["--include-dependencies"], ["--include-dep"],
+                                               ["--no-include-dependencies"], []])
+def test_parallel_worker_builds_only_one_target(include_deps_args):
+    from pycheribuild.targets import ParallelTargetExecutor
+    # sdk is always built with its dependencies (dependenciesMustBeBuilt) unless it is built by a worker process
+    args = include_deps_args + ["--skip-update", "sdk", "qemu"]
+    config = _parse_arguments(args)
+    assert len(targetManager.get_all_chosen_targets(config)) > 2
+    sdk = targetManager.get_target_raw("sdk")
+    worker_args = ParallelTargetExecutor(config, [sdk]).worker_command(sdk, make_jobs=2)[1:]
+    assert worker_args == ["--skip-update", "--parallel-worker", "--parallel-targets=1", "--make-jobs=2", "sdk"]
+    config = _parse_arguments(worker_args)
+    assert [t.name for t in targetManager.get_all_chosen_targets(config)] == ["sdk"]
+
+
+def test_build_cache_global_options():
+    def global_options(args):
+        config = _parse_arguments(args)
+        project = targetManager.get_target("qemu", None, config).get_or_create_project(None, config)
+        # noinspection PyProtectedMember
+        return project._fingerprint_options()[1]
+    default = global_options([])
+    assert "cheri-bits" in default and "verbose" not in default and "make-jobs" not in default
+    assert global_options(["--cheri-bits=256"]) != default
+    assert global_options(["-v", "-j3", "--skip-update", "--pretend"]) == default
+
+
+@pytest.mark.parametrize("target,architecture", [
+    pytest.param("run", None),
+    pytest.param("run-purecap", None),
+    pytest.param("rtld-tests-cheri", "cheri128"),
+])
+def test_run_tests_architecture(monkeypatch, target, architecture):
+    import pycheribuild.projects.project
+    import pycheribuild.utils
+    commands = []
+    monkeypatch.setattr(pycheribuild.projects.project, "runCmd", lambda cmd, **kwargs: commands.append(cmd))
+    config = _parse_arguments(["--pretend", "--test", "--cheri-bits=128", target])
+    # Missing kernels and QEMU binaries are only fatal errors when not pretending
+    monkeypatch.setattr(pycheribuild.utils, "_cheriConfig", config)
+    project = targetManager.get_target(target, None, config).get_or_create_project(None, config)
+    project.run_cheribsd_test_script("run_cheribsd_tests.py")
+    assert len(commands) == 1
+    if architecture is None:
+        # The run targets are not cross-compiled -> no --architecture argument
+        assert "--architecture" not in commands[0]
+    else:
+        assert commands[0][commands[0].index("--architecture") + 1] == architecture
@@ -0,0 +1,111 @@
+import csv
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.benchmark_report import (BenchmarkReport, geometric_mean, median, median_confidence_interval,
+                                           statcounters_configuration_name, welch_t_test)
+
+_HEADER = "progname,archname,cycles,instructions,dcache_read_miss\n"
+# Deterministic noise so that the tests don't depend on a random seed
+_NOISE = (0.0, 0.004, -0.003, 0.002, -0.005, 0.001, 0.003, -0.002, 0.005, -0.001)
+
+
+def _write_statcounters_csv(path: Path, cycles: "typing.Dict[str, float]", archname="mips", repeat_header=False):
+    with path.open("w") as f:
+        f.write(_HEADER)
+        for benchmark, value in cycles.items():
+            for i, noise in enumerate(_NOISE):
+                if repeat_header and i == 5:
+                    f.write(_HEADER)  # libstatcounters writes a header for every run appending to the file
+                # The instruction count is the same for all configurations
+                f.write("{},{},{},{},{}\n".format(benchmark, archname, int(value * (1 + noise)), len(benchmark) * 1000,
+                                                   42))
+    return path
+
+
+def test_statistics():
+    assert median([3, 1, 2]) == 2
+    assert median([4, 1, 3, 2]) == 2.5
+    assert abs(geometric_mean([1, 4, 16]) - 4) < 1e-9
+    assert geometric_mean([]) is None
+    assert geometric_mean([1, 0]) is None
+    # The 95% confidence interval of the median of 10 samples are the 2nd and 9th order statistics
+    assert median_confidence_interval(list(range(1, 11))) == (2, 9)
+    assert median_confidence_interval([5, 1, 3]) == (1, 5)
+    assert median_confidence_interval([7]) == (7, 7)
+
+
+def test_welch_t_test():
+    assert welch_t_test([1], [2, 3]) is None
+    assert welch_t_test([5, 5, 5], [5, 5]) == 1.0
+    assert welch_t_test([5, 5, 5], [6, 6]) == 0.0
+    # t = -1.866 with 5.57 degrees of freedom
+    assert abs(welch_t_test([1, 2, 3, 4, 5], [2, 4, 6, 8, 11]) - 0.11499) < 1e-4
+    assert welch_t_test([1.0, 1.1, 0.9, 1.05], [1.02, 0.98, 1.01, 0.99]) > 0.5
+
+
+def test_configuration_name():
+    assert statcounters_configuration_name(Path("olden-mips-statcounters-mips-20190701-120000.csv")) == \
+        "olden-mips-mips"
+    assert statcounters_configuration_name(Path("spec2006-statcounters-128-static-20190701-120000.csv")) == \
+        "spec2006-128-static"
+    assert statcounters_configuration_name(Path("results.csv")) == "results"
+
+
+def test_report():
+    with tempfile.TemporaryDirectory() as td:
+        mips = _write_statcounters_csv(Path(td, "mibench-statcounters-mips-20190701-120000.csv"),
+                                       {"qsort": 1000000, "sha": 500000, "crc": 200000})
+        # A second run of the same configuration is merged into the same samples
+        mips2 = _write_statcounters_csv(Path(td, "mibench-statcounters-mips-20190702-120000.csv"),
+                                        {"qsort": 1000000}, repeat_header=True)
+        purecap = _write_statcounters_csv(Path(td, "mibench-statcounters-purecap-20190701-130000.csv"),
+                                          {"qsort": 1200000, "sha": 502000, "crc": 180000}, archname="cheri128")
+        report = BenchmarkReport.from_csv_files([purecap, mips, mips2], baseline="mibench-mips", threshold=1.0)
+        assert list(report.configurations) == ["mibench-purecap", "mibench-mips"]
+        assert report.baseline.name == "mibench-mips"
+        assert len(report.baseline.values("qsort", "cycles")) == 20
+        assert report.benchmarks == ["qsort", "sha", "crc"]
+        comparisons = {(c.benchmark, c.metric): c for c in report.comparisons["mibench-purecap"]}
+        qsort = comparisons[("qsort", "cycles")]
+        assert abs(qsort.overhead - 0.2) < 0.001 and qsort.significant and qsort.regression
+        # +0.4% is statistically significant but below the 1% threshold
+        sha = comparisons[("sha", "cycles")]
+        assert sha.significant and not sha.regression
+        crc = comparisons[("crc", "cycles")]
+        assert crc.overhead < 0 and not crc.regression
+        assert comparisons[("qsort", "instructions")].overhead == 0
+        assert not comparisons[("qsort", "instructions")].significant
+        expected_geomean = (1.2 * 1.004 * 0.9) ** (1 / 3) - 1
+        assert abs(report.geomean_overhead("mibench-purecap", "cycles") - expected_geomean) < 0.001
+        assert [(name, c.benchmark) for name, c in report.regressions] == [("mibench-purecap", "qsort")]
+
+        text = report.to_text()
+        assert "Overhead relative to mibench-mips" in text
+        assert "+20.00%" in text and "REGRESSION" in text
+        assert "1 statistically significant regression(s)" in text
+        rows = list(csv.DictReader(io.StringIO(report.to_csv())))
+        assert len(rows) == 12
+        qsort_row = [r for r in rows if r["configuration"] == "mibench-purecap" and r["benchmark"] == "qsort" and
+                     r["metric"] == "cycles"][0]
+        assert qsort_row["status"] == "regression" and abs(float(qsort_row["overhead"]) - 0.2) < 0.001
+        html = report.to_html()
+        assert html.count('<tr class="regression">') == 1
+        assert html.startswith("<!DOCTYPE html>") and html.rstrip().endswith("</html>")
+
+
+def test_report_unknown_baseline():
+    with tempfile.TemporaryDirectory() as td:
+        csv_file = _write_statcounters_csv(Path(td, "olden-statcounters-mips.csv"), {"bisort": 100})
+        try:
+            BenchmarkReport.from_csv_files([csv_file], baseline="olden-purecap")
+            assert False, "should have raised"
+        except ValueError as e:
+            assert "olden-mips" in str(e)
+        report = BenchmarkReport.from_csv_files([csv_file])
+        assert report.comparisons == {}
+        assert "0 statistically significant regression(s)" in report.to_text()
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from .benchmark_suite import BenchmarkParameters, bench_config_loading, compare_results, run_benchmarks
+
+
+def _results(**medians):
+    results = dict()
+    for key, value in medians.items():
+        name, metric = key.split("__")
+        results.setdefault(name, {})[metric] = {"median": value, "min": value, "samples": [value]}
+    return {"parameters": {}, "results": results}
+
+
+def test_compare_results():
+    old = _results(mtree__parse=1.0, mtree__write=2.0, startup__total=0.5)
+    new = _results(mtree__parse=1.05, mtree__write=3.0, config__load=0.1)
+    # metrics that only exist in one of the files are ignored
+    assert compare_results(old, new, threshold=0.1) == [("mtree/parse", 1.0, 1.05, False),
+                                                        ("mtree/write", 2.0, 3.0, True)]
+    assert compare_results(old, new, threshold=0.01)[0][3]
+
+
+def test_quick_run():
+    params = BenchmarkParameters(quick=True)
+    assert set(bench_config_loading(params).keys()) == {"load"}
+    result = run_benchmarks(["config-loading", "mtree"], params, runs=2, verbose=False)
+    assert result["parameters"]["metalog_entries"] == params.metalog_entries
+    assert set(result["results"].keys()) == {"config-loading", "mtree"}
+    assert len(result["results"]["mtree"]["parse"]["samples"]) == 2
+    assert result["results"]["mtree"]["parse"]["min"] <= result["results"]["mtree"]["parse"]["median"]
@@ -0,0 +1,115 @@
+import os
+import stat
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.cross.cheribsd import BuildFreeBSD, BuildenvQueryCache
+from pycheribuild.projects.project import MakeOptions, MakeCommandKind
+
+# Behaves like `make buildenv BUILDENV_SHELL=...`: runs the shell command, and `make -V VAR` prints /obj/VAR
+_FAKE_BMAKE = """#!/bin/sh
+for arg in "$@"; do
+    case "$arg" in
+        BUILDENV_SHELL=*) echo "buildenv" >> "$(dirname "$0")/invocations"; echo "Entering buildenv"; exec sh -c "${arg#BUILDENV_SHELL=}";;
+    esac
+done
+while [ $# -gt 0 ]; do
+    if [ "$1" = "-V" ]; then echo "/obj/$2"; shift; fi
+    shift
+done
+"""
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def _fake_project(root: Path, pretend=False):
+    bmake = root / "bin" / "bmake"
+    if not bmake.exists():
+        bmake.parent.mkdir(parents=True)
+        write_text(bmake, _FAKE_BMAKE)
+        bmake.chmod(bmake.stat().st_mode | stat.S_IXUSR)
+    os.makedirs(str(root / "src"), exist_ok=True)
+    os.makedirs(str(root / "build"), exist_ok=True)
+    config = SimpleNamespace(pretend=pretend, verbose=False)
+    project = SimpleNamespace(config=config, crossbuild=False, sourceDir=root / "src", buildDir=root / "build",
+                              target="freebsd", find_real_bmake_binary=lambda: bmake,
+                              get_crosscompile_target=lambda c: "native", verbose_print=lambda *args: None,
+                              _buildenv_query_cache=None)
+    project.buildenv_query_cache = BuildFreeBSD.buildenv_query_cache.fget(project)
+    project._query_buildenv_paths = lambda args, variables: BuildFreeBSD._query_buildenv_paths(project, args, variables)
+    return project, bmake.parent / "invocations"
+
+
+def _query(project, args: MakeOptions, *variables):
+    return BuildFreeBSD._query_buildenv_paths(project, args, list(variables))
+
+
+def _invocations(path: Path) -> int:
+    return len(read_text(path).splitlines()) if path.exists() else 0
+
+
+def test_buildenv_queries_are_cached():
+    with tempfile.TemporaryDirectory() as td:
+        project, invocations = _fake_project(Path(td))
+        args = MakeOptions(MakeCommandKind.BsdMake, project)
+        args.set(TARGET="mips")
+        assert _query(project, args, ".OBJDIR", "WORLDTMP") == {".OBJDIR": Path("/obj/.OBJDIR"),
+                                                                 "WORLDTMP": Path("/obj/WORLDTMP")}
+        assert _invocations(invocations) == 1
+        # Every variable returned by the first query is cached
+        assert BuildFreeBSD._query_buildenv_path(project, args, "WORLDTMP") == Path("/obj/WORLDTMP")
+        assert _invocations(invocations) == 1
+        assert (project.buildenv_query_cache.hits, project.buildenv_query_cache.misses) == (1, 1)
+        # A new variable or different make options require a new query
+        assert _query(project, args, "KERNEL_OBJDIR") == {"KERNEL_OBJDIR": Path("/obj/KERNEL_OBJDIR")}
+        args.set(TARGET="riscv")
+        assert _query(project, args, ".OBJDIR")
+        assert _invocations(invocations) == 3
+        args.set(TARGET="mips")
+        args.set_env(MAKEOBJDIRPREFIX="/other")
+        assert _query(project, args, ".OBJDIR")
+        assert _invocations(invocations) == 4
+        # The cache is persisted in the build directory
+        project, invocations = _fake_project(Path(td))
+        args = MakeOptions(MakeCommandKind.BsdMake, project)
+        args.set(TARGET="mips")
+        assert _query(project, args, "WORLDTMP", "KERNEL_OBJDIR")
+        assert _invocations(invocations) == 4
+        # Modifying the top-level Makefile invalidates the cached values
+        write_text(Path(td, "src", "Makefile.inc1"), "# changed\n")
+        assert _query(project, args, ".OBJDIR")
+        assert _invocations(invocations) == 5
+        # And so does a new bmake binary
+        write_text(Path(td, "bin", "bmake"), _FAKE_BMAKE + "\n")
+        assert _query(project, args, ".OBJDIR")
+        assert _invocations(invocations) == 6
+
+
+def test_cache_eviction_and_readonly():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, BuildenvQueryCache.FILENAME)
+        cache = BuildenvQueryCache(path)
+        for i in range(BuildenvQueryCache.MAX_ENTRIES + 2):
+            cache.store("key" + str(i), {".OBJDIR": "/obj" + str(i)})
+        reloaded = BuildenvQueryCache(path)
+        assert len(reloaded.entries) == BuildenvQueryCache.MAX_ENTRIES
+        assert reloaded.lookup("key0", [".OBJDIR"]) is None
+        assert reloaded.lookup("key2", [".OBJDIR"]) == {".OBJDIR": "/obj2"}
+        assert reloaded.statistics() == "buildenv queries: 1 from cache, 1 executed"
+        readonly = BuildenvQueryCache(Path(td, "readonly.json"), readonly=True)
+        readonly.store("key", {".OBJDIR": "/obj"})
+        assert readonly.lookup("key", [".OBJDIR"]) == {".OBJDIR": "/obj"}
+        assert not Path(td, "readonly.json").exists()
@@ -0,0 +1,63 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.compiler_cache import *
+
+
+def test_ccache_print_stats():
+    # ccache 4.x
+    stats = parse_ccache_statistics("stats_updated_timestamp\t1600000000\ndirect_cache_hit\t7\n"
+                                    "preprocessed_cache_hit\t3\ncache_miss\t30\nfiles_in_cache\t120\n")
+    assert (stats.hits, stats.misses) == (10, 30)
+    assert stats.hit_rate == 0.25
+    assert str(stats) == "10 hits, 30 misses (25.0% hit rate)"
+    # ccache 3.7
+    stats = parse_ccache_statistics("cache_hit_direct\t2\ncache_hit_preprocessed\t2\ncache_miss\t0\n")
+    assert (stats.hits, stats.misses) == (4, 0)
+    assert stats.hit_rate == 1.0
+
+
+def test_ccache_show_stats():
+    output = """cache directory                     /home/user/.ccache
+primary config                      /home/user/.ccache/ccache.conf
+cache hit (direct)                    12
+cache hit (preprocessed)               4
+cache miss                            16
+cache hit rate                     50.00 %
+files in cache                        48
+"""
+    stats = parse_ccache_statistics(output)
+    assert (stats.hits, stats.misses) == (16, 16)
+    assert parse_ccache_statistics("").hit_rate == 0.0
+
+
+def test_sccache_stats():
+    stats = parse_sccache_statistics(json.dumps({"stats": {"cache_hits": {"counts": {"C/C++": 5, "Rust": 1}},
+                                                           "cache_misses": {"counts": {"C/C++": 2}}}}))
+    assert (stats.hits, stats.misses) == (6, 2)
+    # older versions report plain numbers and no nested "stats" object
+    stats = parse_sccache_statistics(json.dumps({"cache_hits": 3, "cache_misses": 0}))
+    assert (stats.hits, stats.misses) == (3, 0)
+
+
+def test_environment():
+    cache = CompilerCache("ccache", Path("/cache/foo"), "5G", base_dir=Path("/work"), executable="ccache")
+    assert cache.environment() == dict(CCACHE_DIR="/cache/foo", CCACHE_MAXSIZE="5G", CCACHE_BASEDIR="/work")
+    cache = CompilerCache("ccache", Path("/cache/foo"), "1G", executable="ccache")
+    assert "CCACHE_BASEDIR" not in cache.environment()
+    cache = CompilerCache("sccache", Path("/cache/bar"), "10G", base_dir=Path("/work"), executable="sccache",
+                          server_port=4300)
+    assert cache.environment() == dict(SCCACHE_DIR="/cache/bar", SCCACHE_CACHE_SIZE="10G", SCCACHE_SERVER_PORT="4300")
+    # The port of the per-target sccache server must not change once it has been allocated
+    cache = CompilerCache("sccache", Path("/cache/bar"), "10G", executable="sccache")
+    assert int(cache.environment()["SCCACHE_SERVER_PORT"]) > 0
+    assert cache.environment() == cache.environment()
+
+
+def test_common_parent_dir():
+    assert common_parent_dir(Path("/home/user/cheri"), Path("/home/user/cheri/build")) == Path("/home/user/cheri")
+    assert common_parent_dir(Path("/home/user/cheri"), Path("/home/user/cheribuild")) == Path("/home/user")
+    assert common_parent_dir(Path("/src"), Path("/build")) == Path("/")
@@ -0,0 +1,154 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.deletion_queue import DeletionQueue, reaper_command, remove_tree, trash_directory_name
+from pycheribuild.utils import setEnv
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+
+# python 3.4 compatibility
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+def _create_tree(root: Path, dirs=3, files=4, size=10000):
+    for i in range(dirs):
+        d = root / "dir{}".format(i) / "nested"
+        d.mkdir(parents=True)
+        for j in range(files):
+            write_bytes(d / "file{}".format(j), b"x" * size)
+    write_bytes(root / "top-level-file", b"y")
+    return dirs * files + 1
+
+
+def test_remove_tree():
+    with tempfile.TemporaryDirectory() as tmp:
+        td = Path(tmp)
+        tree = td / "tree"
+        expected_files = _create_tree(tree)
+        # Hardlinks don't free any space until the last one is deleted and symlinks must not be followed
+        outside = td / "outside"
+        outside.mkdir()
+        write_bytes(outside / "keep", b"z" * 10000)
+        os.link(str(outside / "keep"), str(tree / "hardlink"))
+        (tree / "symlink").symlink_to(outside)
+        files, size = remove_tree(tree, jobs=3)
+        assert not tree.exists()
+        assert files == expected_files + 2
+        assert 12 * 10000 <= size < 13 * 10000 + 13 * 8192
+        assert read_bytes(outside / "keep") == b"z" * 10000
+        assert remove_tree(tree) == (0, 0)
+        assert remove_tree(outside / "keep", jobs=1)[0] == 1
+        assert not (outside / "keep").exists()
+
+
+def test_trash_directory_name():
+    with tempfile.TemporaryDirectory() as tmp:
+        build_dir = Path(tmp, "llvm-build")
+        assert trash_directory_name(build_dir) == Path(tmp, "llvm-build.delete-me-pls")
+        Path(tmp, "llvm-build.delete-me-pls").mkdir()
+        Path(tmp, "llvm-build.2.delete-me-pls").mkdir()
+        assert trash_directory_name(build_dir) == Path(tmp, "llvm-build.3.delete-me-pls")
+
+
+def test_queue_and_reap():
+    with tempfile.TemporaryDirectory() as tmp:
+        td = Path(tmp)
+        queue = DeletionQueue(td / DeletionQueue.FILENAME)
+        queued = td / "queued.delete-me-pls"
+        stale = td / "crashed-build.delete-me-pls"
+        _create_tree(queued)
+        _create_tree(stale)
+        (td / "not-trash").mkdir()
+        assert not queue.enqueue(queued)
+        assert queue.pending() == [queued]
+        # Directories from crashed runs are added and the ones that no longer exist are dropped
+        assert queue.find_stale_directories([td, td / "missing"]) == [queued, stale]
+        queue.enqueue(td / "already-deleted.delete-me-pls")
+        assert queue.find_stale_directories([]) == [queued, stale]
+
+        # Only one reaper can be running and enqueue() does not start another one while it is
+        reaper_lock = queue._lock(queue._reaper_lock_path)
+        try:
+            assert queue.reap(blocking=False) is None
+            assert queue.enqueue(start_reaper_command=["false"])
+        finally:
+            queue._unlock(reaper_lock)
+
+        stats = queue.reap(jobs=2)
+        assert stats.directories == 2 and stats.files == 26
+        assert not queued.exists() and not stale.exists() and (td / "not-trash").exists()
+        assert queue.pending() == []
+        reclaimed, errors = queue.take_reclaimed_statistics()
+        assert (reclaimed.directories, reclaimed.files, reclaimed.size) == (2, 26, stats.size)
+        assert errors == []
+        # The statistics are only reported once
+        assert queue.take_reclaimed_statistics()[0].directories == 0
+        # Without record_statistics (in-process deletion) nothing is stored for the next run
+        _create_tree(queued)
+        queue.enqueue(queued)
+        assert queue.reap(record_statistics=False).directories == 1
+        assert queue.take_reclaimed_statistics()[0].directories == 0
+
+
+def test_async_clean_detached():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.pretend = False
+        config.detach_deletions = True
+        config.buildRoot.mkdir()
+        build_dir = config.buildRoot / "foo-build"
+        queue = DeletionQueue(config.buildRoot / DeletionQueue.FILENAME)
+        # Pretend that a reaper is already running so that the directories are only queued
+        reaper_lock = queue._lock(queue._reaper_lock_path)
+        try:
+            for i in range(2):
+                _create_tree(build_dir)
+                with config.FS.asyncCleanDirectory(build_dir):
+                    assert build_dir.is_dir() and not list(build_dir.iterdir())
+            # The first trash directory still exists -> the second clean used a different name
+            assert queue.pending() == [build_dir.with_suffix(".delete-me-pls"),
+                                       build_dir.with_suffix(".2.delete-me-pls")]
+            assert all(p.is_dir() for p in queue.pending())
+        finally:
+            queue._unlock(reaper_lock)
+        assert queue.reap().directories == 2
+        assert [p.name for p in config.buildRoot.iterdir() if p.is_dir()] == ["foo-build"]
+
+
+def test_delete_directories_without_rm():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.pretend = False
+        tree = Path(tmp, "tree")
+        _create_tree(tree)
+        assert config.FS._deleteDirectories(tree).files == 0  # rm -rf does not count the files
+        assert not tree.exists()
+        # Fall back to deleting the files in-process if rm is not available
+        expected_files = _create_tree(tree)
+        with setEnv(PATH=str(Path(tmp, "no-such-dir"))):
+            stats = config.FS._deleteDirectories(tree)
+        assert (stats.directories, stats.files) == (1, expected_files)
+        assert not tree.exists()
+
+
+def test_reaper_command():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.verbose = True
+        command = reaper_command(config)
+        assert command[-4:] == ["--reap-deletion-queue", "--build-root=" + str(config.buildRoot), "--make-jobs=2",
+                                "--verbose"]
+        config.verbose = False
+        config.loader._configPath = Path(tmp, "cheribuild.json")
+        assert reaper_command(config)[-1] == "--config-file=" + str(Path(tmp, "cheribuild.json"))
@@ -0,0 +1,55 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.disk_image import DiskImageManifest
+
+
+def _manifest(**kwargs):
+    entries = {".": "gname=wheel mode=0755 type=dir uname=root",
+               "./bin/cat": "gname=wheel mode=0555 type=file uname=root /rootfs/bin/cat:1234:1:2"}
+    entries.update(kwargs)
+    return DiskImageManifest({k: v for k, v in entries.items() if v is not None}, dict(qcow2="False"))
+
+
+def test_manifest_roundtrip():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, "disk.img.manifest.json")
+        assert DiskImageManifest.load(path) is None
+        manifest = _manifest()
+        manifest.save(path)
+        loaded = DiskImageManifest.load(path)
+        assert loaded is not None
+        assert loaded.digest == manifest.digest
+        assert manifest.diff(loaded) == []
+
+
+def test_manifest_diff():
+    old = _manifest(**{"./bin/ls": "gname=wheel mode=0555 type=file uname=root /rootfs/bin/ls:1:1:3"})
+    new = _manifest(**{"./bin/cat": "gname=wheel mode=0555 type=file uname=root /rootfs/bin/cat:1234:2:2",
+                       "./etc": "gname=wheel mode=0755 type=dir uname=root"})
+    new.options["qcow2"] = "True"
+    assert new.digest != old.digest
+    assert new.diff(old) == ["option qcow2 changed: 'False' -> 'True'", "modified: ./bin/cat", "removed: ./bin/ls",
+                             "added: ./etc"]
+
+
+def test_modified_image_is_rebuilt():
+    # Booting the image modifies it -> the recorded identity of the image file no longer matches
+    old = _manifest()
+    old.options["image"] = "/output/disk.img:1073741824:1:5"
+    new = _manifest()
+    new.options["image"] = "/output/disk.img:1073741824:2:5"
+    assert new.diff(old) == ["option image changed: '/output/disk.img:1073741824:1:5' -> "
+                             "'/output/disk.img:1073741824:2:5'"]
+
+
+def test_mtree_lookup():
+    import io
+    from pycheribuild.mtree import MtreeFile
+    mtree = MtreeFile(io.StringIO("#mtree 2.0\n. type=dir\n./bin/cat type=file mode=0555\n"))
+    assert mtree.get("./bin/cat").is_file()
+    assert mtree.get("./bin/ls") is None
+    assert sorted(path for path, _ in mtree.entries()) == [".", "./bin/cat"]
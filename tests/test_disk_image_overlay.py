@@ -0,0 +1,139 @@
+import os
+import pytest
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild import boot_cheribsd
+from pycheribuild.boot_cheribsd import DiskImageOverlay, disk_image_format, get_argument_parser
+
+# Records the arguments and creates the overlay file like the real qemu-img would
+_FAKE_QEMU_IMG = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/qemu-img.log"
+for last; do true; done
+printf 'QFI\\373' > "$last"
+"""
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+@pytest.fixture(autouse=True)
+def atexit_handlers(monkeypatch):
+    # Run the cleanup handlers at the end of each test instead of when pytest exits
+    handlers = []
+    monkeypatch.setattr(boot_cheribsd.atexit, "register", lambda func, *args: handlers.append((func, args)))
+    yield handlers
+    for func, args in reversed(handlers):
+        func(*args)
+
+
+def _make_fake_qemu_img(directory: Path) -> str:
+    qemu_img = directory / "qemu-img"
+    write_text(qemu_img, _FAKE_QEMU_IMG)
+    qemu_img.chmod(0o755)
+    return str(qemu_img)
+
+
+def _make_base_image(directory: Path, contents=b"\0" * 4096) -> Path:
+    base = directory / "cheribsd.img"
+    write_bytes(base, contents)
+    return base
+
+
+def test_disk_image_format():
+    with tempfile.TemporaryDirectory() as td:
+        assert disk_image_format(_make_base_image(Path(td))) == "raw"
+        assert disk_image_format(_make_base_image(Path(td), b"QFI\xfb\0\0\0\3")) == "qcow2"
+
+
+def test_overlay_created_and_removed(atexit_handlers):
+    with tempfile.TemporaryDirectory() as td:
+        qemu_img = _make_fake_qemu_img(Path(td))
+        base = _make_base_image(Path(td))
+        base.chmod(0o444)
+        overlay = DiskImageOverlay(qemu_img, base)
+        assert overlay.path.parent == base.parent
+        assert overlay.path.name.startswith("cheribsd.img.runtests.") and overlay.path.suffix == ".qcow2"
+        assert overlay.path.exists()
+        log = read_text(Path(td, "qemu-img.log")).split()
+        assert log == ["create", "-f", "qcow2", "-F", "raw", "-b", str(base), str(overlay.path)]
+        overlay.succeeded = True
+        overlay.cleanup()
+        assert not overlay.path.exists()
+        assert read_bytes(base) == b"\0" * 4096
+        # The atexit handler must not fail if the overlay has already been removed
+        assert atexit_handlers == [(overlay.cleanup, ())]
+        overlay.cleanup()
+
+
+def test_keep_failed_overlay():
+    with tempfile.TemporaryDirectory() as td:
+        qemu_img = _make_fake_qemu_img(Path(td))
+        base = _make_base_image(Path(td))
+        failed = DiskImageOverlay(qemu_img, base, keep_on_failure=True)
+        failed.cleanup()  # succeeded is only set once the tests have run -> treat aborted runs as failed
+        assert failed.path.exists()
+        failed.path.unlink()
+        passed = DiskImageOverlay(qemu_img, base, keep_on_failure=True)
+        passed.succeeded = True
+        passed.cleanup()
+        assert not passed.path.exists()
+        not_requested = DiskImageOverlay(qemu_img, base)
+        not_requested.cleanup()
+        assert not not_requested.path.exists()
+
+
+def test_remove_leftover_overlays():
+    with tempfile.TemporaryDirectory() as td:
+        qemu_img = _make_fake_qemu_img(Path(td))
+        base = _make_base_image(Path(td))
+        # An overlay of a killed process (the atexit handler and finally block never ran)
+        leftover = DiskImageOverlay(qemu_img, base)
+        other = base.with_name(base.name + ".runtests.20190101000000.pid1.qcow2")
+        write_bytes(other, b"QFI\xfb")
+        DiskImageOverlay.remove_leftover_overlays(base, os.getpid(), keep=True)
+        assert leftover.path.exists()
+        DiskImageOverlay.remove_leftover_overlays(base, os.getpid())
+        assert not leftover.path.exists()
+        assert other.exists() and base.exists()
+
+
+def test_overlay_pretend_mode():
+    old_pretend = boot_cheribsd.PRETEND
+    boot_cheribsd.PRETEND = True
+    try:
+        with tempfile.TemporaryDirectory() as td:
+            overlay = DiskImageOverlay("/does/not/exist/qemu-img", Path(td, "missing.img"))
+            overlay.cleanup()
+            assert not overlay.path.exists()
+    finally:
+        boot_cheribsd.PRETEND = old_pretend
+
+
+def test_overlay_arguments():
+    args = get_argument_parser().parse_args([])
+    assert args.make_disk_image_copy and not args.disk_image_overlay and not args.keep_failed_overlay
+    args = get_argument_parser().parse_args(["--no-make-disk-image-copy", "--disk-image-overlay",
+                                             "--keep-failed-overlay"])
+    assert not args.make_disk_image_copy and args.disk_image_overlay and args.keep_failed_overlay
@@ -0,0 +1,92 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+
+from pycheribuild.boot_cheribsd.duration_history import DurationHistory, percentile, PASSED, FAILED, SKIPPED
+from pycheribuild.boot_cheribsd.duration_history import architecture_from_args, history_key
+
+
+_JUNIT_XML = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="libcxx" tests="3">
+    <testcase classname="std.algorithms" name="sort.pass.cpp" time="1.5"/>
+    <testcase classname="std.algorithms" name="find.pass.cpp" time="0.5"><failure message="failed"/></testcase>
+    <testcase classname="std.thread" name="mutex.pass.cpp" time="0"><skipped/></testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+# python 3.4 compatibility
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 100) == 5.0
+
+
+def test_record_junit():
+    with tempfile.TemporaryDirectory() as td:
+        xml_file = Path(td, "results.xml")
+        write_text(xml_file, _JUNIT_XML)
+        history = DurationHistory(Path(td, "history.sqlite3"))
+        run_id = history.record_junit("libcxx", xml_file, wall_time=100)
+        run = history.runs("libcxx")[0]
+        assert run[0] == run_id
+        assert tuple(run[4:]) == (100, 3, 1, 0, 1)
+        assert history.slowest(run_id, 1) == [("std.algorithms.sort.pass.cpp", 1.5)]
+        assert history.latest_run("libcxx") == run_id
+        assert history.latest_run("other") is None
+
+
+def test_flakiness_and_timeouts():
+    history = DurationHistory(Path(":memory:"))
+    assert history.adaptive_timeout("suite", 3600) == 3600
+    assert history.estimate_remaining("suite", 10) is None
+    for status, wall_time in ((PASSED, 1000), (FAILED, 1200), (PASSED, 1100), (SKIPPED, 1100)):
+        history.record_results("suite", [("flaky", 1.0, status), ("stable", 2.0, PASSED)], wall_time=wall_time)
+    stats = history.test_statistics("suite")
+    assert stats["flaky"]["flips"] == 2
+    assert stats["flaky"]["failures"] == 1
+    assert stats["stable"]["flips"] == 0
+    assert stats["stable"]["p50"] == 2.0
+    assert history.adaptive_timeout("suite", 3600) == 2 * percentile([1000, 1200, 1100, 1100], 95)
+    assert history.adaptive_timeout("suite", 3600, minimum=5000) == 5000
+    assert history.estimate_remaining("suite", 100) == 1000
+    assert history.estimate_remaining("suite", 5000) == 0
+
+
+def test_history_key():
+    history = DurationHistory(Path(":memory:"))
+    sharded = history_key("libcxx", "cheri128", 16)
+    single = history_key("libcxx", "cheri128", 1)
+    assert sharded == "libcxx [cheri128, shards=16]"
+    # Durations of sharded runs must not be used for the timeout of a run on a single VM (or another architecture)
+    history.record_results(sharded, [("a", 1.0, PASSED)], wall_time=1000)
+    assert history.adaptive_timeout(single, 4 * 3600, minimum=0) == 4 * 3600
+    assert history.adaptive_timeout(history_key("libcxx", "mips", 16), 4 * 3600, minimum=0) == 4 * 3600
+    assert history.adaptive_timeout(sharded, 4 * 3600, minimum=0) == 2000
+    assert history_key("juliet") == "juliet"
+    args = argparse.Namespace(architecture=None, kernel="/images/cheribsd128-cheri128-malta64-kernel.bz2")
+    assert architecture_from_args(args) == "cheribsd128-cheri128-malta64-kernel"
+    args.architecture = "cheri128"
+    assert architecture_from_args(args) == "cheri128"
+    assert architecture_from_args(argparse.Namespace()) == "native"
+
+
+def test_regressions():
+    history = DurationHistory(Path(":memory:"))
+    old = history.record_results("suite", [("a", 1.0, PASSED), ("b", 5.0, PASSED), ("c", 2.0, PASSED)])
+    new = history.record_results("suite", [("a", 4.0, PASSED), ("b", 4.0, PASSED), ("c", 2.5, PASSED),
+                                           ("d", 10.0, PASSED)])
+    assert history.regressions(old, new) == [("a", 1.0, 4.0), ("c", 2.0, 2.5)]
+    assert history.regressions(old, new, count=1) == [("a", 1.0, 4.0)]
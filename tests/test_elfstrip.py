@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.elfstrip import ElfStripper, find_elf_files, is_elf_file
+
+_STRIP_TOOL = shutil.which("llvm-strip") or shutil.which("strip")
+_CC = shutil.which("cc") or shutil.which("clang") or shutil.which("gcc")
+
+
+# python 3.4 compatibility
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def _build_tree(root: Path):
+    source = root / "test.c"
+    write_bytes(source, b"static int unused_helper(int x) { return x * 2; }\n"
+                        b"int main(int argc, char** argv) { return unused_helper(argc); }\n")
+    (root / "bin").mkdir()
+    (root / "lib" / "nested").mkdir(parents=True)
+    subprocess.check_call([_CC, "-g", "-O0", "-o", str(root / "bin" / "prog0"), str(source)])
+    for i in range(1, 6):
+        shutil.copy(str(root / "bin" / "prog0"), str(root / "lib" / "nested" / ("prog" + str(i))))
+    os.link(str(root / "bin" / "prog0"), str(root / "bin" / "hardlink"))
+    os.symlink("prog0", str(root / "bin" / "symlink"))
+    write_bytes(root / "bin" / "script.sh", b"#!/bin/sh\necho hello\n")
+    write_bytes(root / "bin" / "tiny", b"\x7fE")
+
+
+def test_find_elf_files():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        write_bytes(root / "a", b"\x7fELF" + b"\0" * 60)
+        write_bytes(root / "b", b"not an elf file")
+        os.link(str(root / "a"), str(root / "c"))
+        os.symlink("a", str(root / "d"))
+        assert is_elf_file(root / "a")
+        assert not is_elf_file(root / "b")
+        assert find_elf_files(root) == [(root / "a", [root / "c"])]
+
+
+@pytest.mark.skipif(_STRIP_TOOL is None or _CC is None, reason="Needs a host compiler and strip tool")
+def test_strip_synthetic_tree():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        _build_tree(root)
+        unstripped_size = (root / "bin" / "prog0").stat().st_size
+        stripper = ElfStripper(Path(_STRIP_TOOL), jobs=3, files_per_invocation=2).strip_tree(root)
+        # prog0 and the hardlink are only stripped once
+        assert stripper.files_stripped == 6
+        assert stripper.bytes_before == 6 * unstripped_size
+        assert stripper.bytes_saved > 0
+        assert "Stripped 6 ELF files" in stripper.summary()
+        stripped_size = (root / "bin" / "prog0").stat().st_size
+        assert stripped_size < unstripped_size
+        for i in range(1, 6):
+            assert (root / "lib" / "nested" / ("prog" + str(i))).stat().st_size == stripped_size
+        # The hardlink must still refer to the same (stripped) inode
+        assert os.path.samefile(str(root / "bin" / "prog0"), str(root / "bin" / "hardlink"))
+        assert (root / "bin" / "symlink").is_symlink()
+        assert read_bytes(root / "bin" / "script.sh") == b"#!/bin/sh\necho hello\n"
+        # Stripping again should be a no-op
+        again = ElfStripper(Path(_STRIP_TOOL), jobs=2).strip_tree(root)
+        assert again.files_stripped == 6
+        assert again.bytes_saved == 0
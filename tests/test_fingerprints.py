@@ -0,0 +1,51 @@
+import subprocess
+import tempfile
+from pathlib import Path
+
+from pycheribuild.fingerprints import FingerprintStore, git_source_revision, hash_components
+
+
+# python 3.4 compatibility
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def test_store_roundtrip():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, FingerprintStore.FILENAME)
+        store = FingerprintStore(path)
+        assert store.fingerprint("llvm") is None
+        components = {"source_revision": "abc", "options": {"llvm/build-type": "Release"}}
+        store.update("llvm", hash_components(components), components)
+        # A new instance should read the same data back from disk
+        reloaded = FingerprintStore(path)
+        assert reloaded.fingerprint("llvm") == hash_components(components)
+        changed = {"source_revision": "abc", "options": {"llvm/build-type": "Debug"}}
+        assert reloaded.explain(reloaded.get("llvm")["components"], changed) == [
+            "options/llvm/build-type changed: 'Release' -> 'Debug'"]
+        reloaded.invalidate("llvm")
+        assert FingerprintStore(path).fingerprint("llvm") is None
+
+
+def test_hash_is_independent_of_key_order():
+    assert hash_components({"a": 1, "b": 2}) == hash_components({"b": 2, "a": 1})
+    assert hash_components({"a": 1, "b": 2}) != hash_components({"a": 1, "b": 3})
+
+
+def test_git_source_revision():
+    with tempfile.TemporaryDirectory() as td:
+        repo = Path(td)
+        assert git_source_revision(repo) is None
+        git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        subprocess.check_call(git + ["init", "-q"], cwd=td)
+        write_text(repo / "file.c", "int x;\n")
+        subprocess.check_call(git + ["add", "file.c"], cwd=td)
+        subprocess.check_call(git + ["commit", "-q", "-m", "initial"], cwd=td)
+        clean = git_source_revision(repo)
+        assert clean is not None and "-dirty-" not in clean
+        write_text(repo / "file.c", "int y;\n")
+        dirty = git_source_revision(repo)
+        assert dirty.startswith(clean + "-dirty-")
+        write_text(repo / "file.c", "int z;\n")
+        assert git_source_revision(repo) != dirty
@@ -0,0 +1,91 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.gitfetch import ConcurrentGitFetcher, FetchRequest
+from pycheribuild.projects.project import GitRepository
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def _git(cwd: Path, *args) -> str:
+    return subprocess.check_output(["git"] + list(args), cwd=str(cwd), stderr=subprocess.DEVNULL).decode("utf-8")
+
+
+def _clone(upstream: Path, dest: Path) -> Path:
+    subprocess.check_call(["git", "clone", "-q", str(upstream), str(dest)], stderr=subprocess.DEVNULL)
+    _git(dest, "config", "user.name", "Test")
+    _git(dest, "config", "user.email", "test@example.com")
+    return dest
+
+
+def _commit(repo: Path, filename: str, contents: str):
+    write_text(repo / filename, contents)
+    _git(repo, "add", filename)
+    _git(repo, "commit", "-q", "-m", "Update " + filename)
+
+
+def _setup_repositories(root: Path):
+    upstream = root / "upstream.git"
+    subprocess.check_call(["git", "init", "-q", "--bare", str(upstream)])
+    writer = _clone(upstream, root / "writer")
+    _commit(writer, "README", "initial\n")
+    _git(writer, "push", "-q", "origin", "HEAD")
+    clones = [_clone(upstream, root / name) for name in ("a", "b")]
+    _commit(writer, "data", "x" * 100000 + "\n")
+    _git(writer, "push", "-q", "origin", "HEAD")
+    return upstream, writer, clones
+
+
+def test_concurrent_fetch():
+    with tempfile.TemporaryDirectory() as td:
+        upstream, writer, clones = _setup_repositories(Path(td))
+        broken = _clone(upstream, Path(td, "broken"))
+        _git(broken, "remote", "set-url", "origin", str(Path(td, "does-not-exist.git")))
+        requests = [FetchRequest(p.name, p) for p in clones + [broken]]
+        fetcher = ConcurrentGitFetcher(jobs=2)
+        results = fetcher.fetch_all(requests)
+        assert [r.request.name for r in results] == ["a", "b", "broken"]
+        assert [r.success for r in results] == [True, True, False]
+        assert results[0].updated_refs == 1
+        assert results[0].bytes_received > 0
+        assert "does-not-exist.git" in results[2].error
+        assert fetcher.bytes_received == results[0].bytes_received + results[1].bytes_received
+        assert "1 failed" in fetcher.summary()
+        # Fetching again does not transfer anything
+        assert ConcurrentGitFetcher(jobs=2).fetch_all(requests[:1])[0].updated_refs == 0
+        # The working tree has not been touched yet
+        assert not (clones[0] / "data").exists()
+
+
+def test_update_after_prefetch_does_not_use_network():
+    with tempfile.TemporaryDirectory() as td:
+        config = setup_mock_chericonfig(Path(td))
+        config.pretend = False
+        config.force_update = True
+        upstream, writer, clones = _setup_repositories(Path(td))
+        repo = clones[0]
+        _commit(repo, "local", "local commit\n")
+        write_text(repo / "README", "uncommitted change\n")
+        assert ConcurrentGitFetcher(jobs=2).fetch_all([FetchRequest("a", repo)])[0].success
+        # make sure that the update only uses the local objects
+        upstream.rename(Path(td, "moved.git"))
+        project = SimpleNamespace(config=config, skipUpdate=False, sources_prefetched=True, projectName="a")
+        GitRepository(str(upstream)).updateRepo(project, srcDir=repo)
+        assert _git(repo, "rev-parse", "HEAD~1") == _git(writer, "rev-parse", "HEAD")
+        assert (repo / "data").exists()
+        assert read_text(repo / "README") == "uncommitted change\n"
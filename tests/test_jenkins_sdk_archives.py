@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.filesystemutils import FileSystemUtils
+from pycheribuild.jenkins import SdkArchive, extract_sdk_archives, load_sdk_archive_records
+
+
+# python 3.4 compatibility
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def _create_archive(path: Path, files: dict):
+    with tarfile.open(str(path), "w:xz") as tar:
+        for name, contents in files.items():
+            info = tarfile.TarInfo("prefix/" + name)
+            info.size = len(contents)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(contents))
+
+
+def _config(workspace: Path, parallel: bool):
+    config = SimpleNamespace(workspace=workspace, sdkDir=workspace / "cherisdk", sdkBinDir=workspace / "cherisdk/bin",
+                             pretend=False, verbose=False, parallel_sdk_extraction=parallel)
+    config.FS = FileSystemUtils(config)
+    return config
+
+
+def _extract(parallel: bool):
+    with tempfile.TemporaryDirectory() as td:
+        workspace = Path(td)
+        _create_archive(workspace / "clang.tar.xz", {"bin/clang": b"clang", "bin/ar": b"ar", "bin/ranlib": b"ranlib",
+                                                     "bin/nm": b"nm", "bin/ld": b"ld", "lib/libc++.so": b"old"})
+        _create_archive(workspace / "sysroot.tar.xz", {"sysroot/usr/include/stddef.h": b"header",
+                                                       "lib/libc++.so": b"new"})
+        config = _config(workspace, parallel)
+        strip = ["--strip-components", "1"]
+        archives = [SdkArchive(config, "clang.tar.xz", required_globs=["bin/clang"], extra_args=strip),
+                    SdkArchive(config, "sysroot.tar.xz", required_globs=["sysroot/usr/include"], extra_args=strip)]
+        extract_sdk_archives(config, archives)
+        sdk = config.sdkDir
+        assert read_bytes(sdk / "bin/clang") == b"clang"
+        assert read_bytes(sdk / "sysroot/usr/include/stddef.h") == b"header"
+        # The later archive should overwrite files from the earlier one
+        assert read_bytes(sdk / "lib/libc++.so") == b"new"
+        assert sorted(os.listdir(str(sdk))) == [".cheribuild-sdk-archives.json", "bin", "lib", "sysroot"]
+
+        records = load_sdk_archive_records(config)
+        assert sorted(records.keys()) == ["clang.tar.xz", "sysroot.tar.xz"]
+        assert all(a.matches_record(records[a.archive.name]) for a in archives)
+        # A copy of the same archive with a new ctime/mtime must still match the recorded digest
+        os.utime(str(archives[0].archive), (1, 1))
+        assert SdkArchive(config, "clang.tar.xz", extra_args=strip).matches_record(records["clang.tar.xz"])
+        # But different contents or different extraction arguments must not match
+        assert not SdkArchive(config, "clang.tar.xz").matches_record(records["clang.tar.xz"])
+        _create_archive(workspace / "clang.tar.xz", {"bin/clang": b"new clang"})
+        assert not SdkArchive(config, "clang.tar.xz", extra_args=strip).matches_record(records["clang.tar.xz"])
+
+
+def test_parallel_sdk_extraction():
+    _extract(parallel=True)
+
+
+def test_sequential_sdk_extraction():
+    _extract(parallel=False)
@@ -0,0 +1,93 @@
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.boot_cheribsd.kyua_junit import (convert_kyua_db, convert_kyua_dbs, escape_control_characters,
+                                                    escape_xml)
+
+_FIXTURES = Path(__file__).parent / "kyua"
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def _create_results_db(path: Path) -> Path:
+    db = sqlite3.connect(str(path))
+    db.executescript(read_text(_FIXTURES / "results.sql", encoding="utf-8"))
+    db.commit()
+    db.close()
+    return path
+
+
+def _parse_kyua_report_junit(path: Path) -> ET.Element:
+    # Same preprocessing as fixup_kyua_generated_junit_xml() in test-scripts/kyua_db_to_junit_xml.py
+    xml_str = escape_control_characters(read_bytes(path).decode("utf-8", errors="backslashreplace"))
+    return ET.fromstring(xml_str.encode("ascii", errors="xmlcharrefreplace"))
+
+
+def _testcases(root: ET.Element):
+    return [(case.attrib, [(child.tag, child.attrib, child.text) for child in case]) for case in root.iter("testcase")]
+
+
+def test_escape():
+    assert escape_xml("a < b && \"c\" > 'd'") == "a &lt; b &amp;&amp; &quot;c&quot; &gt; &#39;d&#39;"
+    assert escape_xml("\x00\x1b[0m\r\n\t") == "\\x00;\\x1b;[0m\\x0d;\n\t"
+    assert escape_control_characters("&amp;\x01\n") == "&amp;\\x01;\n"
+
+
+def test_expected_junit_output():
+    # results-expected-junit.xml was written by hand, this only checks that the output has not changed unexpectedly
+    with tempfile.TemporaryDirectory() as td:
+        db = _create_results_db(Path(td, "test-results.db"))
+        output = Path(td, "test-results.xml")
+        stats = convert_kyua_db(db, output)
+        assert (stats.tests, stats.failures, stats.errors, stats.skipped) == (6, 1, 2, 1)
+        assert abs(stats.time - 311.763) < 0.0001
+        # The output must be plain ASCII and valid XML without any further fixups
+        result = ET.fromstring(read_bytes(output).decode("ascii"))
+        expected = _parse_kyua_report_junit(_FIXTURES / "results-expected-junit.xml")
+        assert result.attrib == dict(errors="2", failures="1", skipped="1", tests="6", time="311.763")
+        assert [p.attrib for p in result.iter("property")] == [p.attrib for p in expected.iter("property")]
+        assert _testcases(result) == _testcases(expected)
+        assert not list(Path(td).glob("*.tmp.*"))
+
+
+@pytest.mark.skipif(shutil.which("kyua") is None, reason="Needs kyua to compare the output")
+def test_matches_kyua_report_junit():
+    with tempfile.TemporaryDirectory() as td:
+        db = _create_results_db(Path(td, "test-results.db"))
+        kyua_output = Path(td, "kyua-report.xml")
+        with kyua_output.open("wb") as f:
+            subprocess.check_call(["kyua", "report-junit", "--results-file=" + str(db)], stdout=f)
+        convert_kyua_db(db, Path(td, "test-results.xml"))
+        result = ET.fromstring(read_bytes(Path(td, "test-results.xml")).decode("ascii"))
+        expected = _parse_kyua_report_junit(kyua_output)
+        assert [p.attrib for p in result.iter("property")] == [p.attrib for p in expected.iter("property")]
+        assert _testcases(result) == _testcases(expected)
+
+
+def test_parallel_conversion():
+    with tempfile.TemporaryDirectory() as td:
+        first = _create_results_db(Path(td, "test-results.db"))
+        second = Path(td, "test-results-1.db")
+        shutil.copy(str(first), str(second))
+        results = convert_kyua_dbs([first, second], jobs=2)
+        assert sorted(results.keys()) == [second, first]
+        assert all(stats.tests == 6 for stats in results.values())
+        assert read_bytes(Path(td, "test-results.xml")) == read_bytes(Path(td, "test-results-1.xml"))
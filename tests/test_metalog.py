@@ -266,3 +266,62 @@ def test_symlink_infer_mode(temp_symlink):
 """.format(target=temp_symlink[2], testfile=str(temp_symlink[1]), symlink_perms=symlink_perms)
     assert expected == _get_as_str(mtree)
 
+
+
+def test_quoted_and_unquoted_lines():
+    # Lines without quoting use a fast path instead of shlex.split() -> check that both give the same result
+    file = """#mtree 2.0
+./bin/cat type=file uname=root gname=wheel mode=0555 size=1234 time=1553167427.0 tags=package=runtime
+./bin/with\\ space type=file uname=root gname=wheel mode=0555 size=1234 time=1553167427.0 tags=package=runtime
+./bin/quoted type=file uname=root gname=wheel mode="0555" size=1234 tags=package=runtime
+# END
+"""
+    mtree = MtreeFile(io.StringIO(file))
+    expected = """#mtree 2.0
+./bin/cat type=file uname=root gname=wheel mode=0555 size=1234
+./bin/quoted type=file uname=root gname=wheel mode=0555 size=1234
+./bin/with space type=file uname=root gname=wheel mode=0555 size=1234
+# END
+"""
+    assert expected == _get_as_str(mtree).replace("'./bin/with space'", "./bin/with space")
+    assert list(mtree._mtree["./bin/cat"].attributes.keys()) == ["type", "uname", "gname", "mode", "size"]
+
+
+def test_sorted_write_after_adding_entries():
+    file = """#mtree 2.0
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+# END
+"""
+    mtree = MtreeFile(io.StringIO(file))
+    mtree.add_dir("usr/bin", print_status=False)
+    assert [".", "./bin", "./usr", "./usr/bin", "./usr/lib"] == mtree.sorted_paths()
+    mtree.add_dir("a/b", print_status=False)
+    mtree.add_dir("usr/bin", mode="0700", print_status=False)  # already exists -> ignored
+    expected = """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./a type=dir uname=root gname=wheel mode=0755
+./a/b type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/bin type=dir uname=root gname=wheel mode=0755
+./usr/lib type=dir uname=root gname=wheel mode=0755
+# END
+"""
+    assert expected == _get_as_str(mtree)
+    assert "./usr/bin" in mtree and "usr/bin" in mtree and "usr//bin/" not in mtree._mtree
+
+
+def test_load_path_contents_root():
+    with tempfile.TemporaryDirectory() as td:
+        metalog = Path(td, "METALOG")
+        with metalog.open("w", encoding="utf-8") as f:
+            f.write("./bin/cat type=file uname=root gname=wheel mode=0555 contents=bin/cat\n")
+        mtree = MtreeFile(metalog, contents_root=Path("/rootfs"))
+        assert mtree._mtree["./bin/cat"].attributes["contents"] == "/rootfs/bin/cat"
+
+
+def test_benchmark_smoke():
+    from .benchmark_mtree import run_benchmark
+    result = run_benchmark(5000, verbose=False)
+    assert result["entries"] == 5000 + 1000 + 2  # extra dirs, "./extra" and "."
@@ -0,0 +1,91 @@
+import gzip
+import io
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.outputpipeline import ProcessOutputPipeline, open_logfile
+
+# Writes partial lines to both streams to check that the logfile never contains interleaved lines
+_CHILD_SCRIPT = r"""
+import os, sys, time
+for i in range(200):
+    os.write(1, b"out %d " % i)
+    os.write(2, b"err %d" % i)
+    os.write(1, b"done\n")
+    os.write(2, b"\n")
+os.write(1, b"x" * 1000000 + b"\n")
+os.write(1, b"no newline at the end")
+sys.exit(3)
+"""
+
+
+# python 3.4 compatibility
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def _run_child(logfile, stdout_filter=None, echo=True):
+    proc = subprocess.Popen([sys.executable, "-c", _CHILD_SCRIPT], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    terminal_stdout = io.BytesIO()
+    terminal_stderr = io.BytesIO()
+    pipeline = ProcessOutputPipeline(proc, logfile, stdout_filter=stdout_filter, chunk_size=4096, echo=echo,
+                                     terminal_stdout=terminal_stdout, terminal_stderr=terminal_stderr)
+    return pipeline.run(), terminal_stdout.getvalue(), terminal_stderr.getvalue(), pipeline
+
+
+def _check_log_contents(contents: bytes):
+    lines = contents.splitlines()
+    assert len(lines) == 402
+    assert sorted(l for l in lines if l.startswith(b"out")) == sorted(b"out %d done" % i for i in range(200))
+    assert sorted(l for l in lines if l.startswith(b"err")) == sorted(b"err %d" % i for i in range(200))
+    assert lines[-2] == b"x" * 1000000
+    assert lines[-1] == b"no newline at the end"
+
+
+def test_pipeline_without_filter():
+    logfile = io.BytesIO()
+    retcode, stdout, stderr, pipeline = _run_child(logfile)
+    assert retcode == 3
+    _check_log_contents(logfile.getvalue())
+    assert stdout == b"".join(b"out %d done\n" % i for i in range(200)) + b"x" * 1000000 + \
+        b"\nno newline at the end"
+    assert stderr == b"".join(b"err %d\n" % i for i in range(200))
+    assert pipeline.bytes_read == len(logfile.getvalue())
+
+
+def test_pipeline_filter_only_affects_terminal():
+    filtered_lines = []
+    logfile = io.BytesIO()
+    retcode, stdout, stderr, _ = _run_child(logfile, stdout_filter=filtered_lines.append)
+    _check_log_contents(logfile.getvalue())
+    assert stdout == b""  # all output was passed to the filter
+    assert filtered_lines[0] == b"out 0 done\n"
+    assert len(filtered_lines) == 202
+    # no echo -> only write to the logfile
+    logfile = io.BytesIO()
+    retcode, stdout, stderr, _ = _run_child(logfile, echo=False)
+    assert stdout == b"" and stderr == b""
+    _check_log_contents(logfile.getvalue())
+
+
+def test_compressed_logfile():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, "build.log.gz")
+        # Appending adds a second gzip member
+        for header in (b"first\n", b"second\n"):
+            with open_logfile(path, "gzip") as logfile:
+                logfile.write(header)
+                _run_child(logfile)
+        contents = gzip.decompress(read_bytes(path))
+        first, second = contents.split(b"second\n")
+        assert first.startswith(b"first\n")
+        _check_log_contents(first[len(b"first\n"):])
+        _check_log_contents(second)
+        with open_logfile(Path(td, "plain.log")) as logfile:
+            logfile.write(b"plain\n")
+        assert read_bytes(Path(td, "plain.log")) == b"plain\n"
@@ -0,0 +1,124 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild import boot_cheribsd
+from pycheribuild.boot_cheribsd.ssh_session import SSHSession, SSH_CONNECTION_ERROR, format_throughput
+
+
+# python 3.4 compatibility
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+def _session(**kwargs) -> SSHSession:
+    return SSHSession("localhost", 12345, Path("/keys/id_ed25519"), retry_delay=0, **kwargs)
+
+
+def test_commands():
+    with _session() as session:
+        control_path = str(session.control_path)
+        assert session.control_dir.is_dir()
+        ssh = session.ssh_command("uname -a")
+        assert ssh[:3] == ["ssh", "-p", "12345"]
+        assert ssh[-3:] == ["root@localhost", "--", "uname -a"]
+        assert "ControlPath=" + control_path in ssh and "ControlMaster=no" in ssh
+        assert ssh[ssh.index("-i") + 1] == "/keys/id_ed25519"
+        scp = session.scp_command("/tmp/foo", session.remote_path("/tmp/bar"))
+        assert scp[:5] == ["scp", "-B", "-r", "-P", "12345"]
+        assert scp[-2:] == ["/tmp/foo", "root@localhost:/tmp/bar"]
+        assert "ControlPath=" + control_path in scp
+    assert not session.control_dir.exists()
+
+
+def test_format_throughput():
+    assert format_throughput(10 * 1024 * 1024, 4) == "10.0 MiB in 4.0s (2.5 MiB/s)"
+    assert format_throughput(0, 0) == "0.0 MiB in 0.0s (0.0 MiB/s)"
+
+
+def test_retries():
+    session = _session(retries=3)
+    reconnects = []
+    session.start = lambda: reconnects.append(True)
+    attempts = []
+
+    def flaky():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise subprocess.CalledProcessError(SSH_CONNECTION_ERROR, ["ssh"])
+        return "ok"
+
+    assert session._with_retries("flaky", flaky) == "ok"
+    assert len(attempts) == 3 and len(reconnects) == 2
+
+    def command_failed():
+        attempts.append(True)
+        raise subprocess.CalledProcessError(1, ["ssh"])
+
+    attempts.clear()
+    try:
+        session._with_retries("command", command_failed)
+        assert False, "should have raised"
+    except subprocess.CalledProcessError as e:
+        assert e.returncode == 1
+    assert len(attempts) == 1  # failures of the remote command (or a local scp/tar error) are not retried
+
+    def connection_refused():
+        attempts.append(True)
+        raise subprocess.CalledProcessError(SSH_CONNECTION_ERROR, ["ssh"])
+
+    attempts.clear()
+    try:
+        session._with_retries("connection", connection_refused)
+        assert False, "should have raised"
+    except subprocess.CalledProcessError:
+        pass
+    assert len(attempts) == 3
+    session.close()
+
+
+def test_tar_pipe():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst_root, _session() as session:
+        # Run the "remote" command locally instead of via ssh
+        session.start = lambda: None
+        session.ssh_command = lambda *command, **kwargs: ["sh", "-c"] + list(command)
+        dst = Path(dst_root, "guest-root")
+        dst.mkdir(mode=0o755)
+        dst.chmod(0o755)
+        Path(src, "subdir").mkdir()
+        with Path(src, "subdir", "file").open("wb") as f:
+            f.write(b"contents")
+        with Path(src, "-starts-with-dash").open("wb") as f:
+            f.write(b"x")
+        session.copy_directory_to_guest(Path(src), str(dst))
+        assert sorted(p.name for p in dst.iterdir()) == ["-starts-with-dash", "subdir"]
+        with Path(dst, "subdir", "file").open("rb") as f:
+            assert f.read() == b"contents"
+        # The mode of the temporary source directory (0700) must not be applied to the destination
+        assert dst.stat().st_mode & 0o777 == 0o755
+        assert session.bytes_transferred == len(b"contents") + 1
+        # An empty directory only creates the destination
+        empty = Path(src, "empty")
+        empty.mkdir()
+        session.copy_directory_to_guest(empty, str(Path(dst, "new")))
+        assert Path(dst, "new").is_dir()
+
+
+def test_pretend_mode():
+    old_pretend = boot_cheribsd.PRETEND
+    boot_cheribsd.PRETEND = True
+    try:
+        with tempfile.TemporaryDirectory() as td, _session() as session:
+            write_bytes(Path(td, "file"), b"x" * 1024)
+            assert not session.is_alive()
+            session.copy_directory_to_guest(Path(td), "/tmp/dir")
+            session.copy_to_guest(Path(td, "file"), "/tmp")
+            session.run("true")
+            # Nothing is transferred in pretend mode
+            assert session.bytes_transferred == 0
+    finally:
+        boot_cheribsd.PRETEND = old_pretend
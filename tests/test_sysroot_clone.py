@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.sysroot_clone import FileCloner, SysrootState, populate_sysroot, sysroot_link_target
+
+_INCLUDES = ("./lib/", "./usr/include/", "./usr/lib/")
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def write_bytes(path: Path, contents: bytes):
+    with path.open(mode="wb") as f:
+        return f.write(contents)
+
+
+def _make_rootfs(root: Path):
+    (root / "lib").mkdir(parents=True)
+    (root / "usr/lib").mkdir(parents=True)
+    (root / "usr/include").mkdir(parents=True)
+    (root / "bin").mkdir()
+    write_bytes(root / "lib/libc.so.7", b"libc" * 1024)
+    write_text(root / "usr/include/stdio.h", "int printf(const char*, ...);\n")
+    write_bytes(root / "bin/sh", b"sh")
+    os.symlink("/lib/libc.so.7", str(root / "usr/lib/libc.so"))
+    # Use the modes from the METALOG (installworld creates read-only files)
+    (root / "lib/libc.so.7").chmod(0o444)
+    (root / "usr/include/stdio.h").chmod(0o444)
+    (root / "bin/sh").chmod(0o555)
+    _write_metalog(root, ["./lib/libc.so.7 type=file mode=0444", "./usr/include/stdio.h type=file mode=0444",
+                          "./usr/lib/libc.so type=link link=/lib/libc.so.7", "./bin/sh type=file mode=0555"])
+
+
+def _write_metalog(root: Path, lines):
+    write_text(root / "METALOG", "#mtree 2.0\n./lib type=dir mode=0755\n" + "\n".join(lines) + "\n")
+
+
+def test_link_target():
+    assert sysroot_link_target("/lib/libc.so.7", "./usr/lib/libc.so") == "../../lib/libc.so.7"
+    assert sysroot_link_target("libc.so.7", "./lib/libc.so") == "libc.so.7"
+
+
+def test_state_roundtrip():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, "sysroot.populate-state.json")
+        assert SysrootState.load(path) is None
+        SysrootState({"./lib/libc.so.7": "file:1:2:3:444"}).save(path)
+        assert SysrootState.load(path).entries == {"./lib/libc.so.7": "file:1:2:3:444"}
+
+
+def test_populate_incrementally():
+    with tempfile.TemporaryDirectory() as td:
+        rootfs = Path(td, "rootfs")
+        sysroot = Path(td, "sysroot")
+        state = Path(td, "sysroot.populate-state.json")
+        _make_rootfs(rootfs)
+        stats = populate_sysroot(rootfs, rootfs / "METALOG", sysroot, state, _INCLUDES, "hardlink")
+        assert (stats.files_hardlinked, stats.bytes_hardlinked, stats.symlinks) == (2, 4126, 1)
+        assert (sysroot / "lib/libc.so.7").stat().st_ino == (rootfs / "lib/libc.so.7").stat().st_ino
+        assert os.readlink(str(sysroot / "usr/lib/libc.so")) == "../../lib/libc.so.7"
+        assert read_bytes(sysroot / "usr/lib/libc.so") == b"libc" * 1024
+        assert not (sysroot / "bin").exists()
+
+        # Nothing changed -> nothing is touched
+        stats = populate_sysroot(rootfs, rootfs / "METALOG", sysroot, state, _INCLUDES, "hardlink")
+        assert (stats.changed, stats.unchanged) == (0, 3)
+
+        # Replacing a file in the rootfs (as installworld does) and removing an entry only updates those paths
+        (rootfs / "usr/include/stdio.h").unlink()
+        write_text(rootfs / "usr/include/stdio.h", "#include <sys/cdefs.h>\n")
+        _write_metalog(rootfs, ["./lib/libc.so.7 type=file mode=0444", "./usr/include/stdio.h type=file mode=0444"])
+        stats = populate_sysroot(rootfs, rootfs / "METALOG", sysroot, state, _INCLUDES, "copy")
+        assert (stats.files_copied, stats.bytes_copied, stats.unchanged, stats.removed) == (1, 23, 1, 1)
+        assert read_text(sysroot / "usr/include/stdio.h") == "#include <sys/cdefs.h>\n"
+        assert not os.path.lexists(str(sysroot / "usr/lib/libc.so"))
+
+
+def test_reflink_falls_back_to_copy():
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(td, "src")
+        write_bytes(src, b"x" * 100)
+        src.chmod(0o444)
+        cloner = FileCloner("reflink")
+        cloner.clone(src, Path(td, "dst"), src.stat())
+        cloner.clone(src, Path(td, "dst"), src.stat())  # overwriting a read-only file must work
+        assert read_bytes(Path(td, "dst")) == b"x" * 100
+        assert Path(td, "dst").stat().st_mode & 0o777 == 0o444
+        assert cloner.stats.files_reflinked + cloner.stats.files_copied == 2
+        assert cloner.stats.bytes_reflinked + cloner.stats.bytes_copied == 200
+
+
+def test_only_read_only_files_are_hardlinked():
+    with tempfile.TemporaryDirectory() as td:
+        rootfs = Path(td, "rootfs")
+        sysroot = Path(td, "sysroot")
+        state = Path(td, "sysroot.populate-state.json")
+        _make_rootfs(rootfs)
+        (rootfs / "lib/libc.so.7").chmod(0o644)
+        stats = populate_sysroot(rootfs, rootfs / "METALOG", sysroot, state, _INCLUDES, "hardlink")
+        assert (stats.files_hardlinked, stats.files_reflinked + stats.files_copied) == (1, 1)
+        # Writable files must not share the inode with the rootfs and the rootfs permissions must not change
+        assert (sysroot / "lib/libc.so.7").stat().st_ino != (rootfs / "lib/libc.so.7").stat().st_ino
+        assert (rootfs / "lib/libc.so.7").stat().st_mode & 0o777 == 0o644
+        assert (sysroot / "lib/libc.so.7").stat().st_mode & 0o777 == 0o644
+        assert read_bytes(sysroot / "lib/libc.so.7") == b"libc" * 1024
+        assert (sysroot / "usr/include/stdio.h").stat().st_ino == (rootfs / "usr/include/stdio.h").stat().st_ino
+        stats = populate_sysroot(rootfs, rootfs / "METALOG", sysroot, state, _INCLUDES, "hardlink")
+        assert (stats.changed, stats.unchanged) == (0, 3)
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.system_deps import SystemDependencyChecker
+from pycheribuild.utils import setEnv
+
+# Logs every invocation and only knows about the packages that have a .pc file in $PKG_CONFIG_PATH
+_FAKE_PKG_CONFIG = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/pkg-config.log"
+if [ "$1" = "--variable" ]; then
+    echo "/nonexistent/pkgconfig"
+    exit 0
+fi
+shift
+for pkg; do
+    [ -f "$PKG_CONFIG_PATH/$pkg.pc" ] || exit 1
+done
+exit 0
+"""
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def _setup(td: Path):
+    bindir = td / "bin"
+    pcdir = td / "pkgconfig"
+    bindir.mkdir()
+    pcdir.mkdir()
+    pkg_config = bindir / "pkg-config"
+    write_text(pkg_config, _FAKE_PKG_CONFIG)
+    pkg_config.chmod(0o755)
+    for pkg in ("glib-2.0", "pixman-1"):
+        write_text(pcdir / (pkg + ".pc"), "")
+    return bindir, pcdir
+
+
+def _log(td: Path):
+    log = td / "bin/pkg-config.log"
+    return read_text(log).splitlines() if log.exists() else []
+
+
+def test_batched_and_cached():
+    with tempfile.TemporaryDirectory() as tmp:
+        td = Path(tmp)
+        bindir, pcdir = _setup(td)
+        cache = td / SystemDependencyChecker.FILENAME
+        with setEnv(PATH=str(bindir) + os.pathsep + os.getenv("PATH"), PKG_CONFIG_PATH=str(pcdir)):
+            checker = SystemDependencyChecker(cache)
+            checker.check_all(["pkg-config", "sh"], ["glib-2.0", "pixman-1"], [], jobs=4)
+            assert _log(td) == ["--variable pc_path pkg-config", "--exists glib-2.0 pixman-1"]
+            assert checker.which("pkg-config") == str(bindir / "pkg-config")
+            assert checker.check_pkg_config_packages(["pixman-1", "glib-2.0"]) == {"pixman-1": True, "glib-2.0": True}
+            assert len(_log(td)) == 2
+            # A new process uses the cached results without running pkg-config
+            checker = SystemDependencyChecker(cache)
+            checker.check_all(["pkg-config", "sh"], ["glib-2.0", "pixman-1"], [], jobs=4)
+            assert len(_log(td)) == 2
+            assert checker.cache_hits == 4 and checker.processes == 0
+            # Adding a package changes the mtime of the search directory -> cached packages are no longer valid
+            write_text(pcdir / "gnutls.pc", "")
+            os.utime(str(pcdir), ns=(0, 0))
+            checker = SystemDependencyChecker(cache)
+            assert checker.check_pkg_config_packages(["glib-2.0", "gnutls"]) == {"glib-2.0": True, "gnutls": True}
+            assert _log(td)[2:] == ["--exists glib-2.0 gnutls"]
+            # --recheck-system-deps ignores the cache
+            checker = SystemDependencyChecker(cache, use_cached_results=False)
+            assert checker.has_pkg_config_package("glib-2.0")
+            assert checker.cache_hits == 0 and checker.processes == 2
+
+
+def test_missing_packages_checked_individually():
+    with tempfile.TemporaryDirectory() as tmp:
+        td = Path(tmp)
+        bindir, pcdir = _setup(td)
+        cache = td / SystemDependencyChecker.FILENAME
+        with setEnv(PATH=str(bindir) + os.pathsep + os.getenv("PATH"), PKG_CONFIG_PATH=str(pcdir)):
+            checker = SystemDependencyChecker(cache)
+            result = checker.check_pkg_config_packages(["glib-2.0", "missing", "pixman-1"], jobs=2)
+            assert result == {"glib-2.0": True, "missing": False, "pixman-1": True}
+            assert sorted(_log(td)[2:]) == ["--exists glib-2.0", "--exists missing", "--exists pixman-1"]
+            assert checker.which("does-not-exist-anywhere") is None
+            checker.save()
+            # Negative results are not cached
+            checker = SystemDependencyChecker(cache)
+            assert not checker.has_pkg_config_package("missing")
+            assert _log(td)[-1] == "--exists missing"
+
+
+def test_headers():
+    checker = SystemDependencyChecker(None)
+    assert not checker.has_header("this/header/does/not/exist.h")
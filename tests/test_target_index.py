@@ -0,0 +1,98 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.target_index import TargetIndex, load_all_projects, source_stamp, _relative_imports
+from pycheribuild.targets import targetManager
+
+
+def _make_index() -> TargetIndex:
+    targets = {"a": dict(module="pkg.a", dependencies=["b"]), "b": dict(module="pkg.b", dependencies=[]),
+               "c": dict(module="pkg.c", dependencies=[]), "d": dict(module="pkg.d", dependencies=[]),
+               "c-native": dict(module="pkg.c", dependencies=[])}
+    options = {"--pretend": None, "-p": None, "-j": None, "--list-targets": None, "--help": None,
+               "--d/foo": "pkg.d", "--c/bool-flag": "pkg.c"}
+    imports = {"pkg.c": ["pkg.helper"], "pkg.helper": ["pkg.c"]}
+    return TargetIndex("stamp", targets, {"c": ["c-native"]}, options, imports)
+
+
+def test_modules_for_arguments():
+    index = _make_index()
+    assert index.modules_for_arguments(["--list-targets"]) == []
+    assert index.modules_for_arguments(["-p", "a"]) == ["pkg.a", "pkg.b"]
+    assert index.modules_for_arguments(["-j4", "-p", "c-native"]) == ["pkg.c", "pkg.helper"]
+    assert index.modules_for_arguments(["--d/foo=1", "b"]) == ["pkg.b", "pkg.d"]
+    assert index.modules_for_arguments(["--c/no-bool-flag"]) == ["pkg.c", "pkg.helper"]
+    # values of options that happen to be target names only cause additional imports
+    assert index.modules_for_arguments(["--d/foo", "c"]) == ["pkg.c", "pkg.d", "pkg.helper"]
+    # Everything is needed for --help, unknown options or __run_everything__
+    assert index.modules_for_arguments(["--help"]) is None
+    assert index.modules_for_arguments(["--unknown/option", "a"]) is None
+    assert index.modules_for_arguments(["__run_everything__"]) is None
+
+
+def test_save_and_load():
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td, "index.json")
+        assert TargetIndex.load(path, "stamp") is None
+        _make_index().save(path)
+        loaded = TargetIndex.load(path, "stamp")
+        assert loaded.target_names == ["a", "b", "c", "c-native", "d"]
+        assert loaded.aliases == {"c": ["c-native"]}
+        # A different source stamp means that the index is out of date
+        assert TargetIndex.load(path, "other-stamp") is None
+
+
+def test_generate_index():
+    load_all_projects()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--list-targets", action="store_true")
+    loader = SimpleNamespace(_parser=parser, options=dict())
+    index = TargetIndex.generate(targetManager, loader, stamp="test")
+    assert index.targets["qemu"]["module"] == "pycheribuild.projects.build_qemu"
+    assert "cheribsd-cheri" in index.aliases["cheribsd"]
+    assert index.options["--list-targets"] is None
+    modules = index.modules_for_arguments(["--list-targets", "qemu"])
+    assert "pycheribuild.projects.build_qemu" in modules
+    assert "pycheribuild.projects.cross.qt5" not in modules
+    # imports inside functions must also be found
+    assert "pycheribuild.projects.build_qemu" in _relative_imports("pycheribuild.projects.project")
+    assert len(source_stamp()) == 64
+
+
+def _run_cheribuild(args, lazy: bool, index_path: Path) -> str:
+    env = os.environ.copy()
+    env.update(CHERIBUILD_LAZY_LOADING="1" if lazy else "0", CHERIBUILD_TARGET_INDEX=str(index_path))
+    return subprocess.check_output([sys.executable, str(Path(__file__).parent.parent / "cheribuild.py"),
+                                    "--config-file", "/this/does/not/exist"] + args, env=env,
+                                   stderr=subprocess.DEVNULL, universal_newlines=True)
+
+
+def test_lazy_loading_matches_eager_loading():
+    with tempfile.TemporaryDirectory() as td:
+        index_path = Path(td, "target-index.json")
+        eager_targets = _run_cheribuild(["--list-targets"], lazy=False, index_path=index_path)
+        assert not index_path.exists()
+        # The first run generates the index, the second one uses it
+        assert _run_cheribuild(["--list-targets"], lazy=True, index_path=index_path) == eager_targets
+        assert index_path.exists()
+        assert _run_cheribuild(["--list-targets"], lazy=True, index_path=index_path) == eager_targets
+        args = ["--get-config-option", "cheribsd-cheri/build-options", "--cheribsd-cheri/build-options=-DFOO"]
+        assert _run_cheribuild(args, lazy=True, index_path=index_path) == \
+            _run_cheribuild(args, lazy=False, index_path=index_path)
+
+
+def test_lazy_loading_get_instance():
+    # mibench-mips --benchmark imports BuildCheriSim inside a function and calls BuildCheriSim.get_instance()
+    args = ["mibench-mips", "--benchmark", "--benchmark-clean-boot", "-p"]
+    with tempfile.TemporaryDirectory() as td:
+        index_path = Path(td, "target-index.json")
+        _run_cheribuild(["--list-targets"], lazy=True, index_path=index_path)
+        assert index_path.exists()
+        assert "Ran benchmarks for target 'mibench-mips'" in _run_cheribuild(args, lazy=True, index_path=index_path)
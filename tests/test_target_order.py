@@ -1,5 +1,6 @@
 import sys
 import copy
+import time
 
 try:
     import typing
@@ -15,7 +16,7 @@ sys.path.append(str(Path(__file__).parent.parent))
 # We can"t do from pycheribuild.configloader import ConfigLoader here because that will only update the local copy
 from pycheribuild.config.loader import DefaultValueOnlyConfigLoader, ConfigLoaderBase
 from pycheribuild.projects.project import SimpleProject, CrossCompileTarget
-from pycheribuild.targets import targetManager
+from pycheribuild.targets import targetManager, DependencyGraph, Target
 # noinspection PyUnresolvedReferences
 from pycheribuild.projects import *  # make sure all projects are loaded so that targetManager gets populated
 from pycheribuild.projects.cross import *  # make sure all projects are loaded so that targetManager gets populated
@@ -188,3 +189,106 @@ def test_libcxx_deps(suffix, expected_suffix):
     # Now check that the cross-compile versions explicitly chose the matching target:
     assert expected == _sort_targets(["libcxx" + suffix], add_dependencies=True, skip_sdk=True)
 
+
+
+def _run_parallel(target_names: "typing.List[str]", parallel_targets: int, make_jobs: int=16):
+    from pycheribuild.targets import ParallelTargetExecutor
+    import threading
+    config = copy.copy(get_global_config())
+    config.parallel_targets = parallel_targets
+    config.makeJobs = make_jobs
+    targets = [targetManager.get_target_raw(name) for name in _sort_targets(target_names, add_dependencies=True)]
+    lock = threading.Lock()
+    started = []
+    finished = []
+
+    class MockExecutor(ParallelTargetExecutor):
+        def run_target(self, target, jobs):
+            with lock:
+                # all dependencies must have been built before the target is started
+                assert self.dependencies[target] <= set(finished), target
+                started.append((target.name, jobs))
+            time.sleep(0.01)
+            with lock:
+                finished.append(target)
+            return 0
+
+    executor = MockExecutor(config, targets)
+    executor.run()
+    assert [t.name for t in finished] != [] and len(finished) == len(targets)
+    return executor, started
+
+
+def test_parallel_targets_respects_dependencies():
+    executor, started = _run_parallel(["run"], parallel_targets=4)
+    names = [name for name, jobs in started]
+    # run must still be executed last and the disk image must be created after everything else
+    assert names[-1] == "run"
+    assert names[-2] == "disk-image-cheri"
+    # llvm, qemu and gdb-native are independent and should be started at the beginning sharing the jobs
+    assert set(names[:3]) == {"llvm", "qemu", "gdb-native"}
+    assert [jobs for name, jobs in started[:3]] == [5, 5, 5]
+    assert executor.dependencies[targetManager.get_target_raw("cheribsd-cheri")] >= \
+        {targetManager.get_target_raw("llvm")}
+
+
+def test_parallel_targets_single_worker():
+    executor, started = _run_parallel(["run"], parallel_targets=1)
+    assert sorted(name for name, jobs in started) == sorted(_sort_targets(["run"], add_dependencies=True))
+    # with only one worker every target gets all the jobs
+    assert all(jobs == 16 for name, jobs in started)
+
+
+def _add_fake_targets(deps: "typing.Dict[str, typing.List[str]]"):
+    for name, target_deps in deps.items():
+        cls = type("Fake_" + name.replace("-", "_"), (SimpleProject,), dict(doNotAddToTargets=True, target=name,
+                                                                               projectName=name,
+                                                                               dependencies=target_deps))
+        targetManager.addTarget(Target(name, cls))
+
+
+def _remove_fake_targets(names):
+    for name in names:
+        del targetManager._allTargets[name]
+
+
+def test_dependency_cycle():
+    deps = {"cycle-a": ["cycle-b"], "cycle-b": ["cycle-c"], "cycle-c": ["cycle-a"], "cycle-root": ["cycle-b"]}
+    _add_fake_targets(deps)
+    try:
+        with pytest.raises(SystemExit, match="Dependency cycle detected: cycle-b -> cycle-c -> cycle-a -> cycle-b"):
+            _sort_targets(["cycle-root"], add_dependencies=True)
+        with pytest.raises(SystemExit, match="Dependency cycle detected: cycle-a -> cycle-b -> cycle-c -> cycle-a"):
+            DependencyGraph(get_global_config()).topological_order([targetManager.get_target_raw("cycle-a")])
+    finally:
+        _remove_fake_targets(deps.keys())
+
+
+def test_deterministic_order():
+    # Independent targets keep the order from the command line, dependencies always come first
+    deps = {"order-a": ["order-c"], "order-b": [], "order-c": [], "order-d": ["order-b", "order-c"]}
+    _add_fake_targets(deps)
+    try:
+        assert _sort_targets(["order-a", "order-b", "order-c"]) == ["order-c", "order-a", "order-b"]
+        assert _sort_targets(["order-b", "order-a", "order-c"]) == ["order-b", "order-c", "order-a"]
+        assert _sort_targets(["order-d"], add_dependencies=True) == ["order-b", "order-c", "order-d"]
+        assert _sort_targets(["order-d", "order-a", "order-d"]) == ["order-d", "order-a"]
+    finally:
+        _remove_fake_targets(deps.keys())
+
+
+def test_explain_deps():
+    config = get_global_config()
+    config.skipSdk = True
+    targetManager.reset()
+    graph = DependencyGraph(config)
+    explanation = graph.explain(targetManager.get_target("qtwebkit-mips", None, config))
+    names = [(dep.name, [t.name for t in required_by], [t.name for t in chain])
+             for dep, required_by, chain in explanation]
+    assert names[0] == ("qtbase-mips", ["qtwebkit-mips"], ["qtwebkit-mips", "qtbase-mips"])
+    # icu4c-native is needed by icu4c-mips and must therefore be built first
+    assert names.index(("icu4c-native", ["icu4c-mips"], ["qtwebkit-mips", "icu4c-mips", "icu4c-native"])) < \
+        names.index(("icu4c-mips", ["qtwebkit-mips"], ["qtwebkit-mips", "icu4c-mips"]))
+    webkit_mips = targetManager.get_target_raw("qtwebkit-mips").projectClass
+    assert set(n[0] for n in names) == set(webkit_mips.allDependencyNames(config))
+    assert graph.explain(targetManager.get_target_raw("llvm")) == []
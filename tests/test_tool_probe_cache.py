@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.utils import ToolProbeCache
+
+
+# python 3.4 compatibility
+def write_text(path: Path, contents: str):
+    with path.open(mode="w") as f:
+        return f.write(contents)
+
+
+def read_bytes(path: Path) -> bytes:
+    with path.open(mode="rb") as f:
+        return f.read()
+
+
+def _write_program(path: Path, output: str):
+    write_text(path, "#!/bin/sh\necho " + output + "\n")
+    path.chmod(0o755)
+
+
+def test_tool_probe_cache():
+    with tempfile.TemporaryDirectory() as td:
+        program = Path(td, "fake-tool")
+        _write_program(program, "version 1")
+        cache_file = Path(td, ToolProbeCache.FILENAME)
+        calls = []
+
+        def probe():
+            calls.append(1)
+            return 0, read_bytes(program), b"\xff invalid utf-8"
+
+        cache = ToolProbeCache(cache_file)
+        result = cache.run("version", program, ["--version"], probe)
+        assert cache.run("version", program, ["--version"], probe) == result
+        assert (cache.hits, cache.misses, len(calls)) == (1, 1, 1)
+        # Different arguments or probe kind are separate entries
+        cache.run("version", program, ["-v"], probe)
+        cache.run("compiler-info", program, ["--version"], probe)
+        assert len(calls) == 3
+
+        # A new cheribuild invocation should load the results from disk
+        cache = ToolProbeCache(cache_file)
+        assert cache.run("version", program, ["--version"], probe) == result
+        assert (cache.hits, cache.misses, len(calls)) == (1, 0, 3)
+        assert "1 from cache" in cache.statistics()
+
+        # Replacing the program invalidates the entry
+        _write_program(program, "version 22")
+        os.utime(str(program), ns=(1, 1))
+        assert cache.run("version", program, ["--version"], probe)[1] == b"#!/bin/sh\necho version 22\n"
+        assert len(calls) == 4
+
+        cache.clear()
+        assert not cache_file.exists()
+        cache.run("version", program, ["--version"], probe)
+        assert len(calls) == 5
+
+
+def test_failed_probes_are_not_cached():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ToolProbeCache(Path(td, ToolProbeCache.FILENAME))
+        calls = []
+
+        def probe():
+            calls.append(1)
+            return 1, b"", b"error"
+
+        cache.run("version", "/bin/sh", ["--invalid-flag"], probe)
+        cache.run("version", "/bin/sh", ["--invalid-flag"], probe)
+        assert len(calls) == 2
+        # Programs that can't be found are never cached
+        cache.run("version", Path(td, "does-not-exist"), [], lambda: (0, b"", b""))
+        assert cache.entries == dict()
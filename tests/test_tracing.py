@@ -0,0 +1,87 @@
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+from pycheribuild.tracing import TraceRecorder, start_tracing, stop_tracing, trace_span, get_trace_recorder
+from pycheribuild.utils import check_call_handle_noexec, popen_handle_noexec, runCmd
+
+
+# python 3.4 compatibility
+def read_text(path: Path, encoding=None) -> str:
+    with path.open(mode="r", encoding=encoding) as f:
+        return f.read()
+
+
+def _events(recorder: TraceRecorder, category: str):
+    return [e for e in recorder.trace_events() if e.get("cat") == category]
+
+
+def test_spans_are_noops_without_trace_file():
+    assert get_trace_recorder() is None
+    with trace_span("configure", "phase", target="foo") as args:
+        args["extra"] = 1
+    assert type(popen_handle_noexec(["true"])) is subprocess.Popen
+
+
+def test_subprocess_and_phase_spans():
+    with tempfile.TemporaryDirectory() as td:
+        recorder = start_tracing(Path(td, "trace.json"))
+        try:
+            with trace_span("qemu", "target", action="build"):
+                with trace_span("compile", "phase", target="qemu") as args:
+                    args["extra"] = "value"
+                    runCmd([sys.executable, "-c", "x = bytearray(32 * 1024 * 1024)"], cwd=td)
+                    check_call_handle_noexec(["true"])
+                    with pytest.raises(subprocess.CalledProcessError):
+                        check_call_handle_noexec(["sh", "-c", "exit 3"])
+            with pytest.raises(RuntimeError):
+                with trace_span("install", "phase"):
+                    raise RuntimeError("failed")
+            thread = threading.Thread(target=runCmd, args=(["true"],), name="worker")
+            thread.start()
+            thread.join()
+        finally:
+            assert stop_tracing() is recorder
+        assert get_trace_recorder() is None
+        data = json.loads(read_text(Path(td, "trace.json")))
+        assert data["traceEvents"] == json.loads(json.dumps(recorder.trace_events()))
+
+    target, = _events(recorder, "target")
+    compile_span, install_span = _events(recorder, "phase")
+    assert compile_span["args"] == {"target": "qemu", "extra": "value"}
+    assert target["ts"] <= compile_span["ts"]
+    assert compile_span["ts"] + compile_span["dur"] <= target["ts"] + target["dur"]
+    assert install_span["args"]["error"] == "RuntimeError: failed"
+
+    python, true, failed, worker = _events(recorder, "subprocess")
+    assert python["args"]["argv"][0] == sys.executable
+    assert python["args"]["cwd"] == td
+    assert python["args"]["max_rss_kb"] >= 32 * 1024
+    assert python["args"]["user_time"] + python["args"]["system_time"] > 0
+    assert compile_span["ts"] <= python["ts"] <= python["ts"] + python["dur"] <= true["ts"]
+    assert (true["name"], true["args"]["exit_code"]) == ("true", 0)
+    assert failed["args"]["exit_code"] == 3
+    assert worker["tid"] != python["tid"]
+    thread_names = {e["tid"]: e["args"]["name"] for e in recorder.trace_events() if e["name"] == "thread_name"}
+    assert thread_names[worker["tid"]] == "worker"
+    assert thread_names[python["tid"]] == "cheribuild"
+
+
+def test_merge_worker_trace():
+    with tempfile.TemporaryDirectory() as td:
+        worker = TraceRecorder(Path(td, "worker.json"))
+        worker.pid = 12345
+        with worker.span("gdb", "target"):
+            pass
+        worker.write()
+        parent = TraceRecorder(Path(td, "parent.json"))
+        parent.merge(worker.path)
+        parent.merge(Path(td, "missing.json"))
+        assert [e["name"] for e in parent.trace_events() if e.get("pid") == 12345] == ["process_name", "thread_name",
+                                                                                     "gdb"]